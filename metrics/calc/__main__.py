@@ -3,7 +3,9 @@ import os
 
 from metrics.data_vendor import DataVendor
 from metrics.calc.events import CalculateMetrics
+from metrics.calc.forecast_manager import ForecastManager
 
+from metrics.utils.parquet import PARQUET_PROFILES, DEFAULT_PARQUET_PROFILE, get_parquet_profile
 from metrics.utils.precipitation import PrecipitationType
 from rich.console import Console
 
@@ -21,7 +23,11 @@ def _run_events(args: argparse.Namespace):
                 f"- forecast_offsets = {args.offsets}\n"
                 f"- observations_offset = {args.observations_offset}\n"
                 f"- sensor_selection_path = {args.filter_sensors_dir}\n"
-                f"- process_num = {args.process_num}\n")
+                f"- process_num = {args.process_num}\n"
+                f"- use_cache = {args.use_cache}\n"
+                f"- prefetch_threads = {args.prefetch_threads}\n"
+                f"- memory_budget = {args.memory_budget}\n"
+                f"- split_time_range = {args.split_time_range}\n")
 
     calculator = CalculateMetrics(
         forecast_vendor=DataVendor(args.forecast_vendor),
@@ -31,12 +37,17 @@ def _run_events(args: argparse.Namespace):
         threshold=args.threshold,
         precip_types=[PrecipitationType[t.upper()] for t in args.precip_types],
         observations_offset=args.observations_offset,
-        sensor_selection_path=args.filter_sensors_dir
+        sensor_selection_path=args.filter_sensors_dir,
+        use_cache=args.use_cache,
+        prefetch_threads=args.prefetch_threads,
+        split_time_range=args.split_time_range,
+        memory_budget=None if args.memory_budget is None else int(args.memory_budget * 1024 ** 3)
     )
 
     os.makedirs(os.path.dirname(args.output_csv), exist_ok=True)
     calculator.calculate(output_csv=args.output_csv,
-                         process_num=args.process_num)
+                         process_num=args.process_num,
+                         writer_profile=get_parquet_profile(args.parquet_profile))
 
 
 def _parse_event_args(subparsers: argparse._SubParsersAction):
@@ -56,6 +67,19 @@ def _parse_event_args(subparsers: argparse._SubParsersAction):
                         help=("Path to a directory with parquet tables. "
                               "If this argument exists, then only sensors id's found in directory would be used."
                               "Sensor id is and `id` field in a parquet table"))
+    parser.add_argument("--use-cache", dest="use_cache", action="store_true", default=False,
+                        help=("Load tables from the session arrow cache built by `metrics.parse --arrow-cache` "
+                              "when it's up to date"))
+    parser.add_argument("--prefetch-threads", dest="prefetch_threads", type=int,
+                        default=ForecastManager.PREFETCH_THREADS,
+                        help=("Number of threads in each process that load next forecast snapshots while "
+                              "the current one is processed. Use 0 to load snapshots one by one"))
+    parser.add_argument("--memory-budget", dest="memory_budget", type=float, default=None,
+                        help=("Memory in GB that parallel jobs can use together. Jobs are admitted by memory "
+                              "estimated from the session catalog and refined by measured peak RSS"))
+    parser.add_argument("--split-time-range", dest="split_time_range", type=int, default=3600,
+                        help=("Time range of a job in seconds, see `metrics.plan` for a range that fits the memory. "
+                              "It's reduced to fit `--memory-budget`"))
 
     parser.set_defaults(func=_run_events)
 
@@ -73,7 +97,9 @@ if __name__ == "__main__":
                         help="Precip types of precipitation event",
                         choices=[t.name.lower() for t in PrecipitationType], default=["rain"])
     parser.add_argument("--output-csv", type=str, dest="output_csv", required=True,
-                        help="Output CSV file")
+                        help="Output CSV file. Metrics are written as a parquet table if it ends with `.parquet`")
+    parser.add_argument("--parquet-profile", dest="parquet_profile", type=str, default=DEFAULT_PARQUET_PROFILE,
+                        choices=list(PARQUET_PROFILES), help="Writer profile of the output parquet table")
     parser.add_argument("--observations-offset", dest="observations_offset", type=int, default=0,
                         required=False, help="Events window offset comparing to forecast")
 
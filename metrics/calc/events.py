@@ -6,9 +6,19 @@ import typing
 
 from dataclasses import dataclass
 from metrics.calc.forecast_manager import ForecastManager, DataVendor
-from metrics.calc.utils import read_selected_sensors
+from metrics.calc.intervals import END_TIMESTAMP_COLUMN, bin_intervals
+from metrics.calc.lead_time import LeadTimeFilter
+from metrics.calc.rollup import ROLLUP_PERIOD, can_use_rollups
+from metrics.calc.scheduler import MemoryScheduler, entries_memory
+from metrics.io import storage
+from metrics.io.arrow_cache import ArrowCache
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, CatalogEntry, SessionCatalog
+from metrics.io.table_store import TableStore, snapshot_table_timestamp
 from metrics.session import Session
+from metrics.utils.memory import peak_rss, reset_peak_rss
+from metrics.utils.parquet import ParquetWriterProfile, get_parquet_profile, read_table
 from metrics.utils.precipitation import PrecipitationType
+from metrics.utils.sensors import read_selected_sensors
 from metrics.utils.time import floor_timestamp
 
 from rich.console import Console
@@ -17,6 +27,9 @@ from tqdm import tqdm
 
 console = Console()
 
+# parts of the split time range that are tried to fit jobs into the memory budget
+SPLIT_TIME_RANGE_PARTS = [2, 3, 6]
+
 
 @dataclass
 class JobParams:
@@ -45,6 +58,10 @@ class JobParams:
         Offset for observations comparing to forecast (in seconds)
     group_period: int
         Grouping period to aggregate events timestamps (in seconds)
+    use_cache: bool
+        Load tables from the session arrow cache when it's up to date
+    prefetch_threads: int
+        Number of threads that load forecast snapshots ahead in each process
     """
     forecast_vendor: DataVendor
     observation_vendor: DataVendor
@@ -57,6 +74,17 @@ class JobParams:
     observations_offset: int = 0
     group_period: int = 600
     forecast_manager_cls: typing.Type[ForecastManager] = ForecastManager
+    use_cache: bool = False
+    prefetch_threads: int = ForecastManager.PREFETCH_THREADS
+
+    def sensors_time_range(self) -> typing.Tuple[int, int]:
+        """Returns range of observation timestamps that the job loads"""
+        return (self.time_range[0] - self.group_period, self.time_range[1])
+
+    def forecast_time_range(self) -> typing.Tuple[int, int]:
+        """Returns range of forecast snapshots that the job loads"""
+        # -1:10, to cover begin of observations with 2 hour forecast
+        return (self.time_range[0] - (max(self.forecast_offsets) + 4200), self.time_range[1])
 
 
 # MARK: Multiprocess Job
@@ -75,11 +103,14 @@ class Worker:
             Path to a directory with sensor files
         """
 
-        files_list = os.listdir(sensors_path)
+        if storage.is_remote(sensors_path):
+            _, files_list = storage.remote_storage().listdir(sensors_path)
+        else:
+            files_list = [file_name for file_name in os.listdir(sensors_path)
+                          if os.path.isfile(os.path.join(sensors_path, file_name))]
 
         def _should_process_file(file_name: str) -> bool:
-            file_path = os.path.join(sensors_path, file_name)
-            if os.path.isfile(file_path) and file_name.endswith(".parquet"):
+            if file_name.endswith(".parquet"):
                 try:
                     timestamp = int(file_name.replace(".parquet", ""))
                     return sensors_time_range[0] <= timestamp <= sensors_time_range[1]
@@ -101,22 +132,50 @@ class Worker:
             Calculated metrics for each sensor id, forecast offset, timestamp
         """
         session = Session.create_from_folder(self._params.session_path)
+        cache = None
+        if self._params.use_cache:
+            cache = ArrowCache(tables_folder=session.tables_folder, cache_folder=session.cache_folder)
+
         sensors_path = None
         sensors_path = os.path.join(session.tables_folder, self._params.observation_vendor.value)
 
-        sensors_start_time, sensors_end_time = self._params.time_range
-        sensors_start_time = sensors_start_time - self._params.group_period
-
-        sensors_time_range = (sensors_start_time, sensors_end_time)
-
-        collected_sensor_files = self._get_sensor_file_list(sensors_time_range=sensors_time_range,
-                                                            sensors_path=sensors_path)
+        sensors_time_range = self._params.sensors_time_range()
+
+        # the catalog lists tables without scanning the folder, compacted snapshots are read from their partitions
+        catalog = SessionCatalog(session_path=session.path)
+        partition_paths = None
+        if catalog.is_synced(kind=KIND_TABLE, vendor=self._params.observation_vendor.value):
+            entries = catalog.list(kind=KIND_TABLE,
+                                   vendor=self._params.observation_vendor.value,
+                                   time_range=sensors_time_range)
+            collected_sensor_files = [catalog.full_path(entry) for entry in entries
+                                      if snapshot_table_timestamp(entry.path) == entry.snapshot]
+            partition_paths = {catalog.full_path(entry) for entry in entries
+                               if snapshot_table_timestamp(entry.path) != entry.snapshot}
+        else:
+            collected_sensor_files = self._get_sensor_file_list(sensors_time_range=sensors_time_range,
+                                                                sensors_path=sensors_path)
 
         console.log(f"Load sensors {collected_sensor_files}")
         loaded_tables = []
+        loaded_snapshots = []
         for file_path in collected_sensor_files:
-            if os.path.exists(file_path):
-                loaded_tables.append(pandas.read_parquet(file_path))
+            if storage.exists(file_path):
+                if cache is not None:
+                    loaded_tables.append(cache.read(file_path).to_pandas())
+                elif storage.is_remote(file_path):
+                    loaded_tables.append(read_table(file_path).to_pandas())
+                else:
+                    loaded_tables.append(pandas.read_parquet(file_path))
+                loaded_snapshots.append(snapshot_table_timestamp(file_path))
+
+        loaded_snapshots = [snapshot for snapshot in loaded_snapshots if snapshot is not None]
+
+        # snapshots that were moved into hourly partitions
+        sensors_store = TableStore(folder=sensors_path, cache=cache)
+        loaded_tables.extend(sensors_store.load_compacted(time_range=sensors_time_range,
+                                                          skip_snapshots=loaded_snapshots,
+                                                          partition_paths=partition_paths))
 
         sensor_observations = pandas.concat(loaded_tables)
 
@@ -138,15 +197,30 @@ class Worker:
         sensor_observations = sensor_observations.sort_values(by=["id", "timestamp"])
         sensor_observations = sensor_observations.drop_duplicates(subset=["id", "timestamp"], keep="first")
 
-        forecast_start_time, forecast_end_time = self._params.time_range
-        # -1:10, to cover begin of observations with 2 hour forecast
-        forecast_start_time = forecast_start_time - (max(self._params.forecast_offsets) + 4200)
+        forecast_start_time, forecast_end_time = self._params.forecast_time_range()
 
         console.log(f"Loading forecast in range ({forecast_start_time}, {forecast_end_time})...")
 
-        data_provider = self._params.forecast_manager_cls(data_vendor=self._params.forecast_vendor, session=session)
+        # binned forecast gives the same metrics when it is binned the same way as calc does
+        rollup_period = None
+        if can_use_rollups(group_period=self._params.group_period,
+                           observations_offset=self._params.observations_offset,
+                           data_step=ForecastManager.DATA_STEP):
+            rollup_period = ROLLUP_PERIOD
+
+        data_provider = self._params.forecast_manager_cls(data_vendor=self._params.forecast_vendor,
+                                                          session=session,
+                                                          rollup_period=rollup_period,
+                                                          cache=cache,
+                                                          prefetch_threads=self._params.prefetch_threads)
+        # rows and snapshots that can't get into requested forecast times are dropped on load
+        lead_times = LeadTimeFilter(forecast_times=self._params.forecast_offsets,
+                                    time_range=sensors_time_range,
+                                    period=self._params.group_period,
+                                    offset=self._params.observations_offset)
         forecast = data_provider.load_forecast(time_rage=(forecast_start_time, forecast_end_time),
-                                               sensors_table=sensor_observations)
+                                               sensors_table=sensor_observations,
+                                               lead_times=lead_times)
 
         console.log(f"Calculating metrics for {self._params.time_range}...")
         return self._calculate(forecast_times=self._params.forecast_offsets,
@@ -203,6 +277,12 @@ class Worker:
         observations = observations.sort_values(by=["id", "timestamp"])
         observations = observations.drop_duplicates(subset=["id", "timestamp"], keep="first")
 
+        # interval tables get a point per bin instead of a point per minute
+        if END_TIMESTAMP_COLUMN in forecast.columns:
+            forecast = bin_intervals(data=forecast,
+                                     period=self._params.group_period,
+                                     offset=self._params.observations_offset)
+
         # ceil forecast time to 10 minutes
         forecast = self._align_time_column(data=forecast,
                                            column_name="forecast_time",
@@ -270,6 +350,97 @@ def _process_time_range(params: JobParams):
     except Exception:
         console.print_exception()
 
+
+def _process_time_range_measured(params: JobParams) -> typing.Tuple[typing.Optional[pandas.DataFrame], int]:
+    """Runs the job and returns its metrics with peak RSS of the process during the job"""
+    reset_peak_rss()
+    metrics = _process_time_range(params)
+    return metrics, peak_rss()
+
+
+def write_metrics(metrics: pandas.DataFrame,
+                  output_csv: str,
+                  writer_profile: typing.Optional[ParquetWriterProfile] = None):
+    """Writes metrics to the CSV file or to the parquet table if the path ends with `.parquet`"""
+    if output_csv.endswith(".parquet"):
+        (writer_profile or get_parquet_profile()).write(metrics, output_csv)
+    else:
+        metrics.to_csv(output_csv, index=False)
+
+
+class MetricsWriter:
+    """Writes metrics of calc jobs as they finish. Rows of every job are appended to the CSV file, so the file
+    grows with the results instead of being rewritten. Parquet tables can't be appended and are written by `close`
+    """
+
+    def __init__(self, output_csv: str, writer_profile: typing.Optional[ParquetWriterProfile] = None):
+        """
+        Parameters
+        ----------
+        output_csv : str
+            Path to the output CSV file or to the parquet table if it ends with `.parquet`. It's rewritten
+            by the first rows
+        writer_profile : ParquetWriterProfile | None
+            Profile of the parquet table, see `write_metrics`
+        """
+        self._output_csv = output_csv
+        self._writer_profile = writer_profile
+        self._parts: typing.List[pandas.DataFrame] = []
+        self._columns: typing.Optional[pandas.Index] = None  # columns of the CSV file, set by the first rows
+        self.failed = 0  # number of failed jobs
+
+    def append(self, metrics: typing.Optional[pandas.DataFrame]):
+        """Adds metrics of a finished job. `None` is counted as a failed job, it has no metrics"""
+        if metrics is None:
+            self.failed += 1
+            return
+
+        self._parts.append(metrics)
+        if self._output_csv.endswith(".parquet") or len(metrics.columns) == 0:
+            return
+
+        if self._columns is None:
+            self._columns = metrics.columns
+            metrics.to_csv(self._output_csv, index=False)
+        else:
+            metrics.reindex(columns=self._columns).to_csv(self._output_csv, mode="a", header=False, index=False)
+
+    def metrics(self) -> pandas.DataFrame:
+        """Returns all added metrics"""
+        return pandas.concat(self._parts) if len(self._parts) > 0 else pandas.DataFrame()
+
+    def close(self):
+        """Writes the parquet table, or the CSV file if no job had metrics"""
+        if len(self._parts) > 0 and (self._output_csv.endswith(".parquet") or self._columns is None):
+            write_metrics(metrics=self.metrics(), output_csv=self._output_csv, writer_profile=self._writer_profile)
+
+
+def estimate_jobs(jobs: typing.List[JobParams],
+                  forecast_entries: typing.List[CatalogEntry],
+                  observation_entries: typing.List[CatalogEntry]) -> typing.List[int]:
+    """Returns estimates of the data loaded by the jobs, see `entries_memory`
+
+    Parameters
+    ----------
+    jobs : List[JobParams]
+        Jobs to estimate
+    forecast_entries : List[CatalogEntry]
+        Forecast tables, or archives for RainViewer, of the session
+    observation_entries : List[CatalogEntry]
+        Observation tables of the session
+
+    Returns
+    -------
+    List[int]
+        Returns estimate of every job in bytes
+    """
+    def _in_range(entries: typing.List[CatalogEntry],
+                  time_range: typing.Tuple[int, int]) -> typing.List[CatalogEntry]:
+        return [entry for entry in entries if time_range[0] <= entry.snapshot <= time_range[1]]
+
+    return [entries_memory(_in_range(forecast_entries, job.forecast_time_range())) +
+            entries_memory(_in_range(observation_entries, job.sensors_time_range())) for job in jobs]
+
 # MARK: Job Management
 
 
@@ -285,7 +456,10 @@ class CalculateMetrics:
                  observations_offset: int = 0,
                  split_time_range: int = 3600,
                  group_period: int = 600,
-                 forecast_manager_cls: typing.Type[ForecastManager] = ForecastManager) -> None:
+                 forecast_manager_cls: typing.Type[ForecastManager] = ForecastManager,
+                 use_cache: bool = False,
+                 prefetch_threads: int = ForecastManager.PREFETCH_THREADS,
+                 memory_budget: typing.Optional[int] = None) -> None:
         """
         Parameters
         ----------
@@ -304,6 +478,14 @@ class CalculateMetrics:
             Path to a session directory
         sensors_path : str
             Path to a directory with sensor tables
+        use_cache : bool
+            Load tables from the session arrow cache when it's up to date
+        prefetch_threads : int
+            Number of threads that load forecast snapshots ahead in each process
+        memory_budget : int | None
+            Memory in bytes that parallel jobs can use together. Jobs are admitted by memory estimated from
+            the session catalog and `split_time_range` is reduced to fit the budget. Jobs are limited only
+            by the number of processes if `None`
         """
         self._forecast_vendor = forecast_vendor
         self._observation_vendor = observation_vendor
@@ -316,36 +498,147 @@ class CalculateMetrics:
         self._split_time_range = split_time_range
         self._group_period = group_period
         self._forecast_manager_cls = forecast_manager_cls
-
-    def _calc_sensors_range(self) -> typing.Tuple[int, int]:
+        self._use_cache = use_cache
+        self._prefetch_threads = prefetch_threads
+        self._memory_budget = memory_budget
+
+    @property
+    def forecast_vendor(self) -> DataVendor:
+        return self._forecast_vendor
+
+    @property
+    def observation_vendor(self) -> DataVendor:
+        return self._observation_vendor
+
+    @property
+    def split_time_range(self) -> int:
+        return self._split_time_range
+
+    @property
+    def forecast_kind(self) -> str:
+        """Returns kind of catalog entries that forecasts are loaded from"""
+        return KIND_ARCHIVE if self._forecast_vendor == DataVendor.RainViewer else KIND_TABLE
+
+    def _calc_sensors_range(self,
+                            session: typing.Optional[Session] = None,
+                            split_time_range: typing.Optional[int] = None) -> typing.Tuple[int, int]:
         """Calculates aligned sensors range based on session start/end time
 
+        Parameters
+        ----------
+        session : Session | None
+            Session to calculate. The session is loaded from `session_path` if `None`
+        split_time_range : int | None
+            Alignment of the range. `self._split_time_range` is used if `None`
+
         Returns
         -------
         Tuple[int, int]
-            Session time range aligned to `self._split_time_range`
+            Session time range aligned to the split time range
         """
-        session = Session.create_from_folder(self._session_path)
+        session = session or Session.create_from_folder(self._session_path)
+        split_time_range = split_time_range or self._split_time_range
 
-        start_time = floor_timestamp(session.start_time, self._split_time_range)
-        end_time = floor_timestamp(session.end_time, self._split_time_range)
+        start_time = floor_timestamp(session.start_time, split_time_range)
+        end_time = floor_timestamp(session.end_time, split_time_range)
         if end_time < session.end_time:
-            end_time += self._split_time_range
+            end_time += split_time_range
 
         return (start_time, end_time)
 
-    def calculate(self, output_csv: str, process_num: int = 1) -> pandas.DataFrame:
+    def _create_jobs(self,
+                     sensors_ids: typing.List[str],
+                     time_range: typing.Tuple[int, int],
+                     split_time_range: int) -> typing.List[JobParams]:
+        jobs = []
+        for timestamp in range(time_range[0], time_range[1], split_time_range):
+            jobs.append(JobParams(forecast_vendor=self._forecast_vendor,
+                                  observation_vendor=self._observation_vendor,
+                                  forecast_offsets=self._forecast_offsets,
+                                  session_path=self._session_path,
+                                  time_range=(timestamp, timestamp + split_time_range),
+                                  sensor_ids=sensors_ids,
+                                  threshold=self._threshold,
+                                  precip_types=[precip_type.value for precip_type in self._precip_types],
+                                  observations_offset=self._observations_offset,
+                                  group_period=self._group_period,
+                                  forecast_manager_cls=self._forecast_manager_cls,
+                                  use_cache=self._use_cache,
+                                  prefetch_threads=self._prefetch_threads))
+
+        return jobs
+
+    def _selected_sensor_ids(self) -> typing.List[str]:
+        selected_sensors = read_selected_sensors(self._sensor_selection_path)
+        selected_sensors = selected_sensors.drop_duplicates(subset=["id"], keep="first")
+        return selected_sensors["id"].unique()
+
+    def session_jobs(self,
+                     session: typing.Optional[Session] = None,
+                     split_time_range: typing.Optional[int] = None) -> typing.List[JobParams]:
+        """Returns jobs that calculate metrics of the session by `split_time_range` ranges in time order.
+        The session is loaded from `session_path` and `self._split_time_range` is used when they are `None`
+        """
+        split_time_range = split_time_range or self._split_time_range
+        return self._create_jobs(sensors_ids=self._selected_sensor_ids(),
+                                 time_range=self._calc_sensors_range(session=session,
+                                                                     split_time_range=split_time_range),
+                                 split_time_range=split_time_range)
+
+    def split_time_range_candidates(self) -> typing.List[int]:
+        """Returns `split_time_range` and its parts that are multiples of the group period, from the largest"""
+        candidates = [self._split_time_range]
+        for parts in SPLIT_TIME_RANGE_PARTS:
+            part = self._split_time_range // parts
+            if part * parts == self._split_time_range and part % self._group_period == 0:
+                candidates.append(part)
+
+        return candidates
+
+    def _estimate_jobs(self, jobs: typing.List[JobParams]) -> typing.List[int]:
+        """Returns estimates of the data loaded by the jobs from the session catalog. Estimates are `0`
+        without a catalog
+        """
+        catalog = SessionCatalog(session_path=self._session_path)
+        if not catalog.exists:
+            return [0 for _ in jobs]
+
+        return estimate_jobs(jobs=jobs,
+                             forecast_entries=catalog.list(kind=self.forecast_kind, vendor=self._forecast_vendor.value),
+                             observation_entries=catalog.list(kind=KIND_TABLE, vendor=self._observation_vendor.value))
+
+    def _choose_split_time_range(self,
+                                 scheduler: MemoryScheduler,
+                                 sensors_ids: typing.List[str],
+                                 time_range: typing.Tuple[int, int]) -> int:
+        """Returns the largest part of `split_time_range` that lets all processes run jobs within the memory budget.
+        Parts are multiples of the group period
+        """
+        for split_time_range in self.split_time_range_candidates():
+            jobs = self._create_jobs(sensors_ids=sensors_ids, time_range=time_range, split_time_range=split_time_range)
+            if all(scheduler.fits(estimate) for estimate in self._estimate_jobs(jobs)):
+                break
+
+        if split_time_range != self._split_time_range:
+            console.log(f"Split time range is reduced to {split_time_range} seconds to fit the memory budget")
+
+        return split_time_range
+
+    def calculate(self,
+                  output_csv: str,
+                  process_num: int = 1,
+                  writer_profile: typing.Optional[ParquetWriterProfile] = None) -> pandas.DataFrame:
         """
         Parameters
         ----------
         output_csv : str
-            Path to the output CSV file
+            Path to the output CSV file. Metrics are written as a parquet table if the path ends with `.parquet`
         process_num : int
             Number of parallel processes to run
+        writer_profile : ParquetWriterProfile | None
+            Profile of the output parquet table. The default profile is used if `None`
         """
-        selected_sensors = read_selected_sensors(self._sensor_selection_path)
-        selected_sensors = selected_sensors.drop_duplicates(subset=["id"], keep="first")
-        selected_sensors_ids = selected_sensors["id"].unique()
+        selected_sensors_ids = self._selected_sensor_ids()
 
         # Calculate metrics in this way:
         # - split session time by 1 hour ranges
@@ -353,31 +646,41 @@ class CalculateMetrics:
 
         start_time, end_time = self._calc_sensors_range()
 
-        jobs = []
-        for timestamp in range(start_time, end_time, self._split_time_range):
-            jobs.append(JobParams(forecast_vendor=self._forecast_vendor,
-                                  observation_vendor=self._observation_vendor,
-                                  forecast_offsets=self._forecast_offsets,
-                                  session_path=self._session_path,
-                                  time_range=(timestamp, timestamp + self._split_time_range),
-                                  sensor_ids=selected_sensors_ids,
-                                  threshold=self._threshold,
-                                  precip_types=[precip_type.value for precip_type in self._precip_types],
-                                  observations_offset=self._observations_offset,
-                                  group_period=self._group_period,
-                                  forecast_manager_cls=self._forecast_manager_cls))
+        scheduler = None
+        split_time_range = self._split_time_range
+        if self._memory_budget is not None:
+            process_num = process_num or os.cpu_count()
+            scheduler = MemoryScheduler(memory_budget=self._memory_budget, process_num=process_num)
+            split_time_range = self._choose_split_time_range(scheduler=scheduler,
+                                                             sensors_ids=selected_sensors_ids,
+                                                             time_range=(start_time, end_time))
+
+        jobs = self._create_jobs(sensors_ids=selected_sensors_ids,
+                                 time_range=(start_time, end_time),
+                                 split_time_range=split_time_range)
 
-        final_metrics: pandas.DataFrame = pandas.DataFrame()
+        writer = MetricsWriter(output_csv=output_csv, writer_profile=writer_profile)
         pool_ctx = multiprocessing.get_context("spawn")
         with pool_ctx.Pool(processes=process_num) as pool:
-            for m in tqdm(pool.imap_unordered(_process_time_range, jobs),
+            if scheduler is None:
+                results = pool.imap_unordered(_process_time_range, jobs)
+            else:
+                results = scheduler.run(pool=pool,
+                                        func=_process_time_range_measured,
+                                        jobs=jobs,
+                                        estimates=self._estimate_jobs(jobs))
+
+            for m in tqdm(results,
                           desc="Calculating metrics...",
                           ascii=True,
                           total=len(jobs)):
-                final_metrics = pandas.concat([final_metrics, m])
-                final_metrics.to_csv(output_csv, index=False)
+                writer.append(m)
+
+        if writer.failed > 0:
+            console.log(f"[red]{writer.failed} of {len(jobs)} time ranges failed to calculate[/red]")
 
-        return final_metrics
+        writer.close()
+        return writer.metrics()
 
 
 def calc_events(session_path: str,
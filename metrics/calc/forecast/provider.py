@@ -5,6 +5,9 @@ from abc import abstractmethod
 
 class ForecastProvider:
 
+    # `load` returns rows of the requested sensors only, so callers don't need to filter them again
+    FILTERS_SENSORS = False
+
     @abstractmethod
     def get_data_timestamp(self) -> int:
         """Returns snapshot timestamp of the data
@@ -27,6 +30,10 @@ class ForecastProvider:
         """
         raise NotImplementedError("Override this function")
 
+    def memory_usage(self) -> int:
+        """Returns number of bytes of the data kept by the provider"""
+        return 0
+
     def _filter_by_sensors(self,
                            sensors_table: pandas.DataFrame,
                            data: pandas.DataFrame) -> pandas.DataFrame:
@@ -45,5 +52,4 @@ class ForecastProvider:
         pandas.DataFrame
             Returns filtered data table. This table contains only rows with id's that exists in `sensors_table`
         """
-        sensor_ids = set(sensors_table["id"].unique())
-        return data[data["id"].isin(sensor_ids)]
+        return data[data["id"].isin(sensors_table["id"].unique())]
@@ -1,37 +1,79 @@
-import os
+import hashlib
 import pandas
 import typing
 
 from metrics.calc.forecast.provider import ForecastProvider
+from metrics.calc.intervals import END_TIMESTAMP_COLUMN
+from metrics.io.arrow_cache import ArrowCache
+from metrics.io.table_store import TableStore
+
+
+def sensors_fingerprint(sensors_table: pandas.DataFrame) -> str:
+    """Returns fingerprint of the set of sensor ids in the table"""
+    ids = pandas.Series(sensors_table["id"].unique()).sort_values(ignore_index=True)
+    return hashlib.sha1(pandas.util.hash_pandas_object(ids, index=False).to_numpy().tobytes()).hexdigest()
 
 
 class TableProvider(ForecastProvider):
 
-    def __init__(self, tables_path: str, snapshot_timestamp: int) -> None:
-        """
+    # columns used by calc, other columns of the tables are not loaded
+    COLUMNS = ["id", "timestamp", "precip_rate", "precip_type", END_TIMESTAMP_COLUMN]
+
+    FILTERS_SENSORS = True
+
+    def __init__(self, tables_path: str, snapshot_timestamp: int, cache: typing.Optional[ArrowCache] = None) -> None:
+        """The table is loaded on the first `load` call. Only its rows of the loaded sensors are kept,
+        the table is loaded again for another set of sensors
+
         Parameters
         ----------
         tables_path : str
             Path to directory with parquet tables
         snapshot_timestamp : int
             Timestamp of rainbow tiles snapshot
+        cache : ArrowCache | None
+            Cache to load the table from. The table is loaded from parquet if `None`
         """
 
+        self._tables_path = tables_path
         self._snapshot_timestamp = snapshot_timestamp
-        self._table = None
-        table_path = os.path.join(tables_path, f"{snapshot_timestamp}.parquet")
-        if os.path.exists(table_path):
-            self._table = pandas.read_parquet(table_path)
+        self._cache = cache
+
+        self._missing = False  # the table doesn't exist
+        self._filtered: typing.Dict[str, pandas.DataFrame] = {}  # tables filtered by sensors fingerprints
+        self._memory_usage = 0
+
+    def _load_table(self) -> typing.Optional[pandas.DataFrame]:
+        return TableStore(folder=self._tables_path,
+                          cache=self._cache).load_snapshot(self._snapshot_timestamp, columns=TableProvider.COLUMNS)
 
     def get_data_timestamp(self) -> int:
         """Returns snapshot timestamp of the data
         """
         return self._snapshot_timestamp
 
+    def memory_usage(self) -> int:
+        """See ForecastProvider.memory_usage"""
+        return self._memory_usage
+
     def load(self, sensors_table: pandas.DataFrame) -> typing.Optional[pandas.DataFrame]:
-        """See DataProviderInterface.load"""
-        if self._table is None:
+        """See DataProviderInterface.load. Returned table is shared between calls with the same sensors,
+        so it shouldn't be modified in place
+        """
+        if self._missing:
             return None
 
-        return self._filter_by_sensors(sensors_table=sensors_table,
-                                       data=self._table)
+        fingerprint = sensors_fingerprint(sensors_table)
+        filtered = self._filtered.get(fingerprint, None)
+        if filtered is None:
+            table = self._load_table()
+            if table is None:
+                self._missing = True
+                return None
+
+            # the whole table is dropped here, providers cached by the forecast manager keep the filtered rows only
+            filtered = self._filter_by_sensors(sensors_table=sensors_table, data=table)
+            self._filtered[fingerprint] = filtered
+            self._memory_usage += int(filtered.memory_usage(index=True, deep=True).sum())
+
+        return filtered
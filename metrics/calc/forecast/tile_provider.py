@@ -3,6 +3,7 @@ import pandas
 import typing
 
 from metrics.calc.forecast.provider import ForecastProvider
+from metrics.io import storage
 from metrics.io.tile_loader import BaseTileLoader
 from metrics.io.tile_reader import TileReader
 from metrics.utils.coords import Coordinate
@@ -20,6 +21,8 @@ class TileProvider(ForecastProvider):
     SNOW_RATE_CONVERT_A: float = 200
     SNOW_RATE_CONVERT_B: float = 2.0
 
+    FILTERS_SENSORS = True
+
     def __init__(self,
                  snapshots_path: str,
                  snapshot_timestamp: int,
@@ -43,11 +46,13 @@ class TileProvider(ForecastProvider):
         self._snapshot_timestamp = snapshot_timestamp
         self._max_forecast_time = max_forecast_time
         self._forecast_step = forecast_step
+        self._tile_loader = None
         self._tile_reader = None
 
         zip_path = os.path.join(snapshots_path, f"{snapshot_timestamp}.zip")
-        if os.path.exists(zip_path):
-            self._tile_reader = TileReader(tile_loader_class(zip_path=zip_path))
+        if storage.exists(zip_path):
+            self._tile_loader = tile_loader_class(zip_path=zip_path)
+            self._tile_reader = TileReader(self._tile_loader)
 
     def get_data_timestamp(self) -> int:
         """Returns snapshot timestamp of the data
@@ -79,22 +84,27 @@ class TileProvider(ForecastProvider):
             sensors_table = sensors_table.sort_values(by=["id", "lon", "lat"])
 
             forecast_time = 0
-            while forecast_time <= self._max_forecast_time:
-                for sensor in sensors_table.itertuples():
-                    precip_value = self._tile_reader.get_dbz_value_by_coords(
-                        coords=Coordinate(lon=sensor.lon, lat=sensor.lat),
-                        offset=forecast_time // 60)
-
-                    if precip_value is not None and precip_value.dbz is not None:
-                        precip_rate = TileProvider.dbz_to_precipitation_rate(dbz=precip_value.dbz,
-                                                                             precip_type=precip_value.precip_type)
-                        result_data.append([
-                            sensor.id,
-                            precip_rate,
-                            precip_value.precip_type.value,
-                            self._snapshot_timestamp + forecast_time])
-
-                forecast_time += self._forecast_step
+            try:
+                while forecast_time <= self._max_forecast_time:
+                    for sensor in sensors_table.itertuples():
+                        precip_value = self._tile_reader.get_dbz_value_by_coords(
+                            coords=Coordinate(lon=sensor.lon, lat=sensor.lat),
+                            offset=forecast_time // 60)
+
+                        if precip_value is not None and precip_value.dbz is not None:
+                            precip_rate = TileProvider.dbz_to_precipitation_rate(
+                                dbz=precip_value.dbz, precip_type=precip_value.precip_type)
+                            result_data.append([
+                                sensor.id,
+                                precip_rate,
+                                precip_value.precip_type.value,
+                                self._snapshot_timestamp + forecast_time])
+
+                    forecast_time += self._forecast_step
+            finally:
+                # the archive isn't kept open by providers cached in the forecast manager
+                if self._tile_loader is not None:
+                    self._tile_loader.close()
 
         return pandas.DataFrame(data=result_data,
                                 columns=["id", "precip_rate", "precip_type", "timestamp"])
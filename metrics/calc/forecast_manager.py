@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import os
 import pandas
 import typing
@@ -6,7 +8,12 @@ import zipfile
 from metrics.calc.forecast.rainviewer import RainViewerProvider
 from metrics.calc.forecast.table_provider import TableProvider
 from metrics.calc.forecast.provider import ForecastProvider
+from metrics.calc.lead_time import LeadTimeFilter
+from metrics.calc.rollup import rollup_folder
 from metrics.data_vendor import BaseDataVendor, DataVendor
+from metrics.io import storage
+from metrics.io.arrow_cache import ArrowCache
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, SessionCatalog, rollup_kind
 
 from metrics.session import Session
 from metrics.utils.time import floor_timestamp
@@ -20,13 +27,57 @@ class ForecastManager:
     """This class wraps access to data providers. It manages access to different timestamps of the data"""
 
     DATA_STEP = 600  # minimum step of forecast snasphots in seconds
+    PROVIDERS_MEMORY_LIMIT = 1024 ** 3  # default limit of data kept by the cached providers in bytes
+    PREFETCH_THREADS = 4  # default number of snapshots loaded in background threads
 
-    def __init__(self, data_vendor: BaseDataVendor, session: Session) -> None:
-
+    def __init__(self,
+                 data_vendor: BaseDataVendor,
+                 session: Session,
+                 rollup_period: typing.Optional[int] = None,
+                 cache: typing.Optional[ArrowCache] = None,
+                 providers_memory_limit: int = PROVIDERS_MEMORY_LIMIT,
+                 prefetch_threads: int = PREFETCH_THREADS) -> None:
+        """
+        Parameters
+        ----------
+        data_vendor : BaseDataVendor
+            Vendor of the forecast
+        session : Session
+            Session to load forecast from
+        rollup_period : int | None
+            Period of rollup tables to use instead of raw tables when they exist. Raw tables are used if `None`
+        cache : ArrowCache | None
+            Cache to load tables from. Tables are loaded from parquet files if `None`
+        providers_memory_limit : int
+            Limit of data in bytes kept by the created providers. Least recently used providers
+            are dropped above the limit
+        prefetch_threads : int
+            Number of threads that load next snapshots while the current one is processed.
+            Snapshots are loaded one by one if `0`
+        """
         self._data_vendor = data_vendor
         self._session = session
+        self._rollup_period = rollup_period
+        self._cache = cache
+        self._catalog = SessionCatalog(session_path=session.path)
+        self._rollup_snapshots: typing.Optional[typing.Set[int]] = None  # snapshots with rollups in the catalog
 
-        self._providers: typing.Dict[int, ForecastProvider] = {}  # providers by timestamps
+        self._providers_memory_limit = providers_memory_limit
+        self._prefetch_threads = prefetch_threads
+        # providers by timestamps, from the least to the most recently used
+        self._providers: typing.OrderedDict[int, ForecastProvider] = collections.OrderedDict()
+        self._providers_usage: typing.Dict[int, int] = {}  # last known memory usage of providers by timestamps
+        self._memory_usage = 0  # sum of `_providers_usage`
+
+    @staticmethod
+    def _is_rollup_fresh(rollup_path: str, table_path: str) -> bool:
+        # the snapshot table is re-parsed after the rollup was written
+        rollup_stat = storage.stat(rollup_path)
+        if rollup_stat is None:
+            return False
+
+        table_stat = storage.stat(table_path)
+        return table_stat is None or rollup_stat.mtime >= table_stat.mtime
 
     def _create_data_provider(self, timestamp: int) -> ForecastProvider:
         if self._data_vendor == DataVendor.RainViewer:
@@ -37,8 +88,25 @@ class ForecastManager:
                 snapshot_timestamp=timestamp)
         elif self._data_vendor in DataVendor:
             snapshots_path = os.path.join(self._session.tables_folder, self._data_vendor.value)
+
+            if self._rollup_period is not None:
+                rollups_path = rollup_folder(tables_folder=self._session.tables_folder,
+                                             data_vendor=self._data_vendor,
+                                             period=self._rollup_period)
+                if self._rollup_snapshots is not None:
+                    if timestamp in self._rollup_snapshots:
+                        return TableProvider(tables_path=rollups_path,
+                                             snapshot_timestamp=timestamp,
+                                             cache=self._cache)
+                elif self._is_rollup_fresh(rollup_path=os.path.join(rollups_path, f"{timestamp}.parquet"),
+                                           table_path=os.path.join(snapshots_path, f"{timestamp}.parquet")):
+                    return TableProvider(tables_path=rollups_path,
+                                         snapshot_timestamp=timestamp,
+                                         cache=self._cache)
+
             return TableProvider(tables_path=snapshots_path,
-                                 snapshot_timestamp=timestamp)
+                                 snapshot_timestamp=timestamp,
+                                 cache=self._cache)
         else:
             raise ValueError(f"Data vendor {self._data_vendor.value} is not supported")
 
@@ -60,6 +128,7 @@ class ForecastManager:
             try:
                 new_provider = self._create_data_provider(timestamp=snapshot_timestamp)
                 self._providers[snapshot_timestamp] = new_provider
+                self._update_memory_usage(snapshot_timestamp)
                 return new_provider
             except ValueError:
                 return None
@@ -67,11 +136,106 @@ class ForecastManager:
                 console.log(f"zipfile.BadZipFile getting provider {self._data_vendor.value} for {snapshot_timestamp}")
                 return None
 
+        self._providers.move_to_end(snapshot_timestamp)
         return found_provider
 
+    def _update_memory_usage(self, snapshot_timestamp: int):
+        """Updates the total memory usage with the current usage of the cached provider of the snapshot"""
+        provider = self._providers.get(snapshot_timestamp, None)
+        if provider is None:
+            return
+
+        usage = provider.memory_usage()
+        self._memory_usage += usage - self._providers_usage.get(snapshot_timestamp, 0)
+        self._providers_usage[snapshot_timestamp] = usage
+
+    def _evict_providers(self):
+        """Drops least recently used providers until their data fits the memory limit.
+        The most recently used provider is always kept
+        """
+        while self._memory_usage > self._providers_memory_limit and len(self._providers) > 1:
+            snapshot_timestamp, _ = self._providers.popitem(last=False)
+            self._memory_usage -= self._providers_usage.pop(snapshot_timestamp, 0)
+
+    def _load_provider(self,
+                       snapshot_timestamp: int,
+                       provider: ForecastProvider,
+                       sensors_table: pandas.DataFrame) -> typing.Optional[pandas.DataFrame]:
+        """Loads data of the provider. Returns `None` if its data can't be read, so the snapshot is skipped"""
+        try:
+            return provider.load(sensors_table=sensors_table)
+        except ValueError:
+            return None
+        except zipfile.BadZipFile:
+            console.log(f"zipfile.BadZipFile loading {self._data_vendor.value} for {snapshot_timestamp}")
+            return None
+
+    def _load_snapshots(self,
+                        snapshots: typing.List[int],
+                        sensors_table: pandas.DataFrame
+                        ) -> typing.Iterator[typing.Tuple[int, ForecastProvider, typing.Optional[pandas.DataFrame]]]:
+        """Loads data of the snapshots in time order. While a snapshot is processed by the caller,
+        the next `prefetch_threads` snapshots are loaded in background threads
+
+        Parameters
+        ----------
+        snapshots : List[int]
+            Sorted snapshot timestamps
+        sensors_table : pandas.DataFrame
+            Table of sensors with unique rows by sensor id
+
+        Returns
+        -------
+        Iterator[Tuple[int, ForecastProvider, pandas.DataFrame | None]]
+            Returns snapshot timestamp, its provider and loaded data for snapshots that have a provider
+        """
+        providers = ((snapshot, self._get_provider_for_timestamp(snapshot)) for snapshot in snapshots)
+        providers = ((snapshot, provider) for snapshot, provider in providers if provider)
+
+        if self._prefetch_threads == 0:
+            for snapshot, provider in providers:
+                yield snapshot, provider, self._load_provider(snapshot, provider, sensors_table)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._prefetch_threads) as executor:
+            pending = collections.deque()
+            for snapshot, provider in providers:
+                pending.append((snapshot, provider,
+                                executor.submit(self._load_provider, snapshot, provider, sensors_table)))
+                if len(pending) > self._prefetch_threads:
+                    snapshot, provider, future = pending.popleft()
+                    yield snapshot, provider, future.result()
+
+            while len(pending) > 0:
+                snapshot, provider, future = pending.popleft()
+                yield snapshot, provider, future.result()
+
+    def _list_catalog_snapshots(self, time_range: typing.Tuple[int, int]) -> typing.Optional[typing.Set[int]]:
+        """Returns snapshots of the vendor listed in the session catalog or `None` if the catalog has never
+        listed the vendor folder
+        """
+        if not isinstance(self._data_vendor, DataVendor):
+            return None
+
+        kind = KIND_ARCHIVE if self._data_vendor == DataVendor.RainViewer else KIND_TABLE
+        if not self._catalog.is_synced(kind=kind, vendor=self._data_vendor.value):
+            return None
+
+        # rollups that the catalog has never listed are checked by their files
+        if self._rollup_period is not None and \
+                self._catalog.is_synced(kind=rollup_kind(self._rollup_period), vendor=self._data_vendor.value):
+            rollups = self._catalog.list(kind=rollup_kind(self._rollup_period),
+                                         vendor=self._data_vendor.value,
+                                         time_range=time_range)
+            self._rollup_snapshots = {entry.snapshot for entry in rollups}
+
+        entries = self._catalog.list(kind=kind, vendor=self._data_vendor.value, time_range=time_range)
+        return {entry.snapshot for entry in entries}
+
     def load_forecast(self,
                       time_rage: typing.Tuple[int, int],
-                      sensors_table: pandas.DataFrame) -> pandas.DataFrame:
+                      sensors_table: pandas.DataFrame,
+                      lead_times: typing.Optional[LeadTimeFilter] = None) -> pandas.DataFrame:
         """Loads data for specified sensors and time range from provider
 
         Parameters
@@ -80,6 +244,8 @@ class ForecastManager:
             Timestamp for which
         sensors_table : pandas.DataFrame
             Table of sensors. It should contains unique rows by sensor id. Has next columns: "id", "lon", "lat"
+        lead_times : LeadTimeFilter | None
+            Filter of rows that will be used. Snapshots without such rows are not loaded. All rows are kept if `None`
 
         Returns
         -------
@@ -87,30 +253,48 @@ class ForecastManager:
             Table with forecast for each sensor that has next columns: "id", "precip_rate", "precip_type", "forecast_time"
         """
 
-        sensor_ids = set(sensors_table["id"].unique())
+        sensor_ids = sensors_table["id"].unique()
         unique_sensors_table = sensors_table.groupby("id").first().reset_index()
 
         curr_time = floor_timestamp(time_rage[0], ForecastManager.DATA_STEP)
         end_time = time_rage[1]
 
-        loaded_forecasts = []
+        available_snapshots = self._list_catalog_snapshots(time_range=(curr_time, end_time))
+
+        snapshots = []
         while curr_time <= end_time:
-            provider = self._get_provider_for_timestamp(curr_time)
+            if available_snapshots is not None and curr_time not in available_snapshots:
+                curr_time += ForecastManager.DATA_STEP
+                continue
 
-            if provider:
-                data = provider.load(sensors_table=unique_sensors_table)
+            if lead_times is not None and not lead_times.can_contribute(curr_time):
+                curr_time += ForecastManager.DATA_STEP
+                continue
 
-                if data is not None:
-                    assert "id" in data.columns
-                    assert "precip_rate" in data.columns
-                    assert "precip_type" in data.columns
-                    assert "timestamp" in data.columns
+            snapshots.append(curr_time)
+            curr_time += ForecastManager.DATA_STEP
 
+        loaded_forecasts = []
+        for snapshot_timestamp, provider, data in self._load_snapshots(snapshots=snapshots,
+                                                                       sensors_table=unique_sensors_table):
+            # the provider's data is loaded now, so its usage is known
+            self._update_memory_usage(snapshot_timestamp)
+            self._evict_providers()
+
+            if data is not None:
+                assert "id" in data.columns
+                assert "precip_rate" in data.columns
+                assert "precip_type" in data.columns
+                assert "timestamp" in data.columns
+
+                if not provider.FILTERS_SENSORS:
                     data = data[data["id"].isin(sensor_ids)]
-                    data["forecast_time"] = data["timestamp"] - curr_time
+                # providers can share loaded tables, so a new table is made
+                data = data.assign(forecast_time=data["timestamp"] - snapshot_timestamp)
 
-                    loaded_forecasts.append(data)
+                if lead_times is not None:
+                    data = lead_times.filter(data)
 
-            curr_time += ForecastManager.DATA_STEP
+                loaded_forecasts.append(data)
 
         return pandas.concat(loaded_forecasts)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas
+import typing
+
+from metrics.utils.intervals import END_TIMESTAMP_COLUMN, INTERVAL_STEP
+
+
+def _boundary_steps(start: np.ndarray,
+                    last: np.ndarray,
+                    period: int,
+                    offset: int,
+                    step: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Returns row indices and step numbers of the first interval points in every bin after the first one.
+    Bins are ranges ((k - 1) * period, k * period] of `value + offset`, as `ceil` alignment builds them
+    """
+    first_bin = np.ceil((start + offset) / period).astype(np.int64)
+    last_bin = np.ceil((last + offset) / period).astype(np.int64)
+    counts = last_bin - first_bin
+
+    rows = np.repeat(np.arange(len(start)), counts)
+    ranks = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    bins = first_bin[rows] + ranks
+
+    steps = np.floor(((bins - 1) * period - offset - start[rows]) / step).astype(np.int64) + 1
+    return rows, steps
+
+
+def bin_intervals(data: pandas.DataFrame,
+                  period: int,
+                  offset: int = 0,
+                  step: int = INTERVAL_STEP) -> pandas.DataFrame:
+    """Replaces intervals by points, one per time bin that the interval covers. Each point keeps values
+    of its interval, so the maximum per bin is the same as for a table with a row per interval point.
+    When there is a "forecast_time" column, its bins are also covered. Rows without end timestamp are points
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Table with "timestamp" and "end_timestamp" columns
+    period : int
+        Period in seconds of the bins
+    offset : int
+        Time offset in seconds applied before binning
+    step : int
+        Step in seconds between points of an interval
+
+    Returns
+    -------
+    pandas.DataFrame
+        Returns table without "end_timestamp" column. Values of "timestamp" and "forecast_time" are not aligned
+    """
+    data = data.reset_index(drop=True)
+    start = data["timestamp"].to_numpy(dtype=np.int64)
+
+    end = data[END_TIMESTAMP_COLUMN].to_numpy(dtype=np.float64)
+    end = np.where(np.isnan(end), start + step, end).astype(np.int64)
+    last = start + np.maximum((end - start - 1) // step, 0) * step
+
+    rows = [np.arange(len(data))]
+    steps = [np.zeros(len(data), dtype=np.int64)]
+
+    boundary_rows, boundary_steps = _boundary_steps(start, last, period, offset, step)
+    rows.append(boundary_rows)
+    steps.append(boundary_steps)
+
+    if "forecast_time" in data.columns:
+        forecast_start = data["forecast_time"].to_numpy(dtype=np.int64)
+        boundary_rows, boundary_steps = _boundary_steps(forecast_start,
+                                                        forecast_start + last - start,
+                                                        period, offset, step)
+        rows.append(boundary_rows)
+        steps.append(boundary_steps)
+
+    points = pandas.DataFrame({"row": np.concatenate(rows), "step": np.concatenate(steps)})
+    points = points.drop_duplicates().sort_values(by=["row", "step"])
+    row_index = points["row"].to_numpy()
+    shift = points["step"].to_numpy() * step
+
+    result = data.iloc[row_index].drop(columns=[END_TIMESTAMP_COLUMN]).reset_index(drop=True)
+    result["timestamp"] = start[row_index] + shift
+    if "forecast_time" in result.columns:
+        result["forecast_time"] = data["forecast_time"].to_numpy(dtype=np.int64)[row_index] + shift
+
+    return result
+
+
+def expand_intervals(data: pandas.DataFrame, step: int = INTERVAL_STEP) -> pandas.DataFrame:
+    """Replaces intervals by all their points. It's the reference for `bin_intervals` and a way to get
+    the per minute table of an interval table
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Table with "timestamp" and "end_timestamp" columns
+    step : int
+        Step in seconds between points of an interval
+
+    Returns
+    -------
+    pandas.DataFrame
+        Returns table without "end_timestamp" column
+    """
+    data = data.reset_index(drop=True)
+    start = data["timestamp"].to_numpy(dtype=np.int64)
+
+    end = data[END_TIMESTAMP_COLUMN].to_numpy(dtype=np.float64)
+    end = np.where(np.isnan(end), start + step, end).astype(np.int64)
+    counts = np.maximum((end - start + step - 1) // step, 1)
+
+    row_index = np.repeat(np.arange(len(data)), counts)
+    shift = (np.arange(len(row_index)) - np.repeat(np.cumsum(counts) - counts, counts)) * step
+
+    result = data.iloc[row_index].drop(columns=[END_TIMESTAMP_COLUMN]).reset_index(drop=True)
+    result["timestamp"] = start[row_index] + shift
+    if "forecast_time" in result.columns:
+        result["forecast_time"] = data["forecast_time"].to_numpy(dtype=np.int64)[row_index] + shift
+
+    return result
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas
+import typing
+
+from dataclasses import dataclass
+from metrics.calc.intervals import END_TIMESTAMP_COLUMN, INTERVAL_STEP
+
+
+def _aligned_range(time_range: typing.Tuple[int, int], period: int, offset: int) -> typing.Tuple[int, int]:
+    """Returns range (start, end] of raw values which `ceil` alignment puts into bins of the values
+    in the range (start, end]"""
+    first_bin = (int(np.floor((time_range[0] + offset) / period)) + 1) * period
+    last_bin = int(np.ceil((time_range[1] + offset) / period)) * period
+    return first_bin - period - offset, last_bin - offset
+
+
+@dataclass
+class LeadTimeFilter:
+    """Rows of forecast that calc can use. Calc aligns forecast time and timestamp with
+    `ceil((value + offset) / period) * period` and keeps only requested forecast times and timestamps
+    of observations, so other rows can be dropped right after load without changing metrics
+    """
+    forecast_times: typing.List[int]        # requested forecast times in seconds
+    time_range: typing.Tuple[int, int]      # range (start, end] of observation timestamps in seconds
+    period: int = 600                       # alignment period in seconds
+    offset: int = 0                         # alignment offset in seconds
+    step: int = INTERVAL_STEP               # step in seconds between points of interval rows
+
+    def windows(self) -> typing.List[typing.Tuple[int, int]]:
+        """Returns sorted ranges (start, end] of raw forecast times that are aligned to the requested ones"""
+        windows = []
+        for forecast_time in sorted(set(self.forecast_times)):
+            start, end = forecast_time - self.period - self.offset, forecast_time - self.offset
+            if len(windows) > 0 and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], end)
+            else:
+                windows.append((start, end))
+
+        return windows
+
+    def can_contribute(self, snapshot: int) -> bool:
+        """Checks if any row of the snapshot can get into the requested forecast times and timestamps"""
+        start, end = _aligned_range(self.time_range, self.period, self.offset)
+        return any(start - window_end < snapshot < end - window_start for window_start, window_end in self.windows())
+
+    def filter(self, data: pandas.DataFrame) -> pandas.DataFrame:
+        """Keeps rows of the forecast that can get into the requested forecast times and timestamps.
+        Interval rows are kept whole if any of their points can
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Forecast table with "timestamp" and "forecast_time" columns
+
+        Returns
+        -------
+        pandas.DataFrame
+            Returns rows of the table that can be used
+        """
+        start = data["timestamp"].to_numpy(dtype=np.int64)
+        last = start
+        if END_TIMESTAMP_COLUMN in data.columns:
+            end = data[END_TIMESTAMP_COLUMN].to_numpy(dtype=np.float64)
+            end = np.where(np.isnan(end), start + self.step, end).astype(np.int64)
+            last = start + np.maximum((end - start - 1) // self.step, 0) * self.step
+
+        forecast_start = data["forecast_time"].to_numpy(dtype=np.int64)
+        forecast_last = forecast_start + last - start
+
+        time_start, time_end = _aligned_range(self.time_range, self.period, self.offset)
+        mask = (start <= time_end) & (last > time_start)
+
+        lead_time_mask = np.zeros(len(data), dtype=bool)
+        for window_start, window_end in self.windows():
+            lead_time_mask |= (forecast_start <= window_end) & (forecast_last > window_start)
+
+        return data[mask & lead_time_mask]
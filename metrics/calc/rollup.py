@@ -0,0 +1,60 @@
+import numpy as np
+import os
+import pandas
+import typing
+
+from metrics.calc.intervals import END_TIMESTAMP_COLUMN, bin_intervals
+from metrics.data_vendor import BaseDataVendor
+
+# Folder inside the session tables folder with pre-binned forecast tables
+ROLLUPS_FOLDER = "rollups"
+
+ROLLUP_PERIOD = 600
+
+
+def rollup_folder(tables_folder: str, data_vendor: BaseDataVendor, period: int = ROLLUP_PERIOD) -> str:
+    """Returns folder with rollup tables of the vendor: `<tables>/rollups/<period>/<vendor>`"""
+    return os.path.join(tables_folder, ROLLUPS_FOLDER, str(period), data_vendor.value)
+
+
+def rollup_table(table: pandas.DataFrame, period: int = ROLLUP_PERIOD) -> pandas.DataFrame:
+    """Bins forecast of one snapshot by time. Timestamps in range (0, period] are aligned to `period`,
+    the same way as calc aligns them. Every bin keeps the maximum precipitation rate for each precipitation type,
+    so the rollup can be grouped by any set of precipitation types later
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Forecast table of one snapshot with columns "id", "timestamp", "precip_rate", "precip_type".
+        Interval tables also have "end_timestamp" column
+    period : int
+        Bin size in seconds
+
+    Returns
+    -------
+    pandas.DataFrame
+        Returns table with columns "id", "timestamp", "precip_type", "precip_rate"
+    """
+    if END_TIMESTAMP_COLUMN in table.columns:
+        table = bin_intervals(data=table, period=period)
+
+    data = table[["id", "timestamp", "precip_type", "precip_rate"]].copy()
+    data["timestamp"] = (np.ceil(data["timestamp"] / period) * period).astype(np.int64)
+
+    # rows without precipitation type are kept, they count as not matching any type
+    return data.groupby(["id", "timestamp", "precip_type"], dropna=False).agg({
+        "precip_rate": "max"
+    }).reset_index()
+
+
+def can_use_rollups(group_period: int,
+                    observations_offset: int,
+                    data_step: int,
+                    period: int = ROLLUP_PERIOD) -> bool:
+    """Checks if calc with specified parameters gets the same result from rollups as from raw tables.
+
+    Calc aligns timestamps and forecast times with `ceil((value + offset) / group_period) * group_period`.
+    Applied to binned timestamps it gives the same values as applied to raw ones only when the bins are
+    the same, the offset is a whole number of bins and snapshots start at bin boundaries
+    """
+    return group_period == period and observations_offset % period == 0 and data_step % period == 0
@@ -0,0 +1,139 @@
+import itertools
+import multiprocessing.pool
+import queue
+import typing
+
+from metrics.io.catalog import CatalogEntry
+
+from rich.console import Console
+
+console = Console()
+
+PROCESS_MEMORY = 256 * 1024 ** 2  # memory of a worker process before it loads any data in bytes
+ROW_MEMORY = 128                   # initial estimate of memory per loaded table row in bytes
+ARCHIVE_MEMORY_RATIO = 8           # initial estimate of memory per byte of a loaded archive
+
+
+def entries_memory(entries: typing.Iterable[CatalogEntry]) -> int:
+    """Returns initial estimate of memory to load the catalog entries. Tables are estimated by
+    number of rows, archives are estimated by their size
+
+    Parameters
+    ----------
+    entries : Iterable[CatalogEntry]
+        Entries that are loaded by a job
+
+    Returns
+    -------
+    int
+        Returns estimate in bytes
+    """
+    return sum(entry.rows * ROW_MEMORY if entry.rows is not None else entry.size * ARCHIVE_MEMORY_RATIO
+               for entry in entries)
+
+
+class MemoryScheduler:
+    """Runs jobs in a process pool while expected memory of the running jobs fits the budget.
+
+    Jobs come with estimates of the data they load. Expected memory of a job is the process memory plus
+    the estimate multiplied by a scale. The scale starts from 1 and is refined from the peak RSS
+    measured by finished jobs, so later jobs are admitted by the actual memory use. The scale is the summed
+    memory of finished jobs above the process memory divided by their summed estimates, so small jobs,
+    whose RSS is mostly the process itself, don't inflate it. A job that doesn't fit the budget alone runs alone
+    """
+
+    def __init__(self, memory_budget: int, process_num: int):
+        """
+        Parameters
+        ----------
+        memory_budget : int
+            Memory in bytes that the running jobs can use together
+        process_num : int
+            Maximum number of jobs that run at the same time
+        """
+        self._memory_budget = memory_budget
+        self._process_num = process_num
+
+        self._scale: typing.Optional[float] = None  # observed memory per estimated byte
+        self._data_memory = 0                       # summed peak RSS above the process memory of finished jobs
+        self._estimates = 0                         # summed estimates of finished jobs
+        self._max_peak_rss = 0                      # maximum observed peak RSS of a job
+
+    def expected_memory(self, estimate: int) -> int:
+        """Returns expected memory in bytes of a job with the estimate. Jobs without estimates, e.g. for sessions
+        without a catalog, are expected to take as much memory as the largest finished job
+        """
+        if estimate == 0:
+            return max(self._max_peak_rss, PROCESS_MEMORY)
+
+        scale = 1.0 if self._scale is None else self._scale
+        return PROCESS_MEMORY + int(estimate * scale)
+
+    def record(self, estimate: int, peak_rss: int):
+        """Refines expected memory by the peak RSS measured by a finished job with the estimate"""
+        self._max_peak_rss = max(self._max_peak_rss, peak_rss)
+        if estimate > 0:
+            self._data_memory += max(peak_rss - PROCESS_MEMORY, 0)
+            self._estimates += estimate
+            self._scale = self._data_memory / self._estimates
+
+    def fits(self, estimate: int) -> bool:
+        """Checks if `process_num` jobs with the estimate can run together within the budget"""
+        return self.expected_memory(estimate) * self._process_num <= self._memory_budget
+
+    def run(self,
+            pool: multiprocessing.pool.Pool,
+            func: typing.Callable[[typing.Any], typing.Tuple[typing.Any, int]],
+            jobs: typing.List[typing.Any],
+            estimates: typing.List[int]) -> typing.Iterator[typing.Any]:
+        """Runs the jobs in the pool in the order of the list and yields their results as they finish
+
+        Parameters
+        ----------
+        pool : multiprocessing.pool.Pool
+            Pool to run the jobs
+        func : Callable[[Any], Tuple[Any, int]]
+            Function that runs a job and returns its result and peak RSS in bytes
+        jobs : List[Any]
+            Jobs to run
+        estimates : List[int]
+            Estimates of the data loaded by the jobs, see `entries_memory`
+
+        Returns
+        -------
+        Iterator[Any]
+            Returns results of the jobs in order they finish
+        """
+        finished = queue.Queue()
+        pending = list(zip(jobs, estimates))[::-1]
+        running: typing.Dict[int, int] = {}  # expected memory of running jobs by their indices
+        counter = itertools.count()
+
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < self._process_num:
+                job, estimate = pending[-1]
+                expected = self.expected_memory(estimate)
+                if len(running) > 0 and sum(running.values()) + expected > self._memory_budget:
+                    break
+
+                if expected > self._memory_budget:
+                    console.log(f"[yellow]Job is expected to take {expected // 1024 ** 2} MB, "
+                                f"more than the memory budget. It runs alone[/yellow]")
+
+                pending.pop()
+                index = next(counter)
+                running[index] = expected
+                pool.apply_async(func, (job,),
+                                 callback=lambda result, index=index, estimate=estimate:
+                                     finished.put((index, estimate, result, None)),
+                                 error_callback=lambda error, index=index, estimate=estimate:
+                                     finished.put((index, estimate, None, error)))
+
+            index, estimate, result, error = finished.get()
+            del running[index]
+            if error is not None:
+                raise error
+
+            value, peak_rss = result
+            self.record(estimate=estimate, peak_rss=peak_rss)
+            yield value
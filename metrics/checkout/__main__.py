@@ -1,7 +1,10 @@
 import argparse
+import sys
 
 from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo
 from metrics.checkout.checkout import checkout
+from metrics.checkout.engine import MAX_CONCURRENCY, RETRIES
+from metrics.checkout.multipart import PART_CONCURRENCY, PART_SIZE
 
 
 def _run_checkout(args: argparse.Namespace):
@@ -15,13 +18,25 @@ def _run_checkout(args: argparse.Namespace):
 
     observations = ObservationSourcesInfo(s3_uri_metar=args.s3_uri_metar_data)
 
-    checkout(start_time=args.start_time,
-             end_time=args.end_time,
-             session_path=args.session_path,
-             session_clear=args.session_clear,
-             forecasts_source=forecasts,
-             observations_source=observations,
-             forecast_range=args.forecast_range)
+    report = checkout(start_time=args.start_time,
+                      end_time=args.end_time,
+                      session_path=args.session_path,
+                      session_clear=args.session_clear,
+                      forecasts_source=forecasts,
+                      observations_source=observations,
+                      forecast_range=args.forecast_range,
+                      max_concurrency=args.max_concurrency,
+                      retries=args.retries,
+                      cache_folder=args.cache_dir,
+                      cache_size=None if args.cache_size is None else int(args.cache_size * 1024 ** 3),
+                      part_size=int(args.part_size * 1024 ** 2),
+                      part_concurrency=args.part_concurrency,
+                      sensor_selection_path=args.filter_sensors_dir,
+                      data_uri=args.data_uri,
+                      tables_uri=args.tables_uri)
+
+    if len(report.failed) > 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -43,8 +58,26 @@ if __name__ == "__main__":
                         help="End timestamp")
     parser.add_argument("--forecast-range", type=int, dest="forecast_range", required=False, default=7800,
                         help="Forecast range in seconds")
+    parser.add_argument("--max-concurrency", type=int, dest="max_concurrency", required=False,
+                        default=MAX_CONCURRENCY,
+                        help="Maximum number of S3 requests in flight across all sources")
+    parser.add_argument("--retries", type=int, dest="retries", required=False, default=RETRIES,
+                        help="Number of retries of a failed S3 request with exponential backoff")
+    parser.add_argument("--cache-dir", type=str, dest="cache_dir", required=False, default=None,
+                        help="Folder of the data cache shared by sessions. Sessions get hardlinks to cached files")
+    parser.add_argument("--cache-size", type=float, dest="cache_size", required=False, default=None,
+                        help="Maximum size of the data cache in GB, least recently used files are evicted")
+    parser.add_argument("--part-size", type=float, dest="part_size", required=False,
+                        default=PART_SIZE / 1024 ** 2,
+                        help="Size of a part of large objects downloaded by ranged requests in MB")
+    parser.add_argument("--part-concurrency", type=int, dest="part_concurrency", required=False,
+                        default=PART_CONCURRENCY,
+                        help="Maximum number of parts of one object downloaded in parallel")
 
     sensor_group = parser.add_argument_group(title="Sensors")
+    sensor_group.add_argument("--filter-sensors-dir", dest="filter_sensors_dir", type=str, default=None,
+                              help="Path to the sensor selection with `lon` and `lat` columns. Only RainViewer tiles "
+                                   "of the selected sensors are fetched from the archives")
     sensor_group.add_argument("--s3-uri-metar-data", type=str, dest="s3_uri_metar_data", required=False, default=None,
                               help="S3 uri where to get metar data")
 
@@ -66,6 +99,13 @@ if __name__ == "__main__":
                           required=False, default=None,
                           help="S3 uri where to get WeatherCompany forecast")
 
+    remote_group = parser.add_argument_group(title="Remote session")
+    remote_group.add_argument("--data-uri", type=str, dest="data_uri", required=False, default=None,
+                              help="S3 uri with `<vendor>/<snapshot>.zip` archives that parse and calc read in place "
+                                   "instead of downloading them")
+    remote_group.add_argument("--tables-uri", type=str, dest="tables_uri", required=False, default=None,
+                              help="S3 uri with parsed `<vendor>/...` tables that calc reads in place")
+
     parser.set_defaults(func=_run_checkout)
 
     args = parser.parse_args()
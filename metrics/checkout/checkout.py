@@ -1,12 +1,23 @@
-import concurrent.futures
+import hashlib
+import json
+import mercantile
 import os
+import pandas
 import shutil
 import typing
 
 from metrics.checkout.constants import AGGREGATION_PERIOD
 from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo, DataSource, FILENAME_RULES
+from metrics.checkout.engine import MAX_CONCURRENCY, RETRIES, CheckoutEngine, CheckoutReport, DownloadTask
+from metrics.checkout.multipart import PART_CONCURRENCY, PART_SIZE
+from metrics.checkout.remote_zip import MemberSelection
+from metrics.data_vendor import DataVendor
+from metrics.io import storage
+from metrics.io.catalog import KIND_ARCHIVE, SessionCatalog
+from metrics.io.data_cache import DataCache
+from metrics.io.rainviewer import RainViewerTileLoader
 from metrics.session import Session
-from metrics.utils.s3 import S3Client
+from metrics.utils.sensors import read_selected_sensors
 from metrics.utils.time import format_time
 from metrics.utils.time_measure import TimeMeasure
 from rich.console import Console
@@ -71,24 +82,21 @@ def _build_s3_download_list(snaphots: typing.List[int], s3_uri: str, rule: str)
     return list(map(lambda item: os.path.join(s3_uri, filename_func(item)), snaphots))
 
 
-def _download_file_impl(args):
-    uri, file_path = args
-    s3_client = S3Client()
-    if not s3_client.download_file(s3_uri=uri, file_path=file_path):
-        console.log(f"\n[red]Error:[/red] Wasn't able to download {uri}")
-
-
-def _download_data(s3_uri: str,
-                   download_path: str,
-                   start_time: int,
-                   end_time: int,
-                   period: int,
-                   rule: str):
-    """Downloads timestamps of sensors data from s3.
+def _build_download_task(name: str,
+                         s3_uri: str,
+                         download_path: str,
+                         start_time: int,
+                         end_time: int,
+                         period: int,
+                         rule: str,
+                         selection: typing.Optional[MemberSelection] = None) -> DownloadTask:
+    """Builds download task of data snapshots from s3.
 
     Parameters
     ----------
-    data_uri : str
+    name : str
+        Name of the data source in logs
+    s3_uri : str
         S3 URI of folder with data on s3
     download_path : str
         Path where to download data
@@ -100,80 +108,104 @@ def _download_data(s3_uri: str,
         Period of stored data
     rule : str
         Rule for creating filename from timestamp
+    selection : MemberSelection | None
+        Members to fetch from zip archives. Whole archives are downloaded if `None`
+
+    Returns
+    -------
+    DownloadTask
+        Returns task to run by :class:`CheckoutEngine`
     """
-    sensors_timestamps = _build_snapshot_list(
+    timestamps = _build_snapshot_list(
         start_time=start_time,
         end_time=end_time,
         period=period)
 
     download_uri_list = _build_s3_download_list(
-        snaphots=sensors_timestamps,
+        snaphots=timestamps,
         s3_uri=s3_uri,
         rule=rule)
 
-    download_jobs = []
-    for uri, timestamp in zip(download_uri_list, sensors_timestamps):
+    file_paths = []
+    for uri, timestamp in zip(download_uri_list, timestamps):
         _, file_ext = os.path.splitext(uri)
-        file_path = os.path.join(download_path, f"{timestamp}{file_ext}")
-        download_jobs.append((uri, file_path))
+        file_paths.append(os.path.join(download_path, f"{timestamp}{file_ext}"))
 
-    tm = TimeMeasure()
-    console.log(f"Download data from {s3_uri}...")
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.map(_download_file_impl, download_jobs)
-    console.log(f"Download from {s3_uri} completed in {tm():.2f} seconds...")
+    return DownloadTask(name=name,
+                        download_path=download_path,
+                        download_uri_list=download_uri_list,
+                        file_paths=file_paths,
+                        selection=selection)
 
 
-def checkout_forecasts(session: Session, forecasts_source: ForecastSourcesInfo):
-    def _download_forecast(vendor: str, s3_uri: str, data_folder: str, rule: str, period: int = 600):
-        time = format_time(session.start_time - session.forecast_range)
-        console.log(f"[yellow]Download `{vendor}` forecast[/yellow]: [{time}, {format_time(session.end_time)}]")
-        os.makedirs(data_folder, exist_ok=True)
+def rainviewer_selection(sensors: pandas.DataFrame) -> typing.Optional[MemberSelection]:
+    """Returns selection of RainViewer data and mask tiles that contain the sensors
 
-        _download_data(s3_uri=s3_uri,
-                       download_path=data_folder,
-                       start_time=session.start_time - session.forecast_range,
-                       end_time=session.end_time,
-                       period=period,
-                       rule=rule)
+    Parameters
+    ----------
+    sensors : pandas.DataFrame
+        Sensors with `lon` and `lat` columns
 
-    os.makedirs(session.data_folder, exist_ok=True)
+    Returns
+    -------
+    MemberSelection | None
+        Returns selection or `None` if there are no sensor coordinates
+    """
+    if not {"lon", "lat"}.issubset(sensors.columns):
+        return None
+
+    sensors = sensors.dropna(subset=["lon", "lat"])
+    if len(sensors) == 0:
+        return None
+
+    tiles = sorted({(tile.x, tile.y) for tile in (mercantile.tile(lon, lat, RainViewerTileLoader.ZOOM_LEVEL)
+                                                  for lon, lat in zip(sensors["lon"], sensors["lat"]))})
+    selected = frozenset(tiles)
+
+    return MemberSelection(fingerprint=hashlib.sha1(json.dumps(tiles).encode()).hexdigest(),
+                           accept=lambda name: RainViewerTileLoader.member_tile(name) in selected)
+
+
+def forecast_download_tasks(session: Session,
+                            forecasts_source: ForecastSourcesInfo,
+                            rainviewer_tiles: typing.Optional[MemberSelection] = None) -> typing.List[DownloadTask]:
+    tasks = []
+    start_time = session.start_time - session.forecast_range
     for source in DataSource.forecast_sources_list(session=session,
                                                    forecast_source_info=forecasts_source):
         if source.s3_uri is not None:
-            _download_forecast(vendor=source.vendor,
-                               s3_uri=source.s3_uri,
-                               data_folder=source.data_folder,
-                               period=source.period,
-                               rule=source.filename_rule)
-
-
-def checkout_sensors(session: Session, observations_source: ObservationSourcesInfo):
-    def _download_sensors(vendor: str,
-                          s3_uri: str,
-                          data_folder: str,
-                          rule: str,
-                          period: int = 600):
-        time = format_time(session.start_time - AGGREGATION_PERIOD)
-        console.log(f"[yellow]Download `{vendor}` sensors data[/yellow]: [{time}, {format_time(session.end_time)}]")
-        os.makedirs(data_folder, exist_ok=True)
-
-        _download_data(s3_uri=s3_uri,
-                       download_path=data_folder,
-                       start_time=session.start_time - AGGREGATION_PERIOD,
-                       end_time=session.end_time,
-                       period=period,
-                       rule=rule)
-
-    os.makedirs(session.data_folder, exist_ok=True)
+            console.log(f"[yellow]Download `{source.vendor}` forecast[/yellow]: "
+                        f"[{format_time(start_time)}, {format_time(session.end_time)}]")
+            tasks.append(_build_download_task(name=f"{source.vendor} forecast",
+                                              s3_uri=source.s3_uri,
+                                              download_path=source.data_folder,
+                                              start_time=start_time,
+                                              end_time=session.end_time,
+                                              period=source.period,
+                                              rule=source.filename_rule,
+                                              selection=rainviewer_tiles
+                                              if source.vendor == DataVendor.RainViewer.value else None))
+
+    return tasks
+
+
+def sensors_download_tasks(session: Session, observations_source: ObservationSourcesInfo) -> typing.List[DownloadTask]:
+    tasks = []
+    start_time = session.start_time - AGGREGATION_PERIOD
     for source in DataSource.observation_sources_list(session=session,
                                                       observation_source_info=observations_source):
         if source.s3_uri is not None:
-            _download_sensors(vendor=source.vendor,
-                              s3_uri=source.s3_uri,
-                              data_folder=source.data_folder,
-                              period=source.period,
-                              rule=source.filename_rule)
+            console.log(f"[yellow]Download `{source.vendor}` sensors data[/yellow]: "
+                        f"[{format_time(start_time)}, {format_time(session.end_time)}]")
+            tasks.append(_build_download_task(name=f"{source.vendor} sensors",
+                                              s3_uri=source.s3_uri,
+                                              download_path=source.data_folder,
+                                              start_time=start_time,
+                                              end_time=session.end_time,
+                                              period=source.period,
+                                              rule=source.filename_rule))
+
+    return tasks
 
 
 def checkout(start_time: int,
@@ -182,9 +214,26 @@ def checkout(start_time: int,
              session_clear: bool,
              observations_source: ObservationSourcesInfo,
              forecasts_source: ForecastSourcesInfo,
-             forecast_range: int = 7800):
+             forecast_range: int = 7800,
+             max_concurrency: int = MAX_CONCURRENCY,
+             retries: int = RETRIES,
+             cache_folder: typing.Optional[str] = None,
+             cache_size: typing.Optional[int] = None,
+             part_size: int = PART_SIZE,
+             part_concurrency: int = PART_CONCURRENCY,
+             sensor_selection_path: typing.Optional[str] = None,
+             data_uri: typing.Optional[str] = None,
+             tables_uri: typing.Optional[str] = None) -> CheckoutReport:
     """
-    Checkout specified data into session folder
+    Checkout specified data into session folder. Data of all sources is downloaded together with
+    at most `max_concurrency` S3 requests in flight, failed requests are retried `retries` times.
+    With `cache_folder` the session links objects of the data cache shared by sessions, the cache keeps
+    at most `cache_size` bytes. Large objects are downloaded by ranged GETs of `part_size` bytes with at most
+    `part_concurrency` parts of an object in flight. With `sensor_selection_path` that has sensor coordinates,
+    only RainViewer tiles of the sensors are fetched from the archives.
+    With `data_uri` the session reads archives `<data_uri>/<vendor>/<snapshot>.zip` from S3 in place and nothing is
+    downloaded, with `tables_uri` it reads already parsed tables from S3.
+    Returns report with S3 URIs of objects that weren't downloaded
     """
     console.log(f"Run [green]checkout[/green] command:\n"
                 f"- session_path = {session_path}\n"
@@ -212,17 +261,81 @@ def checkout(start_time: int,
     session = Session(session_path=session_path,
                       start_time=start_time,
                       end_time=end_time,
-                      forecast_range=forecast_range)
-
-    # download data
-    checkout_forecasts(session=session,
-                       forecasts_source=forecasts_source)
-    checkout_sensors(session=session,
-                     observations_source=observations_source)
+                      forecast_range=forecast_range,
+                      data_folder=data_uri,
+                      tables_folder=tables_uri)
+
+    if storage.is_remote(session.data_folder):
+        # archives are read in place by parse and calc
+        os.makedirs(session_path, exist_ok=True)
+        report = CheckoutReport()
+        console.log(f"Archives are read from {session.data_folder}, nothing to download")
+    else:
+        report = _download(session=session,
+                           observations_source=observations_source,
+                           forecasts_source=forecasts_source,
+                           max_concurrency=max_concurrency,
+                           retries=retries,
+                           cache_folder=cache_folder,
+                           cache_size=cache_size,
+                           part_size=part_size,
+                           part_concurrency=part_concurrency,
+                           sensor_selection_path=sensor_selection_path)
 
     # save session meta info
     session.save_meta()
 
+    # list downloaded archives, so later stages don't scan data folders
+    catalog = SessionCatalog(session_path=session_path)
+    for vendor in DataVendor:
+        data_folder = os.path.join(session.data_folder, vendor.value)
+        if storage.isdir(data_folder):
+            catalog.sync(kind=KIND_ARCHIVE, vendor=vendor.value, folder=data_folder)
+
     deadline_timestamp = session.start_time - session.forecast_range - 3600
     deadline_timestamp = deadline_timestamp - (deadline_timestamp % 3600)
     session.clear_outdated(deadline_timestamp=deadline_timestamp)
+
+    return report
+
+
+def _download(session: Session,
+              observations_source: ObservationSourcesInfo,
+              forecasts_source: ForecastSourcesInfo,
+              max_concurrency: int,
+              retries: int,
+              cache_folder: typing.Optional[str],
+              cache_size: typing.Optional[int],
+              part_size: int,
+              part_concurrency: int,
+              sensor_selection_path: typing.Optional[str]) -> CheckoutReport:
+    """Downloads data of all sources into the session data folder, parameters are the same as of :func:`checkout`"""
+    # download data of all sources together
+    os.makedirs(session.data_folder, exist_ok=True)
+    rainviewer_tiles = None
+    if sensor_selection_path is not None:
+        rainviewer_tiles = rainviewer_selection(read_selected_sensors(sensor_selection_path))
+        if rainviewer_tiles is None:
+            console.log(f"[yellow]Sensor selection {sensor_selection_path} has no coordinates, "
+                        f"whole RainViewer archives are downloaded[/yellow]")
+
+    tasks = forecast_download_tasks(session=session,
+                                    forecasts_source=forecasts_source,
+                                    rainviewer_tiles=rainviewer_tiles)
+    tasks += sensors_download_tasks(session=session, observations_source=observations_source)
+
+    tm = TimeMeasure()
+    cache = None if cache_folder is None else DataCache(folder=cache_folder, max_size=cache_size)
+    engine = CheckoutEngine(max_concurrency=max_concurrency,
+                            retries=retries,
+                            cache=cache,
+                            part_size=part_size,
+                            part_concurrency=part_concurrency)
+    report = engine.run(tasks)
+    console.log(f"Download completed in {tm():.2f} seconds: {report.downloaded} downloaded, "
+                f"{report.up_to_date} up to date, {report.cached} cached, {report.missing} don't exist, "
+                f"{len(report.failed)} failed")
+    for s3_uri in report.failed:
+        console.log(f"[red]Failed:[/red] {s3_uri}")
+
+    return report
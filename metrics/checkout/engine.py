@@ -0,0 +1,526 @@
+import aioboto3
+import aiohttp
+import asyncio
+import botocore.exceptions
+import hashlib
+import itertools
+import zipfile
+import os
+import random
+import typing
+
+from aiobotocore.config import AioConfig
+from dataclasses import dataclass, field
+from metrics.checkout.manifest import CheckoutManifest
+from metrics.checkout.multipart import (MULTIPART_THRESHOLD, PART_CONCURRENCY, PART_SIZE, ChecksumError, PartCheckpoint,
+                                        file_md5, file_multipart_etag, is_md5_etag, multipart_etag_parts,
+                                        part_ranges)
+from metrics.checkout.remote_zip import (MAX_RANGE_GAP, TAIL_SIZE, MemberSelection, MissingRangeError, RangeFile,
+                                         coalesce_ranges, member_ranges, write_members)
+from metrics.io.data_cache import DataCache
+from metrics.utils.s3 import DOWNLOAD_CHUNK_SIZE, ListWindow, S3Object, list_window, listed_object, parse_s3_uri
+from metrics.utils.time_measure import TimeMeasure
+from rich.console import Console
+
+console = Console()
+
+MAX_CONCURRENCY = 32    # maximum number of S3 requests in flight across all download tasks
+RETRIES = 5             # number of retries of a failed request
+BACKOFF_BASE = 0.5      # delay before the first retry in seconds
+BACKOFF_MAX = 30.0      # maximum delay between retries in seconds
+
+# error codes of S3 responses that are worth retrying besides 5xx and 429 statuses
+RETRYABLE_ERROR_CODES = {"RequestTimeout", "SlowDown", "Throttling", "ThrottlingException", "InternalError"}
+
+
+@dataclass
+class DownloadJob:
+    s3_uri: str         # S3 URI of the object
+    file_path: str      # path where to save the object
+    size: int           # listed size of the object in bytes
+    etag: str           # listed entity tag of the object
+    selection: typing.Optional[MemberSelection] = None  # selected members of the zip archive, all if `None`
+
+    @property
+    def selection_fingerprint(self) -> typing.Optional[str]:
+        return None if self.selection is None else self.selection.fingerprint
+
+
+@dataclass
+class DownloadTask:
+    name: str                               # name of the data source in logs
+    download_path: str                      # folder where to save the objects, it keeps the checkout manifest
+    download_uri_list: typing.List[str]     # S3 URIs of the objects to download, all in one bucket
+    file_paths: typing.List[str]            # paths where to save the objects
+    selection: typing.Optional[MemberSelection] = None  # members to fetch from zip archives, whole objects if `None`
+
+
+@dataclass
+class CheckoutReport:
+    downloaded: int = 0     # number of downloaded objects
+    up_to_date: int = 0     # number of objects that were already downloaded
+    cached: int = 0         # number of objects linked from the data cache
+    missing: int = 0        # number of objects that don't exist
+    failed: typing.List[str] = field(default_factory=list)  # S3 URIs of objects that weren't downloaded
+
+    def merge(self, other: "CheckoutReport"):
+        self.downloaded += other.downloaded
+        self.up_to_date += other.up_to_date
+        self.cached += other.cached
+        self.missing += other.missing
+        self.failed.extend(other.failed)
+
+
+class DownloadListener:
+    """Receives files of download tasks as they become ready for the next stage. Files are announced in
+    the order of the task, the engine waits for :func:`reserve` before it resolves a file, so a listener
+    that consumes files slower than they are downloaded holds back the downloads
+    """
+
+    async def reserve(self, file_path: str):
+        """Waits until the listener can accept the file"""
+
+    async def ready(self, file_path: str, ok: bool):
+        """Called when the file is downloaded, up to date or linked from the cache (`ok`), or when
+        it doesn't exist or failed to download. Every reserved file is announced once
+        """
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, max_delay: float = BACKOFF_MAX) -> float:
+    """Returns delay before the retry with exponential backoff and full jitter, so requests
+    that failed together don't retry together
+
+    Parameters
+    ----------
+    attempt : int
+        Number of the failed attempt starting from 0
+    base : float
+        Delay before the first retry in seconds
+    max_delay : float
+        Maximum delay in seconds
+
+    Returns
+    -------
+    float
+        Returns delay in seconds
+    """
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Checks if the request that raised the error can succeed on retry. Connection errors, throttling
+    and server errors are transient, other client errors like missing keys or access denial are not
+    """
+    if isinstance(error, botocore.exceptions.ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        code = error.response.get("Error", {}).get("Code", None)
+        return status >= 500 or status == 429 or code in RETRYABLE_ERROR_CODES
+
+    return isinstance(error, (botocore.exceptions.BotoCoreError, aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class CheckoutEngine:
+    """Downloads objects of several tasks, e.g. vendors, with one asynchronous S3 client.
+
+    Objects of a task are listed with paginated `list_objects_v2` over the key range of the task and only
+    objects that aren't in the checkout manifest are downloaded. All tasks share one limit of requests
+    in flight. Failed requests are retried with jittered exponential backoff, objects that fail all retries
+    are reported instead of stopping the checkout. With a data cache, cached objects are linked
+    instead of downloading and downloaded objects are added to the cache.
+
+    Large objects are downloaded by ranged GETs of parts in parallel. Parts are checkpointed, so failed
+    or interrupted downloads resume with the missing parts on the next attempt or run. Downloads are verified
+    by size and by MD5 when the ETag is MD5 of the content, or MD5 of MD5s of the upload parts for objects
+    uploaded by parts.
+
+    Tasks with a member selection fetch only the selected members of zip archives. The central directory is
+    read from the archive tail, byte ranges of the selected members are coalesced and fetched by ranged GETs
+    and the members are written into a slim local archive with the same member names
+    """
+
+    def __init__(self,
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 retries: int = RETRIES,
+                 backoff_base: float = BACKOFF_BASE,
+                 backoff_max: float = BACKOFF_MAX,
+                 session: typing.Optional[aioboto3.Session] = None,
+                 endpoint_url: typing.Optional[str] = None,
+                 cache: typing.Optional[DataCache] = None,
+                 multipart_threshold: int = MULTIPART_THRESHOLD,
+                 part_size: int = PART_SIZE,
+                 part_concurrency: int = PART_CONCURRENCY):
+        """
+        Parameters
+        ----------
+        max_concurrency : int
+            Maximum number of S3 requests in flight across all tasks
+        retries : int
+            Number of retries of a failed request
+        backoff_base : float
+            Delay before the first retry in seconds
+        backoff_max : float
+            Maximum delay between retries in seconds
+        session : aioboto3.Session | None
+            Session to create the S3 client. A new session is created if `None`
+        endpoint_url : str | None
+            S3 endpoint, e.g. of a local S3 compatible storage. AWS endpoint is used if `None`
+        cache : DataCache | None
+            Cache of downloaded objects shared by sessions. Objects are always downloaded if `None`
+        multipart_threshold : int
+            Objects of this size and larger are downloaded by parts, in bytes
+        part_size : int
+            Size of a part in bytes
+        part_concurrency : int
+            Maximum number of parts of one object in flight. Parts also count against `max_concurrency`
+        """
+        assert max_concurrency > 0, "Concurrency should be greater than 0"
+        assert part_size > 0 and part_concurrency > 0, "Part size and concurrency should be greater than 0"
+        assert retries >= 0, "Number of retries should be non-negative"
+
+        self._max_concurrency = max_concurrency
+        self._retries = retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._session = session
+        self._endpoint_url = endpoint_url
+        self._cache = cache
+        self._multipart_threshold = multipart_threshold
+        self._part_size = part_size
+        self._part_concurrency = part_concurrency
+
+    def run(self,
+            tasks: typing.List[DownloadTask],
+            listener: typing.Optional[DownloadListener] = None) -> CheckoutReport:
+        """Downloads objects of the tasks
+
+        Parameters
+        ----------
+        tasks : List[DownloadTask]
+            Tasks to run together
+        listener : DownloadListener | None
+            Listener of files that become ready, e.g. to process them while other files download
+
+        Returns
+        -------
+        CheckoutReport
+            Returns report of all tasks
+        """
+        return asyncio.run(self.run_async(tasks, listener=listener))
+
+    async def run_async(self,
+                        tasks: typing.List[DownloadTask],
+                        listener: typing.Optional[DownloadListener] = None) -> CheckoutReport:
+        """Asynchronous version of :func:`run`"""
+        listener = DownloadListener() if listener is None else listener
+        session = aioboto3.Session() if self._session is None else self._session
+        # retries are made by the engine with backoff, botocore retries would multiply them
+        config = AioConfig(max_pool_connections=self._max_concurrency, retries={"total_max_attempts": 1})
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        report = CheckoutReport()
+        async with session.client("s3", endpoint_url=self._endpoint_url, config=config) as s3:
+            for task_report in await asyncio.gather(*[self._run_task(s3, semaphore, task, listener)
+                                                      for task in tasks]):
+                report.merge(task_report)
+
+        return report
+
+    async def _retry(self, semaphore: asyncio.Semaphore, request: typing.Callable[[], typing.Awaitable]):
+        for attempt in range(self._retries + 1):
+            try:
+                async with semaphore:
+                    return await request()
+            except Exception as ex:
+                if attempt == self._retries or not is_retryable(ex):
+                    raise
+
+            # sleep outside of the semaphore, so waiting retries don't hold slots of other requests
+            await asyncio.sleep(backoff_delay(attempt=attempt, base=self._backoff_base, max_delay=self._backoff_max))
+
+    async def _list_objects(self,
+                            s3: typing.Any,
+                            bucket_name: str,
+                            window: ListWindow) -> typing.Dict[str, S3Object]:
+        listed = {}
+        paginator = s3.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=bucket_name, Prefix=window.prefix, StartAfter=window.start_after):
+            for item in page.get("Contents", []):
+                if item["Key"] > window.end_key:
+                    return listed
+
+                listed[item["Key"]] = listed_object(item)
+
+        return listed
+
+    async def _plan(self,
+                    s3: typing.Any,
+                    semaphore: asyncio.Semaphore,
+                    task: DownloadTask,
+                    manifest: CheckoutManifest) -> typing.Tuple[typing.List[DownloadJob], CheckoutReport]:
+        report = CheckoutReport()
+        if len(task.download_uri_list) == 0:
+            return [], report
+
+        bucket_name = parse_s3_uri(task.download_uri_list[0])[0]
+        wanted = {parse_s3_uri(uri)[1]: file_path for uri, file_path in zip(task.download_uri_list, task.file_paths)}
+
+        window = list_window(wanted)
+        try:
+            listed = await self._retry(semaphore, lambda: self._list_objects(s3=s3,
+                                                                             bucket_name=bucket_name,
+                                                                             window=window))
+        except Exception as ex:
+            console.log(f"[red]Error:[/red] Wasn't able to list objects of `{task.name}`: {ex}")
+            report.failed.extend(task.download_uri_list)
+            return [], report
+
+        jobs = []
+        for key, file_path in wanted.items():
+            s3_object = listed.get(key, None)
+            if s3_object is None:
+                report.missing += 1
+            elif manifest.is_fresh(file_path=file_path,
+                                   size=s3_object.size,
+                                   etag=s3_object.etag,
+                                   selection=None if task.selection is None else task.selection.fingerprint):
+                report.up_to_date += 1
+            else:
+                jobs.append(DownloadJob(s3_uri=f"s3://{bucket_name}/{key}",
+                                        file_path=file_path,
+                                        size=s3_object.size,
+                                        etag=s3_object.etag,
+                                        selection=task.selection))
+
+        return jobs, report
+
+    async def _get_object(self, s3: typing.Any, job: DownloadJob) -> S3Object:
+        bucket_name, object_key = parse_s3_uri(job.s3_uri)
+        response = await s3.get_object(Bucket=bucket_name, Key=object_key)
+        etag = response["ETag"].strip('"')
+
+        # the file is written via a temporary file, so interrupted downloads don't leave partial files
+        tmp_path = f"{job.file_path}.tmp"
+        body = response["Body"]
+        md5 = hashlib.md5()
+        try:
+            with open(tmp_path, "wb") as file:
+                async for chunk in body.iter_chunks(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    md5.update(chunk)
+
+            if is_md5_etag(etag, response.get("ServerSideEncryption", None)) and md5.hexdigest() != etag:
+                raise ChecksumError(f"MD5 of the downloaded content doesn't match ETag {etag}")
+            os.replace(tmp_path, job.file_path)
+        finally:
+            body.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return S3Object(key=object_key, size=response["ContentLength"], etag=etag)
+
+    async def _get_part(self,
+                        s3: typing.Any,
+                        job: DownloadJob,
+                        checkpoint: PartCheckpoint,
+                        part_range: typing.Tuple[int, int]) -> typing.Optional[str]:
+        bucket_name, object_key = parse_s3_uri(job.s3_uri)
+        start, end = part_range
+        # parts of another version of the object fail the precondition instead of mixing with the listed one
+        response = await s3.get_object(Bucket=bucket_name,
+                                       Key=object_key,
+                                       Range=f"bytes={start}-{end}",
+                                       IfMatch=f'"{job.etag}"')
+
+        body = response["Body"]
+        written = 0
+        try:
+            with open(checkpoint.part_path, "r+b") as file:
+                file.seek(start)
+                async for chunk in body.iter_chunks(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    written += len(chunk)
+        finally:
+            body.close()
+
+        # a body cut by the connection is retried like other transient errors
+        if written != end - start + 1:
+            raise botocore.exceptions.IncompleteReadError(actual_bytes=written, expected_bytes=end - start + 1)
+
+        return response.get("ServerSideEncryption", None)
+
+    async def _upload_part_size(self, s3: typing.Any, semaphore: asyncio.Semaphore, job: DownloadJob) -> int:
+        """Returns size of the first part the object was uploaded by"""
+        bucket_name, object_key = parse_s3_uri(job.s3_uri)
+        response = await self._retry(semaphore, lambda: s3.head_object(Bucket=bucket_name,
+                                                                       Key=object_key,
+                                                                       PartNumber=1))
+        return response["ContentLength"]
+
+    async def _get_object_by_parts(self, s3: typing.Any, semaphore: asyncio.Semaphore, job: DownloadJob) -> S3Object:
+        checkpoint = PartCheckpoint(file_path=job.file_path, size=job.size, etag=job.etag, part_size=self._part_size)
+        part_semaphore = asyncio.Semaphore(self._part_concurrency)
+        encryption = []
+
+        async def _download_part(index: int, part_range: typing.Tuple[int, int]):
+            async with part_semaphore:
+                encryption.append(await self._retry(semaphore, lambda: self._get_part(s3=s3,
+                                                                                      job=job,
+                                                                                      checkpoint=checkpoint,
+                                                                                      part_range=part_range)))
+            # the part is synced to disk before it's recorded, outside of the event loop
+            await asyncio.to_thread(checkpoint.mark_done, index)
+
+        # all parts run to the end even if some fail, so the next attempt resumes with fewer parts
+        results = await asyncio.gather(*[_download_part(index, part_range)
+                                         for index, part_range in enumerate(part_ranges(job.size, self._part_size))
+                                         if index not in checkpoint.done],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        server_side_encryption = encryption[0] if len(encryption) > 0 else None
+        etag = None
+        if is_md5_etag(job.etag, server_side_encryption):
+            etag = await asyncio.to_thread(file_md5, checkpoint.part_path)
+        elif multipart_etag_parts(job.etag, server_side_encryption) is not None:
+            upload_part_size = await self._upload_part_size(s3=s3, semaphore=semaphore, job=job)
+            # parts of other sizes than the first one can't be checked by the ETag
+            if len(part_ranges(job.size, upload_part_size)) == multipart_etag_parts(job.etag):
+                etag = await asyncio.to_thread(file_multipart_etag, checkpoint.part_path, upload_part_size)
+
+        if etag is not None and etag != job.etag:
+            checkpoint.remove()
+            raise ChecksumError(f"MD5 of the downloaded content doesn't match ETag {job.etag}")
+
+        checkpoint.complete(job.file_path)
+        return S3Object(key=parse_s3_uri(job.s3_uri)[1], size=job.size, etag=job.etag)
+
+    async def _get_range(self, s3: typing.Any, job: DownloadJob, start: int, end: int) -> bytes:
+        bucket_name, object_key = parse_s3_uri(job.s3_uri)
+        response = await s3.get_object(Bucket=bucket_name,
+                                       Key=object_key,
+                                       Range=f"bytes={start}-{end - 1}",
+                                       IfMatch=f'"{job.etag}"')
+        body = response["Body"]
+        try:
+            data = await body.read()
+        finally:
+            body.close()
+
+        if len(data) != end - start:
+            raise botocore.exceptions.IncompleteReadError(actual_bytes=len(data), expected_bytes=end - start)
+
+        return data
+
+    async def _get_zip_members(self, s3: typing.Any, semaphore: asyncio.Semaphore, job: DownloadJob) -> S3Object:
+        def _fetch(start: int, end: int) -> typing.Awaitable[bytes]:
+            return self._retry(semaphore, lambda: self._get_range(s3=s3, job=job, start=start, end=end))
+
+        range_file = RangeFile(size=job.size)
+        tail_start = max(job.size - TAIL_SIZE, 0)
+        range_file.add(tail_start, await _fetch(tail_start, job.size))
+
+        # the tail has end of central directory records, the central directory is fetched when it's not in the tail
+        while True:
+            try:
+                zip_file = zipfile.ZipFile(range_file, "r")
+                break
+            except MissingRangeError as ex:
+                range_file.add(ex.start, await _fetch(ex.start, ex.end))
+
+        ranges = member_ranges(zip_file)
+        names = [name for name in ranges if job.selection.accept(name)]
+        fetch_ranges = [(start, end) for start, end in coalesce_ranges([ranges[name] for name in names],
+                                                                       max_gap=MAX_RANGE_GAP)
+                        if not range_file.covers(start, end)]
+
+        for (start, _), data in zip(fetch_ranges, await asyncio.gather(*[_fetch(start, end)
+                                                                         for start, end in fetch_ranges])):
+            range_file.add(start, data)
+
+        # the slim archive is written in a thread, since members are decompressed and checked by CRC
+        try:
+            await asyncio.to_thread(write_members, zip_file, names, job.file_path)
+        finally:
+            zip_file.close()
+        return S3Object(key=parse_s3_uri(job.s3_uri)[1], size=job.size, etag=job.etag)
+
+    def _cache_uri(self, job: DownloadJob) -> str:
+        # slim archives are cached separately from whole objects and from each other
+        return job.s3_uri if job.selection is None else f"{job.s3_uri}#{job.selection.fingerprint}"
+
+    async def _download(self,
+                        s3: typing.Any,
+                        semaphore: asyncio.Semaphore,
+                        manifest: CheckoutManifest,
+                        job: DownloadJob) -> bool:
+        try:
+            if job.selection is not None:
+                s3_object = await self._get_zip_members(s3=s3, semaphore=semaphore, job=job)
+            elif job.size >= self._multipart_threshold:
+                s3_object = await self._get_object_by_parts(s3=s3, semaphore=semaphore, job=job)
+            else:
+                s3_object = await self._retry(semaphore, lambda: self._get_object(s3=s3, job=job))
+        except Exception as ex:
+            console.log(f"[red]Error:[/red] Wasn't able to download {job.s3_uri}: {ex}")
+            return False
+
+        manifest.update(file_path=job.file_path,
+                        size=s3_object.size,
+                        etag=s3_object.etag,
+                        selection=job.selection_fingerprint)
+        if self._cache is not None:
+            await asyncio.to_thread(self._cache.store, self._cache_uri(job), s3_object.etag, job.file_path)
+        return True
+
+    async def _run_task(self,
+                        s3: typing.Any,
+                        semaphore: asyncio.Semaphore,
+                        task: DownloadTask,
+                        listener: DownloadListener) -> CheckoutReport:
+        tm = TimeMeasure()
+        os.makedirs(task.download_path, exist_ok=True)
+
+        manifest = CheckoutManifest(folder=task.download_path)
+        jobs, report = await self._plan(s3=s3, semaphore=semaphore, task=task, manifest=manifest)
+        if self._cache is not None:
+            # the cache is locked once for all jobs and outside of the event loop
+            cached = await asyncio.to_thread(self._cache.fetch_many,
+                                             [(self._cache_uri(job), job.etag, job.file_path) for job in jobs])
+            for job in itertools.compress(jobs, cached):
+                manifest.update(file_path=job.file_path,
+                                size=job.size,
+                                etag=job.etag,
+                                selection=job.selection_fingerprint)
+
+            report.cached = sum(cached)
+            jobs = [job for job, is_cached in zip(jobs, cached) if not is_cached]
+
+        console.log(f"`{task.name}`: {len(jobs)} files to download, {report.up_to_date} are up to date, "
+                    f"{report.cached} are cached, {report.missing} don't exist")
+
+        jobs_by_path = {job.file_path: job for job in jobs}
+
+        async def _resolve(file_path: str) -> bool:
+            # files that aren't downloaded are up to date, cached or don't exist
+            await listener.reserve(file_path)
+            job = jobs_by_path.get(file_path, None)
+            if job is None:
+                ok = os.path.exists(file_path)
+            else:
+                ok = await self._download(s3=s3, semaphore=semaphore, manifest=manifest, job=job)
+            await listener.ready(file_path=file_path, ok=ok)
+            return ok
+
+        results = dict(zip(task.file_paths, await asyncio.gather(*[_resolve(file_path)
+                                                                   for file_path in task.file_paths])))
+        for job in jobs:
+            if results[job.file_path]:
+                report.downloaded += 1
+            else:
+                report.failed.append(job.s3_uri)
+
+        manifest.save()
+        console.log(f"`{task.name}`: download completed in {tm():.2f} seconds, {len(report.failed)} failed")
+        return report
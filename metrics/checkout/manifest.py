@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import typing
+
+from dataclasses import asdict, dataclass
+from metrics.utils.file import write_atomic
+
+MANIFEST_FILE_NAME = "checkout_manifest.jsonl"
+
+_manifest_locks: typing.Dict[str, threading.Lock] = {}
+_manifest_locks_lock = threading.Lock()
+
+
+def _reset_manifest_locks():
+    # locks held by threads of the parent process are never released in a forked one
+    global _manifest_locks_lock
+    _manifest_locks.clear()
+    _manifest_locks_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_manifest_locks)
+
+
+def _manifest_lock(path: str) -> threading.Lock:
+    """Returns lock of the manifest file shared by all manifests of the process"""
+    with _manifest_locks_lock:
+        return _manifest_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+@dataclass
+class ManifestEntry:
+    size: int       # size of the S3 object in bytes
+    etag: str       # entity tag of the S3 object
+    mtime: float    # modification time of the downloaded file
+    selection: typing.Optional[str] = None  # fingerprint of the archive members selection, `None` for whole objects
+    dropped: bool = False   # the file was removed after it was parsed, so it isn't downloaded again
+
+
+class CheckoutManifest:
+    """Keeps sizes and ETags of the downloaded S3 objects, so checkout reruns download only new or changed objects.
+
+    Entries are appended to a JSON lines file in the download folder as soon as an object is downloaded.
+    :func:`save` rewrites the file with only the latest entries of existing and dropped files. Several manifests
+    of one folder, e.g. of a running checkout and of retention, append to the same file under one lock,
+    so :func:`save` takes the latest entries from the file and keeps the changes of the others
+    """
+
+    def __init__(self, folder: str):
+        """
+        Parameters
+        ----------
+        folder : str
+            Folder with downloaded files. Entries are stored by file names
+        """
+        self._folder = folder
+        self._path = os.path.join(folder, MANIFEST_FILE_NAME)
+        self._lock = _manifest_lock(self._path)
+        with self._lock:
+            self._entries = self._read()
+
+    def _read(self) -> typing.Dict[str, ManifestEntry]:
+        entries: typing.Dict[str, ManifestEntry] = {}
+        if os.path.exists(self._path):
+            with open(self._path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        entries[record["file"]] = ManifestEntry(**record["entry"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # line that wasn't completely written before a crash
+
+        return entries
+
+    def _key(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self._folder)
+
+    def is_fresh(self,
+                 file_path: str,
+                 size: int,
+                 etag: str,
+                 selection: typing.Optional[str] = None,
+                 record: bool = True) -> bool:
+        """Checks if the file is a complete download of the S3 object with the size and ETag
+
+        Files downloaded before the manifest existed have no entries. They are considered fresh
+        when their size matches and get entries with the listed ETag if `record` is `True`, otherwise
+        the manifest isn't changed. Files with selected archive members are fresh for the same selection,
+        complete files are fresh for any selection. Dropped files are fresh while the object keeps its size and ETag
+        """
+        if not os.path.exists(file_path):
+            entry = self._entries.get(self._key(file_path), None)
+            return entry is not None and entry.dropped and entry.size == size and entry.etag == etag and \
+                entry.selection in (None, selection)
+
+        stat = os.stat(file_path)
+        entry = self._entries.get(self._key(file_path), None)
+        if entry is None:
+            if stat.st_size != size:
+                return False
+
+            if record:
+                self.update(file_path=file_path, size=size, etag=etag)
+            return True
+
+        if entry.selection is None:
+            return entry.size == size and entry.etag == etag and entry.mtime == stat.st_mtime and \
+                stat.st_size == size
+
+        return entry.size == size and entry.etag == etag and entry.mtime == stat.st_mtime and \
+            entry.selection == selection
+
+    def update(self, file_path: str, size: int, etag: str, selection: typing.Optional[str] = None):
+        """Records the downloaded S3 object. Can be called from several threads"""
+        key = self._key(file_path)
+        entry = ManifestEntry(size=size, etag=etag, mtime=os.path.getmtime(file_path), selection=selection)
+
+        with self._lock:
+            self._entries[key] = entry
+
+            os.makedirs(self._folder, exist_ok=True)
+            with open(self._path, "a") as file:
+                file.write(json.dumps({"file": key, "entry": asdict(entry)}) + "\n")
+
+    def drop(self, file_path: str) -> bool:
+        """Records that the file is removed after parsing, so checkout doesn't download it again
+
+        Returns
+        -------
+        bool
+            Returns `False` if the file has no entry, e.g. it wasn't downloaded by checkout
+        """
+        key = self._key(file_path)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return False
+
+            entry.dropped = True
+            with open(self._path, "a") as file:
+                file.write(json.dumps({"file": key, "entry": asdict(entry)}) + "\n")
+
+        return True
+
+    def save(self):
+        """Rewrites the manifest with only the latest entries of existing and dropped files"""
+        def _write(path: str):
+            with open(path, "w") as file:
+                for key, entry in self._entries.items():
+                    if entry.dropped or os.path.exists(os.path.join(self._folder, key)):
+                        file.write(json.dumps({"file": key, "entry": asdict(entry)}) + "\n")
+
+        os.makedirs(self._folder, exist_ok=True)
+        with self._lock:
+            self._entries = self._read()
+            write_atomic(self._path, _write)
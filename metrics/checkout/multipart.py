@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import typing
+
+from metrics.utils.file import write_atomic
+
+MULTIPART_THRESHOLD = 64 * 1024 ** 2   # objects of this size and larger are downloaded by parts in bytes
+PART_SIZE = 16 * 1024 ** 2             # size of a part in bytes
+PART_CONCURRENCY = 8                   # maximum number of parts of one object in flight
+
+PART_FILE_SUFFIX = ".part"
+CHECKPOINT_FILE_SUFFIX = ".part.json"
+
+_MD5_ETAG_RE = re.compile(r"^[0-9a-f]{32}$")
+_MULTIPART_ETAG_RE = re.compile(r"^[0-9a-f]{32}-(?P<parts>\d+)$")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def part_ranges(size: int, part_size: int) -> typing.List[typing.Tuple[int, int]]:
+    """Returns byte ranges of the parts of the object, both ends are included as in HTTP `Range` header"""
+    assert part_size > 0, "Part size should be greater than 0"
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def is_md5_etag(etag: str, server_side_encryption: typing.Optional[str] = None) -> bool:
+    """Checks if the ETag is MD5 of the object content. It isn't for objects uploaded by parts, which have
+    `-<parts>` suffix, and for objects encrypted with KMS keys
+    """
+    return _MD5_ETAG_RE.match(etag) is not None and server_side_encryption != "aws:kms"
+
+
+def multipart_etag_parts(etag: str, server_side_encryption: typing.Optional[str] = None) -> typing.Optional[int]:
+    """Returns number of upload parts if the ETag is MD5 of MD5s of the parts, or `None` if it isn't,
+    e.g. for objects encrypted with KMS keys
+    """
+    match = _MULTIPART_ETAG_RE.match(etag)
+    if match is None or server_side_encryption == "aws:kms":
+        return None
+
+    return int(match.group("parts"))
+
+
+def file_md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(PART_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def file_multipart_etag(path: str, upload_part_size: int) -> str:
+    """Returns ETag of the file uploaded by parts of the size, that is MD5 of MD5s of the parts with
+    `-<parts>` suffix
+    """
+    md5 = hashlib.md5()
+    parts = 0
+    with open(path, "rb") as file:
+        for part in iter(lambda: file.read(upload_part_size), b""):
+            md5.update(hashlib.md5(part).digest())
+            parts += 1
+    return f"{md5.hexdigest()}-{parts}"
+
+
+class PartCheckpoint:
+    """Progress of a download by parts into `<file>.part`, stored in `<file>.part.json`.
+
+    Parts are marked done after they are written to the part file and synced to disk, so an interrupted
+    download resumes with the remaining parts and never trusts data lost by a crash. Progress is dropped
+    when the object or the part size changes
+    """
+
+    def __init__(self, file_path: str, size: int, etag: str, part_size: int):
+        """
+        Parameters
+        ----------
+        file_path : str
+            Path where to save the object
+        size : int
+            Size of the object in bytes
+        etag : str
+            Entity tag of the object
+        part_size : int
+            Size of a part in bytes
+        """
+        self.part_path = f"{file_path}{PART_FILE_SUFFIX}"
+        self._path = f"{file_path}{CHECKPOINT_FILE_SUFFIX}"
+        self._state = {"size": size, "etag": etag, "part_size": part_size}
+        self.done: typing.Set[int] = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(self._path) and os.path.exists(self.part_path) and \
+                os.path.getsize(self.part_path) == size:
+            try:
+                with open(self._path, "r") as file:
+                    record = json.load(file)
+                if all(record.get(key, None) == value for key, value in self._state.items()):
+                    self.done = set(record["done"])
+            except (ValueError, KeyError, TypeError):
+                pass
+
+        if len(self.done) == 0:
+            if os.path.exists(self._path):
+                os.remove(self._path)
+
+            # part file of the object size, parts are written at their offsets
+            with open(self.part_path, "wb") as file:
+                file.truncate(size)
+
+    def mark_done(self, index: int):
+        """Syncs the written part to disk and records it as done. Can be called from several threads"""
+        with open(self.part_path, "r+b") as file:
+            getattr(os, "fdatasync", os.fsync)(file.fileno())
+
+        def _write(path: str):
+            with open(path, "w") as file:
+                json.dump({**self._state, "done": sorted(self.done)}, file)
+
+        with self._lock:
+            self.done.add(index)
+            write_atomic(self._path, _write)
+
+    def complete(self, file_path: str):
+        """Moves the downloaded part file to the file path"""
+        os.replace(self.part_path, file_path)
+        self.remove()
+
+    def remove(self):
+        for path in [self.part_path, self._path]:
+            if os.path.exists(path):
+                os.remove(path)
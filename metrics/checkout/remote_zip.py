@@ -0,0 +1,148 @@
+import bisect
+import io
+import os
+import typing
+import zipfile
+
+from dataclasses import dataclass
+from metrics.utils.file import write_atomic
+
+TAIL_SIZE = 128 * 1024      # size of the archive tail read first, it contains end of central directory records
+MAX_RANGE_GAP = 64 * 1024   # members closer than this are fetched by one request, gaps are read and dropped
+
+
+@dataclass
+class MemberSelection:
+    fingerprint: str                    # fingerprint of the selection, archives of another selection are fetched again
+    accept: typing.Callable[[str], bool]  # checks if the archive member with the name is selected
+
+
+class MissingRangeError(Exception):
+    """Raised by :class:`RangeFile` when a read needs bytes `[start, end)` that weren't fetched"""
+
+    def __init__(self, start: int, end: int):
+        super().__init__(f"Bytes {start}-{end} are not fetched")
+        self.start = start
+        self.end = end
+
+
+class RangeFile(io.RawIOBase):
+    """Read-only file of the given size that serves reads from fetched byte ranges of a remote object.
+
+    `zipfile.ZipFile` reads the archive from it. Reads of bytes that weren't fetched raise
+    :class:`MissingRangeError` with the range to fetch, the caller fetches it and repeats the read
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._position = 0
+        self._starts: typing.List[int] = []     # sorted starts of fetched ranges that don't overlap
+        self._chunks: typing.List[bytes] = []   # data of fetched ranges
+
+    def add(self, start: int, data: bytes):
+        """Adds fetched bytes starting from the offset, overlapping and adjacent ranges are merged"""
+        end = start + len(data)
+        first = bisect.bisect_right(self._starts, start) - 1
+        if first < 0 or self._starts[first] + len(self._chunks[first]) < start:
+            first += 1
+
+        last = first
+        while last < len(self._starts) and self._starts[last] <= end:
+            last += 1
+
+        if first < last:
+            merged_start = min(start, self._starts[first])
+            merged_end = max(end, self._starts[last - 1] + len(self._chunks[last - 1]))
+            merged = bytearray(merged_end - merged_start)
+            for chunk_start, chunk in zip(self._starts[first:last], self._chunks[first:last]):
+                merged[chunk_start - merged_start:chunk_start - merged_start + len(chunk)] = chunk
+            merged[start - merged_start:end - merged_start] = data
+            start, data = merged_start, bytes(merged)
+
+        self._starts[first:last] = [start]
+        self._chunks[first:last] = [data]
+
+    def covers(self, start: int, end: int) -> bool:
+        index = bisect.bisect_right(self._starts, start) - 1
+        return index >= 0 and self._starts[index] + len(self._chunks[index]) >= end
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+
+        if offset < 0:
+            raise OSError("Negative seek position")
+
+        self._position = offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        end = self._size if size is None or size < 0 else min(self._position + size, self._size)
+        if end <= self._position:
+            return b""
+
+        index = bisect.bisect_right(self._starts, self._position) - 1
+        if index < 0 or self._starts[index] + len(self._chunks[index]) < end:
+            raise MissingRangeError(start=self._position, end=end)
+
+        offset = self._position - self._starts[index]
+        data = self._chunks[index][offset:offset + end - self._position]
+        self._position = end
+        return data
+
+
+def member_ranges(zip_file: zipfile.ZipFile) -> typing.Dict[str, typing.Tuple[int, int]]:
+    """Returns byte ranges `[start, end)` of the archive members. A member takes bytes from its local header
+    to the next local header or the central directory, so the range includes local extra fields and data
+    descriptors that the central directory doesn't describe
+    """
+    infos = sorted(zip_file.infolist(), key=lambda info: info.header_offset)
+    # `start_dir` is the offset of the central directory that follows the last member
+    ends = [info.header_offset for info in infos[1:]] + [zip_file.start_dir]
+    return {info.filename: (info.header_offset, end) for info, end in zip(infos, ends)}
+
+
+def coalesce_ranges(ranges: typing.Iterable[typing.Tuple[int, int]],
+                    max_gap: int = MAX_RANGE_GAP) -> typing.List[typing.Tuple[int, int]]:
+    """Merges ranges `[start, end)` that overlap or have gaps up to `max_gap` bytes
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        Returns merged ranges sorted by start
+    """
+    merged: typing.List[typing.Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def write_members(zip_file: zipfile.ZipFile, names: typing.Iterable[str], path: str):
+    """Writes the members of the archive into a new archive atomically. Members keep names,
+    modification times and compression. CRC of the members is checked while they are read
+    """
+    def _write(tmp_path: str):
+        with zipfile.ZipFile(tmp_path, "w") as output:
+            for name in names:
+                info = zip_file.getinfo(name)
+                # `writestr` updates offsets and sizes of the info, so infos of the source archive are copied
+                output_info = zipfile.ZipInfo(filename=info.filename, date_time=info.date_time)
+                output_info.external_attr = info.external_attr
+                output.writestr(output_info, zip_file.read(info), compress_type=info.compress_type)
+
+    write_atomic(path, _write)
@@ -0,0 +1,114 @@
+import os
+import pyarrow
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import typing
+
+from metrics.utils.file import write_atomic
+from metrics.utils.parquet import read_table
+
+# Compression of cached tables: uncompressed files are memory mapped and read without copies,
+# lz4 files are smaller but every read decodes the buffers into memory
+ARROW_CACHE_COMPRESSIONS = ["uncompressed", "lz4"]
+DEFAULT_ARROW_CACHE_COMPRESSION = "uncompressed"
+
+
+class ArrowCache:
+    """Arrow IPC (Feather v2) copies of parquet tables in a session.
+
+    Every parquet table `<tables>/<path>.parquet` has a copy `<cache>/<path>.arrow`. Copies are read through
+    a memory map, so processes reading the same table share the page cache and no parquet decoding is done.
+    A copy is used only while it's newer than its table, so re-parsed or re-compacted tables are read from parquet
+    until the cache is rebuilt.
+    """
+
+    def __init__(self, tables_folder: str, cache_folder: str):
+        """
+        Parameters
+        ----------
+        tables_folder : str
+            Path to the session tables folder
+        cache_folder : str
+            Path to the folder with cached tables
+        """
+        self._tables_folder = tables_folder
+        self._cache_folder = cache_folder
+
+    def cache_path(self, table_path: str) -> str:
+        """Returns path of the cached copy of the parquet table"""
+        relative_path = os.path.relpath(table_path, self._tables_folder)
+        return os.path.join(self._cache_folder, f"{os.path.splitext(relative_path)[0]}.arrow")
+
+    def is_fresh(self, table_path: str) -> bool:
+        """Checks if the table has a cached copy that is not older than the table"""
+        cache_path = self.cache_path(table_path)
+        if not os.path.exists(cache_path) or not os.path.exists(table_path):
+            return False
+
+        return os.path.getmtime(cache_path) >= os.path.getmtime(table_path)
+
+    def read(self,
+             table_path: str,
+             filters: typing.Optional[typing.List[typing.Tuple]] = None,
+             columns: typing.Optional[typing.List[str]] = None) -> pyarrow.Table:
+        """Reads the parquet table from its cached copy when it's fresh or from the table itself
+
+        Parameters
+        ----------
+        table_path : str
+            Path to the parquet table
+        filters : List[Tuple] | None
+            Row filters in `pyarrow.parquet.read_table` format
+        columns : List[str] | None
+            Columns to read. Columns that the table doesn't have are skipped. All columns are read if `None`
+
+        Returns
+        -------
+        pyarrow.Table
+            Returns rows of the table that match the filters
+        """
+        if not self.is_fresh(table_path):
+            return read_table(table_path, filters=filters, columns=columns)
+
+        with pyarrow.memory_map(self.cache_path(table_path), "r") as source:
+            table = ipc.open_file(source).read_all()
+
+        if filters is not None:
+            table = table.filter(pq.filters_to_expression(filters))
+
+        if columns is not None:
+            table = table.select([column for column in columns if column in table.column_names])
+
+        return table
+
+    def write(self, table_path: str, compression: str = DEFAULT_ARROW_CACHE_COMPRESSION) -> str:
+        """Writes a cached copy of the parquet table
+
+        Parameters
+        ----------
+        table_path : str
+            Path to the parquet table
+        compression : str
+            Compression of the copy, one of `ARROW_CACHE_COMPRESSIONS`
+
+        Returns
+        -------
+        str
+            Returns path of the cached copy
+        """
+        if compression not in ARROW_CACHE_COMPRESSIONS:
+            raise ValueError(f"Unknown cache compression {compression}, "
+                             f"available compressions: {', '.join(ARROW_CACHE_COMPRESSIONS)}")
+
+        table = pq.read_table(table_path)
+        options = ipc.IpcWriteOptions(compression=None if compression == "uncompressed" else compression)
+
+        def _write(path: str):
+            with ipc.new_file(path, table.schema, options=options) as writer:
+                writer.write_table(table)
+
+        cache_path = self.cache_path(table_path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        write_atomic(cache_path, _write)
+
+        return cache_path
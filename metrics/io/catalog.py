@@ -0,0 +1,390 @@
+import contextlib
+import os
+import pyarrow.parquet as pq
+import re
+import sqlite3
+import typing
+
+from dataclasses import dataclass
+from metrics.io import storage
+from metrics.io.table_store import PARTITION_FILE_NAME, SNAPSHOT_COLUMN, partition_timestamp
+
+CATALOG_FILE_NAME = "catalog.sqlite"
+
+# Kinds of catalog entries
+KIND_ARCHIVE = "archive"    # downloaded archives `data/<vendor>/<snapshot>.<ext>`
+KIND_TABLE = "table"        # parsed tables `tables/<vendor>/...`
+ROLLUP_KIND_PREFIX = "rollup/"  # rollup tables of a period, see `rollup_kind`
+
+_SNAPSHOT_FILE_RE = re.compile(r"^(?P<snapshot>\d+)\.(zip|gz|parquet)$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    vendor TEXT NOT NULL,
+    snapshot INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    rows INTEGER,
+    start_time INTEGER,
+    end_time INTEGER,
+    PRIMARY KEY (kind, vendor, snapshot)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    kind TEXT NOT NULL,
+    vendor TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    PRIMARY KEY (kind, vendor)
+);
+"""
+
+
+def rollup_kind(period: int) -> str:
+    """Returns kind of rollup tables with the period"""
+    return f"{ROLLUP_KIND_PREFIX}{period}"
+
+
+@dataclass
+class CatalogEntry:
+    kind: str                   # kind of the file: archive, table or rollup
+    vendor: str                 # vendor folder name
+    snapshot: int               # snapshot timestamp
+    path: str                   # path to the file relative to the session folder or its `s3://` URI
+    size: int                   # size of the file in bytes
+    mtime: float = 0.0          # modification time of the file
+    rows: typing.Optional[int] = None        # number of rows of the snapshot, `None` for archives
+    start_time: typing.Optional[int] = None  # minimum timestamp of the snapshot rows
+    end_time: typing.Optional[int] = None    # maximum timestamp of the snapshot rows
+
+
+def _timestamp_bounds(metadata: pq.FileMetaData,
+                      row_groups: typing.List[int]) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    names = metadata.schema.names
+    if "timestamp" not in names:
+        return None, None
+
+    column = names.index("timestamp")
+    minimums, maximums = [], []
+    for index in row_groups:
+        statistics = metadata.row_group(index).column(column).statistics
+        if statistics is None or not statistics.has_min_max:
+            return None, None
+        minimums.append(statistics.min)
+        maximums.append(statistics.max)
+
+    if len(minimums) == 0:
+        return None, None
+
+    return int(min(minimums)), int(max(maximums))
+
+
+class SessionCatalog:
+    """Index of session files in a single SQLite database `<session>/catalog.sqlite`.
+
+    The catalog lists archives, parsed tables and rollups per vendor and snapshot with sizes, row counts
+    and time bounds. Checkout and parse keep it in sync with the folders, so later stages query it instead
+    of listing folders and probing files. Stages fall back to the file system for kinds and vendors that
+    the catalog has never synced, e.g. tables parsed before the catalog was created.
+    """
+
+    def __init__(self, session_path: str):
+        """
+        Parameters
+        ----------
+        session_path : str
+            Path to the session folder
+        """
+        self._session_path = session_path
+        self._path = os.path.join(session_path, CATALOG_FILE_NAME)
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self._path)
+
+    def full_path(self, entry: CatalogEntry) -> str:
+        """Returns path of the entry file"""
+        return self._full_path(entry.path)
+
+    def _full_path(self, path: str) -> str:
+        if storage.is_remote(path):
+            return path
+
+        return os.path.join(self._session_path, path)
+
+    def _relative_path(self, path: str) -> str:
+        if storage.is_remote(path):
+            return path
+
+        return os.path.relpath(path, self._session_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._path, timeout=60)
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def _query(self, sql: str, params: typing.Sequence[typing.Any] = ()) -> typing.List[CatalogEntry]:
+        if not self.exists:
+            return []
+
+        connection = self._connect()
+        try:
+            return [CatalogEntry(*row) for row in connection.execute(sql, params).fetchall()]
+        finally:
+            connection.close()
+
+    def is_synced(self, kind: str, vendor: str) -> bool:
+        """Checks if entries of the vendor were synced with its folder, so they list all its files"""
+        if not self.exists:
+            return False
+
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT 1 FROM synced WHERE kind = ? AND vendor = ?",
+                                      (kind, vendor)).fetchone() is not None
+        finally:
+            connection.close()
+
+    def synced_folders(self) -> typing.Set[str]:
+        """Returns normalized paths of the local folders that entries of any kind and vendor were synced with"""
+        if not self.exists:
+            return set()
+
+        connection = self._connect()
+        try:
+            folders = [folder for folder, in connection.execute("SELECT folder FROM synced").fetchall()]
+        finally:
+            connection.close()
+
+        return {os.path.normpath(self._full_path(folder)) for folder in folders if not storage.is_remote(folder)}
+
+    def list(self,
+             kind: str,
+             vendor: str,
+             time_range: typing.Optional[typing.Tuple[int, int]] = None) -> typing.List[CatalogEntry]:
+        """Lists entries of the vendor
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the entries
+        vendor : str
+            Vendor folder name
+        time_range : Tuple[int, int] | None
+            Range of snapshot timestamps, both ends are included. All snapshots if `None`
+
+        Returns
+        -------
+        List[CatalogEntry]
+            Returns entries sorted by snapshot
+        """
+        sql = "SELECT * FROM entries WHERE kind = ? AND vendor = ?"
+        params: typing.List[typing.Any] = [kind, vendor]
+        if time_range is not None:
+            sql += " AND snapshot >= ? AND snapshot <= ?"
+            params.extend(time_range)
+
+        return self._query(f"{sql} ORDER BY snapshot", params)
+
+    def list_before(self, deadline: int) -> typing.List[CatalogEntry]:
+        """Lists entries of all kinds and vendors with snapshots before the deadline"""
+        return self._query("SELECT * FROM entries WHERE snapshot < ? ORDER BY snapshot", (deadline,))
+
+    def remove(self, entries: typing.Iterable[CatalogEntry]):
+        """Removes the entries from the catalog. Files are not touched"""
+        keys = [(entry.kind, entry.vendor, entry.snapshot) for entry in entries]
+        if len(keys) == 0 or not self.exists:
+            return
+
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM entries WHERE kind = ? AND vendor = ? AND snapshot = ?", keys)
+
+    def remove_rollups(self, vendor: str, snapshots: typing.Iterable[int]):
+        """Removes rollups of all periods for the snapshots, e.g. because their tables were parsed again"""
+        keys = [(f"{ROLLUP_KIND_PREFIX}%", vendor, snapshot) for snapshot in snapshots]
+        if len(keys) == 0 or not self.exists:
+            return
+
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM entries WHERE kind LIKE ? AND vendor = ? AND snapshot = ?", keys)
+
+    def sync(self, kind: str, vendor: str, folder: str) -> typing.List[CatalogEntry]:
+        """Replaces entries of the vendor by files found in the folder. Files with the same size and
+        modification time as in the catalog are not opened again
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the entries
+        vendor : str
+            Vendor folder name
+        folder : str
+            Folder with `<snapshot>.<ext>` files and hourly partitions of the vendor, local or `s3://` URI
+
+        Returns
+        -------
+        List[CatalogEntry]
+            Returns entries of the vendor
+        """
+        known: typing.Dict[str, typing.List[CatalogEntry]] = {}
+        for entry in self.list(kind=kind, vendor=vendor):
+            known.setdefault(entry.path, []).append(entry)
+
+        def _is_known(entries: typing.List[CatalogEntry], stat: storage.FileStat) -> bool:
+            return len(entries) > 0 and all(entry.size == stat.size and entry.mtime == stat.mtime
+                                            for entry in entries)
+
+        found: typing.Dict[int, CatalogEntry] = {}
+        loose: typing.Dict[int, CatalogEntry] = {}
+        folder = folder.rstrip("/") if storage.is_remote(folder) else folder
+        for root, _, files in storage.walk(folder):
+            is_partition = partition_timestamp(root) is not None
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                relative_path = self._relative_path(path)
+
+                if is_partition and file_name == PARTITION_FILE_NAME:
+                    stat = storage.stat(path)
+                    entries = known.get(relative_path, [])
+                    if not _is_known(entries, stat):
+                        entries = self._describe_partition(kind, vendor, path, stat)
+                    found.update({entry.snapshot: entry for entry in entries})
+                    continue
+
+                match = _SNAPSHOT_FILE_RE.match(file_name)
+                if root != folder or match is None:
+                    continue
+
+                stat = storage.stat(path)
+                entries = known.get(relative_path, [])
+                if _is_known(entries, stat):
+                    entry = entries[0]
+                else:
+                    entry = self._describe_file(kind, vendor, int(match.group("snapshot")), path, stat)
+                loose[entry.snapshot] = entry
+
+        # separate tables take precedence over the compacted ones
+        found.update(loose)
+        entries = [found[snapshot] for snapshot in sorted(found)]
+
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM entries WHERE kind = ? AND vendor = ?", (kind, vendor))
+            connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(entry.kind, entry.vendor, entry.snapshot, entry.path, entry.size, entry.mtime,
+                                     entry.rows, entry.start_time, entry.end_time) for entry in entries])
+            connection.execute("INSERT OR REPLACE INTO synced VALUES (?, ?, ?)",
+                               (kind, vendor, self._relative_path(folder)))
+
+        return entries
+
+    def sync_files(self, kind: str, vendor: str, paths: typing.Iterable[str]) -> typing.List[CatalogEntry]:
+        """Replaces entries of the files, e.g. just written partitions, without walking the folder of the vendor.
+        Entries of the files that don't exist anymore are removed
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the entries
+        vendor : str
+            Vendor folder name
+        paths : Iterable[str]
+            Paths to `<snapshot>.<ext>` files and partition tables of the vendor, local or `s3://` URIs
+
+        Returns
+        -------
+        List[CatalogEntry]
+            Returns entries of the existing files
+        """
+        paths = list(paths)
+        relative_paths = set(self._relative_path(path) for path in paths)
+        known = {entry.snapshot: entry for entry in self.list(kind=kind, vendor=vendor)}
+
+        entries: typing.List[CatalogEntry] = []
+        for path in paths:
+            stat = storage.stat(path)
+            if stat is None:
+                continue
+
+            file_name = os.path.basename(path)
+            if file_name == PARTITION_FILE_NAME and partition_timestamp(os.path.dirname(path)) is not None:
+                # separate tables take precedence over the compacted ones
+                entries.extend(entry for entry in self._describe_partition(kind, vendor, path, stat)
+                               if entry.snapshot not in known or known[entry.snapshot].path in relative_paths or
+                               os.path.basename(known[entry.snapshot].path) == PARTITION_FILE_NAME)
+                continue
+
+            match = _SNAPSHOT_FILE_RE.match(file_name)
+            if match is not None:
+                entries.append(self._describe_file(kind, vendor, int(match.group("snapshot")), path, stat))
+
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM entries WHERE kind = ? AND vendor = ? AND path = ?",
+                                   [(kind, vendor, path) for path in relative_paths])
+            connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(entry.kind, entry.vendor, entry.snapshot, entry.path, entry.size, entry.mtime,
+                                     entry.rows, entry.start_time, entry.end_time) for entry in entries])
+
+        return entries
+
+    @contextlib.contextmanager
+    def _transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        connection = self._connect()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _describe_file(self, kind: str, vendor: str, snapshot: int, path: str, stat: storage.FileStat) -> CatalogEntry:
+        entry = CatalogEntry(kind=kind,
+                             vendor=vendor,
+                             snapshot=snapshot,
+                             path=self._relative_path(path),
+                             size=stat.size,
+                             mtime=stat.mtime)
+        if path.endswith(".parquet"):
+            try:
+                metadata = storage.parquet_metadata(path)
+                entry.rows = metadata.num_rows
+                entry.start_time, entry.end_time = _timestamp_bounds(metadata, list(range(metadata.num_row_groups)))
+            except OSError:
+                pass  # incomplete table is listed without row statistics
+
+        return entry
+
+    def _describe_partition(self,
+                            kind: str,
+                            vendor: str,
+                            path: str,
+                            stat: storage.FileStat) -> typing.List[CatalogEntry]:
+        # every row group of a partition has rows of one snapshot
+        try:
+            metadata = storage.parquet_metadata(path)
+        except OSError:
+            return []  # incomplete partition has no listed snapshots
+
+        names = metadata.schema.names
+        if SNAPSHOT_COLUMN not in names:
+            return []
+
+        column = names.index(SNAPSHOT_COLUMN)
+        row_groups: typing.Dict[int, typing.List[int]] = {}
+        for index in range(metadata.num_row_groups):
+            statistics = metadata.row_group(index).column(column).statistics
+            if statistics is not None and statistics.has_min_max:
+                row_groups.setdefault(int(statistics.min), []).append(index)
+
+        entries = []
+        for snapshot, indices in sorted(row_groups.items()):
+            start_time, end_time = _timestamp_bounds(metadata, indices)
+            entries.append(CatalogEntry(kind=kind,
+                                        vendor=vendor,
+                                        snapshot=snapshot,
+                                        path=self._relative_path(path),
+                                        size=stat.size,
+                                        mtime=stat.mtime,
+                                        rows=sum(metadata.row_group(index).num_rows for index in indices),
+                                        start_time=start_time,
+                                        end_time=end_time))
+
+        return entries
@@ -0,0 +1,289 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+
+from metrics.utils.file import write_atomic
+
+INDEX_FILE_NAME = "index.sqlite"
+LOCK_FILE_NAME = "lock"
+OBJECTS_FOLDER = "objects"
+
+USES_BATCH = 256            # number of reads of cached objects whose last use times are written together
+USES_FLUSH_INTERVAL = 30.0  # maximum time in seconds before last use times of read objects are written
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    s3_uri TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    size INTEGER NOT NULL
+);
+"""
+
+
+def cache_key(s3_uri: str, etag: str) -> str:
+    """Returns key of the S3 object content. Objects rewritten in S3 get new ETags and new keys"""
+    return hashlib.sha256(f"{s3_uri}\n{etag}".encode()).hexdigest()
+
+
+def link_file(src_path: str, dst_path: str) -> bool:
+    """Replaces the destination with a hardlink to the source. Files on different file systems
+    can't be linked and are copied
+
+    Returns
+    -------
+    bool
+        Returns `True` if the file was linked and `False` if it was copied
+    """
+    tmp_path = f"{dst_path}.tmp"
+    try:
+        try:
+            os.link(src_path, tmp_path)
+            linked = True
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+            linked = False
+
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return linked
+
+
+class DataCache:
+    """Machine-wide cache of downloaded S3 objects shared by sessions.
+
+    Objects are stored by hashes of their S3 URIs and ETags in `<folder>/objects` and sessions get hardlinks
+    to them, so overlapping sessions download every object once. The index `<folder>/index.sqlite` keeps
+    sizes and last use times of the objects, the least recently used objects are evicted when the cache
+    exceeds its size. The index keeps the total size of the objects, so the objects are listed only when
+    some of them have to be evicted. Evicted objects stay in sessions that link them. All operations except
+    `read` take an exclusive lock on `<folder>/lock`, so concurrent checkouts don't race. Objects are written
+    atomically, so `read` reads them without the lock and keeps their uses in memory of the process until
+    they are written to the index in batches
+    """
+
+    def __init__(self, folder: str, max_size: typing.Optional[int] = None):
+        """
+        Parameters
+        ----------
+        folder : str
+            Cache folder
+        max_size : int | None
+            Maximum size of the cached objects in bytes. The cache is not bounded if `None`
+        """
+        self._folder = folder
+        self._max_size = max_size
+        os.makedirs(os.path.join(folder, OBJECTS_FOLDER), exist_ok=True)
+
+        self._uses_lock = threading.Lock()
+        self._uses: typing.Dict[str, float] = {}  # last use times of read objects that aren't in the index yet
+        self._uses_written = time.monotonic()
+
+    def object_path(self, key: str) -> str:
+        return os.path.join(self._folder, OBJECTS_FOLDER, key[:2], key)
+
+    @contextlib.contextmanager
+    def _locked(self) -> typing.Iterator[sqlite3.Connection]:
+        with open(os.path.join(self._folder, LOCK_FILE_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            connection = sqlite3.connect(os.path.join(self._folder, INDEX_FILE_NAME), timeout=60)
+            try:
+                connection.executescript(_SCHEMA)
+                with connection:
+                    # indices written before the total was kept get it once
+                    connection.execute("INSERT OR IGNORE INTO usage "
+                                       "SELECT 0, COALESCE(SUM(size), 0) FROM objects "
+                                       "WHERE NOT EXISTS (SELECT 1 FROM usage)")
+                    yield connection
+            finally:
+                connection.close()
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, s3_uri: str, etag: str, file_path: str) -> bool:
+        """Links the cached object into the file path
+
+        Parameters
+        ----------
+        s3_uri : str
+            S3 URI of the object
+        etag : str
+            Entity tag of the object
+        file_path : str
+            Path where to link the object
+
+        Returns
+        -------
+        bool
+            Returns `True` if the object was in the cache
+        """
+        return self.fetch_many([(s3_uri, etag, file_path)])[0]
+
+    def fetch_many(self, objects: typing.List[typing.Tuple[str, str, str]]) -> typing.List[bool]:
+        """Links the cached objects into their file paths under one lock of the cache
+
+        Parameters
+        ----------
+        objects : List[Tuple[str, str, str]]
+            S3 URIs, entity tags and file paths of the objects, see `fetch`
+
+        Returns
+        -------
+        List[bool]
+            Returns `True` for the objects that were in the cache
+        """
+        if len(objects) == 0:
+            return []
+
+        fetched = []
+        with self._locked() as connection:
+            now = time.time()
+            for s3_uri, etag, file_path in objects:
+                key = cache_key(s3_uri=s3_uri, etag=etag)
+                object_path = self.object_path(key)
+                row = connection.execute("SELECT size FROM objects WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    fetched.append(False)
+                elif not os.path.exists(object_path):
+                    self._remove(connection, key=key, size=row[0])
+                    fetched.append(False)
+                else:
+                    link_file(object_path, file_path)
+                    connection.execute("UPDATE objects SET last_used = ? WHERE key = ?", (now, key))
+                    fetched.append(True)
+
+        return fetched
+
+    def store(self, s3_uri: str, etag: str, file_path: str):
+        """Adds the downloaded object to the cache and evicts the least recently used objects
+        that don't fit the cache size
+
+        Parameters
+        ----------
+        s3_uri : str
+            S3 URI of the object
+        etag : str
+            Entity tag of the object
+        file_path : str
+            Path to the downloaded object
+        """
+        key = cache_key(s3_uri=s3_uri, etag=etag)
+        object_path = self.object_path(key)
+        with self._locked() as connection:
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                link_file(file_path, object_path)
+
+            self._add(connection, key=key, s3_uri=s3_uri, etag=etag, size=os.path.getsize(object_path))
+            self._evict(connection)
+
+    def read(self, s3_uri: str, etag: str) -> typing.Optional[bytes]:
+        """Returns content of the cached object, e.g. a block of a remote file, or `None` if it isn't cached.
+        The object is read without the lock, its use is written to the index with the next batch
+        """
+        key = cache_key(s3_uri=s3_uri, etag=etag)
+        try:
+            with open(self.object_path(key), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        with self._uses_lock:
+            self._uses[key] = time.time()
+            if len(self._uses) < USES_BATCH and time.monotonic() - self._uses_written < USES_FLUSH_INTERVAL:
+                return data
+
+        self.flush()
+        return data
+
+    def flush(self):
+        """Writes last use times of the objects read by the process to the index"""
+        with self._locked() as connection:
+            self._write_uses(connection)
+
+    def _write_uses(self, connection: sqlite3.Connection):
+        with self._uses_lock:
+            uses, self._uses = self._uses, {}
+            self._uses_written = time.monotonic()
+
+        connection.executemany("UPDATE objects SET last_used = MAX(last_used, ?) WHERE key = ?",
+                               [(last_used, key) for key, last_used in uses.items()])
+
+    def write(self, s3_uri: str, etag: str, data: bytes):
+        """Adds content of the object to the cache and evicts the least recently used objects
+        that don't fit the cache size
+        """
+        key = cache_key(s3_uri=s3_uri, etag=etag)
+        object_path = self.object_path(key)
+
+        def _write(path: str):
+            with open(path, "wb") as file:
+                file.write(data)
+
+        with self._locked() as connection:
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                write_atomic(object_path, _write)
+
+            self._add(connection, key=key, s3_uri=s3_uri, etag=etag, size=len(data))
+            # recently read objects are kept by the eviction
+            self._write_uses(connection)
+            self._evict(connection)
+
+    @staticmethod
+    def _total_size(connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT size FROM usage").fetchone()[0]
+
+    @staticmethod
+    def _add(connection: sqlite3.Connection, key: str, s3_uri: str, etag: str, size: int):
+        row = connection.execute("SELECT size FROM objects WHERE key = ?", (key,)).fetchone()
+        connection.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                           (key, s3_uri, etag, size, time.time()))
+        connection.execute("UPDATE usage SET size = size + ?", (size - (0 if row is None else row[0]),))
+
+    @staticmethod
+    def _remove(connection: sqlite3.Connection, key: str, size: int):
+        connection.execute("DELETE FROM objects WHERE key = ?", (key,))
+        connection.execute("UPDATE usage SET size = size - ?", (size,))
+
+    def _evict(self, connection: sqlite3.Connection):
+        if self._max_size is None:
+            return
+
+        total_size = self._total_size(connection)
+        if total_size <= self._max_size:
+            return
+
+        # only the least recently used rows that have to go are read
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM objects ORDER BY last_used"):
+            if total_size <= self._max_size:
+                break
+
+            evicted.append((key, size))
+            total_size -= size
+
+        for key, size in evicted:
+            object_path = self.object_path(key)
+            if os.path.exists(object_path):
+                os.remove(object_path)
+            self._remove(connection, key=key, size=size)
+
+    def size(self) -> int:
+        """Returns size of the cached objects in bytes"""
+        with self._locked() as connection:
+            return self._total_size(connection)
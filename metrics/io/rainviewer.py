@@ -3,9 +3,11 @@ import cv2
 import functools
 import numpy as np
 import os
+import re
 import typing
 import zipfile
 
+from metrics.io import storage
 from metrics.io.tile_loader import BaseTileLoader
 from metrics.utils.dbz import MIN_VALUE
 from metrics.utils.precipitation import PrecipitationData, PrecipitationType
@@ -142,18 +144,57 @@ def decode_mask_from_file(fo: typing.BinaryIO) -> np.ndarray:
     return image[..., 3] == 0
 
 
+# data and mask tiles `<timestamp>/_map/t<offset>/<zoom>/<x>/<y>.png` and `<timestamp>/_mask/<zoom>/<x>/<y>.png`
+_TILE_MEMBER_RE = re.compile(r"(?:^|/)_(?:map/t\d+|mask)/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$")
+
+
 class RainViewerTileLoader(BaseTileLoader):
 
     ZOOM_LEVEL = 7
 
+    @staticmethod
+    def member_tile(name: str) -> typing.Optional[typing.Tuple[int, int]]:
+        """Returns `(x, y)` of the tile stored in the archive member or `None` if the member is not
+        a data or mask tile of the loaded zoom level
+        """
+        match = _TILE_MEMBER_RE.search(name)
+        if match is None or int(match["zoom"]) != RainViewerTileLoader.ZOOM_LEVEL:
+            return None
+
+        return int(match["x"]), int(match["y"])
+
     def __init__(self, zip_path: str) -> None:
-        self._zip_file = zipfile.ZipFile(zip_path, "r")
+        self._zip_path = zip_path
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._zip_file: typing.Optional[zipfile.ZipFile] = None
 
         file_name = os.path.basename(zip_path)
         self._timestamp_path, _ = os.path.splitext(file_name)
 
         self._zip_precip_type = None
 
+    def _archive(self) -> zipfile.ZipFile:
+        """Returns the archive, it's opened by the first load after :func:`close`"""
+        if self._zip_file is None:
+            # only the central directory and the read tiles of remote archives are downloaded
+            self._file = storage.open_file(self._zip_path)
+            try:
+                self._zip_file = zipfile.ZipFile(self._file, "r")
+            except Exception:
+                self.close()
+                raise
+
+        return self._zip_file
+
+    def close(self):
+        """Overriden from base class"""
+        if self._zip_file is not None:
+            self._zip_file.close()
+            self._zip_file = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
     def load(self, offset: int, tile_x: int, tile_y: int) -> PrecipitationData:
         """Overriden from base class"""
         return self._load_impl(offset=offset, tile_x=tile_x, tile_y=tile_y)
@@ -166,8 +207,9 @@ class RainViewerTileLoader(BaseTileLoader):
             mask_path = os.path.join(self._timestamp_path, "_mask",
                                      str(RainViewerTileLoader.ZOOM_LEVEL), str(tile_x), f"{tile_y}.png")
 
-            with self._zip_file.open(tile_path, "r") as tile_file:
-                with self._zip_file.open(mask_path, "r") as mask_file:
+            zip_file = self._archive()
+            with zip_file.open(tile_path, "r") as tile_file:
+                with zip_file.open(mask_path, "r") as mask_file:
                     return decode_data_from_file(tile_file, mask_file)
 
         except KeyError:
@@ -0,0 +1,382 @@
+import botocore.exceptions
+import collections
+import io
+import os
+import pyarrow.parquet as pq
+import threading
+import time
+import typing
+
+from dataclasses import dataclass
+from metrics.io.data_cache import DataCache
+from metrics.utils.s3 import parse_s3_uri, shared_s3_client
+
+S3_SCHEME = "s3://"
+
+BLOCK_SIZE = 1024 ** 2              # remote files are read and cached by blocks of this size in bytes
+MEMORY_CACHE_SIZE = 64 * 1024 ** 2  # size of the blocks kept in memory by a process in bytes
+FOOTER_CACHE_SIZE = 1024            # number of parquet footers kept in memory by a process
+STAT_TTL = 60.0                     # time in seconds that stats of remote files are kept in memory
+
+# environment variables that configure the block cache of remote files, spawned processes inherit them
+BLOCK_CACHE_DIR_ENV = "METRICS_BLOCK_CACHE_DIR"
+BLOCK_CACHE_SIZE_ENV = "METRICS_BLOCK_CACHE_SIZE"   # in GB
+
+_NOT_FOUND_CODES = {"404", "NoSuchKey", "NotFound"}
+
+
+def is_remote(path: str) -> bool:
+    """Checks if the path is an `s3://` URI"""
+    return isinstance(path, str) and path.startswith(S3_SCHEME)
+
+
+@dataclass
+class FileStat:
+    size: int                           # size of the file in bytes
+    mtime: float                        # modification time of the file
+    etag: typing.Optional[str] = None   # entity tag of a remote file, `None` for local files
+
+
+class _RemoteFile(io.RawIOBase):
+    """Read-only seekable file over a remote object, reads are served by blocks of :class:`RemoteStorage`"""
+
+    def __init__(self, storage: "RemoteStorage", s3_uri: str, stat: FileStat):
+        self._storage = storage
+        self._s3_uri = s3_uri
+        self._stat = stat
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._stat.size
+
+        if offset < 0:
+            raise OSError("Negative seek position")
+
+        self._position = offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self._stat.size)
+        if end <= self._position:
+            return 0
+
+        data = self._storage.read_range(self._s3_uri, self._stat, self._position, end)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class RemoteStorage:
+    """Reads files of `s3://` folders by ranged GETs of fixed size blocks.
+
+    Blocks are keyed by the object URI, ETag and index, so rewritten objects are never mixed with cached blocks.
+    Recently read blocks are kept in memory, so parquet footers and zip central directories that are read
+    several times cost one request. With a block cache, blocks are also kept on disk across processes and runs
+    and only the used parts of archives and tables are ever downloaded
+    """
+
+    def __init__(self,
+                 client: typing.Any = None,
+                 cache: typing.Optional[DataCache] = None,
+                 block_size: int = BLOCK_SIZE,
+                 memory_cache_size: int = MEMORY_CACHE_SIZE,
+                 stat_ttl: float = STAT_TTL):
+        """
+        Parameters
+        ----------
+        client : Any
+            boto3 S3 client. The client shared by the process is used if `None`
+        cache : DataCache | None
+            Cache of blocks on disk. Blocks are kept only in memory if `None`
+        block_size : int
+            Size of a block in bytes
+        memory_cache_size : int
+            Size of the blocks kept in memory in bytes
+        stat_ttl : float
+            Time in seconds that stats of existing objects are kept in memory, so objects rewritten
+            in the meantime are seen. Missing objects are always requested again
+        """
+        assert block_size > 0, "Block size should be greater than 0"
+
+        self._client = shared_s3_client() if client is None else client
+        self._cache = cache
+        self._block_size = block_size
+        self._memory_cache_size = memory_cache_size
+
+        self._lock = threading.Lock()
+        self._blocks: typing.OrderedDict[typing.Tuple[str, str, int], bytes] = collections.OrderedDict()
+        self._blocks_size = 0
+        self._stat_ttl = stat_ttl
+        self._stats: typing.Dict[str, typing.Tuple[FileStat, float]] = {}  # stats and times they were taken
+
+    def _cache_stat(self, s3_uri: str, stat: FileStat):
+        with self._lock:
+            self._stats[s3_uri] = (stat, time.monotonic())
+
+    def stat(self, s3_uri: str) -> typing.Optional[FileStat]:
+        """Returns size, modification time and ETag of the object or `None` if it doesn't exist.
+        Objects listed by :func:`listdir` or requested within `stat_ttl` seconds are not requested again
+        """
+        with self._lock:
+            cached = self._stats.get(s3_uri, None)
+            if cached is not None:
+                stat, taken = cached
+                if time.monotonic() - taken < self._stat_ttl:
+                    return stat
+                del self._stats[s3_uri]
+
+        bucket_name, object_key = parse_s3_uri(s3_uri)
+        try:
+            response = self._client.head_object(Bucket=bucket_name, Key=object_key)
+            stat = FileStat(size=response["ContentLength"],
+                            mtime=response["LastModified"].timestamp(),
+                            etag=response["ETag"].strip('"'))
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code", None) not in _NOT_FOUND_CODES:
+                raise
+            # the object may be uploaded later, e.g. by a running checkout
+            return None
+
+        self._cache_stat(s3_uri, stat)
+        return stat
+
+    def listdir(self, s3_uri: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """Returns names of the sub folders and files of the folder"""
+        bucket_name, prefix = parse_s3_uri(s3_uri)
+        prefix = prefix.rstrip("/") + "/" if len(prefix) > 0 else ""
+
+        folders, files = [], []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
+            for item in page.get("CommonPrefixes", []):
+                folders.append(item["Prefix"][len(prefix):].rstrip("/"))
+
+            for item in page.get("Contents", []):
+                name = item["Key"][len(prefix):]
+                if len(name) == 0:
+                    continue  # folder marker
+
+                files.append(name)
+                self._cache_stat(f"{S3_SCHEME}{bucket_name}/{item['Key']}",
+                                 FileStat(size=item["Size"],
+                                          mtime=item["LastModified"].timestamp(),
+                                          etag=item["ETag"].strip('"')))
+
+        return folders, files
+
+    def read_range(self, s3_uri: str, stat: FileStat, start: int, end: int) -> bytes:
+        """Returns bytes `[start, end)` of the object with the stat"""
+        first, last = start // self._block_size, (end - 1) // self._block_size
+        data = b"".join(self._block(s3_uri, stat, index) for index in range(first, last + 1))
+        offset = start - first * self._block_size
+        return data[offset:offset + end - start]
+
+    def open(self, s3_uri: str) -> typing.BinaryIO:
+        """Opens the object for reading"""
+        stat = self.stat(s3_uri)
+        if stat is None:
+            raise FileNotFoundError(s3_uri)
+
+        return _RemoteFile(storage=self, s3_uri=s3_uri, stat=stat)
+
+    def _block(self, s3_uri: str, stat: FileStat, index: int) -> bytes:
+        key = (s3_uri, stat.etag, index)
+        with self._lock:
+            block = self._blocks.get(key, None)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                return block
+
+        block_uri = f"{s3_uri}#block={self._block_size}:{index}"
+        block = None if self._cache is None else self._cache.read(s3_uri=block_uri, etag=stat.etag)
+        if block is None:
+            block = self._get_block(s3_uri, stat, index)
+            if self._cache is not None:
+                self._cache.write(s3_uri=block_uri, etag=stat.etag, data=block)
+
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self._blocks_size += len(block)
+            while self._blocks_size > self._memory_cache_size and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self._blocks_size -= len(evicted)
+
+        return block
+
+    def _get_block(self, s3_uri: str, stat: FileStat, index: int) -> bytes:
+        bucket_name, object_key = parse_s3_uri(s3_uri)
+        start = index * self._block_size
+        end = min(start + self._block_size, stat.size)
+        # blocks of another version of the object fail the precondition instead of mixing with cached ones
+        response = self._client.get_object(Bucket=bucket_name,
+                                           Key=object_key,
+                                           Range=f"bytes={start}-{end - 1}",
+                                           IfMatch=f'"{stat.etag}"')
+        body = response["Body"]
+        try:
+            block = body.read()
+        finally:
+            body.close()
+
+        if len(block) != end - start:
+            raise OSError(f"Block {index} of {s3_uri} has {len(block)} bytes instead of {end - start}")
+
+        return block
+
+
+_remote_storage: typing.Optional[RemoteStorage] = None
+_remote_storage_lock = threading.Lock()
+
+_footers: typing.OrderedDict[typing.Tuple[str, int, float], pq.FileMetaData] = collections.OrderedDict()
+_footers_lock = threading.Lock()
+
+
+def _reset_remote_storage():
+    # forked processes create their own storage, so they don't use connections of the parent process
+    global _remote_storage, _remote_storage_lock
+    _remote_storage = None
+    _remote_storage_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_remote_storage)
+
+
+def configure(storage: typing.Optional[RemoteStorage]):
+    """Sets storage of remote files of the process. The storage is created on the first use if `None`.
+    Forked processes don't inherit the storage and create their own one on the first use
+    """
+    global _remote_storage
+    with _remote_storage_lock:
+        _remote_storage = storage
+
+    with _footers_lock:
+        _footers.clear()
+
+
+def remote_storage() -> RemoteStorage:
+    """Returns storage of remote files of the process. It's created on the first use with the block cache
+    configured by `METRICS_BLOCK_CACHE_DIR` and `METRICS_BLOCK_CACHE_SIZE` (GB) environment variables
+    """
+    global _remote_storage
+    with _remote_storage_lock:
+        if _remote_storage is None:
+            cache = None
+            cache_folder = os.environ.get(BLOCK_CACHE_DIR_ENV, None)
+            if cache_folder:
+                cache_size = os.environ.get(BLOCK_CACHE_SIZE_ENV, None)
+                cache = DataCache(folder=cache_folder,
+                                  max_size=None if not cache_size else int(float(cache_size) * 1024 ** 3))
+            _remote_storage = RemoteStorage(cache=cache)
+
+        return _remote_storage
+
+
+def stat(path: str) -> typing.Optional[FileStat]:
+    """Returns stat of the local or remote file or `None` if it doesn't exist"""
+    if is_remote(path):
+        return remote_storage().stat(path)
+
+    try:
+        local_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return FileStat(size=local_stat.st_size, mtime=local_stat.st_mtime)
+
+
+def exists(path: str) -> bool:
+    """Checks if the local or remote file exists"""
+    if not is_remote(path):
+        return os.path.exists(path)
+
+    return stat(path) is not None
+
+
+def getsize(path: str) -> int:
+    """Returns size of the local or remote file in bytes"""
+    if not is_remote(path):
+        return os.path.getsize(path)
+
+    file_stat = stat(path)
+    if file_stat is None:
+        raise FileNotFoundError(path)
+
+    return file_stat.size
+
+
+def isdir(path: str) -> bool:
+    """Checks if the local folder exists or the remote folder has files"""
+    if not is_remote(path):
+        return os.path.isdir(path)
+
+    folders, files = remote_storage().listdir(path)
+    return len(folders) > 0 or len(files) > 0
+
+
+def listdir(path: str) -> typing.List[str]:
+    """Returns names of the files and sub folders of the local or remote folder"""
+    if not is_remote(path):
+        return os.listdir(path)
+
+    folders, files = remote_storage().listdir(path)
+    return folders + files
+
+
+def walk(path: str) -> typing.Iterator[typing.Tuple[str, typing.List[str], typing.List[str]]]:
+    """Walks the local or remote folder top-down like `os.walk`"""
+    if not is_remote(path):
+        yield from os.walk(path)
+        return
+
+    root = path.rstrip("/")
+    folders, files = remote_storage().listdir(root)
+    yield root, folders, files
+    for folder in folders:
+        yield from walk(f"{root}/{folder}")
+
+
+def open_file(path: str) -> typing.BinaryIO:
+    """Opens the local or remote file for binary reading"""
+    if is_remote(path):
+        return remote_storage().open(path)
+
+    return open(path, "rb")
+
+
+def parquet_metadata(path: str) -> pq.FileMetaData:
+    """Returns footer metadata of the parquet table. Footers are kept in memory by paths,
+    sizes and modification times, so the footer of an unchanged table is read once
+    """
+    file_stat = stat(path)
+    if file_stat is None:
+        raise FileNotFoundError(path)
+
+    key = (path, file_stat.size, file_stat.mtime)
+    with _footers_lock:
+        metadata = _footers.get(key, None)
+        if metadata is not None:
+            _footers.move_to_end(key)
+            return metadata
+
+    with open_file(path) as file:
+        metadata = pq.ParquetFile(file).metadata
+
+    with _footers_lock:
+        _footers[key] = metadata
+        while len(_footers) > FOOTER_CACHE_SIZE:
+            _footers.popitem(last=False)
+
+    return metadata
@@ -0,0 +1,252 @@
+import datetime
+import numpy
+import os
+import pandas
+import pyarrow
+import pyarrow.parquet as pq
+import re
+import typing
+
+from metrics.io import storage
+from metrics.io.arrow_cache import ArrowCache
+from metrics.utils.file import write_atomic
+from metrics.utils.parquet import ParquetWriterProfile, get_parquet_profile, read_table
+
+# Column with the snapshot timestamp in compacted tables
+SNAPSHOT_COLUMN = "snapshot"
+
+PARTITION_PERIOD = 3600
+PARTITION_FILE_NAME = "data.parquet"
+
+_PARTITION_RE = re.compile(r"date=(?P<date>\d{4}-\d{2}-\d{2})/hour=(?P<hour>\d{2})$")
+_SNAPSHOT_FILE_RE = re.compile(r"^(?P<snapshot>\d+)\.parquet$")
+
+
+def partition_folder(snapshot_timestamp: int) -> str:
+    """Returns hive partition folder `date=<YYYY-MM-DD>/hour=<HH>` of the snapshot, relative to the vendor folder"""
+    date = datetime.datetime.fromtimestamp(snapshot_timestamp, datetime.timezone.utc)
+    return os.path.join(f"date={date.strftime('%Y-%m-%d')}", f"hour={date.strftime('%H')}")
+
+
+def partition_timestamp(folder: str) -> typing.Optional[int]:
+    """Returns start timestamp of the hive partition folder or `None` if the folder is not a partition"""
+    match = _PARTITION_RE.search(folder.replace(os.sep, "/"))
+    if match is None:
+        return None
+
+    date = datetime.datetime.strptime(f"{match.group('date')} {match.group('hour')}", "%Y-%m-%d %H")
+    return int(date.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def snapshot_table_timestamp(path: str) -> typing.Optional[int]:
+    """Returns snapshot timestamp of the `<snapshot>.parquet` table or `None` for other files"""
+    match = _SNAPSHOT_FILE_RE.match(os.path.basename(path))
+    if match is None:
+        return None
+
+    return int(match.group("snapshot"))
+
+
+class TableStore:
+    """Access to parsed tables of one vendor.
+
+    Parse writes one table per snapshot `<snapshot>.parquet`. Compaction moves them into hourly hive partitions
+    `date=<YYYY-MM-DD>/hour=<HH>/data.parquet`. Partition tables have an additional `snapshot` column, are sorted
+    by snapshot, sensor id and timestamp, and store every snapshot in its own row groups, so a single snapshot is
+    read using row group statistics. Snapshot tables take precedence over the compacted ones.
+    Tables are read from a local folder or an `s3://` prefix, only local folders are compacted.
+    """
+
+    def __init__(self,
+                 folder: str,
+                 writer_profile: typing.Optional[ParquetWriterProfile] = None,
+                 cache: typing.Optional[ArrowCache] = None):
+        """
+        Parameters
+        ----------
+        folder : str
+            Path to the vendor tables folder, local or `s3://` URI
+        writer_profile : ParquetWriterProfile | None
+            Profile of the partition tables. Its sort keys are applied within every snapshot.
+            The default profile is used if `None`
+        cache : ArrowCache | None
+            Cache to load tables from. Tables are loaded from parquet files if `None`
+        """
+        self._folder = folder
+        self._writer_profile = writer_profile or get_parquet_profile()
+        self._cache = cache
+
+    def snapshot_path(self, snapshot_timestamp: int) -> str:
+        """Returns path of the snapshot table"""
+        return os.path.join(self._folder, f"{snapshot_timestamp}.parquet")
+
+    def partition_path(self, snapshot_timestamp: int) -> str:
+        """Returns path of the partition table that stores the snapshot"""
+        return os.path.join(self._folder, partition_folder(snapshot_timestamp), PARTITION_FILE_NAME)
+
+    def list_snapshot_tables(self) -> typing.List[int]:
+        """Returns sorted timestamps of snapshots that are stored as separate tables"""
+        if storage.is_remote(self._folder):
+            _, file_names = storage.remote_storage().listdir(self._folder)
+            return sorted(snapshot for snapshot in map(snapshot_table_timestamp, file_names) if snapshot is not None)
+
+        if not os.path.isdir(self._folder):
+            return []
+
+        snapshots = []
+        for file_name in os.listdir(self._folder):
+            snapshot = snapshot_table_timestamp(file_name)
+            if snapshot is not None and os.path.isfile(os.path.join(self._folder, file_name)):
+                snapshots.append(snapshot)
+
+        return sorted(snapshots)
+
+    def load_snapshot(self,
+                      snapshot_timestamp: int,
+                      columns: typing.Optional[typing.List[str]] = None) -> typing.Optional[pandas.DataFrame]:
+        """Loads table of the snapshot
+
+        Parameters
+        ----------
+        snapshot_timestamp : int
+            Timestamp of the snapshot
+        columns : List[str] | None
+            Columns to load. Columns that the table doesn't have are skipped. All columns are loaded if `None`
+
+        Returns
+        -------
+        pandas.DataFrame | None
+            Returns table of the snapshot or `None` if there is no table for it
+        """
+        table_path = self.snapshot_path(snapshot_timestamp)
+        if storage.exists(table_path):
+            return self._read_table(table_path, columns=columns).to_pandas()
+
+        partitions = self.load_compacted(time_range=(snapshot_timestamp, snapshot_timestamp), columns=columns)
+        if len(partitions) == 0:
+            return None
+
+        return pandas.concat(partitions, ignore_index=True)
+
+    def load_compacted(self,
+                       time_range: typing.Tuple[int, int],
+                       skip_snapshots: typing.Collection[int] = (),
+                       partition_paths: typing.Optional[typing.Collection[str]] = None,
+                       columns: typing.Optional[typing.List[str]] = None) -> typing.List[pandas.DataFrame]:
+        """Loads compacted tables of snapshots in the time range
+
+        Parameters
+        ----------
+        time_range : Tuple[int, int]
+            Range of snapshot timestamps to load, both ends are included
+        skip_snapshots : Collection[int]
+            Snapshots that shouldn't be loaded, e.g. because their separate tables are loaded
+        partition_paths : Collection[str] | None
+            Existing partition tables, e.g. listed by the session catalog. When `None`, partitions
+            of the time range are looked up in the folder
+        columns : List[str] | None
+            Columns to load. Columns that the tables don't have are skipped. All columns are loaded if `None`
+
+        Returns
+        -------
+        List[pandas.DataFrame]
+            Returns tables of the partitions that have snapshots in the range, without the `snapshot` column
+        """
+        start_time, end_time = time_range
+
+        tables = []
+        partition_start = start_time - start_time % PARTITION_PERIOD
+        while partition_start <= end_time:
+            partition_path = self.partition_path(partition_start)
+            partition_start += PARTITION_PERIOD
+
+            if partition_paths is not None:
+                if partition_path not in partition_paths:
+                    continue
+            elif not storage.exists(partition_path):
+                continue
+
+            filters = [(SNAPSHOT_COLUMN, ">=", start_time), (SNAPSHOT_COLUMN, "<=", end_time)]
+            skipped = [snapshot for snapshot in skip_snapshots if start_time <= snapshot <= end_time]
+            if len(skipped) > 0:
+                filters.append((SNAPSHOT_COLUMN, "not in", skipped))
+
+            table = self._read_table(partition_path, filters=filters, columns=columns).to_pandas()
+            if len(table) > 0:
+                tables.append(table.drop(columns=[SNAPSHOT_COLUMN], errors="ignore"))
+
+        return tables
+
+    def _read_table(self,
+                    table_path: str,
+                    filters: typing.Optional[typing.List[typing.Tuple]] = None,
+                    columns: typing.Optional[typing.List[str]] = None) -> pyarrow.Table:
+        if self._cache is not None:
+            return self._cache.read(table_path, filters=filters, columns=columns)
+
+        return read_table(table_path, filters=filters, columns=columns)
+
+    def compact(self, before: typing.Optional[int] = None) -> typing.Dict[int, str]:
+        """Moves snapshot tables into hourly partitions. Snapshot tables replace the same snapshots
+        in the existing partitions
+
+        Parameters
+        ----------
+        before : int | None
+            Only snapshots of the partitions that end before or at this timestamp are compacted, so hours
+            that are still being filled aren't rewritten. All snapshots are compacted if `None`
+
+        Returns
+        -------
+        Dict[int, str]
+            Returns path of the partition table for each compacted snapshot
+        """
+        snapshots_by_partition: typing.Dict[str, typing.List[int]] = {}
+        for snapshot in self.list_snapshot_tables():
+            if before is not None and snapshot - snapshot % PARTITION_PERIOD + PARTITION_PERIOD > before:
+                continue
+
+            snapshots_by_partition.setdefault(self.partition_path(snapshot), []).append(snapshot)
+
+        compacted = {}
+        for partition_path, snapshots in snapshots_by_partition.items():
+            tables = []
+            for snapshot in snapshots:
+                table = pandas.read_parquet(self.snapshot_path(snapshot))
+                table[SNAPSHOT_COLUMN] = snapshot
+                tables.append(table)
+
+            if os.path.exists(partition_path):
+                existing = pq.read_table(partition_path, filters=[(SNAPSHOT_COLUMN, "not in", snapshots)])
+                tables.append(existing.to_pandas())
+
+            self._write_partition(partition_path=partition_path, tables=tables)
+
+            for snapshot in snapshots:
+                os.remove(self.snapshot_path(snapshot))
+                compacted[snapshot] = partition_path
+
+        return compacted
+
+    def _write_partition(self, partition_path: str, tables: typing.List[pandas.DataFrame]):
+        # empty tables have no inferred column types, so they would turn the merged columns into objects
+        non_empty_tables = [table for table in tables if len(table) > 0]
+        if len(non_empty_tables) > 0:
+            tables = non_empty_tables
+
+        data_frame = pandas.concat(tables, ignore_index=True)
+        profile = self._writer_profile
+        data_frame = profile.sort(data_frame, sort_by=[SNAPSHOT_COLUMN, *(profile.sort_by or ["id", "timestamp"])])
+        table = pyarrow.Table.from_pandas(data_frame, preserve_index=False)
+
+        # one row group per snapshot at least, so the snapshot statistics of row groups don't overlap
+        snapshot_bounds = numpy.flatnonzero(numpy.diff(data_frame[SNAPSHOT_COLUMN].to_numpy())) + 1
+        bounds = [0, *snapshot_bounds, len(table)]
+
+        def _write(path: str):
+            with pq.ParquetWriter(path, table.schema, **profile.writer_options(table.column_names)) as writer:
+                for start, end in zip(bounds[:-1], bounds[1:]):
+                    writer.write_table(table.slice(start, end - start), row_group_size=profile.row_group_size)
+
+        os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+        write_atomic(partition_path, _write)
@@ -22,3 +22,7 @@ class BaseTileLoader:
             Loaded precipitation data
         """
         raise NotImplementedError(f"Have to be overriden in {self.__class__.__name__}")
+
+    def close(self):
+        """Releases files of the loader. Tiles can be loaded after it, the files are opened again"""
+        pass
@@ -1,10 +1,40 @@
 import argparse
-from metrics.parse.parse import parse
+from metrics.io.arrow_cache import ARROW_CACHE_COMPRESSIONS, DEFAULT_ARROW_CACHE_COMPRESSION
+from metrics.parse.cache import cache
+from metrics.parse.compact import compact
+from metrics.parse.parse import DEFAULT_MEMBERS_PER_JOB, parse
+from metrics.parse.retention import RetentionPolicy, parse_vendor_quotas, retain
+from metrics.parse.rollup import rollup
+from metrics.utils.parquet import PARQUET_PROFILES, DEFAULT_PARQUET_PROFILE, get_parquet_profile
 
 
 def _run_parse(args: argparse.Namespace):
+    writer_profile = get_parquet_profile(args.parquet_profile)
     parse(session_path=args.session_path,
-          process_num=args.process_num)
+          process_num=args.process_num,
+          members_per_job=args.members_per_job,
+          sensor_selection_path=args.filter_sensors_dir,
+          writer_profile=writer_profile)
+
+    # rollups are built from snapshot tables, so before they are compacted
+    if args.rollup:
+        rollup(session_path=args.session_path,
+               process_num=args.process_num,
+               writer_profile=writer_profile)
+
+    if args.compact:
+        compact(session_path=args.session_path, writer_profile=writer_profile)
+
+    policy = RetentionPolicy(drop_parsed_archives=args.drop_parsed_archives,
+                             vendor_quotas=parse_vendor_quotas(args.vendor_quota))
+    if policy.enabled:
+        retain(session_path=args.session_path, policy=policy, writer_profile=writer_profile)
+
+    # the cache follows the final layout of the tables
+    if args.arrow_cache is not None:
+        cache(session_path=args.session_path,
+              process_num=args.process_num,
+              compression=args.arrow_cache)
 
 
 if __name__ == "__main__":
@@ -15,10 +45,42 @@ if __name__ == "__main__":
     common = parser.add_argument_group("Common parameters")
     common.add_argument("--process-num", type=int, dest="process_num", default=None, required=False,
                         help="Number of processes for multiprocessing")
+    common.add_argument("--members-per-job", type=int, dest="members_per_job", default=DEFAULT_MEMBERS_PER_JOB,
+                        required=False,
+                        help="Split archives with more members into chunks parsed in parallel")
 
     parser.add_argument("--session-path", type=str, dest="session_path", required=True,
                         help="Path to session")
 
+    parser.add_argument("--filter-sensors-dir", dest="filter_sensors_dir", type=str, default=None,
+                        help=("Path to a directory or a file with selected sensor id's. "
+                              "If this argument exists, then only sensors id's found in it would be parsed. "
+                              "Tables parsed with a selection don't contain other sensors"))
+
+    parser.add_argument("--compact", dest="compact", action="store_true", default=False,
+                        help="Move parsed snapshot tables into hourly partitions after parsing")
+
+    parser.add_argument("--drop-parsed-archives", dest="drop_parsed_archives", action="store_true", default=False,
+                        help=("Remove archives once their tables are verified by the parse manifest. "
+                              "Checkout doesn't download them again while they are unchanged"))
+
+    parser.add_argument("--vendor-quota", dest="vendor_quota", nargs="+", type=str, default=None,
+                        help=("Maximum size of archives and tables of a vendor as `<vendor>=<GB>`, "
+                              "the oldest snapshots are removed first"))
+
+    parser.add_argument("--rollup", dest="rollup", action="store_true", default=False,
+                        help=("Write 10-minute max rate rollups of forecast tables. "
+                              "Calc uses them when it groups by 10 minutes"))
+
+    parser.add_argument("--arrow-cache", dest="arrow_cache", type=str, nargs="?", default=None,
+                        const=DEFAULT_ARROW_CACHE_COMPRESSION, choices=ARROW_CACHE_COMPRESSIONS,
+                        help=("Write memory-mappable arrow copies of the tables with this compression "
+                              f"({DEFAULT_ARROW_CACHE_COMPRESSION} by default, lz4 trades read copies for disk space). "
+                              "`metrics.calc events --use-cache` reads them instead of parquet"))
+
+    parser.add_argument("--parquet-profile", dest="parquet_profile", type=str, default=DEFAULT_PARQUET_PROFILE,
+                        choices=list(PARQUET_PROFILES), help="Writer profile of the parsed tables")
+
     parser.set_defaults(func=_run_parse)
 
     args = parser.parse_args()
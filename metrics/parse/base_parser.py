@@ -4,36 +4,151 @@ import typing
 import zipfile
 
 from abc import abstractmethod
+from metrics.io import storage
+from metrics.utils.parquet import ParquetWriterProfile, get_parquet_profile
 
 
 class BaseParser:
     """Base class for raw observation/forecast parsing"""
 
-    def parse(self, input_archive_path: str, output_parquet_path: str):
+    # Version of the output table. Increase it when the parser output changes, so parsed tables are rebuilt
+    VERSION = 1
+
+    # Ids of the sensors to keep. All sensors are kept when `None`
+    _sensor_ids: typing.Optional[typing.Set[str]] = None
+
+    def parse(self, input_archive_path: str, output_parquet_path: str,
+              members: typing.Optional[typing.List[str]] = None,
+              sensor_ids: typing.Optional[typing.Set[str]] = None,
+              writer_profile: typing.Optional[ParquetWriterProfile] = None) -> int:
         """Converts data from raw format to parquet table
 
         Parameters
         ----------
         input_archive_path : str
-            Path to the input archive file
+            Path to the input archive file, local or `s3://` URI. Only the read members of remote archives
+            are downloaded
         output_parquet_path : str
             Path to the output parquet file
+        members : List[str] | None
+            Names of the archive members to parse. When `None`, every member with a parsable extension is parsed
+        sensor_ids : Set[str] | None
+            Ids of the sensors to keep. Members of other sensors are skipped without being read
+        writer_profile : ParquetWriterProfile | None
+            Profile of the output parquet file. The default profile is used if `None`
+
+        Returns
+        -------
+        int
+            Returns number of rows in the output table
         """
+        self._sensor_ids = sensor_ids
+
         rows = []
-        with zipfile.ZipFile(input_archive_path, "r") as zip_file:
+        with storage.open_file(input_archive_path) as file, zipfile.ZipFile(file, "r") as zip_file:
             zip_name = os.path.basename(input_archive_path)
             timestamp = int(zip_name.replace(".zip", ""))
 
-            for file_name in zip_file.namelist():
-                _, ext = os.path.splitext(file_name)
-                if self._should_parse_file_extension(ext):
-                    parsed_rows = self._parse_impl(timestamp=timestamp,
-                                                   file_name=file_name,
-                                                   data=zip_file.read(file_name))
-                    rows.extend(parsed_rows)
+            if members is None:
+                members = self._filter_members(zip_file.namelist())
+
+            for file_name in members:
+                parsed_rows = self._parse_impl(timestamp=timestamp,
+                                               file_name=file_name,
+                                               data=zip_file.read(file_name))
+                rows.extend(parsed_rows)
 
         data_frame = pandas.DataFrame(rows, columns=self._get_columns())
-        data_frame.to_parquet(output_parquet_path, compression="gzip")
+        (writer_profile or get_parquet_profile()).write(data_frame, output_parquet_path)
+
+        return len(data_frame)
+
+    def split_members(self, input_archive_path: str, chunk_size: int,
+                      sensor_ids: typing.Optional[typing.Set[str]] = None) -> typing.List[typing.List[str]]:
+        """Splits parsable members of the archive into chunks that can be parsed independently
+
+        Parameters
+        ----------
+        input_archive_path : str
+            Path to the input archive file
+        chunk_size : int
+            Maximum number of members in a chunk
+        sensor_ids : Set[str] | None
+            Ids of the sensors to keep
+
+        Returns
+        -------
+        List[List[str]]
+            Returns chunks of member names in the archive order
+        """
+        self._sensor_ids = sensor_ids
+
+        with storage.open_file(input_archive_path) as file, zipfile.ZipFile(file, "r") as zip_file:
+            members = self._filter_members(zip_file.namelist())
+
+        return [members[i:i + chunk_size] for i in range(0, len(members), chunk_size)]
+
+    @staticmethod
+    def merge_parts(part_parquet_paths: typing.List[str],
+                    output_parquet_path: str,
+                    writer_profile: typing.Optional[ParquetWriterProfile] = None) -> int:
+        """Merges tables produced from archive chunks into one parquet file
+
+        Parameters
+        ----------
+        part_parquet_paths : List[str]
+            Paths to the partial tables in the order of chunks
+        output_parquet_path : str
+            Path to the output parquet file
+        writer_profile : ParquetWriterProfile | None
+            Profile of the output parquet file. The default profile is used if `None`
+
+        Returns
+        -------
+        int
+            Returns number of rows in the output table
+        """
+        parts = [pandas.read_parquet(path) for path in part_parquet_paths]
+
+        # empty chunks have no inferred column types, so they would turn the merged columns into objects
+        non_empty_parts = [part for part in parts if len(part) > 0]
+        if len(non_empty_parts) > 0:
+            parts = non_empty_parts
+
+        data_frame = pandas.concat(parts, ignore_index=True)
+        (writer_profile or get_parquet_profile()).write(data_frame, output_parquet_path)
+
+        return len(data_frame)
+
+    def _filter_members(self, names: typing.List[str]) -> typing.List[str]:
+        """Returns names of the archive members that should be parsed"""
+        members = []
+        for name in names:
+            if not self._should_parse_file_extension(os.path.splitext(name)[1]):
+                continue
+
+            sensor_id = self._get_member_sensor_id(name)
+            if self._sensor_ids is not None and sensor_id is not None and sensor_id not in self._sensor_ids:
+                continue
+
+            members.append(name)
+
+        return members
+
+    def _get_member_sensor_id(self, file_name: str) -> typing.Optional[str]:
+        """Returns id of the sensor stored in the archive member
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file from archive
+
+        Returns
+        -------
+        str | None
+            Returns sensor id, or `None` if the member contains data of several sensors
+        """
+        return os.path.splitext(os.path.basename(file_name))[0]
 
     @abstractmethod
     def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
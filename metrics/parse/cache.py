@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import traceback
+
+from dataclasses import dataclass
+from metrics.io.arrow_cache import ArrowCache, DEFAULT_ARROW_CACHE_COMPRESSION
+from metrics.session import Session
+
+from rich.console import Console
+from rich.progress import Progress
+
+from typing import List, Optional
+
+console = Console()
+
+
+@dataclass
+class CacheJob:
+    cache: ArrowCache           # cache of the session
+    table_path: str             # path to the parquet table
+    compression: str = DEFAULT_ARROW_CACHE_COMPRESSION  # compression of the cached copy
+
+
+def _cache_process_impl(job: CacheJob) -> Optional[str]:
+    try:
+        job.cache.write(job.table_path, compression=job.compression)
+    except Exception:
+        return traceback.format_exc()
+
+    return None
+
+
+def _remove_orphans(tables_folder: str, cache: ArrowCache, cache_folder: str) -> int:
+    """Removes cached copies of tables that don't exist anymore, e.g. compacted snapshot tables"""
+    cached_paths = set()
+    for root, _, files in os.walk(tables_folder):
+        for file_name in files:
+            if file_name.endswith(".parquet"):
+                cached_paths.add(cache.cache_path(os.path.join(root, file_name)))
+
+    removed = 0
+    for root, _, files in os.walk(cache_folder):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            if path not in cached_paths:
+                os.remove(path)
+                removed += 1
+
+    return removed
+
+
+def cache(session_path: str,
+          process_num: Optional[int],
+          compression: str = DEFAULT_ARROW_CACHE_COMPRESSION) -> int:
+    """Writes arrow copies of all parsed tables of the session that have no up to date copy.
+    Calc loads the copies instead of parquet tables with `use_cache`
+
+    Parameters
+    ----------
+    session_path : str
+        Path to a session folder
+    process_num : int | None
+        Number of processes for multiprocessing
+    compression : str
+        Compression of the copies, one of `ARROW_CACHE_COMPRESSIONS`
+
+    Returns
+    -------
+    int
+        Returns number of written copies
+    """
+    console.log(f"Run cache command for {session_path}")
+    session = Session.create_from_folder(session_path=session_path)
+    table_cache = ArrowCache(tables_folder=session.tables_folder, cache_folder=session.cache_folder)
+
+    removed = _remove_orphans(tables_folder=session.tables_folder,
+                              cache=table_cache,
+                              cache_folder=session.cache_folder)
+    if removed > 0:
+        console.log(f"Removed {removed} cached tables without source")
+
+    jobs: List[CacheJob] = []
+    for root, _, files in os.walk(session.tables_folder):
+        for file_name in sorted(files):
+            table_path = os.path.join(root, file_name)
+            if file_name.endswith(".parquet") and not table_cache.is_fresh(table_path):
+                jobs.append(CacheJob(cache=table_cache, table_path=table_path, compression=compression))
+
+    if len(jobs) == 0:
+        console.log("Cache is up to date")
+        return 0
+
+    written = 0
+    with Progress(console=console) as progress:
+        task = progress.add_task("Cache tables", total=len(jobs))
+
+        with multiprocessing.Pool(processes=process_num) as pool:
+            for job, error in zip(jobs, pool.imap(_cache_process_impl, jobs)):
+                progress.advance(task)
+
+                if error is not None:
+                    console.log(f"[red]Failed[/red] caching {job.table_path}:\n{error}")
+                else:
+                    written += 1
+
+    console.log(f"Cached {written} of {len(jobs)} tables with {compression} compression")
+
+    return written
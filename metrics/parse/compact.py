@@ -0,0 +1,110 @@
+import os
+
+from metrics.data_vendor import BaseDataVendor, DataVendor
+from metrics.io.catalog import KIND_TABLE, SessionCatalog
+from metrics.io.table_store import TableStore
+from metrics.parse.manifest import ParseManifest
+from metrics.session import Session
+from metrics.utils.parquet import ParquetWriterProfile
+
+from rich.console import Console
+
+from typing import Dict, List, Optional
+
+console = Console()
+
+
+def compact_vendor(folder: str,
+                   vendor: str,
+                   manifest: ParseManifest,
+                   catalog: SessionCatalog,
+                   writer_profile: Optional[ParquetWriterProfile] = None,
+                   before: Optional[int] = None) -> Dict[int, str]:
+    """Moves parsed snapshot tables of the vendor into hourly partitions and records them in the manifest
+    and the catalog. The manifest is not saved. The folder is synced with the catalog only if it wasn't synced
+    before, otherwise only entries of the written partitions are replaced
+
+    Parameters
+    ----------
+    folder : str
+        Folder with tables of the vendor
+    vendor : str
+        Vendor folder name
+    manifest : ParseManifest
+        Parse manifest of the session
+    catalog : SessionCatalog
+        Catalog of the session
+    writer_profile : ParquetWriterProfile | None
+        Profile of the partition tables. The default profile is used if `None`
+    before : int | None
+        Only partitions that end before or at this timestamp are written, see :func:`TableStore.compact`
+
+    Returns
+    -------
+    Dict[int, str]
+        Returns path of the partition table for each compacted snapshot
+    """
+    store = TableStore(folder=folder, writer_profile=writer_profile)
+    compacted = store.compact(before=before)
+
+    snapshots_by_partition: Dict[str, List[int]] = {}
+    for snapshot, partition_path in compacted.items():
+        snapshots_by_partition.setdefault(partition_path, []).append(snapshot)
+
+    for partition_path, snapshots in snapshots_by_partition.items():
+        manifest.move_outputs(output_paths=[store.snapshot_path(snapshot) for snapshot in snapshots],
+                              table_path=partition_path)
+
+    if catalog.is_synced(kind=KIND_TABLE, vendor=vendor):
+        # only the written partitions and the moved tables are described again
+        moved_paths = [store.snapshot_path(snapshot) for snapshot in compacted]
+        catalog.sync_files(kind=KIND_TABLE, vendor=vendor, paths=list(snapshots_by_partition) + moved_paths)
+    else:
+        catalog.sync(kind=KIND_TABLE, vendor=vendor, folder=folder)
+
+    return compacted
+
+
+def compact(session_path: str,
+            providers: List[BaseDataVendor] = [v for v in DataVendor],
+            writer_profile: Optional[ParquetWriterProfile] = None) -> Dict[str, int]:
+    """Moves parsed snapshot tables into hourly partitions
+
+    Parameters
+    ----------
+    session_path : str
+        Path to a session folder
+    providers : List[BaseDataVendor]
+        Vendors to compact tables for
+    writer_profile : ParquetWriterProfile | None
+        Profile of the partition tables. The default profile is used if `None`
+
+    Returns
+    -------
+    Dict[str, int]
+        Returns number of compacted snapshots by vendor name
+    """
+    console.log(f"Run compact command for {session_path}")
+    session = Session.create_from_folder(session_path=session_path)
+    manifest = ParseManifest(folder=session.tables_folder)
+    catalog = SessionCatalog(session_path=session_path)
+
+    compacted_snapshots = {}
+    for provider in providers:
+        folder = os.path.join(session.tables_folder, provider.value)
+        if not os.path.isdir(folder):
+            continue
+
+        compacted = compact_vendor(folder=folder,
+                                   vendor=provider.value,
+                                   manifest=manifest,
+                                   catalog=catalog,
+                                   writer_profile=writer_profile)
+
+        console.log(f"Compacted {len(compacted)} {provider.name} snapshots into "
+                    f"{len(set(compacted.values()))} partitions")
+        compacted_snapshots[provider.name] = len(compacted)
+
+    manifest.save()
+
+    return compacted_snapshots
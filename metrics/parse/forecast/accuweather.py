@@ -4,10 +4,14 @@ import os
 import typing
 
 from metrics.parse.base_parser import BaseParser
+from metrics.utils.intervals import END_TIMESTAMP_COLUMN, INTERVAL_STEP
 from metrics.utils.precipitation import PrecipitationType
 
 
 class AccuWeatherParser(BaseParser):
+    """Writes a row per summary interval: the precipitation doesn't change from `timestamp` to `end_timestamp`"""
+
+    VERSION = 2
 
     def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
         """See :func:`~metrics.base_parser.BaseParser._parse_impl`"""
@@ -38,11 +42,10 @@ class AccuWeatherParser(BaseParser):
                         if precip_type_name == "SNOW":
                             precip_type = PrecipitationType.SNOW.value
 
-                    start_time = item["StartMinute"]
-                    end_time = item["EndMinute"] + 1
-                    for offset in range(start_time, end_time):
-                        rows.append((sensor_id, lon, lat, timestamp + offset * 60,
-                                    precip_rate, precip_prob, precip_type))
+                    start_time = timestamp + item["StartMinute"] * INTERVAL_STEP
+                    end_time = timestamp + (item["EndMinute"] + 1) * INTERVAL_STEP
+                    rows.append((sensor_id, lon, lat, start_time, end_time,
+                                 precip_rate, precip_prob, precip_type))
         return rows
 
     def _should_parse_file_extension(self, file_extension: str) -> bool:
@@ -51,4 +54,4 @@ class AccuWeatherParser(BaseParser):
 
     def _get_columns(self) -> typing.List[str]:
         """See :func:`~metrics.base_parser.BaseParser._get_columns`"""
-        return ["id", "lon", "lat", "timestamp", "precip_rate", "precip_prob", "precip_type"]
+        return ["id", "lon", "lat", "timestamp", END_TIMESTAMP_COLUMN, "precip_rate", "precip_prob", "precip_type"]
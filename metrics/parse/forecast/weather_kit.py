@@ -1,4 +1,5 @@
 
+import bisect
 import json
 import os
 import typing
@@ -7,11 +8,12 @@ from dataclasses import dataclass
 from dateutil.parser import isoparse
 
 from metrics.parse.base_parser import BaseParser
+from metrics.utils.intervals import END_TIMESTAMP_COLUMN, INTERVAL_STEP
 from rich.console import Console
 from metrics.utils.precipitation import PrecipitationType
 
 
-OutputRowType = typing.List[typing.Tuple[str, float, float, int, float, float, int]]
+OutputRowType = typing.List[typing.Tuple[str, float, float, int, int, float, float, int]]
 
 PROB_THRESHOLD = 0.7
 
@@ -47,6 +49,9 @@ class SummaryRange:
 
 
 class WeatherKitParser(BaseParser):
+    """Writes a row per run of minutes with the same forecast, from `timestamp` to `end_timestamp`"""
+
+    VERSION = 2
 
     def _parse_next_hour(self, sensor_id: str, forecast: dict) -> OutputRowType:
         """Parses `forecastNextHour` forecast from weather kit API response
@@ -72,10 +77,17 @@ class WeatherKitParser(BaseParser):
         # sort summeries by start time
         summaries = sorted(summaries, key=lambda item: item.start_time)
 
+        # summary of a minute is the first one that ends after it. Running maximum of end times is sorted
+        # and exceeds the minute first at the same summary, so it's found by a binary search
+        summary_ends: typing.List[float] = []
+        for item in summaries:
+            end_time = float("inf") if item.end_time is None else item.end_time
+            summary_ends.append(max(end_time, summary_ends[-1]) if len(summary_ends) > 0 else end_time)
+
         def _get_precip_type(timestamp: int) -> PrecipitationType:
-            for item in summaries:
-                if item.end_time is None or timestamp < item.end_time:
-                    return item.precip_type
+            index = bisect.bisect_right(summary_ends, timestamp)
+            if index < len(summaries):
+                return summaries[index].precip_type
 
             return PrecipitationType.UNKNOWN
 
@@ -92,7 +104,15 @@ class WeatherKitParser(BaseParser):
             elif precip_prob < PROB_THRESHOLD:
                 precip_rate = 0.0
 
-            result.append((sensor_id, lon, lat, timestamp, precip_rate, precip_prob, precip_type.value))
+            # extend the previous interval by the next minute with the same forecast
+            if len(result) > 0:
+                last = result[-1]
+                if last[4] == timestamp and last[5:] == (precip_rate, precip_prob, precip_type.value):
+                    result[-1] = (*last[:4], timestamp + INTERVAL_STEP, *last[5:])
+                    continue
+
+            result.append((sensor_id, lon, lat, timestamp, timestamp + INTERVAL_STEP,
+                           precip_rate, precip_prob, precip_type.value))
 
         return result
 
@@ -117,4 +137,4 @@ class WeatherKitParser(BaseParser):
 
     def _get_columns(self) -> typing.List[str]:
         """See :func:`~metrics.base_parser.BaseParser._get_columns`"""
-        return ["id", "lon", "lat", "timestamp", "precip_rate", "precip_prob", "precip_type"]
+        return ["id", "lon", "lat", "timestamp", END_TIMESTAMP_COLUMN, "precip_rate", "precip_prob", "precip_type"]
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import threading
+import typing
+
+from dataclasses import asdict, dataclass
+from metrics.io import storage
+from metrics.utils.file import write_atomic
+
+MANIFEST_FILE_NAME = "parse_manifest.jsonl"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+@dataclass
+class ManifestEntry:
+    input_size: int             # size of the input archive in bytes
+    input_mtime: float          # modification time of the input archive
+    input_hash: str             # sha256 of the input archive
+    parser: str                 # name of the parser class
+    parser_version: int         # version of the parser
+    sensor_selection: typing.Optional[str]  # fingerprint of the sensor selection, `None` for all sensors
+    output_size: int            # size of the output parquet file in bytes
+    rows: int                   # number of rows in the output table
+    location: typing.Optional[str] = None  # table that stores the output after compaction, relative to the manifest
+
+
+def hash_file(path: str) -> str:
+    """Returns sha256 hex digest of the file content. Remote files are identified by their ETags,
+    so they aren't downloaded to be hashed
+    """
+    if storage.is_remote(path):
+        return f"etag:{storage.stat(path).etag}"
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def selection_fingerprint(sensor_ids: typing.Optional[typing.Iterable[str]]) -> typing.Optional[str]:
+    """Returns fingerprint of the sensor selection. Returns `None` when all sensors are selected"""
+    if sensor_ids is None:
+        return None
+
+    return hashlib.sha256("\n".join(sorted(sensor_ids)).encode()).hexdigest()
+
+
+class ParseManifest:
+    """Keeps track of parsed archives, so parse reruns process only new or changed archives.
+
+    Entries are appended to a JSON lines file as soon as an archive is parsed, so the progress survives
+    crashes. The latest entry of an output wins. :func:`save` rewrites the file with only the latest entries.
+    Entries can be updated from several threads, e.g. by the pipeline and its retention.
+    """
+
+    def __init__(self, folder: str):
+        """
+        Parameters
+        ----------
+        folder : str
+            Folder with parsed tables. Entries are stored by paths relative to this folder
+        """
+        self._folder = folder
+        self._path = os.path.join(folder, MANIFEST_FILE_NAME)
+        self._entries: typing.Dict[str, ManifestEntry] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(self._path):
+            with open(self._path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        self._entries[record["output"]] = ManifestEntry(**record["entry"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # line that wasn't completely written before a crash
+
+    def _key(self, output_path: str) -> str:
+        return os.path.relpath(output_path, self._folder)
+
+    def get(self, output_path: str) -> typing.Optional[ManifestEntry]:
+        """Returns entry of the output table or `None` if there is no entry for it"""
+        return self._entries.get(self._key(output_path))
+
+    def is_fresh(self,
+                 input_path: str,
+                 output_path: str,
+                 parser_class: typing.Any,
+                 sensor_selection: typing.Optional[str],
+                 record: bool = True) -> bool:
+        """Checks if the output table was produced from the current input archive with the same parser and selection
+
+        Parameters
+        ----------
+        input_path : str
+            Path to the input archive
+        output_path : str
+            Path to the output parquet file
+        parser_class : Any
+            Parser class that produces the table
+        sensor_selection : str | None
+            Fingerprint of the sensor selection
+        record : bool
+            Record the new modification time of an archive rewritten with the same content. The manifest
+            isn't changed if `False`
+
+        Returns
+        -------
+        bool
+            Returns `True` if the output table doesn't need to be parsed again. Input archive is hashed
+            only when its size or modification time differ from the recorded ones
+        """
+        entry = self.get(output_path)
+        if entry is None:
+            return False
+
+        if (entry.parser != parser_class.__name__
+                or entry.parser_version != parser_class.VERSION
+                or entry.sensor_selection != sensor_selection):
+            return False
+
+        table_path = output_path
+        if entry.location is not None:
+            table_path = os.path.join(self._folder, entry.location)
+
+        if not os.path.exists(table_path) or os.path.getsize(table_path) != entry.output_size:
+            return False
+
+        input_stat = storage.stat(input_path)
+        if input_stat is None:
+            return False
+
+        if input_stat.size == entry.input_size and input_stat.mtime == entry.input_mtime:
+            return True
+
+        if input_stat.size != entry.input_size or hash_file(input_path) != entry.input_hash:
+            return False
+
+        # archive was rewritten with the same content
+        if record:
+            entry.input_mtime = input_stat.mtime
+            self.update(output_path=output_path, entry=entry)
+        return True
+
+    def update(self, output_path: str, entry: ManifestEntry):
+        """Records entry of the output table"""
+        key = self._key(output_path)
+        with self._lock:
+            self._entries[key] = entry
+
+            os.makedirs(self._folder, exist_ok=True)
+            with open(self._path, "a") as file:
+                file.write(json.dumps({"output": key, "entry": asdict(entry)}) + "\n")
+
+    def move_outputs(self, output_paths: typing.List[str], table_path: str):
+        """Records that output tables were moved into another table, e.g. by compaction
+
+        Parameters
+        ----------
+        output_paths : List[str]
+            Paths of the moved output tables
+        table_path : str
+            Path of the table that stores them now. Sizes of all entries stored in it are updated.
+            Changes are persisted by :func:`save`
+        """
+        location = self._key(table_path)
+        moved_keys = set(self._key(path) for path in output_paths)
+        table_size = os.path.getsize(table_path)
+
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key in moved_keys or entry.location == location:
+                    entry.location = location
+                    entry.output_size = table_size
+
+    def remove_tables(self, table_paths: typing.Iterable[str]):
+        """Removes entries of the outputs stored in the tables, e.g. because the tables were evicted.
+        Changes are persisted by :func:`save`
+        """
+        keys = set(self._key(path) for path in table_paths)
+        with self._lock:
+            self._entries = {key: entry for key, entry in self._entries.items()
+                             if key not in keys and entry.location not in keys}
+
+    def save(self):
+        """Rewrites the manifest with only the latest entries"""
+        def _write(path: str):
+            with open(path, "w") as file:
+                for key, entry in self._entries.items():
+                    file.write(json.dumps({"output": key, "entry": asdict(entry)}) + "\n")
+
+        os.makedirs(self._folder, exist_ok=True)
+        with self._lock:
+            write_atomic(self._path, _write)
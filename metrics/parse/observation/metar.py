@@ -1,4 +1,6 @@
 import datetime
+import io
+import re
 import typing
 import xml.etree.ElementTree as xml
 
@@ -14,104 +16,210 @@ DEFAULT_PRECIP_RATE = 10.0
 
 console = Console()
 
+# Present weather group in the same form as `Metar.weather` items:
+# (intensity, description, precipitation, obscuration, other)
+WeatherGroup = typing.Tuple[str, typing.Optional[str], str, typing.Optional[str], typing.Optional[str]]
+
+# Canonical METAR body that can be classified without python-metar. Every group here is matched by exactly one
+# python-metar handler, in the same order as python-metar tries them, so the present weather groups it captures are
+# the ones python-metar would decode. Reports that don't fit (trends, recent weather, missing values, etc.)
+# go through python-metar.
+_FAST_REPORT_RE = re.compile(
+    r"""^((METAR|SPECI)\s)?(COR\s)?
+        [A-Z][A-Z0-9]{3}\s
+        (?P<day>\d\d)(?P<hour>\d\d)(?P<min>\d\d)Z\s
+        ((AUTO|COR)\s)?
+        (([0-2]\d0|3[0-6]0|VRB)\d\d\d?(G\d\d\d?)?(KT|MPS)\s)
+        (([0-2]\d0|3[0-6]0)V([0-2]\d0|3[0-6]0)\s)?
+        ((CAVOK|\d{4}(NDV)?|P?\d{1,2}SM|M?[1-9]/[1-9]\d?SM|[1-9]\s[1-9]/[1-9]SM)\s)?
+        (R\d\d[LRC]?/[MP]?\d{4}(V[MP]?\d{4})?(FT)?[UDN]?\s)*
+        (?P<weather>(((-|\+|VC)?(MI|PR|BC|DR|BL|SH|TS|FZ)?(DZ|RA|SN|SG|IC|PL|GR|GS|UP)*
+                      (BR|FG|FU|VA|DU|SA|HZ|PY)?(PO|SQ|FC|SS|DS)?)\s)*)
+        (((FEW|SCT|BKN|OVC)\d{3}(CB|TCU)?|VV\d{3}|CLR|SKC|NSC|NCD)\s)*
+        M?\d\d/(M?\d\d)?\s
+        [AQ]\d{4}\s
+        (NOSIG\s)?
+        (?P<remarks>RMKS?\s.*)?$""",
+    re.VERBOSE)
+
+# Remarks that python-metar converts into dates and that may fail on invalid values
+_FAST_REMARK_FALLBACK_RE = re.compile(r"(^|\s)(P[A-Z]\s+WND|WSHFT)\s")
+
 
 def to_date(timestamp: int) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(timestamp, datetime.UTC)
 
 
-class MetarParser(BaseParser):
+# Weather codes taken from here: https://www.weather.gov/media/wrh/mesowest/metar_decode_key.pdf
+def _is_rain(codes: WeatherGroup) -> bool:
+    has_rain = False
 
-    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
-        """See :func:`~metrics.base_parser.BaseParser._parse_impl`"""
+    # low drizzle
+    if "-" in codes and "DZ" in codes:
+        return has_rain
 
-        # Weather codes taken from here: https://www.weather.gov/media/wrh/mesowest/metar_decode_key.pdf
-        def _is_rain(codes: str) -> bool:
-            has_rain = False
+    rain_codes = ["DZ", "RA", "GR"]
+    for code in codes:
+        has_rain = has_rain or (code in rain_codes)
 
-            # low drizzle
-            if "-" in codes and "DZ" in codes:
-                return has_rain
+    return has_rain
 
-            rain_codes = ["DZ", "RA", "GR"]
-            for code in codes:
-                has_rain = has_rain or (code in rain_codes)
 
-            return has_rain
+def _is_snow(codes: WeatherGroup) -> bool:
+    has_snow = False
 
-        def _is_snow(codes: str) -> bool:
-            has_snow = False
+    snow_codes = ["SN", "GS", "SG", "SNINCR", "SP", "SW", "S"]
+    for code in codes:
+        has_snow = has_snow or (code in snow_codes)
 
-            snow_codes = ["SN", "GS", "SG", "SNINCR", "SP", "SW", "S"]
-            for code in codes:
-                has_snow = has_snow or (code in snow_codes)
+    return has_snow
 
-            return has_snow
 
-        def _should_skip_report(report: str) -> bool:
-            skip_criteria = ["RAB" in report,       # report with time offset
-                             report.endswith("$")]  # sensor is on maintenance
+def _should_skip_report(report: str) -> bool:
+    skip_criteria = ["RAB" in report,       # report with time offset
+                     report.endswith("$")]  # sensor is on maintenance
 
-            return any(skip_criteria)
+    return any(skip_criteria)
 
-        report_date = to_date(timestamp)
 
-        rows = []
-        # Load and parse the XML file
+def parse_weather_fast(raw_text: str, report_date: datetime.datetime) -> typing.Optional[typing.List[WeatherGroup]]:
+    """Extracts present weather groups from a raw METAR report without building a full `Metar.Metar` object
+
+    Parameters
+    ----------
+    raw_text : str
+        Raw METAR report
+    report_date : datetime.datetime
+        Date of the report archive. Its month and year are used to validate the observation time
+
+    Returns
+    -------
+    Optional[List[WeatherGroup]]
+        Returns present weather groups in the same form as `Metar.Metar.weather`.
+        Returns `None` when the report can't be classified and has to be parsed by python-metar
+    """
+    code = " ".join(raw_text.strip().rstrip("=").split()) + " "
+
+    match = _FAST_REPORT_RE.match(code)
+    if match is None:
+        return None
+
+    remarks = match.group("remarks")
+    if remarks is not None and _FAST_REMARK_FALLBACK_RE.search(remarks):
+        return None
+
+    try:
+        datetime.datetime(report_date.year, report_date.month,
+                          int(match.group("day")), int(match.group("hour")), int(match.group("min")))
+    except ValueError:
+        return None  # python-metar rejects the report, so let it produce the same result
+
+    weather = []
+    for group in match.group("weather").split():
+        d = Metar.WEATHER_RE.match(f"{group} ").groupdict()
+        intensity = d["int"]
+        if not intensity and d["int2"]:
+            intensity = d["int2"]
+        weather.append((intensity, d["desc"], d["prec"], d["obsc"], d["other"]))
+
+    return weather
+
+
+class MetarParser(BaseParser):
+
+    def __init__(self, use_fast_path: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        use_fast_path : bool
+            Extract present weather with a compiled tokenizer and use python-metar only for reports
+            that the tokenizer can't classify. When `False`, every report is parsed by python-metar
+        """
+        self._use_fast_path = use_fast_path
+
+    def _parse_weather(self, raw_text: str, report_date: datetime.datetime) -> typing.List[WeatherGroup]:
+        """Returns present weather groups of the report. Raises `Metar.ParserError` for reports that
+        python-metar can't parse
+        """
+        if self._use_fast_path:
+            weather = parse_weather_fast(raw_text=raw_text, report_date=report_date)
+            if weather is not None:
+                return weather
+
+        return Metar.Metar(raw_text, month=report_date.month, year=report_date.year).weather
+
+    def _parse_report(self, report: xml.Element, report_date: datetime.datetime) -> typing.Optional[typing.List[any]]:
+        """Converts `METAR` element into a table row. Returns `None` when the report should be skipped"""
         try:
-            tree = xml.fromstring(data)
-            for child in tree.iter("METAR"):
+            raw_text = report.find("raw_text")
+            if raw_text is None:
+                return None
 
-                try:
-                    raw_text = child.find("raw_text")
-                    if raw_text is None:
-                        continue
+            id = report.find("station_id").text
+            if self._sensor_ids is not None and id not in self._sensor_ids:
+                return None
 
-                    if _should_skip_report(raw_text.text):
-                        continue
+            if _should_skip_report(raw_text.text):
+                return None
 
-                    metar = Metar.Metar(raw_text.text, month=report_date.month, year=report_date.year)
+            weather = self._parse_weather(raw_text=raw_text.text, report_date=report_date)
 
-                    lon = float(child.find("longitude").text)
-                    lat = float(child.find("latitude").text)
-                    id = child.find("station_id").text
-                    obs_timestamp = self._parse_timestamp(child.find("observation_time").text)
+            lon = float(report.find("longitude").text)
+            lat = float(report.find("latitude").text)
+            obs_timestamp = self._parse_timestamp(report.find("observation_time").text)
 
-                    # check valid coordinates
-                    if not Coordinate(lon=lon, lat=lat).is_valid():
-                        continue
+            # check valid coordinates
+            if not Coordinate(lon=lon, lat=lat).is_valid():
+                return None
 
-                except Metar.ParserError as ex:
-                    # console.log(f"Metar.ParserError while parsing file {file_name}: {ex}")
-                    continue
-                except AttributeError as ex:
-                    # console.log(f"AttributeError while parsing file {file_name}: {ex}")
-                    continue
+        except Metar.ParserError:
+            return None
+        except AttributeError:
+            return None
 
-                has_rain = any(_is_rain(code) for code in metar.weather)
-                has_snow = any(_is_snow(code) for code in metar.weather)
+        has_rain = any(_is_rain(code) for code in weather)
+        has_snow = any(_is_snow(code) for code in weather)
 
-                pixel = coord_to_tile_pixel(coord=Coordinate(lon=lon, lat=lat),
-                                            zoom_level=ZOOM_LEVEL,
-                                            tile_size=TILE_SIZE)
+        pixel = coord_to_tile_pixel(coord=Coordinate(lon=lon, lat=lat),
+                                    zoom_level=ZOOM_LEVEL,
+                                    tile_size=TILE_SIZE)
 
-                precip_type = PrecipitationType.UNKNOWN.value
-                precip_rate = 0.0
-                if has_rain or has_snow:
-                    precip_rate = DEFAULT_PRECIP_RATE
+        precip_type = PrecipitationType.UNKNOWN.value
+        precip_rate = 0.0
+        if has_rain or has_snow:
+            precip_rate = DEFAULT_PRECIP_RATE
 
-                if has_rain and has_snow:
-                    precip_type = PrecipitationType.MIX.value
-                elif has_rain:
-                    precip_type = PrecipitationType.RAIN.value
-                elif has_snow:
-                    precip_type = PrecipitationType.SNOW.value
+        if has_rain and has_snow:
+            precip_type = PrecipitationType.MIX.value
+        elif has_rain:
+            precip_type = PrecipitationType.RAIN.value
+        elif has_snow:
+            precip_type = PrecipitationType.SNOW.value
 
-                rows.append([id, lon, lat, obs_timestamp, precip_rate,
-                             precip_type, pixel.px, pixel.py,
-                             pixel.tile_x, pixel.tile_y])
+        return [id, lon, lat, obs_timestamp, precip_rate,
+                precip_type, pixel.px, pixel.py,
+                pixel.tile_x, pixel.tile_y]
+
+    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
+        """See :func:`~metrics.base_parser.BaseParser._parse_impl`"""
+        report_date = to_date(timestamp)
+
+        rows = []
+        # Stream the XML file and drop every report as soon as it is converted
+        try:
+            for _, element in xml.iterparse(io.BytesIO(data), events=("end",)):
+                if element.tag != "METAR":
+                    continue
+
+                row = self._parse_report(report=element, report_date=report_date)
+                element.clear()
+
+                if row is not None:
+                    rows.append(row)
 
         except xml.ParseError as ex:
             console.log(f"xml.ParseError while parsing file {file_name}: {ex}")
+            rows = []  # malformed file doesn't produce rows, the same as when it is parsed as a whole
 
         return rows
 
@@ -119,6 +227,10 @@ class MetarParser(BaseParser):
         """See :func:`~metrics.base_parser.BaseParser._should_parse_file_extension`"""
         return file_extension == ".xml"
 
+    def _get_member_sensor_id(self, file_name: str) -> typing.Optional[str]:
+        """See :func:`~metrics.base_parser.BaseParser._get_member_sensor_id`"""
+        return None  # all stations are in one file, so they are filtered while parsing
+
     def _get_columns(self) -> typing.List[str]:
         """See :func:`~metrics.base_parser.BaseParser._get_columns`"""
         return ["id", "lon", "lat", "timestamp", "precip_rate", "precip_type", "px", "py", "tile_x", "tile_y"]
@@ -1,20 +1,31 @@
 import os
 import multiprocessing
+import traceback
+import zipfile
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
 from metrics.data_vendor import BaseDataVendor, DataVendor
 from metrics.parse import PROVIDERS_PARSERS
+from metrics.io import storage
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, SessionCatalog
 from metrics.parse.base_parser import BaseParser
+from metrics.parse.manifest import ManifestEntry, ParseManifest, hash_file, selection_fingerprint
+from metrics.io.table_store import snapshot_table_timestamp
 from metrics.session import Session
+from metrics.utils.parquet import ParquetWriterProfile
+from metrics.utils.sensors import read_selected_sensors
 
 from rich.console import Console
-from rich.progress import track
+from rich.progress import Progress
 
-from typing import Any, Dict, Optional, List, Tuple, Type
+from typing import Any, Dict, FrozenSet, Optional, List, Tuple, Type
 
 console = Console()
 
+# Archives with more parsable members are split into several jobs
+DEFAULT_MEMBERS_PER_JOB = 1000
+
 
 @dataclass
 class ParseSource:
@@ -26,58 +37,301 @@ class ParseSource:
 
 @dataclass
 class ParseJob:
+    vendor: str                 # name of the vendor
     input_archive_path: str     # path to the input archive file
     output_parquet_path: str    # path to the output parquet file
     parser_class: Any           # parser class
+    archive_size: int = 0       # size of the input archive in bytes
+    members: Optional[List[str]] = None  # archive members to parse, all parsable members if `None`
+    part_index: int = 0         # index of the archive chunk parsed by the job
+    parts_num: int = 1          # number of chunks the archive is split into
+    sensor_ids: Optional[FrozenSet[str]] = None  # ids of the sensors to keep, all sensors if `None`
+    sensor_selection: Optional[str] = None  # fingerprint of `sensor_ids`
+    writer_profile: Optional[ParquetWriterProfile] = None  # profile of the output table, the default if `None`
+
 
+@dataclass
+class ParseResult:
+    job: ParseJob               # finished job
+    error: Optional[str] = None  # formatted exception if the job failed
+    rows: int = 0               # number of parsed rows
+    input_size: int = 0         # size of the input archive when it was parsed
+    input_mtime: float = 0.0    # modification time of the input archive when it was parsed
+    input_hash: Optional[str] = None  # sha256 of the input archive, computed by the first chunk only
 
-def _parse_process_impl(parse_job: ParseJob):
-    parser: BaseParser = parse_job.parser_class()
-    parser.parse(input_archive_path=parse_job.input_archive_path,
-                 output_parquet_path=parse_job.output_parquet_path)
 
+def _part_parquet_path(parse_job: ParseJob) -> str:
+    return f"{parse_job.output_parquet_path}.part{parse_job.part_index}"
 
-def _execute_source_jobs(source_name: str,
-                         jobs: List[ParseJob],
-                         process_num: int):
-    with multiprocessing.Pool(processes=process_num) as pool:
-        for _ in track(pool.imap_unordered(_parse_process_impl, jobs),
-                       total=len(jobs),
-                       description=f"Parse {source_name}"):
-            pass
 
+def _parse_process_impl(parse_job: ParseJob) -> ParseResult:
+    output_parquet_path = parse_job.output_parquet_path
+    if parse_job.parts_num > 1:
+        output_parquet_path = _part_parquet_path(parse_job)
+
+    result = ParseResult(job=parse_job)
+    try:
+        # describe the input before parsing, so a concurrent rewrite of the archive makes the entry stale
+        if parse_job.part_index == 0:
+            input_stat = storage.stat(parse_job.input_archive_path)
+            if input_stat is None:
+                raise FileNotFoundError(parse_job.input_archive_path)
+
+            result.input_size = input_stat.size
+            result.input_mtime = input_stat.mtime
+            result.input_hash = hash_file(parse_job.input_archive_path)
+
+        parser: BaseParser = parse_job.parser_class()
+        result.rows = parser.parse(input_archive_path=parse_job.input_archive_path,
+                                   output_parquet_path=output_parquet_path,
+                                   members=parse_job.members,
+                                   sensor_ids=parse_job.sensor_ids,
+                                   writer_profile=parse_job.writer_profile)
+    except Exception:
+        result.error = traceback.format_exc()
+
+    return result
+
+
+def _record_result(manifest: ParseManifest, result: ParseResult):
+    job = result.job
+    manifest.update(output_path=job.output_parquet_path,
+                    entry=ManifestEntry(input_size=result.input_size,
+                                        input_mtime=result.input_mtime,
+                                        input_hash=result.input_hash,
+                                        parser=job.parser_class.__name__,
+                                        parser_version=job.parser_class.VERSION,
+                                        sensor_selection=job.sensor_selection,
+                                        output_size=os.path.getsize(job.output_parquet_path),
+                                        rows=result.rows))
+
+
+def _finish_parts(part_results: List[ParseResult]) -> ParseResult:
+    """Merges tables of archive chunks into the snapshot table and removes them.
+    Merging rewrites the whole table, so it runs in a pool worker like parsing
+
+    Parameters
+    ----------
+    part_results : List[ParseResult]
+        Results of all chunk jobs of one archive
+
+    Returns
+    -------
+    ParseResult
+        Returns result of the whole archive
+    """
+    part_results = sorted(part_results, key=lambda result: result.job.part_index)
+    snapshot_job = replace(part_results[0].job, members=None, part_index=0, parts_num=1)
+    part_paths = [_part_parquet_path(result.job) for result in part_results]
+
+    first_part = part_results[0]
+    result = replace(first_part, job=snapshot_job, rows=0)
+
+    errors = [result.error for result in part_results if result.error is not None]
+    if len(errors) == 0:
+        try:
+            result.rows = snapshot_job.parser_class.merge_parts(part_parquet_paths=part_paths,
+                                                                output_parquet_path=snapshot_job.output_parquet_path,
+                                                                writer_profile=snapshot_job.writer_profile)
+        except Exception:
+            errors.append(traceback.format_exc())
+
+    for path in part_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    result.error = "\n".join(errors) if len(errors) > 0 else None
+    return result
 
-def _process_source(source: ParseSource, process_num: int):
-    # collect archives
-    collected_archives = []
-    for root, _, files in os.walk(source.input_folder):
-        for file in files:
-            if file.endswith(".zip"):
-                collected_archives.append(os.path.join(root, file))
 
-        os.makedirs(source.output_folder, exist_ok=True)
-        if len(collected_archives) > 0:
-            jobs = []
-            for zip_path in collected_archives:
-                file_name, _ = os.path.splitext(os.path.basename(zip_path))
-                output_file = os.path.join(source.output_folder, f"{file_name}.parquet")
+def _execute_jobs(jobs: List[ParseJob],
+                  process_num: Optional[int],
+                  manifest: Optional[ParseManifest] = None) -> List[ParseResult]:
+    """Runs parse jobs of all vendors in a single process pool
 
-                if os.path.exists(output_file):
+    Parameters
+    ----------
+    jobs : List[ParseJob]
+        Jobs to run. They are dispatched to workers in the list order
+    process_num : int | None
+        Number of processes for multiprocessing
+    manifest : ParseManifest | None
+        Manifest to record parsed archives in
+
+    Returns
+    -------
+    List[ParseResult]
+        Results of all archives. Chunk jobs of an archive are reported as one result
+    """
+    jobs_per_vendor: Dict[str, int] = {}
+    for job in jobs:
+        jobs_per_vendor[job.vendor] = jobs_per_vendor.get(job.vendor, 0) + 1
+
+    results = []
+
+    def _finish(result: ParseResult):
+        if result.error is not None:
+            console.log(f"[red]Error:[/red] wasn't able to parse {result.job.input_archive_path}")
+        elif manifest is not None:
+            _record_result(manifest=manifest, result=result)
+
+        results.append(result)
+
+    pending_parts: Dict[str, List[ParseResult]] = {}
+    merges = []
+    with Progress(console=console) as progress:
+        tasks = {vendor: progress.add_task(f"Parse {vendor}", total=count)
+                 for vendor, count in jobs_per_vendor.items()}
+
+        with multiprocessing.Pool(processes=process_num) as pool:
+            for result in pool.imap_unordered(_parse_process_impl, jobs):
+                progress.advance(tasks[result.job.vendor])
+
+                if result.job.parts_num == 1:
+                    _finish(result)
                     continue
 
-                jobs.append(ParseJob(input_archive_path=zip_path,
-                                     output_parquet_path=output_file,
-                                     parser_class=source.parser_class))
+                parts = pending_parts.setdefault(result.job.output_parquet_path, [])
+                parts.append(result)
+                if len(parts) == result.job.parts_num:
+                    merges.append(pool.apply_async(_finish_parts,
+                                                   (pending_parts.pop(result.job.output_parquet_path),)))
+
+            for merge in merges:
+                _finish(merge.get())
+
+    return results
+
+
+def _collect_archive_jobs(source: ParseSource,
+                          zip_path: str,
+                          members_per_job: Optional[int] = None,
+                          sensor_ids: Optional[FrozenSet[str]] = None,
+                          sensor_selection: Optional[str] = None,
+                          manifest: Optional[ParseManifest] = None,
+                          writer_profile: Optional[ParquetWriterProfile] = None) -> List[ParseJob]:
+    """Returns jobs that parse the archive of the source, no jobs if its parsed table is up to date.
+    `sensor_selection` is the fingerprint of `sensor_ids`, it's computed once per run by the caller.
+    Other parameters are the same as of :func:`_collect_source_jobs`
+    """
+    file_name, _ = os.path.splitext(os.path.basename(zip_path))
+    output_file = os.path.join(source.output_folder, f"{file_name}.parquet")
+
+    if manifest is None:
+        if os.path.exists(output_file):
+            return []
+    elif manifest.is_fresh(input_path=zip_path,
+                           output_path=output_file,
+                           parser_class=source.parser_class,
+                           sensor_selection=sensor_selection):
+        return []
+
+    job = ParseJob(vendor=source.vendor,
+                   input_archive_path=zip_path,
+                   output_parquet_path=output_file,
+                   parser_class=source.parser_class,
+                   archive_size=storage.getsize(zip_path),
+                   sensor_ids=sensor_ids,
+                   sensor_selection=sensor_selection,
+                   writer_profile=writer_profile)
+
+    chunks = []
+    if members_per_job is not None:
+        try:
+            chunks = source.parser_class().split_members(input_archive_path=zip_path,
+                                                         chunk_size=members_per_job,
+                                                         sensor_ids=sensor_ids)
+        except (OSError, zipfile.BadZipFile):
+            pass  # broken archive is reported by the parse job
+
+    if len(chunks) > 1:
+        return [replace(job, members=members, part_index=index, parts_num=len(chunks))
+                for index, members in enumerate(chunks)]
 
-            _execute_source_jobs(source_name=source.vendor,
-                                 jobs=jobs,
-                                 process_num=process_num)
+    return [job]
+
+
+def _collect_source_jobs(source: ParseSource,
+                         members_per_job: Optional[int] = None,
+                         sensor_ids: Optional[FrozenSet[str]] = None,
+                         manifest: Optional[ParseManifest] = None,
+                         writer_profile: Optional[ParquetWriterProfile] = None) -> List[ParseJob]:
+    """Collects archives of the source that have no up to date parsed table
+
+    Parameters
+    ----------
+    source : ParseSource
+        Source to collect archives from
+    members_per_job : int | None
+        Maximum number of archive members parsed by one job. Larger archives are split into
+        several jobs. When `None`, every archive is parsed by a single job
+    sensor_ids : FrozenSet[str] | None
+        Ids of the sensors to keep. All sensors are kept when `None`
+    manifest : ParseManifest | None
+        Manifest of parsed archives. Archives with a fresh manifest entry are skipped.
+        When `None`, archives are skipped if their table exists
+    writer_profile : ParquetWriterProfile | None
+        Profile of the output tables. The default profile is used if `None`
+
+    Returns
+    -------
+    List[ParseJob]
+        Returns parse jobs for collected archives
+    """
+    os.makedirs(source.output_folder, exist_ok=True)
+    sensor_selection = selection_fingerprint(sensor_ids)
+
+    jobs = []
+    for root, _, files in storage.walk(source.input_folder):
+        for file in files:
+            if not file.endswith(".zip"):
+                continue
+
+            jobs.extend(_collect_archive_jobs(source=source,
+                                              zip_path=os.path.join(root, file),
+                                              members_per_job=members_per_job,
+                                              sensor_ids=sensor_ids,
+                                              sensor_selection=sensor_selection,
+                                              manifest=manifest,
+                                              writer_profile=writer_profile))
+
+    return jobs
+
+
+def _sync_catalog(catalog: SessionCatalog, sources: List[ParseSource]):
+    """Lists archives and tables of the sources in the session catalog"""
+    for source in sources:
+        catalog.sync(kind=KIND_ARCHIVE, vendor=os.path.basename(source.input_folder), folder=source.input_folder)
+        catalog.sync(kind=KIND_TABLE, vendor=os.path.basename(source.output_folder), folder=source.output_folder)
+
+
+def _parse_sources(session: Session,
+                   providers: List[BaseDataVendor],
+                   providers_parser: Dict[BaseDataVendor, BaseParser]) -> List[ParseSource]:
+    """Returns sources of the providers that have parsers"""
+    sources: List[ParseSource] = []
+    for provider in providers:
+        parser_cls = providers_parser.get(provider)
+        if parser_cls is not None:
+            input_path = os.path.join(session.data_folder, provider.value)
+            output_path = os.path.join(session.tables_folder, provider.value)
+            sources.append(ParseSource(vendor=provider.name,
+                                       input_folder=input_path,
+                                       output_folder=output_path,
+                                       parser_class=parser_cls))
+        else:
+            console.log(f"No parser class found for provider {provider}")
+
+    return sources
 
 
 def parse(session_path: str,
           process_num: Optional[int],
           providers: List[BaseDataVendor] = [v for v in DataVendor],
-          providers_parser: Dict[BaseDataVendor, BaseParser] = PROVIDERS_PARSERS):
+          providers_parser: Dict[BaseDataVendor, BaseParser] = PROVIDERS_PARSERS,
+          members_per_job: Optional[int] = DEFAULT_MEMBERS_PER_JOB,
+          sensor_selection_path: Optional[str] = None,
+          writer_profile: Optional[ParquetWriterProfile] = None) -> List[ParseResult]:
     """Parses data into common parquet format
 
     Parameters
@@ -86,6 +340,19 @@ def parse(session_path: str,
         Path to a session folder
     process_num : int | None
         Number of processes for multiprocessing
+    members_per_job : int | None
+        Maximum number of archive members parsed by one process. Archives with more members are split
+        into chunks that are parsed in parallel and merged into one table per snapshot. `None` disables splitting
+    sensor_selection_path : str | None
+        Path to the sensor selection in any format supported by `read_selected_sensors`.
+        When specified, only the selected sensors are parsed
+    writer_profile : ParquetWriterProfile | None
+        Profile of the output tables. The default profile is used if `None`
+
+    Returns
+    -------
+    List[ParseResult]
+        Returns results of the jobs that failed
     """
     console.log(f"Run parse command for {session_path}")
 
@@ -94,21 +361,54 @@ def parse(session_path: str,
     console.log(session)
 
     output_folder = session.tables_folder
+    if storage.is_remote(output_folder):
+        raise ValueError(f"Tables are written into a local folder, but the session tables folder is {output_folder}")
     os.makedirs(output_folder, exist_ok=True)
 
-    convert_sources: List[ParseSource] = []
-    for provider in providers:
-        parser_cls = providers_parser.get(provider)
-        if parser_cls is not None:
-            input_path = os.path.join(session.data_folder, provider.value)
-            output_path = os.path.join(session.tables_folder, provider.value)
-            convert_sources.append(ParseSource(vendor=provider.name,
-                                               input_folder=input_path,
-                                               output_folder=output_path,
-                                               parser_class=parser_cls))
-        else:
-            console.log(f"No parser class found for provider {provider}")
+    convert_sources = _parse_sources(session=session, providers=providers, providers_parser=providers_parser)
+
+    sensor_ids = None
+    if sensor_selection_path is not None:
+        selected_sensors = read_selected_sensors(sensor_selection_path)
+        if len(selected_sensors) > 0:
+            sensor_ids = frozenset(selected_sensors["id"].astype(str))
+            console.log(f"Parse {len(sensor_ids)} selected sensors from {sensor_selection_path}")
 
+    manifest = ParseManifest(folder=session.tables_folder)
+
+    jobs: List[ParseJob] = []
+    for source in convert_sources:
+        jobs.extend(_collect_source_jobs(source=source,
+                                         members_per_job=members_per_job,
+                                         sensor_ids=sensor_ids,
+                                         manifest=manifest,
+                                         writer_profile=writer_profile))
+
+    catalog = SessionCatalog(session_path=session_path)
+
+    if len(jobs) == 0:
+        manifest.save()
+        _sync_catalog(catalog=catalog, sources=convert_sources)
+        console.log("Nothing to parse")
+        return []
+
+    # the largest archives go first, so the tail of the run consists of small jobs from any vendor
+    jobs = sorted(jobs, key=lambda job: job.archive_size, reverse=True)
+
+    results = _execute_jobs(jobs=jobs, process_num=process_num, manifest=manifest)
+    manifest.save()
+
+    # rollups of parsed again tables are outdated
     for source in convert_sources:
-        _process_source(source=source,
-                        process_num=process_num)
+        catalog.remove_rollups(vendor=os.path.basename(source.output_folder),
+                               snapshots=[snapshot_table_timestamp(result.job.output_parquet_path)
+                                          for result in results if result.job.vendor == source.vendor])
+    _sync_catalog(catalog=catalog, sources=convert_sources)
+
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        console.log(f"[red]Failed[/red] {result.job.vendor} {result.job.input_archive_path}:\n{result.error}")
+
+    console.log(f"Parsed {len(results) - len(failed)} of {len(results)} archives")
+
+    return failed
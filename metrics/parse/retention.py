@@ -0,0 +1,284 @@
+import os
+import threading
+import typing
+
+from dataclasses import dataclass, field
+from metrics.checkout.manifest import CheckoutManifest
+from metrics.data_vendor import BaseDataVendor, DataVendor
+from metrics.io import storage
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, CatalogEntry, SessionCatalog
+from metrics.parse import PROVIDERS_PARSERS
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.compact import compact_vendor
+from metrics.parse.manifest import ParseManifest
+from metrics.parse.parse import ParseSource, _parse_sources
+from metrics.session import Session
+from metrics.utils.parquet import ParquetWriterProfile
+
+from rich.console import Console
+
+console = Console()
+
+
+@dataclass
+class RetentionPolicy:
+    compact: bool = False               # move parsed snapshot tables into hourly partitions
+    drop_parsed_archives: bool = False  # remove archives whose tables are verified by the parse manifest
+    vendor_quotas: typing.Dict[str, int] = field(default_factory=dict)  # maximum bytes on disk by vendor folder name
+
+    @property
+    def enabled(self) -> bool:
+        return self.compact or self.drop_parsed_archives or len(self.vendor_quotas) > 0
+
+
+@dataclass
+class RetentionReport:
+    compacted: int = 0          # number of compacted snapshot tables
+    dropped: int = 0            # number of removed parsed archives
+    evicted: int = 0            # number of files removed to fit the vendor quotas
+    freed: int = 0              # bytes of the removed archives and tables
+
+
+def parse_vendor_quotas(values: typing.Optional[typing.List[str]]) -> typing.Dict[str, int]:
+    """Returns quotas in bytes by vendor folder name from `<vendor>=<GB>` command line values"""
+    quotas = {}
+    for value in values or []:
+        vendor, _, size = value.partition("=")
+        if vendor not in [vendor.value for vendor in DataVendor] or len(size) == 0:
+            raise ValueError(f"Vendor quota should be `<vendor>=<GB>`, got `{value}`")
+        quotas[vendor] = int(float(size) * 1024 ** 3)
+
+    return quotas
+
+
+class Retention:
+    """Keeps a long-lived session within its disk budget.
+
+    Parsed snapshot tables are compacted into hourly partitions, archives are removed once the parse manifest
+    verifies that their tables were parsed from them, and the oldest archives and tables of a vendor are removed
+    while the vendor takes more than its quota. Dropped archives are recorded in the checkout manifest, so
+    checkout doesn't download them again. A run touches only snapshots before `before`, so it can go on
+    while newer snapshots are downloaded, parsed and calculated
+    """
+
+    def __init__(self,
+                 session: Session,
+                 policy: RetentionPolicy,
+                 parse_sources: typing.List[ParseSource],
+                 manifest: typing.Optional[ParseManifest] = None,
+                 writer_profile: typing.Optional[ParquetWriterProfile] = None):
+        """
+        Parameters
+        ----------
+        session : Session
+            Session to retain
+        policy : RetentionPolicy
+            What to do with parsed archives and tables
+        parse_sources : List[ParseSource]
+            Vendors with parsers. Archives of other vendors are never dropped, calc reads them as they are
+        manifest : ParseManifest | None
+            Parse manifest shared with a running parse. It's loaded from the session if `None`
+        writer_profile : ParquetWriterProfile | None
+            Profile of the partition tables. The default profile is used if `None`
+        """
+        self._session = session
+        self._policy = policy
+        self._sources = parse_sources
+        self._manifest = manifest or ParseManifest(folder=session.tables_folder)
+        self._writer_profile = writer_profile
+        self._catalog = SessionCatalog(session_path=session.path)
+
+        # held while tables are moved and removed, so the catalog isn't synced with a changing folder
+        self.lock = threading.Lock()
+
+    def run(self, before: typing.Optional[int] = None) -> RetentionReport:
+        """Applies the policy to the snapshots before the timestamp, or to all snapshots if `None`"""
+        report = RetentionReport()
+        with self.lock:
+            for source in self._sources:
+                vendor = os.path.basename(source.output_folder)
+                if self._policy.compact and os.path.isdir(source.output_folder):
+                    report.compacted += len(compact_vendor(folder=source.output_folder,
+                                                           vendor=vendor,
+                                                           manifest=self._manifest,
+                                                           catalog=self._catalog,
+                                                           writer_profile=self._writer_profile,
+                                                           before=before))
+
+                if self._policy.drop_parsed_archives and os.path.isdir(source.input_folder):
+                    self._sync(kind=KIND_ARCHIVE, vendor=vendor, folder=source.input_folder, before=before)
+                    self._drop_parsed_archives(source=source, vendor=vendor, before=before, report=report)
+
+            for vendor, quota in self._policy.vendor_quotas.items():
+                self._evict(vendor=vendor, quota=quota, before=before, report=report)
+
+            self._manifest.save()
+
+        if report.compacted + report.dropped + report.evicted > 0:
+            console.log(f"Retention: {report.compacted} tables compacted, {report.dropped} parsed archives dropped, "
+                        f"{report.evicted} files evicted, {report.freed / 1024 ** 2:.1f} MB freed")
+
+        return report
+
+    def _sync(self, kind: str, vendor: str, folder: str, before: typing.Optional[int]):
+        # a run with `before` follows the syncs of the pipeline, which list all snapshots before it
+        if before is None or not self._catalog.is_synced(kind=kind, vendor=vendor):
+            self._catalog.sync(kind=kind, vendor=vendor, folder=folder)
+
+    def _drop_parsed_archives(self,
+                              source: ParseSource,
+                              vendor: str,
+                              before: typing.Optional[int],
+                              report: RetentionReport):
+        checkout_manifest = CheckoutManifest(folder=source.input_folder)
+        dropped = []
+        for entry in self._catalog.list(kind=KIND_ARCHIVE,
+                                        vendor=vendor,
+                                        time_range=None if before is None else (0, before - 1)):
+            archive_path = self._catalog.full_path(entry)
+            table_path = os.path.join(source.output_folder, f"{entry.snapshot}.parquet")
+            parsed = self._manifest.get(table_path)
+            # the table was parsed from this very archive by the current parser, whatever the sensor selection
+            if parsed is None or not self._manifest.is_fresh(input_path=archive_path,
+                                                             output_path=table_path,
+                                                             parser_class=source.parser_class,
+                                                             sensor_selection=parsed.sensor_selection):
+                continue
+
+            # archives that checkout doesn't know would be downloaded again
+            if not checkout_manifest.drop(archive_path):
+                continue
+
+            os.remove(archive_path)
+            dropped.append(entry)
+            report.freed += entry.size
+
+        self._catalog.remove(dropped)
+        report.dropped += len(dropped)
+
+    def _evict(self, vendor: str, quota: int, before: typing.Optional[int], report: RetentionReport):
+        for kind, folder in [(KIND_ARCHIVE, self._session.data_folder), (KIND_TABLE, self._session.tables_folder)]:
+            if os.path.isdir(os.path.join(folder, vendor)):
+                self._sync(kind=kind, vendor=vendor, folder=os.path.join(folder, vendor), before=before)
+
+        # a partition table is listed once per snapshot, it's removed with its last snapshot
+        files: typing.Dict[str, typing.List[CatalogEntry]] = {}
+        for kind in [KIND_ARCHIVE, KIND_TABLE]:
+            for entry in self._catalog.list(kind=kind, vendor=vendor):
+                files.setdefault(self._catalog.full_path(entry), []).append(entry)
+
+        usage = sum(entries[0].size for entries in files.values())
+        if usage <= quota:
+            return
+
+        # the oldest snapshots go first, tables before their archives, so no table is left without its archive
+        candidates = sorted(files.items(), key=lambda item: (max(entry.snapshot for entry in item[1]),
+                                                             item[1][0].kind != KIND_TABLE))
+        checkout_manifest = CheckoutManifest(folder=os.path.join(self._session.data_folder, vendor))
+        evicted = []
+        for path, entries in candidates:
+            if usage <= quota:
+                break
+            if storage.is_remote(path) or (before is not None and max(entry.snapshot for entry in entries) >= before):
+                continue
+
+            # evicted archives are recorded like dropped ones, so checkout doesn't download them again
+            if entries[0].kind == KIND_ARCHIVE:
+                checkout_manifest.drop(path)
+            if os.path.exists(path):
+                os.remove(path)
+            usage -= entries[0].size
+            report.freed += entries[0].size
+            report.evicted += 1
+            evicted.extend(entries)
+
+        self._catalog.remove(evicted)
+
+        # the parse manifest doesn't keep entries of the removed tables
+        self._manifest.remove_tables(self._catalog.full_path(entry) for entry in evicted if entry.kind == KIND_TABLE)
+
+        if usage > quota:
+            console.log(f"[yellow]`{vendor}` takes {usage / 1024 ** 2:.1f} MB, more than its quota of "
+                        f"{quota / 1024 ** 2:.1f} MB, newer snapshots are still in use[/yellow]")
+
+
+class RetentionWorker:
+    """Runs retention in a background thread. Requests that come while a run is in progress are merged
+    into the next run with the latest timestamp
+    """
+
+    def __init__(self, retention: Retention):
+        self._retention = retention
+        self._condition = threading.Condition()
+        self._before: typing.Optional[int] = None
+        self._requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, before: int):
+        """Requests a run over the snapshots before the timestamp"""
+        with self._condition:
+            self._before = before
+            self._requested = True
+            self._condition.notify()
+
+    def close(self):
+        """Waits for the requested run to finish and stops the thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._requested and not self._closed:
+                    self._condition.wait()
+
+                if not self._requested:
+                    return
+
+                before = self._before
+                self._requested = False
+
+            try:
+                self._retention.run(before=before)
+            except Exception as ex:
+                console.log(f"[red]Retention failed:[/red] {ex}")
+
+
+def retain(session_path: str,
+           policy: RetentionPolicy,
+           providers: typing.List[BaseDataVendor] = [v for v in DataVendor],
+           writer_profile: typing.Optional[ParquetWriterProfile] = None,
+           providers_parser: typing.Dict[BaseDataVendor, BaseParser] = PROVIDERS_PARSERS) -> RetentionReport:
+    """Applies the retention policy to all snapshots of the session
+
+    Parameters
+    ----------
+    session_path : str
+        Path to a session folder
+    policy : RetentionPolicy
+        What to do with parsed archives and tables
+    providers : List[BaseDataVendor]
+        Vendors to compact and drop archives of. Quotas apply to the vendors of the policy
+    writer_profile : ParquetWriterProfile | None
+        Profile of the partition tables. The default profile is used if `None`
+
+    Returns
+    -------
+    RetentionReport
+        Returns what was compacted and removed
+    """
+    console.log(f"Run retention for {session_path}")
+    session = Session.create_from_folder(session_path=session_path)
+
+    retention = Retention(session=session,
+                          policy=policy,
+                          parse_sources=_parse_sources(session=session,
+                                                       providers=[provider for provider in providers
+                                                                  if provider in providers_parser],
+                                                       providers_parser=providers_parser),
+                          writer_profile=writer_profile)
+    return retention.run()
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import pandas
+import traceback
+
+from dataclasses import dataclass
+from metrics.calc.rollup import ROLLUP_PERIOD, rollup_folder, rollup_table
+from metrics.data_vendor import BaseDataVendor, DataVendor
+from metrics.io.catalog import SessionCatalog, rollup_kind
+from metrics.io.table_store import TableStore
+from metrics.session import Session
+from metrics.utils.parquet import ParquetWriterProfile, get_parquet_profile
+
+from rich.console import Console
+from rich.progress import Progress
+
+from typing import Dict, List, Optional
+
+console = Console()
+
+# Forecast vendors with parsed tables. Observations and RainViewer tiles have no rollups
+ROLLUP_PROVIDERS = [v for v in DataVendor if v not in (DataVendor.Metar, DataVendor.RainViewer)]
+
+
+@dataclass
+class RollupJob:
+    vendor: str                 # name of the vendor
+    table_path: str             # path to the parsed snapshot table
+    rollup_path: str            # path to the output rollup table
+    period: int = ROLLUP_PERIOD  # bin size in seconds
+    writer_profile: Optional[ParquetWriterProfile] = None  # profile of the output table, the default if `None`
+
+
+@dataclass
+class RollupResult:
+    job: RollupJob              # finished job
+    error: Optional[str] = None  # formatted exception if the job failed
+
+
+def _rollup_process_impl(job: RollupJob) -> RollupResult:
+    result = RollupResult(job=job)
+    try:
+        table = pandas.read_parquet(job.table_path)
+        (job.writer_profile or get_parquet_profile()).write(rollup_table(table, period=job.period), job.rollup_path)
+    except Exception:
+        result.error = traceback.format_exc()
+
+    return result
+
+
+def _collect_rollup_jobs(tables_folder: str,
+                         provider: BaseDataVendor,
+                         period: int,
+                         writer_profile: Optional[ParquetWriterProfile] = None) -> List[RollupJob]:
+    """Collects snapshot tables of the vendor that have no rollup or have a rollup older than the table"""
+    store = TableStore(folder=os.path.join(tables_folder, provider.value))
+    output_folder = rollup_folder(tables_folder=tables_folder, data_vendor=provider, period=period)
+
+    jobs = []
+    for snapshot in store.list_snapshot_tables():
+        table_path = store.snapshot_path(snapshot)
+        rollup_path = os.path.join(output_folder, f"{snapshot}.parquet")
+        if os.path.exists(rollup_path) and os.path.getmtime(rollup_path) >= os.path.getmtime(table_path):
+            continue
+
+        jobs.append(RollupJob(vendor=provider.name,
+                              table_path=table_path,
+                              rollup_path=rollup_path,
+                              period=period,
+                              writer_profile=writer_profile))
+
+    if len(jobs) > 0:
+        os.makedirs(output_folder, exist_ok=True)
+
+    return jobs
+
+
+def _sync_catalog(session: Session, period: int, providers: List[BaseDataVendor]):
+    catalog = SessionCatalog(session_path=session.path)
+    for provider in providers:
+        catalog.sync(kind=rollup_kind(period),
+                     vendor=provider.value,
+                     folder=rollup_folder(tables_folder=session.tables_folder, data_vendor=provider, period=period))
+
+
+def rollup(session_path: str,
+           process_num: Optional[int],
+           period: int = ROLLUP_PERIOD,
+           providers: List[BaseDataVendor] = ROLLUP_PROVIDERS,
+           writer_profile: Optional[ParquetWriterProfile] = None) -> Dict[str, int]:
+    """Writes pre-binned forecast tables next to the parsed ones. Every rollup keeps the maximum precipitation rate
+    per sensor, time bin and precipitation type of one snapshot. Calc uses them instead of the parsed tables
+    when it groups by the same period
+
+    Parameters
+    ----------
+    session_path : str
+        Path to a session folder
+    process_num : int | None
+        Number of processes for multiprocessing
+    period : int
+        Bin size in seconds
+    providers : List[BaseDataVendor]
+        Forecast vendors to write rollups for
+    writer_profile : ParquetWriterProfile | None
+        Profile of the rollup tables. The default profile is used if `None`
+
+    Returns
+    -------
+    Dict[str, int]
+        Returns number of written rollups by vendor name
+    """
+    console.log(f"Run rollup command for {session_path}")
+    session = Session.create_from_folder(session_path=session_path)
+
+    jobs: List[RollupJob] = []
+    for provider in providers:
+        jobs.extend(_collect_rollup_jobs(tables_folder=session.tables_folder,
+                                         provider=provider,
+                                         period=period,
+                                         writer_profile=writer_profile))
+
+    written: Dict[str, int] = {}
+    if len(jobs) == 0:
+        _sync_catalog(session=session, period=period, providers=providers)
+        console.log("Nothing to roll up")
+        return written
+
+    with Progress(console=console) as progress:
+        task = progress.add_task(f"Roll up {period}s", total=len(jobs))
+
+        with multiprocessing.Pool(processes=process_num) as pool:
+            for result in pool.imap_unordered(_rollup_process_impl, jobs):
+                progress.advance(task)
+
+                if result.error is not None:
+                    console.log(f"[red]Failed[/red] rollup of {result.job.table_path}:\n{result.error}")
+                else:
+                    written[result.job.vendor] = written.get(result.job.vendor, 0) + 1
+
+    _sync_catalog(session=session, period=period, providers=providers)
+    console.log(f"Written {sum(written.values())} of {len(jobs)} rollups")
+
+    return written
@@ -0,0 +1,158 @@
+import argparse
+import os
+import sys
+
+from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo
+from metrics.checkout.engine import MAX_CONCURRENCY, RETRIES
+from metrics.checkout.multipart import PART_CONCURRENCY, PART_SIZE
+from metrics.data_vendor import DataVendor
+from metrics.parse.parse import DEFAULT_MEMBERS_PER_JOB
+from metrics.parse.retention import RetentionPolicy, parse_vendor_quotas
+from metrics.pipeline.pipeline import QUEUE_SIZE, run_pipeline
+from metrics.utils.parquet import PARQUET_PROFILES, DEFAULT_PARQUET_PROFILE, get_parquet_profile
+from metrics.utils.precipitation import PrecipitationType
+
+
+def _run_pipeline(args: argparse.Namespace):
+    forecasts = ForecastSourcesInfo(s3_uri_rainviewer=args.s3_uri_rainviewer,
+                                    s3_uri_wk=args.s3_uri_wk,
+                                    s3_uri_accuweather=args.s3_uri_accuweather,
+                                    s3_uri_tomorrowio=args.s3_uri_tomorrowio,
+                                    s3_uri_vaisala=args.s3_uri_vaisala,
+                                    s3_uri_rainbowai=args.s3_uri_rainbowai,
+                                    s3_uri_weathercompany=args.s3_uri_weathercompany)
+
+    observations = ObservationSourcesInfo(s3_uri_metar=args.s3_uri_metar_data)
+
+    output_folder = os.path.dirname(args.output_csv)
+    if len(output_folder) > 0:
+        os.makedirs(output_folder, exist_ok=True)
+
+    report = run_pipeline(start_time=args.start_time,
+                          end_time=args.end_time,
+                          session_path=args.session_path,
+                          forecasts_source=forecasts,
+                          observations_source=observations,
+                          forecast_vendor=DataVendor(args.forecast_vendor),
+                          observation_vendor=DataVendor(args.observation_vendor),
+                          forecast_offsets=[int(v) * 60 for v in args.offsets.split(" ")],
+                          threshold=args.threshold,
+                          precip_types=[PrecipitationType[t.upper()] for t in args.precip_types],
+                          output_csv=args.output_csv,
+                          observations_offset=args.observations_offset,
+                          forecast_range=args.forecast_range,
+                          sensor_selection_path=args.filter_sensors_dir,
+                          process_num=args.process_num,
+                          queue_size=args.queue_size,
+                          members_per_job=args.members_per_job,
+                          writer_profile=get_parquet_profile(args.parquet_profile),
+                          max_concurrency=args.max_concurrency,
+                          retries=args.retries,
+                          cache_folder=args.cache_dir,
+                          cache_size=None if args.cache_size is None else int(args.cache_size * 1024 ** 3),
+                          part_size=int(args.part_size * 1024 ** 2),
+                          part_concurrency=args.part_concurrency,
+                          retention=RetentionPolicy(compact=args.compact,
+                                                    drop_parsed_archives=args.drop_parsed_archives,
+                                                    vendor_quotas=parse_vendor_quotas(args.vendor_quota)))
+
+    if len(report.checkout.failed) > 0 or len(report.parse_failed) > 0 or report.calc_failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tool checks out, parses and calculates metrics of a session "
+                                                 "in one streaming run")
+
+    parser.add_argument("--session-path", type=str, dest="session_path", required=True,
+                        help="Path to directory where to download required files")
+    parser.add_argument("--start-time", type=int, dest="start_time", required=True,
+                        help="Start timestamp")
+    parser.add_argument("--end-time", type=int, dest="end_time", required=True,
+                        help="End timestamp")
+    parser.add_argument("--forecast-range", type=int, dest="forecast_range", required=False, default=7800,
+                        help="Forecast range in seconds")
+    parser.add_argument("--process-num", type=int, dest="process_num", default=None, required=False,
+                        help="Number of processes of each of the parse and calc pools")
+    parser.add_argument("--queue-size", type=int, dest="queue_size", default=QUEUE_SIZE, required=False,
+                        help="Maximum number of archives downloaded ahead of parsing")
+    parser.add_argument("--output-csv", type=str, dest="output_csv", required=True,
+                        help="Output CSV file. Metrics are written as a parquet table if it ends with `.parquet`")
+    parser.add_argument("--parquet-profile", dest="parquet_profile", type=str, default=DEFAULT_PARQUET_PROFILE,
+                        choices=list(PARQUET_PROFILES), help="Writer profile of the parsed and output tables")
+    parser.add_argument("--filter-sensors-dir", dest="filter_sensors_dir", type=str, default=None,
+                        help=("Path to a directory or a file with selected sensors. Only the selected sensors are "
+                              "parsed and compared, with `lon` and `lat` columns only their RainViewer tiles "
+                              "are fetched"))
+
+    checkout_group = parser.add_argument_group(title="Checkout")
+    checkout_group.add_argument("--max-concurrency", type=int, dest="max_concurrency", required=False,
+                                default=MAX_CONCURRENCY,
+                                help="Maximum number of S3 requests in flight across all sources")
+    checkout_group.add_argument("--retries", type=int, dest="retries", required=False, default=RETRIES,
+                                help="Number of retries of a failed S3 request with exponential backoff")
+    checkout_group.add_argument("--cache-dir", type=str, dest="cache_dir", required=False, default=None,
+                                help="Folder of the data cache shared by sessions")
+    checkout_group.add_argument("--cache-size", type=float, dest="cache_size", required=False, default=None,
+                                help="Maximum size of the data cache in GB")
+    checkout_group.add_argument("--part-size", type=float, dest="part_size", required=False,
+                                default=PART_SIZE / 1024 ** 2,
+                                help="Size of a part of large objects downloaded by ranged requests in MB")
+    checkout_group.add_argument("--part-concurrency", type=int, dest="part_concurrency", required=False,
+                                default=PART_CONCURRENCY,
+                                help="Maximum number of parts of one object downloaded in parallel")
+    checkout_group.add_argument("--s3-uri-metar-data", type=str, dest="s3_uri_metar_data", required=False,
+                                default=None, help="S3 uri where to get metar data")
+    checkout_group.add_argument("--s3-uri-rainviewer", type=str, dest="s3_uri_rainviewer", required=False,
+                                default=None, help="S3 uri where to get rainviewer forecast")
+    checkout_group.add_argument("--s3-uri-wk", type=str, dest="s3_uri_wk", required=False, default=None,
+                                help="S3 uri where to get weather kit forecast")
+    checkout_group.add_argument("--s3-uri-accuweather", type=str, dest="s3_uri_accuweather", required=False,
+                                default=None, help="S3 uri where to get accuweather forecast")
+    checkout_group.add_argument("--s3-uri-tomorrowio", type=str, dest="s3_uri_tomorrowio", required=False,
+                                default=None, help="S3 uri where to get tomorrow io forecast")
+    checkout_group.add_argument("--s3-uri-vaisala", type=str, dest="s3_uri_vaisala", required=False, default=None,
+                                help="S3 uri where to get vaisala forecast")
+    checkout_group.add_argument("--s3-uri-rainbowai", type=str, dest="s3_uri_rainbowai", required=False,
+                                default=None, help="S3 uri where to get rainbowai forecast")
+    checkout_group.add_argument("--s3-uri-weathercompany", type=str, dest="s3_uri_weathercompany", required=False,
+                                default=None, help="S3 uri where to get WeatherCompany forecast")
+
+    parse_group = parser.add_argument_group(title="Parse")
+    parse_group.add_argument("--members-per-job", type=int, dest="members_per_job", default=DEFAULT_MEMBERS_PER_JOB,
+                             required=False, help="Split archives with more members into chunks parsed in parallel")
+
+    retention_group = parser.add_argument_group(title="Retention",
+                                                description="Applied in the background to snapshots that calc "
+                                                            "moved past and to all snapshots at the end")
+    retention_group.add_argument("--compact", dest="compact", action="store_true", default=False,
+                                 help="Move parsed snapshot tables into hourly partitions")
+    retention_group.add_argument("--drop-parsed-archives", dest="drop_parsed_archives", action="store_true",
+                                 default=False,
+                                 help="Remove archives once their tables are verified by the parse manifest. "
+                                      "Checkout doesn't download them again while they are unchanged")
+    retention_group.add_argument("--vendor-quota", dest="vendor_quota", nargs="+", type=str, default=None,
+                                 help="Maximum size of archives and tables of a vendor as `<vendor>=<GB>`, "
+                                      "the oldest snapshots are removed first")
+
+    calc_group = parser.add_argument_group(title="Calc")
+    calc_group.add_argument("--forecast-vendor", dest="forecast_vendor", type=str, required=True,
+                            choices=[value.value for value in DataVendor],
+                            help="Data vendor to compare with sensors")
+    calc_group.add_argument("--observation-vendor", dest="observation_vendor", type=str, required=True,
+                            choices=[value.value for value in DataVendor],
+                            help="Sensors vendor to compare with data")
+    calc_group.add_argument("--offsets", type=str, default="0 10 20 30 40 50 60",
+                            help="List of offsets to calculate metrics")
+    calc_group.add_argument("--threshold", dest="threshold", type=float, default=0.1,
+                            help="Threshold in mm/h")
+    calc_group.add_argument("--precip-types", dest="precip_types", nargs="+", type=str,
+                            help="Precip types of precipitation event",
+                            choices=[t.name.lower() for t in PrecipitationType], default=["rain"])
+    calc_group.add_argument("--observations-offset", dest="observations_offset", type=int, default=0,
+                            required=False, help="Events window offset comparing to forecast")
+
+    parser.set_defaults(func=_run_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,517 @@
+import asyncio
+import collections
+import contextlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+import typing
+
+from dataclasses import dataclass, field, replace
+from metrics.calc.events import CalculateMetrics, JobParams, MetricsWriter, _process_time_range
+from metrics.checkout.checkout import forecast_download_tasks, rainviewer_selection, sensors_download_tasks
+from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo
+from metrics.checkout.engine import MAX_CONCURRENCY, RETRIES, CheckoutEngine, CheckoutReport, DownloadListener, \
+    DownloadTask
+from metrics.checkout.multipart import PART_CONCURRENCY, PART_SIZE
+from metrics.data_vendor import BaseDataVendor, DataVendor
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, SessionCatalog
+from metrics.io.data_cache import DataCache
+from metrics.parse import PROVIDERS_PARSERS
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.manifest import ParseManifest, selection_fingerprint
+from metrics.parse.parse import (DEFAULT_MEMBERS_PER_JOB, ParseJob, ParseResult, ParseSource, _collect_archive_jobs,
+                                 _finish_parts, _parse_process_impl, _parse_sources, _record_result)
+from metrics.parse.retention import Retention, RetentionPolicy, RetentionWorker
+from metrics.session import Session
+from metrics.utils.parquet import ParquetWriterProfile
+from metrics.utils.precipitation import PrecipitationType
+from metrics.utils.sensors import read_selected_sensors
+from metrics.utils.time import format_time
+from metrics.utils.time_measure import TimeMeasure
+from rich.console import Console
+
+console = Console()
+
+QUEUE_SIZE = 16     # maximum number of archives that are downloaded ahead of parsing
+
+EVENT_READY = "ready"           # archive is downloaded or resolved by the checkout
+EVENT_PARSED = "parsed"         # parse job is finished
+EVENT_CALCULATED = "calculated"  # calc job is finished
+EVENT_CHECKOUT = "checkout"     # checkout of all archives is finished
+EVENT_ERROR = "error"           # checkout failed
+
+
+@dataclass
+class PipelineReport:
+    checkout: CheckoutReport = field(default_factory=CheckoutReport)  # report of the checkout stage
+    parsed: int = 0             # number of parsed archives
+    parse_failed: typing.List[str] = field(default_factory=list)  # paths of archives that failed to parse
+    calculated: int = 0         # number of calculated time ranges
+    calc_failed: int = 0        # number of time ranges that failed to calculate
+
+
+def _archive_snapshot(file_path: str) -> typing.Tuple[str, int]:
+    """Returns vendor folder name and snapshot of the `<vendor>/<snapshot>.<ext>` archive"""
+    file_name, _ = os.path.splitext(os.path.basename(file_path))
+    return os.path.basename(os.path.dirname(file_path)), int(file_name)
+
+
+class SnapshotTracker:
+    """Snapshots that the pipeline expects but that aren't ready for calc yet. A snapshot is ready when
+    its archive is parsed, or is downloaded if the vendor has no parser, or doesn't exist.
+    Snapshots of vendors that aren't tracked are always ready
+    """
+
+    def __init__(self):
+        self._pending: typing.Dict[str, typing.Set[int]] = {}
+
+    def expect(self, vendor: str, snapshots: typing.Iterable[int]):
+        self._pending.setdefault(vendor, set()).update(snapshots)
+
+    def resolve(self, vendor: str, snapshot: int):
+        self._pending.get(vendor, set()).discard(snapshot)
+
+    def resolve_all(self):
+        self._pending.clear()
+
+    def is_ready(self, vendor: str, time_range: typing.Tuple[int, int]) -> bool:
+        """Checks if all snapshots of the vendor in the range, both ends included, are ready"""
+        return not any(time_range[0] <= snapshot <= time_range[1] for snapshot in self._pending.get(vendor, ()))
+
+
+class _ArchiveFeed(DownloadListener):
+    """Passes archives from the checkout thread to the pipeline. At most `queue_size` archives are downloaded
+    and not yet processed, the checkout waits for free slots. Freed slots go to the waiting archive with
+    the earliest snapshot, so vendors are downloaded side by side in time order as calc needs them,
+    instead of one task taking all slots
+    """
+
+    def __init__(self, events: queue.Queue, queue_size: int):
+        self._events = events
+        self._free = queue_size
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        # futures of the archives that wait for a slot by their snapshots
+        self._waiting: typing.List[typing.Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    async def reserve(self, file_path: str):
+        # futures belong to the event loop of the checkout, so it's taken there
+        self._loop = asyncio.get_running_loop()
+        if self._free > 0 and len(self._waiting) == 0:
+            self._free -= 1
+            return
+
+        future = self._loop.create_future()
+        heapq.heappush(self._waiting, (_archive_snapshot(file_path)[1], next(self._counter), future))
+        await future
+
+    async def ready(self, file_path: str, ok: bool):
+        self._events.put((EVENT_READY, file_path, ok))
+
+    def _release(self):
+        # the slot is handed over to the earliest waiting archive
+        while len(self._waiting) > 0:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self._free += 1
+
+    def release(self):
+        """Frees the slot of a processed archive, can be called from any thread"""
+        try:
+            self._loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # the checkout is finished and its loop is closed
+
+
+class Pipeline:
+    """Runs checkout, parse and calc of a session together, snapshot by snapshot.
+
+    Archives are parsed as soon as they are downloaded and a calc job starts as soon as all forecast and
+    observation snapshots of its time range are ready, so the stages overlap instead of waiting for each other.
+    The stages are connected by bounded queues: the checkout is held back when `queue_size` archives wait
+    for parsing, and at most `process_num` calc jobs are queued. Every stage keeps its usual outputs, so
+    a stopped run resumes with the checkout and parse manifests and only calc runs again
+    """
+
+    def __init__(self,
+                 session: Session,
+                 calculator: CalculateMetrics,
+                 output_csv: str,
+                 parse_sources: typing.List[ParseSource],
+                 process_num: typing.Optional[int] = None,
+                 queue_size: int = QUEUE_SIZE,
+                 members_per_job: typing.Optional[int] = DEFAULT_MEMBERS_PER_JOB,
+                 sensor_ids: typing.Optional[typing.FrozenSet[str]] = None,
+                 writer_profile: typing.Optional[ParquetWriterProfile] = None,
+                 retention: typing.Optional[RetentionPolicy] = None):
+        """
+        Parameters
+        ----------
+        session : Session
+            Session to fill, its meta is saved before the first calc job
+        calculator : CalculateMetrics
+            Calculator of the metrics of the session
+        output_csv : str
+            Path to the output CSV file, rows of every calc job are appended to it
+        parse_sources : List[ParseSource]
+            Vendors with parsers. Archives of other vendors are used by calc as they are
+        process_num : int | None
+            Number of processes of each of the parse and calc pools. Number of CPUs if `None`
+        queue_size : int
+            Maximum number of archives that are downloaded ahead of parsing
+        members_per_job : int | None
+            Maximum number of archive members parsed by one job, see :func:`metrics.parse.parse.parse`
+        sensor_ids : FrozenSet[str] | None
+            Ids of the sensors to parse. All sensors are parsed when `None`
+        writer_profile : ParquetWriterProfile | None
+            Profile of the parsed tables and of the output parquet table. The default profile is used if `None`
+        retention : RetentionPolicy | None
+            Policy applied in the background to the snapshots that no unfinished calc job reads, and to all
+            snapshots when the run is finished. Nothing is compacted or removed if `None`
+        """
+        assert queue_size > 0, "Queue size should be greater than 0"
+
+        self._session = session
+        self._calculator = calculator
+        self._output_csv = output_csv
+        self._sources = {source.input_folder: source for source in parse_sources}
+        self._process_num = process_num or os.cpu_count()
+        self._queue_size = queue_size
+        self._members_per_job = members_per_job
+        self._sensor_ids = sensor_ids
+        self._sensor_selection = selection_fingerprint(sensor_ids)
+        self._writer_profile = writer_profile
+        self._retention = retention
+
+    def _sync_catalog(self, catalog: SessionCatalog, tasks: typing.List[DownloadTask]):
+        """Syncs the catalog with all archive and table folders of the tasks"""
+        for task in tasks:
+            vendor = os.path.basename(task.download_path)
+            if os.path.isdir(task.download_path):
+                catalog.sync(kind=KIND_ARCHIVE, vendor=vendor, folder=task.download_path)
+
+            source = self._sources.get(task.download_path, None)
+            if source is not None and os.path.isdir(source.output_folder):
+                catalog.sync(kind=KIND_TABLE, vendor=vendor, folder=source.output_folder)
+
+    @staticmethod
+    def _sync_changed_files(catalog: SessionCatalog, changed_files: typing.Dict[typing.Tuple[str, str, str],
+                                                                                typing.List[str]]):
+        """Records the downloaded and parsed files in the catalog. Folders that were never synced are synced
+        as a whole, otherwise only the files are described
+        """
+        for (kind, vendor, folder), paths in changed_files.items():
+            if catalog.is_synced(kind=kind, vendor=vendor):
+                catalog.sync_files(kind=kind, vendor=vendor, paths=paths)
+            elif os.path.isdir(folder):
+                catalog.sync(kind=kind, vendor=vendor, folder=folder)
+        changed_files.clear()
+
+    def run(self, engine: CheckoutEngine, tasks: typing.List[DownloadTask]) -> PipelineReport:
+        """Downloads archives of the tasks, parses them and calculates metrics of the session
+
+        Parameters
+        ----------
+        engine : CheckoutEngine
+            Engine that downloads the archives
+        tasks : List[DownloadTask]
+            Download tasks of the session
+
+        Returns
+        -------
+        PipelineReport
+            Returns report of all stages
+        """
+        for source in self._sources.values():
+            os.makedirs(source.output_folder, exist_ok=True)
+        self._session.save_meta()
+
+        report = PipelineReport()
+        events: queue.Queue = queue.Queue()
+        feed = _ArchiveFeed(events=events, queue_size=self._queue_size)
+        manifest = ParseManifest(folder=self._session.tables_folder)
+        catalog = SessionCatalog(session_path=self._session.path)
+        # files of earlier runs are listed once, new files are recorded as they are downloaded and parsed
+        self._sync_catalog(catalog=catalog, tasks=tasks)
+
+        tracker = SnapshotTracker()
+        for task in tasks:
+            tracker.expect(vendor=os.path.basename(task.download_path),
+                           snapshots=[_archive_snapshot(file_path)[1] for file_path in task.file_paths])
+
+        forecast_vendor = self._calculator.forecast_vendor.value
+        observation_vendor = self._calculator.observation_vendor.value
+        calc_jobs: typing.Deque[JobParams] = collections.deque(self._calculator.session_jobs())
+        running_jobs: typing.List[JobParams] = []
+        total_calc_jobs = len(calc_jobs)
+
+        retention = None
+        if self._retention is not None and self._retention.enabled:
+            retention = Retention(session=self._session,
+                                  policy=self._retention,
+                                  parse_sources=list(self._sources.values()),
+                                  manifest=manifest,
+                                  writer_profile=self._writer_profile)
+        # retention moves and removes tables, so the catalog is synced between its runs
+        tables_lock = contextlib.nullcontext() if retention is None else retention.lock
+
+        def _checkout():
+            try:
+                events.put((EVENT_CHECKOUT, engine.run(tasks, listener=feed)))
+            except Exception as ex:
+                events.put((EVENT_ERROR, ex))
+
+        def _calculated(job: JobParams, failed: bool = False) -> typing.Callable[[typing.Any], None]:
+            return lambda result: events.put((EVENT_CALCULATED, None if failed else result, job))
+
+        def _parsed(result: ParseResult):
+            events.put((EVENT_PARSED, result))
+
+        def _parse_failed(job: ParseJob) -> typing.Callable[[BaseException], None]:
+            # the job is reported as failed, so the pipeline doesn't wait for it
+            return lambda error: _parsed(ParseResult(job=job, error="".join(traceback.format_exception(error))))
+
+        # pools are started before the checkout thread, so forked parse workers don't copy a running thread
+        parse_pool = multiprocessing.Pool(processes=self._process_num)
+        calc_pool = multiprocessing.get_context("spawn").Pool(processes=self._process_num)
+        checkout_thread = threading.Thread(target=_checkout, daemon=True)
+        retention_worker = None if retention is None else RetentionWorker(retention)
+        retained_before = None
+
+        pending_parts: typing.Dict[str, typing.List[ParseResult]] = {}
+        # files not recorded in the catalog yet by kind, vendor and folder
+        changed_files: typing.Dict[typing.Tuple[str, str, str], typing.List[str]] = collections.defaultdict(list)
+        metrics = MetricsWriter(output_csv=self._output_csv, writer_profile=self._writer_profile)
+        parsing = 0         # number of archives being parsed
+        calculating = 0     # number of submitted calc jobs
+        checkout_done = False
+
+        tm = TimeMeasure()
+        try:
+            checkout_thread.start()
+            while not checkout_done or parsing > 0 or len(calc_jobs) > 0 or calculating > 0:
+                event, *payload = events.get()
+
+                if event == EVENT_ERROR:
+                    raise payload[0]
+                elif event == EVENT_CHECKOUT:
+                    report.checkout = payload[0]
+                    checkout_done = True
+                elif event == EVENT_READY:
+                    file_path, ok = payload
+                    if ok:
+                        folder = os.path.dirname(file_path)
+                        changed_files[(KIND_ARCHIVE, os.path.basename(folder), folder)].append(file_path)
+
+                    source = self._sources.get(os.path.dirname(file_path), None)
+                    jobs: typing.List[ParseJob] = []
+                    if ok and source is not None:
+                        jobs = _collect_archive_jobs(source=source,
+                                                     zip_path=file_path,
+                                                     members_per_job=self._members_per_job,
+                                                     sensor_ids=self._sensor_ids,
+                                                     sensor_selection=self._sensor_selection,
+                                                     manifest=manifest,
+                                                     writer_profile=self._writer_profile)
+
+                    if len(jobs) == 0:
+                        # the table is up to date, the vendor has no parser or the archive doesn't exist
+                        tracker.resolve(*_archive_snapshot(file_path))
+                        feed.release()
+                    else:
+                        parsing += 1
+                        for job in jobs:
+                            parse_pool.apply_async(_parse_process_impl, (job,),
+                                                   callback=_parsed,
+                                                   error_callback=_parse_failed(job))
+                elif event == EVENT_PARSED:
+                    result: ParseResult = payload[0]
+                    if result.job.parts_num > 1:
+                        parts = pending_parts.setdefault(result.job.output_parquet_path, [])
+                        parts.append(result)
+                        if len(parts) == result.job.parts_num:
+                            # the merged result comes back as a whole archive
+                            snapshot_job = replace(result.job, members=None, part_index=0, parts_num=1)
+                            parse_pool.apply_async(_finish_parts, (pending_parts.pop(result.job.output_parquet_path),),
+                                                   callback=_parsed,
+                                                   error_callback=_parse_failed(snapshot_job))
+                        continue
+
+                    vendor, snapshot = _archive_snapshot(result.job.input_archive_path)
+                    if result.error is None:
+                        _record_result(manifest=manifest, result=result)
+                        folder = os.path.dirname(result.job.output_parquet_path)
+                        changed_files[(KIND_TABLE, vendor, folder)].append(result.job.output_parquet_path)
+                        # rollups of parsed again tables are outdated
+                        catalog.remove_rollups(vendor=vendor, snapshots=[snapshot])
+                        report.parsed += 1
+                    else:
+                        console.log(f"[red]Failed[/red] {result.job.vendor} {result.job.input_archive_path}:\n"
+                                    f"{result.error}")
+                        report.parse_failed.append(result.job.input_archive_path)
+
+                    parsing -= 1
+                    tracker.resolve(vendor, snapshot)
+                    feed.release()
+                elif event == EVENT_CALCULATED:
+                    calculating -= 1
+                    job_metrics, job = payload
+                    running_jobs.remove(job)
+                    if job_metrics is None:
+                        report.calc_failed += 1
+                    else:
+                        report.calculated += 1
+                        metrics.append(job_metrics)
+                    console.log(f"Calculated {report.calculated + report.calc_failed} of {total_calc_jobs} "
+                                f"time ranges in {tm():.2f} seconds")
+
+                # every archive is announced by the checkout, so nothing can be pending after it's processed
+                if checkout_done and parsing == 0:
+                    tracker.resolve_all()
+
+                ready_jobs = []
+                while len(calc_jobs) > 0 and calculating + len(ready_jobs) < self._process_num and \
+                        tracker.is_ready(forecast_vendor, calc_jobs[0].forecast_time_range()) and \
+                        tracker.is_ready(observation_vendor, calc_jobs[0].sensors_time_range()):
+                    ready_jobs.append(calc_jobs.popleft())
+
+                if len(ready_jobs) > 0:
+                    # calc reads tables through the catalog, so it lists the new ones first
+                    with tables_lock:
+                        self._sync_changed_files(catalog=catalog, changed_files=changed_files)
+                    for job in ready_jobs:
+                        calculating += 1
+                        running_jobs.append(job)
+                        calc_pool.apply_async(_process_time_range, (job,),
+                                              callback=_calculated(job),
+                                              error_callback=_calculated(job, failed=True))
+
+                # snapshots before the unfinished calc jobs aren't read anymore
+                if retention_worker is not None and len(calc_jobs) + len(running_jobs) > 0:
+                    before = min(min(job.forecast_time_range()[0], job.sensors_time_range()[0])
+                                 for job in itertools.chain(calc_jobs, running_jobs))
+                    if retained_before is None or before > retained_before:
+                        retention_worker.request(before=before)
+                        retained_before = before
+
+            parse_pool.close()
+            calc_pool.close()
+            metrics.close()
+        finally:
+            if retention_worker is not None:
+                retention_worker.close()
+            manifest.save()
+            parse_pool.terminate()
+            calc_pool.terminate()
+            parse_pool.join()
+            calc_pool.join()
+
+        checkout_thread.join()
+        if retention is not None:
+            retention.run()
+        self._sync_catalog(catalog=catalog, tasks=tasks)
+
+        console.log(f"Pipeline completed in {tm():.2f} seconds: {report.checkout.downloaded} downloaded, "
+                    f"{report.parsed} parsed, {len(report.parse_failed)} failed to parse, "
+                    f"{report.calculated} time ranges calculated, {report.calc_failed} failed")
+        return report
+
+
+def run_pipeline(start_time: int,
+                 end_time: int,
+                 session_path: str,
+                 observations_source: ObservationSourcesInfo,
+                 forecasts_source: ForecastSourcesInfo,
+                 forecast_vendor: DataVendor,
+                 observation_vendor: DataVendor,
+                 forecast_offsets: typing.List[int],
+                 threshold: float,
+                 precip_types: typing.List[PrecipitationType],
+                 output_csv: str,
+                 observations_offset: int = 0,
+                 forecast_range: int = 7800,
+                 sensor_selection_path: typing.Optional[str] = None,
+                 process_num: typing.Optional[int] = None,
+                 queue_size: int = QUEUE_SIZE,
+                 members_per_job: typing.Optional[int] = DEFAULT_MEMBERS_PER_JOB,
+                 writer_profile: typing.Optional[ParquetWriterProfile] = None,
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 retries: int = RETRIES,
+                 cache_folder: typing.Optional[str] = None,
+                 cache_size: typing.Optional[int] = None,
+                 part_size: int = PART_SIZE,
+                 part_concurrency: int = PART_CONCURRENCY,
+                 retention: typing.Optional[RetentionPolicy] = None,
+                 providers_parser: typing.Dict[BaseDataVendor, BaseParser] = PROVIDERS_PARSERS) -> PipelineReport:
+    """
+    Checks out, parses and calculates metrics of the session in one run. Parameters have the same meaning
+    as the parameters of `metrics.checkout`, `metrics.parse` and `metrics.calc events`. Archives are parsed
+    while others download and metrics of a time range are calculated as soon as its inputs are parsed.
+    At most `queue_size` archives are downloaded ahead of parsing. With `retention`, tables are compacted and
+    parsed archives are removed in the background as calc moves past them
+    """
+    console.log(f"Run [green]pipeline[/green] command:\n"
+                f"- session_path = {session_path}\n"
+                f"- start_time = {start_time} ({format_time(start_time)})\n"
+                f"- end-time = {end_time} ({format_time(end_time)})\n"
+                f"- forecast_vendor = {forecast_vendor.value}\n"
+                f"- observation_vendor = {observation_vendor.value}\n"
+                f"- sensor_selection_path = {sensor_selection_path}\n"
+                f"- process_num = {process_num}\n"
+                f"- queue_size = {queue_size}")
+
+    session = Session(session_path=session_path,
+                      start_time=start_time,
+                      end_time=end_time,
+                      forecast_range=forecast_range)
+
+    sensor_ids = None
+    rainviewer_tiles = None
+    if sensor_selection_path is not None:
+        selected_sensors = read_selected_sensors(sensor_selection_path)
+        if len(selected_sensors) > 0:
+            sensor_ids = frozenset(selected_sensors["id"].astype(str))
+        rainviewer_tiles = rainviewer_selection(selected_sensors)
+
+    tasks = forecast_download_tasks(session=session,
+                                    forecasts_source=forecasts_source,
+                                    rainviewer_tiles=rainviewer_tiles)
+    tasks += sensors_download_tasks(session=session, observations_source=observations_source)
+
+    calculator = CalculateMetrics(forecast_vendor=forecast_vendor,
+                                  observation_vendor=observation_vendor,
+                                  sensor_selection_path=sensor_selection_path,
+                                  forecast_offsets=forecast_offsets,
+                                  threshold=threshold,
+                                  precip_types=precip_types,
+                                  session_path=session_path,
+                                  observations_offset=observations_offset)
+
+    pipeline = Pipeline(session=session,
+                        calculator=calculator,
+                        output_csv=output_csv,
+                        parse_sources=_parse_sources(session=session,
+                                                     providers=list(providers_parser),
+                                                     providers_parser=providers_parser),
+                        process_num=process_num,
+                        queue_size=queue_size,
+                        members_per_job=members_per_job,
+                        sensor_ids=sensor_ids,
+                        writer_profile=writer_profile,
+                        retention=retention)
+
+    cache = None if cache_folder is None else DataCache(folder=cache_folder, max_size=cache_size)
+    engine = CheckoutEngine(max_concurrency=max_concurrency,
+                            retries=retries,
+                            cache=cache,
+                            part_size=part_size,
+                            part_concurrency=part_concurrency)
+
+    return pipeline.run(engine=engine, tasks=tasks)
@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+
+from metrics.calc.events import CalculateMetrics
+from metrics.checkout.checkout import forecast_download_tasks, rainviewer_selection, sensors_download_tasks
+from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo
+from metrics.data_vendor import DataVendor
+from metrics.plan.plan import PlanLimits, make_plan, print_plan
+from metrics.session import Session
+from metrics.utils.precipitation import PrecipitationType
+from metrics.utils.sensors import read_selected_sensors
+from rich.console import Console
+
+console = Console()
+
+
+def _gb(value):
+    return None if value is None else int(value * 1024 ** 3)
+
+
+def _run_plan(args: argparse.Namespace):
+    forecasts = ForecastSourcesInfo(s3_uri_rainviewer=args.s3_uri_rainviewer,
+                                    s3_uri_wk=args.s3_uri_wk,
+                                    s3_uri_accuweather=args.s3_uri_accuweather,
+                                    s3_uri_tomorrowio=args.s3_uri_tomorrowio,
+                                    s3_uri_vaisala=args.s3_uri_vaisala,
+                                    s3_uri_rainbowai=args.s3_uri_rainbowai,
+                                    s3_uri_weathercompany=args.s3_uri_weathercompany)
+
+    observations = ObservationSourcesInfo(s3_uri_metar=args.s3_uri_metar_data)
+
+    session = Session(session_path=args.session_path,
+                      start_time=args.start_time,
+                      end_time=args.end_time,
+                      forecast_range=args.forecast_range,
+                      data_folder=args.data_uri)
+
+    sensor_ids = None
+    rainviewer_tiles = None
+    if args.filter_sensors_dir is not None:
+        selected_sensors = read_selected_sensors(args.filter_sensors_dir)
+        if len(selected_sensors) > 0:
+            sensor_ids = frozenset(selected_sensors["id"].astype(str))
+            rainviewer_tiles = rainviewer_selection(selected_sensors)
+
+    tasks = forecast_download_tasks(session=session, forecasts_source=forecasts, rainviewer_tiles=rainviewer_tiles)
+    tasks += sensors_download_tasks(session=session, observations_source=observations)
+
+    calculator = None
+    if args.forecast_vendor is not None and args.observation_vendor is not None:
+        calculator = CalculateMetrics(forecast_vendor=DataVendor(args.forecast_vendor),
+                                      observation_vendor=DataVendor(args.observation_vendor),
+                                      sensor_selection_path=args.filter_sensors_dir,
+                                      forecast_offsets=[int(v) * 60 for v in args.offsets.split(" ")],
+                                      threshold=0.0,
+                                      precip_types=[PrecipitationType.RAIN],
+                                      session_path=args.session_path,
+                                      split_time_range=args.split_time_range)
+
+    limits = PlanLimits(max_download_size=_gb(args.max_download_size),
+                        max_disk_size=_gb(args.max_disk_size),
+                        max_memory=_gb(args.max_memory))
+
+    plan = make_plan(session=session,
+                     tasks=tasks,
+                     calculator=calculator,
+                     process_num=args.process_num,
+                     sensor_ids=sensor_ids,
+                     limits=limits)
+    print_plan(plan)
+
+    violations = plan.violations(limits)
+    for violation in violations:
+        console.log(f"[red]The run exceeds limits: {violation}[/red]")
+
+    if len(violations) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tool estimates download size, table rows, memory and processes "
+                                                 "of checkout, parse and calc of a session without running them")
+
+    parser.add_argument("--session-path", type=str, dest="session_path", required=True,
+                        help="Path to the session directory, it may not exist yet")
+    parser.add_argument("--start-time", type=int, dest="start_time", required=True,
+                        help="Start timestamp")
+    parser.add_argument("--end-time", type=int, dest="end_time", required=True,
+                        help="End timestamp")
+    parser.add_argument("--forecast-range", type=int, dest="forecast_range", required=False, default=7800,
+                        help="Forecast range in seconds")
+    parser.add_argument("--process-num", type=int, dest="process_num", default=os.cpu_count(), required=False,
+                        help="Number of processes of each of the parse and calc pools")
+    parser.add_argument("--filter-sensors-dir", dest="filter_sensors_dir", type=str, default=None,
+                        help="Path to a directory or a file with selected sensors")
+    parser.add_argument("--data-uri", type=str, dest="data_uri", required=False, default=None,
+                        help="S3 uri with `<vendor>/<snapshot>.zip` archives that are read in place")
+
+    limits_group = parser.add_argument_group(title="Limits",
+                                             description="The command fails if the run exceeds one of the limits "
+                                                         "or the free disk space")
+    limits_group.add_argument("--max-download-size", type=float, dest="max_download_size", default=None,
+                              help="Maximum size of the downloaded archives in GB")
+    limits_group.add_argument("--max-disk-size", type=float, dest="max_disk_size", default=None,
+                              help="Maximum size of the downloaded archives and parsed tables in GB")
+    limits_group.add_argument("--max-memory", type=float, dest="max_memory", default=None,
+                              help="Maximum memory of all processes of a stage in GB. Processes are suggested "
+                                   "to fit the physical memory without it")
+
+    checkout_group = parser.add_argument_group(title="Checkout")
+    checkout_group.add_argument("--s3-uri-metar-data", type=str, dest="s3_uri_metar_data", required=False,
+                                default=None, help="S3 uri where to get metar data")
+    checkout_group.add_argument("--s3-uri-rainviewer", type=str, dest="s3_uri_rainviewer", required=False,
+                                default=None, help="S3 uri where to get rainviewer forecast")
+    checkout_group.add_argument("--s3-uri-wk", type=str, dest="s3_uri_wk", required=False, default=None,
+                                help="S3 uri where to get weather kit forecast")
+    checkout_group.add_argument("--s3-uri-accuweather", type=str, dest="s3_uri_accuweather", required=False,
+                                default=None, help="S3 uri where to get accuweather forecast")
+    checkout_group.add_argument("--s3-uri-tomorrowio", type=str, dest="s3_uri_tomorrowio", required=False,
+                                default=None, help="S3 uri where to get tomorrow io forecast")
+    checkout_group.add_argument("--s3-uri-vaisala", type=str, dest="s3_uri_vaisala", required=False, default=None,
+                                help="S3 uri where to get vaisala forecast")
+    checkout_group.add_argument("--s3-uri-rainbowai", type=str, dest="s3_uri_rainbowai", required=False,
+                                default=None, help="S3 uri where to get rainbowai forecast")
+    checkout_group.add_argument("--s3-uri-weathercompany", type=str, dest="s3_uri_weathercompany", required=False,
+                                default=None, help="S3 uri where to get WeatherCompany forecast")
+
+    calc_group = parser.add_argument_group(title="Calc", description="The calc stage is planned with both vendors")
+    calc_group.add_argument("--forecast-vendor", dest="forecast_vendor", type=str, required=False, default=None,
+                            choices=[value.value for value in DataVendor],
+                            help="Data vendor to compare with sensors")
+    calc_group.add_argument("--observation-vendor", dest="observation_vendor", type=str, required=False,
+                            default=None, choices=[value.value for value in DataVendor],
+                            help="Sensors vendor to compare with data")
+    calc_group.add_argument("--offsets", type=str, default="0 10 20 30 40 50 60",
+                            help="List of offsets to calculate metrics")
+    calc_group.add_argument("--split-time-range", dest="split_time_range", type=int, default=3600,
+                            help="Largest time range of a calc job in seconds")
+
+    parser.set_defaults(func=_run_plan)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,357 @@
+import os
+import shutil
+import typing
+
+from dataclasses import dataclass, field
+from metrics.calc.events import CalculateMetrics, estimate_jobs
+from metrics.calc.scheduler import ARCHIVE_MEMORY_RATIO, PROCESS_MEMORY, MemoryScheduler
+from metrics.checkout.engine import DownloadTask
+from metrics.checkout.manifest import CheckoutManifest
+from metrics.data_vendor import BaseDataVendor
+from metrics.io import storage
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, CatalogEntry, SessionCatalog
+from metrics.parse import PROVIDERS_PARSERS
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.manifest import ParseManifest, selection_fingerprint
+from metrics.session import Session
+from metrics.utils.memory import total_memory
+from metrics.utils.s3 import S3Client, S3Object, list_window, parse_s3_uri, shared_s3_client
+
+from rich.console import Console
+
+console = Console()
+
+TABLE_SIZE_RATIO = 1.0  # initial estimate of table bytes per archive byte, both are compressed alike
+
+
+@dataclass
+class VendorPlan:
+    vendor: str                 # vendor folder name
+    objects: int = 0            # number of archives of the session that exist in S3
+    missing: int = 0            # number of archives of the session that don't exist in S3
+    download_objects: int = 0   # number of archives to download
+    download_size: int = 0      # bytes to download, whole archives even if only selected members are fetched
+    archive_size: int = 0       # bytes of all archives of the session
+    parse_archives: int = 0     # number of archives to parse
+    table_rows: typing.Optional[int] = 0  # expected rows of all tables, `None` if the vendor was never parsed
+    table_size: int = 0         # expected bytes of the tables to write
+    parse_memory: int = 0       # estimated peak memory of a parse worker in bytes
+    archives: typing.List[CatalogEntry] = field(default_factory=list, repr=False)  # archives after checkout
+    tables: typing.List[CatalogEntry] = field(default_factory=list, repr=False)    # tables after parse
+
+
+@dataclass
+class CalcPlan:
+    jobs: int                   # number of calc jobs with the suggested split time range
+    split_time_range: int       # suggested split time range in seconds
+    job_memory: int             # estimated peak memory of a calc worker in bytes
+    process_num: int            # suggested number of calc processes
+
+
+@dataclass
+class PlanLimits:
+    max_download_size: typing.Optional[int] = None  # maximum bytes to download
+    max_disk_size: typing.Optional[int] = None      # maximum bytes that the run adds to the disk
+    max_memory: typing.Optional[int] = None         # maximum memory of all workers of a stage in bytes
+
+
+@dataclass
+class RunPlan:
+    vendors: typing.List[VendorPlan]        # plans of the checked out vendors
+    process_num: int                        # requested number of processes of every stage
+    parse_process_num: int                  # suggested number of parse processes
+    free_disk: typing.Optional[int] = None  # free bytes on the disk of the session, `None` if unknown
+    calc: typing.Optional[CalcPlan] = None  # plan of the calc stage, `None` if it's not planned
+
+    @property
+    def download_size(self) -> int:
+        return sum(vendor.download_size for vendor in self.vendors)
+
+    @property
+    def disk_size(self) -> int:
+        """Returns bytes that the run adds to the disk: downloaded archives and written tables"""
+        return self.download_size + sum(vendor.table_size for vendor in self.vendors)
+
+    @property
+    def peak_memory(self) -> int:
+        """Returns peak memory of `process_num` workers of the most demanding stage in bytes"""
+        worker_memory = max([vendor.parse_memory for vendor in self.vendors] +
+                            [0 if self.calc is None else self.calc.job_memory])
+        return worker_memory * self.process_num
+
+    def violations(self, limits: PlanLimits) -> typing.List[str]:
+        """Returns descriptions of the limits that the run exceeds, the free disk space is always a limit"""
+        violations = []
+        if limits.max_download_size is not None and self.download_size > limits.max_download_size:
+            violations.append(f"download of {format_size(self.download_size)} exceeds the limit of "
+                              f"{format_size(limits.max_download_size)}")
+
+        if limits.max_disk_size is not None and self.disk_size > limits.max_disk_size:
+            violations.append(f"{format_size(self.disk_size)} written to the disk exceed the limit of "
+                              f"{format_size(limits.max_disk_size)}")
+
+        if self.free_disk is not None and self.disk_size > self.free_disk:
+            violations.append(f"{format_size(self.disk_size)} written to the disk exceed "
+                              f"{format_size(self.free_disk)} of free space")
+
+        if limits.max_memory is not None and self.peak_memory > limits.max_memory:
+            violations.append(f"{self.process_num} processes are expected to take {format_size(self.peak_memory)}, "
+                              f"more than the limit of {format_size(limits.max_memory)}")
+
+        return violations
+
+
+def format_size(size: int) -> str:
+    """Returns human readable size in bytes"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TB"
+
+
+def _free_disk(path: str) -> typing.Optional[int]:
+    # the session folder may not exist yet
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+    return shutil.disk_usage(path).free
+
+
+def _list_task(client: S3Client, task: DownloadTask) -> typing.Dict[str, S3Object]:
+    """Lists objects of the task over its key range like the checkout does"""
+    bucket_name = parse_s3_uri(task.download_uri_list[0])[0]
+    window = list_window([parse_s3_uri(uri)[1] for uri in task.download_uri_list])
+
+    listed = client.list_objects(s3_uri=f"s3://{bucket_name}/{window.prefix}",
+                                 start_after=window.start_after,
+                                 end_key=window.end_key)
+    return {s3_object.key: s3_object for s3_object in listed}
+
+
+def _ratio(numerators: typing.Iterable[int],
+           denominators: typing.Iterable[int],
+           default: typing.Optional[float]) -> typing.Optional[float]:
+    numerator, denominator = sum(numerators), sum(denominators)
+    return numerator / denominator if numerator > 0 and denominator > 0 else default
+
+
+def _snapshot_sizes(entries: typing.List[CatalogEntry]) -> typing.Dict[int, int]:
+    """Returns bytes of the snapshot tables. Entries of a partition table have the size of the whole table,
+    its snapshots share the size by their rows
+    """
+    partition_rows: typing.Dict[str, int] = {}
+    for entry in entries:
+        partition_rows[entry.path] = partition_rows.get(entry.path, 0) + (entry.rows or 0)
+
+    return {entry.snapshot: entry.size if partition_rows[entry.path] == 0 else
+            entry.size * (entry.rows or 0) // partition_rows[entry.path] for entry in entries}
+
+
+def _plan_vendor(task: DownloadTask,
+                 listed: typing.Dict[str, S3Object],
+                 session: Session,
+                 catalog: SessionCatalog,
+                 parse_manifest: ParseManifest,
+                 parser_class: typing.Optional[typing.Type[BaseParser]],
+                 sensor_selection: typing.Optional[str]) -> VendorPlan:
+    vendor = os.path.basename(task.download_path)
+    plan = VendorPlan(vendor=vendor)
+    checkout_manifest = CheckoutManifest(folder=task.download_path)
+    selection = None if task.selection is None else task.selection.fingerprint
+
+    # tables parsed before tell how many rows and table bytes an archive byte of the vendor gives,
+    # rows of a vendor that was never parsed are unknown
+    known_archives = {entry.snapshot: entry for entry in catalog.list(kind=KIND_ARCHIVE, vendor=vendor)}
+    table_entries = catalog.list(kind=KIND_TABLE, vendor=vendor)
+    table_sizes = _snapshot_sizes(table_entries)
+    known_tables = {entry.snapshot: entry for entry in table_entries if entry.rows is not None}
+    parsed = [snapshot for snapshot in known_tables if snapshot in known_archives]
+    rows_per_byte = _ratio([known_tables[snapshot].rows for snapshot in parsed],
+                           [known_archives[snapshot].size for snapshot in parsed],
+                           default=None)
+    table_size_ratio = _ratio([table_sizes[snapshot] for snapshot in parsed],
+                              [known_archives[snapshot].size for snapshot in parsed],
+                              default=TABLE_SIZE_RATIO)
+
+    tables_folder = os.path.join(session.tables_folder, vendor)
+    largest_parsed = 0
+    for uri, file_path in zip(task.download_uri_list, task.file_paths):
+        s3_object = listed.get(parse_s3_uri(uri)[1], None)
+        if s3_object is None:
+            plan.missing += 1
+            continue
+
+        snapshot = int(os.path.splitext(os.path.basename(file_path))[0])
+        plan.objects += 1
+        plan.archive_size += s3_object.size
+        plan.archives.append(CatalogEntry(kind=KIND_ARCHIVE, vendor=vendor, snapshot=snapshot, path=file_path,
+                                          size=s3_object.size))
+
+        # archives of a remote data folder are read in place, planning doesn't record files in the manifest
+        downloaded = not storage.is_remote(file_path) and \
+            not checkout_manifest.is_fresh(file_path=file_path,
+                                           size=s3_object.size,
+                                           etag=s3_object.etag,
+                                           selection=selection,
+                                           record=False)
+        if downloaded:
+            plan.download_objects += 1
+            plan.download_size += s3_object.size
+
+        if parser_class is None:
+            continue
+
+        table_path = os.path.join(tables_folder, f"{snapshot}.parquet")
+        table = known_tables.get(snapshot, None)
+        if not downloaded and table is not None and parse_manifest.is_fresh(input_path=file_path,
+                                                                            output_path=table_path,
+                                                                            parser_class=parser_class,
+                                                                            sensor_selection=sensor_selection,
+                                                                            record=False):
+            rows, table_size = table.rows, table_sizes[snapshot]
+        else:
+            # tables without rows are estimated by their size like archives, see `entries_memory`
+            rows = None if rows_per_byte is None else int(s3_object.size * rows_per_byte)
+            table_size = int(s3_object.size * table_size_ratio)
+            plan.parse_archives += 1
+            plan.table_size += table_size
+            largest_parsed = max(largest_parsed, s3_object.size)
+
+        plan.table_rows = None if plan.table_rows is None or rows is None else plan.table_rows + rows
+        plan.tables.append(CatalogEntry(kind=KIND_TABLE, vendor=vendor, snapshot=snapshot, path=table_path,
+                                        size=table_size, rows=rows))
+
+    if plan.parse_archives > 0:
+        plan.parse_memory = PROCESS_MEMORY + largest_parsed * ARCHIVE_MEMORY_RATIO
+
+    return plan
+
+
+def _plan_calc(calculator: CalculateMetrics,
+               session: Session,
+               vendors: typing.Dict[str, VendorPlan],
+               memory: int,
+               process_num: int) -> CalcPlan:
+    forecast = vendors.get(calculator.forecast_vendor.value, VendorPlan(vendor=calculator.forecast_vendor.value))
+    observations = vendors.get(calculator.observation_vendor.value,
+                               VendorPlan(vendor=calculator.observation_vendor.value))
+    forecast_entries = forecast.archives if calculator.forecast_kind == KIND_ARCHIVE else forecast.tables
+
+    # the largest split time range that lets all processes run within the memory, like `--memory-budget` does
+    scheduler = MemoryScheduler(memory_budget=memory, process_num=process_num)
+    for split_time_range in calculator.split_time_range_candidates():
+        jobs = calculator.session_jobs(session=session, split_time_range=split_time_range)
+        estimates = estimate_jobs(jobs=jobs,
+                                  forecast_entries=forecast_entries,
+                                  observation_entries=observations.tables)
+        if all(scheduler.fits(estimate) for estimate in estimates):
+            break
+
+    job_memory = scheduler.expected_memory(max(estimates, default=0))
+    return CalcPlan(jobs=len(jobs),
+                    split_time_range=split_time_range,
+                    job_memory=job_memory,
+                    process_num=max(1, min(process_num, memory // job_memory)))
+
+
+def make_plan(session: Session,
+              tasks: typing.List[DownloadTask],
+              calculator: typing.Optional[CalculateMetrics] = None,
+              process_num: typing.Optional[int] = None,
+              sensor_ids: typing.Optional[typing.FrozenSet[str]] = None,
+              limits: typing.Optional[PlanLimits] = None,
+              client: typing.Optional[S3Client] = None,
+              providers_parser: typing.Dict[BaseDataVendor, BaseParser] = PROVIDERS_PARSERS) -> RunPlan:
+    """Estimates checkout, parse and calc of the session from S3 listings, the session catalog and manifests.
+    Only listings are requested, nothing is downloaded or parsed
+
+    Parameters
+    ----------
+    session : Session
+        Session to plan, it may not exist yet
+    tasks : List[DownloadTask]
+        Download tasks of the checkout, see `forecast_download_tasks` and `sensors_download_tasks`
+    calculator : CalculateMetrics | None
+        Calculator of the metrics. The calc stage is not planned if `None`
+    process_num : int | None
+        Number of processes of every stage. The number of CPUs if `None`
+    sensor_ids : FrozenSet[str] | None
+        Ids of the parsed sensors. All sensors are parsed if `None`
+    limits : PlanLimits | None
+        Limits of the run. Processes are suggested to fit `max_memory`, or the physical memory if it's not set
+    client : S3Client | None
+        Client to list objects. A client over the shared S3 client is used if `None`
+    providers_parser : Dict[BaseDataVendor, BaseParser]
+        Parsers of the vendors
+
+    Returns
+    -------
+    RunPlan
+        Returns plan of the run
+    """
+    limits = limits or PlanLimits()
+    client = client or S3Client(client=shared_s3_client())
+    process_num = process_num or os.cpu_count() or 1
+    memory = limits.max_memory or total_memory()
+
+    catalog = SessionCatalog(session_path=session.path)
+    parse_manifest = ParseManifest(folder=session.tables_folder)
+    parsers = {vendor.value: parser_class for vendor, parser_class in providers_parser.items()}
+
+    vendors: typing.Dict[str, VendorPlan] = {}
+    for task in tasks:
+        if len(task.download_uri_list) == 0:
+            continue
+
+        vendor = os.path.basename(task.download_path)
+        vendors[vendor] = _plan_vendor(task=task,
+                                       listed=_list_task(client=client, task=task),
+                                       session=session,
+                                       catalog=catalog,
+                                       parse_manifest=parse_manifest,
+                                       parser_class=parsers.get(vendor, None),
+                                       sensor_selection=selection_fingerprint(sensor_ids))
+
+    parse_memory = max([vendor.parse_memory for vendor in vendors.values()], default=0)
+    parse_process_num = process_num if parse_memory == 0 else max(1, min(process_num, memory // parse_memory))
+    plan = RunPlan(vendors=list(vendors.values()),
+                   process_num=process_num,
+                   parse_process_num=parse_process_num,
+                   free_disk=_free_disk(session.path))
+
+    if calculator is not None:
+        plan.calc = _plan_calc(calculator=calculator,
+                               session=session,
+                               vendors=vendors,
+                               memory=memory,
+                               process_num=process_num)
+
+    return plan
+
+
+def print_plan(plan: RunPlan):
+    """Logs the plan per vendor and stage with the suggested parameters"""
+    for vendor in plan.vendors:
+        console.log(f"[green]{vendor.vendor}[/green]:\n"
+                    f"- checkout: {vendor.objects} archives ({format_size(vendor.archive_size)}), "
+                    f"{vendor.download_objects} to download ({format_size(vendor.download_size)}), "
+                    f"{vendor.missing} missing\n"
+                    f"- parse: {vendor.parse_archives} archives to parse, "
+                    f"{'unknown number of' if vendor.table_rows is None else vendor.table_rows} table rows, "
+                    f"{format_size(vendor.table_size)} of new tables, "
+                    f"{format_size(vendor.parse_memory)} per worker")
+
+    console.log(f"Download {format_size(plan.download_size)}, write {format_size(plan.disk_size)} to the disk"
+                + ("" if plan.free_disk is None else f" with {format_size(plan.free_disk)} free"))
+    console.log(f"Parse: suggested process_num = {plan.parse_process_num}")
+
+    if plan.calc is not None:
+        console.log(f"Calc: {plan.calc.jobs} jobs, {format_size(plan.calc.job_memory)} per worker, "
+                    f"suggested process_num = {plan.calc.process_num}, "
+                    f"split_time_range = {plan.calc.split_time_range}")
@@ -1,7 +1,10 @@
 import json
 import os
 import re
+import typing
 
+from metrics.io.catalog import SessionCatalog
+from metrics.io.table_store import PARTITION_PERIOD, partition_timestamp
 from metrics.utils.time import format_time
 from rich.console import Console
 
@@ -19,6 +22,18 @@ TABLES_FOLDER = "tables"
 # metrics
 METRICS_FOLDER = "metrics"
 
+# arrow copies of tables
+CACHE_FOLDER = "cache"
+
+
+def _remove_empty_partition(partition_folder: str):
+    """Removes the `hour=` partition folder and then its `date=` folder if they are empty"""
+    for folder in [partition_folder, os.path.dirname(partition_folder)]:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            return  # the folder has other files or partitions
+
 
 class Session:
 
@@ -40,6 +55,10 @@ class Session:
         self._sensors_folder = sensors_folder or os.path.join(self._path, SENSORS_FOLDER)
         self._metrics_folder = metrics_folder or os.path.join(self._path, METRICS_FOLDER)
 
+    @property
+    def path(self) -> str:
+        return self._path
+
     @property
     def session_name(self) -> str:
         return os.path.basename(self._path)
@@ -72,6 +91,10 @@ class Session:
     def metrics_folder(self) -> str:
         return self._metrics_folder
 
+    @property
+    def cache_folder(self) -> str:
+        return os.path.join(self._path, CACHE_FOLDER)
+
     def __repr__(self) -> str:
         return (f"Session {self._path}:\n"
                 f"- start_time: {self._start_time} ({format_time(self._start_time)})\n"
@@ -119,9 +142,22 @@ class Session:
 
         return session
 
-    def _clear_outdated(self, target_dir: str, deadline: int):
-        timestamp_regexp = r'^\d+(?=\.(zip|gz|parquet|csv)$)'
-        for dir, _, files in os.walk(target_dir):
+    def _clear_outdated(self, target_dir: str, deadline: int, skip_dirs: typing.AbstractSet[str] = frozenset()):
+        timestamp_regexp = r'^\d+(?=\.(zip|gz|parquet|csv|arrow)$)'
+        for dir, subdirs, files in os.walk(target_dir):
+            if os.path.normpath(dir) in skip_dirs:
+                subdirs.clear()
+                continue
+
+            # compacted tables are removed when the whole partition is outdated
+            partition_start = partition_timestamp(dir)
+            if partition_start is not None:
+                if partition_start + PARTITION_PERIOD <= deadline:
+                    for file_name in files:
+                        os.remove(os.path.join(dir, file_name))
+                    _remove_empty_partition(dir)
+                continue
+
             for file_name in files:
                 match = re.match(timestamp_regexp, file_name)
                 if match:
@@ -129,11 +165,31 @@ class Session:
                     if timestamp < deadline:
                         os.remove(os.path.join(dir, file_name))
 
+    def _clear_outdated_catalog(self, catalog: SessionCatalog, deadline: int):
+        removed = []
+        for entry in catalog.list_before(deadline):
+            path = catalog.full_path(entry)
+
+            # compacted tables are removed when the whole partition is outdated
+            partition_start = partition_timestamp(os.path.dirname(path))
+            if partition_start is not None and partition_start + PARTITION_PERIOD > deadline:
+                continue
+
+            if os.path.exists(path):
+                os.remove(path)
+                if partition_start is not None:
+                    _remove_empty_partition(os.path.dirname(path))
+            removed.append(entry)
+
+        catalog.remove(removed)
+
     def clear_outdated(self, deadline_timestamp: int):
         console.log(f"Clear data older then {deadline_timestamp} ({format_time(deadline_timestamp)})")
-        target_dirs = [self.data_folder,
-                       self.sensors_folder,
-                       self.tables_folder]
-
-        for dir in target_dirs:
-            self._clear_outdated(target_dir=dir, deadline=deadline_timestamp)
+        # archives and tables of the folders that the catalog lists aren't walked
+        catalog = SessionCatalog(session_path=self._path)
+        synced_dirs = catalog.synced_folders()
+        if catalog.exists:
+            self._clear_outdated_catalog(catalog=catalog, deadline=deadline_timestamp)
+
+        for dir in [self.data_folder, self.tables_folder, self.sensors_folder, self.cache_folder]:
+            self._clear_outdated(target_dir=dir, deadline=deadline_timestamp, skip_dirs=synced_dirs)
@@ -0,0 +1,21 @@
+import os
+import typing
+
+
+def write_atomic(path: str, write: typing.Callable[[str], None]):
+    """Writes a file via a temporary file that replaces the target only when it's completely written
+
+    Parameters
+    ----------
+    path : str
+        Path to the target file
+    write : Callable[[str], None]
+        Function that writes the content into the specified path
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,5 @@
+# Column with the end of the interval in interval tables. The end is not included
+END_TIMESTAMP_COLUMN = "end_timestamp"
+
+# Interval covers points `timestamp, timestamp + INTERVAL_STEP, ...` before `end_timestamp`
+INTERVAL_STEP = 60
@@ -0,0 +1,40 @@
+import os
+import resource
+import sys
+
+
+def reset_peak_rss() -> bool:
+    """Resets peak resident set size of the current process, so `peak_rss` measures from now on
+
+    Returns
+    -------
+    bool
+        Returns `True` if the peak was reset. Without Linux `/proc/self/clear_refs` the peak
+        can't be reset and `peak_rss` returns the peak since the process start
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """Returns peak resident set size of the current process in bytes"""
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def total_memory() -> int:
+    """Returns physical memory of the machine in bytes"""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
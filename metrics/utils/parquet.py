@@ -0,0 +1,123 @@
+import pandas
+import pyarrow
+import pyarrow.parquet as pq
+import typing
+
+from dataclasses import dataclass, field
+from metrics.io import storage
+from metrics.utils.file import write_atomic
+
+
+@dataclass
+class ParquetWriterProfile:
+    compression: str = "gzip"   # codec: gzip, zstd, snappy, lz4, brotli or none
+    compression_level: typing.Optional[int] = None  # codec specific level, the codec default if `None`
+    row_group_size: typing.Optional[int] = None  # maximum number of rows in a row group, pyarrow default if `None`
+    dictionary_columns: typing.Optional[typing.List[str]] = None  # columns with dictionary encoding, all if `None`
+    sort_by: typing.List[str] = field(default_factory=list)  # columns to sort rows by before writing
+
+    def writer_options(self, columns: typing.List[str]) -> typing.Dict[str, typing.Any]:
+        """Returns options of `pyarrow.parquet.ParquetWriter` for a table with specified columns"""
+        use_dictionary = True
+        if self.dictionary_columns is not None:
+            use_dictionary = [column for column in self.dictionary_columns if column in columns]
+
+        return {"compression": self.compression,
+                "compression_level": self.compression_level,
+                "use_dictionary": use_dictionary}
+
+    def sort(self, data_frame: pandas.DataFrame, sort_by: typing.Optional[typing.List[str]] = None) -> pandas.DataFrame:
+        """Sorts rows by the profile sort keys that exist in the table. Rows with equal keys keep their order
+
+        Parameters
+        ----------
+        data_frame : pandas.DataFrame
+            Table to sort
+        sort_by : List[str] | None
+            Sort keys. The profile sort keys are used if `None`
+        """
+        keys = [column for column in (self.sort_by if sort_by is None else sort_by) if column in data_frame.columns]
+        if len(keys) == 0:
+            return data_frame
+
+        return data_frame.sort_values(by=keys, kind="stable", ignore_index=True)
+
+    def write(self, data_frame: pandas.DataFrame, path: str):
+        """Writes the table into a parquet file. The file is replaced only when it's completely written
+
+        Parameters
+        ----------
+        data_frame : pandas.DataFrame
+            Table to write
+        path : str
+            Path to the output parquet file
+        """
+        table = pyarrow.Table.from_pandas(self.sort(data_frame), preserve_index=False)
+
+        def _write(tmp_path: str):
+            pq.write_table(table, tmp_path,
+                           row_group_size=self.row_group_size,
+                           **self.writer_options(table.column_names))
+
+        write_atomic(path, _write)
+
+
+PARQUET_PROFILES: typing.Dict[str, ParquetWriterProfile] = {
+    # unsorted gzip tables as written by pandas defaults
+    "gzip": ParquetWriterProfile(compression="gzip"),
+    # sorted tables that are fast to decode and support pruning by sensor id and time
+    "zstd": ParquetWriterProfile(compression="zstd",
+                                 compression_level=3,
+                                 row_group_size=128 * 1024,
+                                 dictionary_columns=["id", "precip_type"],
+                                 sort_by=["id", "timestamp"]),
+    "snappy": ParquetWriterProfile(compression="snappy",
+                                   row_group_size=128 * 1024,
+                                   dictionary_columns=["id", "precip_type"],
+                                   sort_by=["id", "timestamp"]),
+    "lz4": ParquetWriterProfile(compression="lz4",
+                                row_group_size=128 * 1024,
+                                dictionary_columns=["id", "precip_type"],
+                                sort_by=["id", "timestamp"]),
+}
+
+DEFAULT_PARQUET_PROFILE = "gzip"
+
+
+def get_parquet_profile(name: typing.Optional[str] = None) -> ParquetWriterProfile:
+    """Returns writer profile by name. Returns the default profile if `name` is `None`"""
+    name = DEFAULT_PARQUET_PROFILE if name is None else name
+    if name not in PARQUET_PROFILES:
+        raise ValueError(f"Unknown parquet profile {name}, available profiles: {', '.join(PARQUET_PROFILES)}")
+
+    return PARQUET_PROFILES[name]
+
+
+def read_table(path: str,
+               filters: typing.Optional[typing.List[typing.Tuple]] = None,
+               columns: typing.Optional[typing.List[str]] = None) -> pyarrow.Table:
+    """Reads the parquet table
+
+    Parameters
+    ----------
+    path : str
+        Path to the parquet table, local or `s3://` URI. Remote tables are read by ranges of the used row groups
+    filters : List[Tuple] | None
+        Row filters in `pyarrow.parquet.read_table` format
+    columns : List[str] | None
+        Columns to read. Columns that the table doesn't have are skipped. All columns are read if `None`
+
+    Returns
+    -------
+    pyarrow.Table
+        Returns rows of the table that match the filters
+    """
+    if columns is not None:
+        names = storage.parquet_metadata(path).schema.to_arrow_schema().names
+        columns = [column for column in columns if column in names]
+
+    if not storage.is_remote(path):
+        return pq.read_table(path, filters=filters, columns=columns)
+
+    with storage.open_file(path) as file:
+        return pq.read_table(file, filters=filters, columns=columns)
@@ -1,15 +1,121 @@
 import boto3
 import botocore
+import botocore.config
 import os
+import threading
 import typing
 
+from dataclasses import dataclass
 from urllib.parse import urlparse
 
+# Number of connections of the shared client, it limits number of parallel requests of a process
+MAX_POOL_CONNECTIONS = 32
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_shared_clients: typing.Dict[int, typing.Any] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def _reset_shared_clients():
+    # connections of the parent process can't be used by a forked one
+    global _shared_clients_lock
+    _shared_clients.clear()
+    _shared_clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_shared_clients)
+
+
+@dataclass
+class S3Object:
+    key: str    # key of the object in the bucket
+    size: int   # size of the object in bytes
+    etag: str   # entity tag of the object without quotes
+
+
+@dataclass
+class ListWindow:
+    prefix: str         # common prefix of the keys
+    start_after: str    # key to start listing after, so the first key is listed
+    end_key: str        # last key to list
+
+
+def list_window(keys: typing.Collection[str]) -> ListWindow:
+    """Returns window of a listing over the key range of the keys, so objects outside of it cost no requests"""
+    first_key = min(keys)
+    return ListWindow(prefix=os.path.commonprefix(list(keys)), start_after=first_key[:-1], end_key=max(keys))
+
+
+def listed_object(item: typing.Dict[str, typing.Any]) -> S3Object:
+    """Returns object of an item of a `list_objects_v2` response"""
+    return S3Object(key=item["Key"], size=item["Size"], etag=item["ETag"].strip('"'))
+
+
+def parse_s3_uri(s3_uri: str) -> typing.Tuple[str, str]:
+    """Returns bucket name and object key (or prefix) of the S3 URI"""
+    parsed_uri = urlparse(s3_uri)
+    return parsed_uri.netloc, parsed_uri.path.lstrip('/')
+
+
+def shared_s3_client(max_pool_connections: int = MAX_POOL_CONNECTIONS) -> typing.Any:
+    """Returns boto3 S3 client shared by all threads of the process. Clients are thread safe and keep
+    a pool of connections, so one client serves parallel downloads without creating a client per file
+    """
+    with _shared_clients_lock:
+        client = _shared_clients.get(max_pool_connections, None)
+        if client is None:
+            config = botocore.config.Config(max_pool_connections=max_pool_connections)
+            client = boto3.client('s3', config=config)
+            _shared_clients[max_pool_connections] = client
+
+        return client
+
 
 class S3Client:
 
-    def __init__(self):
-        self._client = boto3.client('s3')
+    def __init__(self, client: typing.Any = None):
+        """
+        Parameters
+        ----------
+        client : Any
+            boto3 S3 client to use, e.g. `shared_s3_client()`. A new client is created if `None`
+        """
+        self._client = boto3.client('s3') if client is None else client
+
+    def list_objects(self,
+                     s3_uri: str,
+                     start_after: typing.Optional[str] = None,
+                     end_key: typing.Optional[str] = None) -> typing.Iterator[S3Object]:
+        """Lists objects with keys that start with the URI path, in lexicographical order of keys
+
+        Parameters
+        ----------
+        s3_uri : str
+            S3 URI of the key prefix
+        start_after : str | None
+            Key to start listing after
+        end_key : str | None
+            Last key to list. Listing stops at the first greater key
+
+        Returns
+        -------
+        Iterator[S3Object]
+            Returns listed objects. Pages are requested as they are consumed
+        """
+        bucket_name, prefix = parse_s3_uri(s3_uri)
+
+        params = {"Bucket": bucket_name, "Prefix": prefix}
+        if start_after is not None:
+            params["StartAfter"] = start_after
+
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**params):
+            for item in page.get("Contents", []):
+                if end_key is not None and item["Key"] > end_key:
+                    return
+
+                yield listed_object(item)
 
     def download_file(self,
                       s3_uri: str,
@@ -35,11 +141,7 @@ class S3Client:
         bool
             Returns `True` when file downloaded or already exists; otherwise returns `False`
         """
-        parsed_uri = urlparse(s3_uri)
-
-        # extract the bucket name and object key
-        bucket_name = parsed_uri.netloc
-        object_key = parsed_uri.path.lstrip('/')
+        bucket_name, object_key = parse_s3_uri(s3_uri)
 
         try:
             total_bytes = self._client.head_object(Bucket=bucket_name, Key=object_key)['ContentLength']
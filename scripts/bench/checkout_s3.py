@@ -0,0 +1,325 @@
+"""Measures checkout throughput against a local S3 compatible server.
+
+The script starts a moto server, seeds it with synthetic vendor archives of realistic sizes and cadences
+(2-minute METAR, 10-minute forecasts, large RainViewer snapshots with zoom 7 tiles) and runs the checkout engine
+with the given parameters in three scenarios:
+
+- `cold`: an empty session downloads all archives;
+- `warm`: the same session is checked out again, all archives are up to date;
+- `tiles`: an empty session fetches only the RainViewer tiles of random sensors.
+
+For every scenario it reports checked out objects/s, received MB/s and S3 requests by operation, so changes of the checkout
+engine can be compared on the same data. All snapshots of a vendor share one archive, so the server is seeded
+quickly; archives are stored, not deflated, so their sizes are exact.
+
+Usage:
+    PYTHONPATH=. python scripts/bench/checkout_s3.py [--hours 1] [--scale 0.1] [--output-json before.json]
+"""
+import aioboto3
+import argparse
+import boto3
+import collections
+import io
+import json
+import logging
+import mercantile
+import os
+import pandas
+import random
+import socket
+import tempfile
+import time
+import typing
+import zipfile
+
+from dataclasses import asdict, dataclass, field
+from metrics.checkout.checkout import forecast_download_tasks, rainviewer_selection, sensors_download_tasks
+from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo
+from metrics.checkout.engine import MAX_CONCURRENCY, CheckoutEngine, DownloadTask
+from metrics.checkout.multipart import MULTIPART_THRESHOLD, PART_CONCURRENCY, PART_SIZE
+from metrics.data_vendor import DataVendor
+from metrics.io.rainviewer import RainViewerTileLoader
+from metrics.session import Session
+from moto.server import ThreadedMotoServer
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+BUCKET = "weatherindex-bench"
+# 2025-04-21 11:00:00 UTC
+START_TIME = 1745233200
+# forecast offsets of a RainViewer snapshot, each one has a data tile, the mask tile is shared
+RAINVIEWER_OFFSETS = [0, 10, 20, 30, 40, 50, 60]
+
+
+@dataclass
+class ArchiveProfile:
+    size: int           # size of an archive in bytes
+    members: int        # number of members of a non RainViewer archive
+
+
+# approximate sizes of production archives
+ARCHIVE_PROFILES = {
+    DataVendor.Metar: ArchiveProfile(size=128 * 1024, members=1),
+    DataVendor.AccuWeather: ArchiveProfile(size=4 * 1024 ** 2, members=16),
+    DataVendor.RainbowAi: ArchiveProfile(size=8 * 1024 ** 2, members=16),
+    DataVendor.RainViewer: ArchiveProfile(size=128 * 1024 ** 2, members=0),
+}
+
+SOURCE_FIELDS = {
+    DataVendor.AccuWeather: "s3_uri_accuweather",
+    DataVendor.RainbowAi: "s3_uri_rainbowai",
+    DataVendor.RainViewer: "s3_uri_rainviewer",
+}
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    objects: int = 0            # number of checked out objects, downloaded, cached or up to date
+    downloaded: int = 0         # number of downloaded objects
+    received: int = 0           # bytes of GetObject responses
+    seconds: float = 0.0        # wall time of the checkout
+    requests: typing.Dict[str, int] = field(default_factory=dict)  # number of S3 requests by operation
+
+    @property
+    def objects_per_second(self) -> float:
+        return self.objects / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.received / 1024 ** 2 / self.seconds if self.seconds > 0 else 0.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _pool_slice(pool: bytes, rng: random.Random, size: int) -> bytes:
+    start = rng.randrange(0, max(1, len(pool) - size))
+    return pool[start:start + size]
+
+
+def _archive(vendor: DataVendor, profile: ArchiveProfile, tiles: int, rng: random.Random) -> bytes:
+    """Builds an archive of the profile size, RainViewer archives have data and mask tiles of a `tiles` x `tiles`
+    grid of zoom 7
+    """
+    if vendor == DataVendor.RainViewer:
+        names = []
+        for x in range(tiles):
+            for y in range(tiles):
+                names += [f"{START_TIME}/_map/t{offset}/{RainViewerTileLoader.ZOOM_LEVEL}/{x}/{y}.png"
+                          for offset in RAINVIEWER_OFFSETS]
+                names.append(f"{START_TIME}/_mask/{RainViewerTileLoader.ZOOM_LEVEL}/{x}/{y}.png")
+    else:
+        names = [f"{index}.json" for index in range(profile.members)]
+
+    member_size = max(1, profile.size // len(names))
+    pool = os.urandom(min(profile.size, 4 * 1024 ** 2) + member_size)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name in names:
+            archive.writestr(name, _pool_slice(pool, rng, member_size))
+
+    return buffer.getvalue()
+
+
+def _seed(client: typing.Any, tasks: typing.List[DownloadTask], archives: typing.Dict[str, bytes]):
+    for task in tasks:
+        vendor = os.path.basename(task.download_path)
+        for s3_uri in task.download_uri_list:
+            client.put_object(Bucket=BUCKET, Key=s3_uri[len(f"s3://{BUCKET}/"):], Body=archives[vendor])
+
+
+def _session(session_path: str, args: argparse.Namespace) -> Session:
+    return Session(session_path=session_path,
+                   start_time=START_TIME,
+                   end_time=START_TIME + int(args.hours * 3600),
+                   forecast_range=0)
+
+
+def _tasks(session: Session, vendors: typing.List[DataVendor]) -> typing.List[DownloadTask]:
+    forecasts = ForecastSourcesInfo(**{SOURCE_FIELDS[vendor]: f"s3://{BUCKET}/{vendor.value}/"
+                                       for vendor in vendors if vendor in SOURCE_FIELDS})
+    observations = ObservationSourcesInfo(s3_uri_metar=f"s3://{BUCKET}/{DataVendor.Metar.value}/"
+                                          if DataVendor.Metar in vendors else None)
+
+    return forecast_download_tasks(session=session, forecasts_source=forecasts) + \
+        sensors_download_tasks(session=session, observations_source=observations)
+
+
+def _sensors(tiles: int, count: int, rng: random.Random) -> pandas.DataFrame:
+    """Places sensors at the centers of random tiles of the seeded grid"""
+    lon, lat = [], []
+    for _ in range(count):
+        bounds = mercantile.bounds(rng.randrange(tiles), rng.randrange(tiles), RainViewerTileLoader.ZOOM_LEVEL)
+        lon.append((bounds.west + bounds.east) / 2)
+        lat.append((bounds.south + bounds.north) / 2)
+
+    return pandas.DataFrame({"id": [str(index) for index in range(count)], "lon": lon, "lat": lat})
+
+
+def _run_scenario(name: str,
+                  tasks: typing.List[DownloadTask],
+                  endpoint_url: str,
+                  args: argparse.Namespace) -> ScenarioResult:
+    result = ScenarioResult(scenario=name)
+    requests = collections.Counter()
+
+    def _on_received(parsed: typing.Dict[str, typing.Any], **kwargs):
+        result.received += parsed.get("ContentLength", 0)
+
+    session = aioboto3.Session()
+    session.events.register("before-call.s3", lambda model, **kwargs: requests.update([model.name]))
+    session.events.register("after-call.s3.GetObject", _on_received)
+
+    engine = CheckoutEngine(max_concurrency=args.max_concurrency,
+                            session=session,
+                            endpoint_url=endpoint_url,
+                            multipart_threshold=int(args.multipart_threshold * 1024 ** 2),
+                            part_size=int(args.part_size * 1024 ** 2),
+                            part_concurrency=args.part_concurrency)
+
+    start = time.perf_counter()
+    report = engine.run(tasks)
+    result.seconds = time.perf_counter() - start
+
+    if len(report.failed) > 0:
+        raise RuntimeError(f"Checkout of `{name}` failed for {len(report.failed)} objects, e.g. {report.failed[0]}")
+
+    # objects of the warm run are checked without downloading, they count for its throughput
+    result.objects = report.downloaded + report.cached + report.up_to_date
+    result.downloaded = report.downloaded
+    result.requests = dict(sorted(requests.items()))
+    return result
+
+
+def _run_round(vendors: typing.List[DataVendor],
+               sensors: typing.Optional[pandas.DataFrame],
+               endpoint_url: str,
+               args: argparse.Namespace) -> typing.List[ScenarioResult]:
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        tasks = _tasks(_session(os.path.join(folder, "cold"), args), vendors)
+        results.append(_run_scenario("cold", tasks, endpoint_url, args))
+        results.append(_run_scenario("warm", tasks, endpoint_url, args))
+
+        if sensors is not None:
+            tasks = forecast_download_tasks(session=_session(os.path.join(folder, "tiles"), args),
+                                            forecasts_source=ForecastSourcesInfo(
+                                                s3_uri_rainviewer=f"s3://{BUCKET}/{DataVendor.RainViewer.value}/"),
+                                            rainviewer_tiles=rainviewer_selection(sensors))
+            results.append(_run_scenario("tiles", tasks, endpoint_url, args))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures checkout throughput against a local S3 compatible server")
+    parser.add_argument("--vendors", type=str, nargs="+", default=[vendor.value for vendor in ARCHIVE_PROFILES],
+                        choices=[vendor.value for vendor in ARCHIVE_PROFILES],
+                        help="Vendors to seed and check out")
+    parser.add_argument("--hours", type=float, default=1.0,
+                        help="Time range of the session in hours")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiplier of the archive sizes, e.g. 0.1 for a quick run")
+    parser.add_argument("--rainviewer-tiles", type=int, default=128,
+                        help="Side of the grid of RainViewer tiles, 128 covers the whole zoom 7 like production")
+    parser.add_argument("--sensors", type=int, default=100,
+                        help="Number of sensors of the `tiles` scenario, 0 to skip it")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs of every scenario, the fastest run is reported")
+    parser.add_argument("--output-json", type=str, default=None,
+                        help="Path of a json file with parameters and results to compare runs")
+
+    engine_group = parser.add_argument_group(title="Checkout engine")
+    engine_group.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY,
+                              help="Maximum number of S3 requests in flight")
+    engine_group.add_argument("--multipart-threshold", type=float, default=MULTIPART_THRESHOLD / 1024 ** 2,
+                              help="Objects of this size in MB and larger are downloaded by parts")
+    engine_group.add_argument("--part-size", type=float, default=PART_SIZE / 1024 ** 2,
+                              help="Part size in MB")
+    engine_group.add_argument("--part-concurrency", type=int, default=PART_CONCURRENCY,
+                              help="Maximum number of parts of one object in flight")
+    args = parser.parse_args()
+
+    vendors = [DataVendor(vendor) for vendor in args.vendors]
+    rng = random.Random(0)
+
+    # the server must never get real credentials
+    os.environ.update({"AWS_ACCESS_KEY_ID": "bench",
+                       "AWS_SECRET_ACCESS_KEY": "bench",
+                       "AWS_DEFAULT_REGION": "us-east-1"})
+
+    # the server logs every request otherwise
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    endpoint_url = f"http://127.0.0.1:{port}"
+
+    try:
+        with console.status("Seed archives..."):
+            archives = {}
+            for vendor in vendors:
+                profile = ARCHIVE_PROFILES[vendor]
+                archives[vendor.value] = _archive(vendor=vendor,
+                                                  profile=ArchiveProfile(size=int(profile.size * args.scale),
+                                                                         members=profile.members),
+                                                  tiles=args.rainviewer_tiles,
+                                                  rng=rng)
+
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+            client.create_bucket(Bucket=BUCKET)
+            # only keys of the tasks are used, nothing is written into the session
+            _seed(client, _tasks(_session(tempfile.gettempdir(), args), vendors), archives)
+
+        for vendor in vendors:
+            console.log(f"`{vendor.value}` archive: {len(archives[vendor.value]) / 1024 ** 2:.2f} MB")
+
+        sensors = None
+        if DataVendor.RainViewer in vendors and args.sensors > 0:
+            sensors = _sensors(tiles=args.rainviewer_tiles, count=args.sensors, rng=rng)
+
+        runs = collections.defaultdict(list)
+        for _ in range(args.repeat):
+            for result in _run_round(vendors=vendors, sensors=sensors, endpoint_url=endpoint_url, args=args):
+                runs[result.scenario].append(result)
+    finally:
+        server.stop()
+
+    best = [min(results, key=lambda result: result.seconds) for results in runs.values()]
+
+    operations = sorted({operation for result in best for operation in result.requests})
+    report = Table(title="Checkout throughput")
+    for column in ["scenario", "objects", "downloaded", "received, MB", "time, s", "objects/s", "MB/s"] + operations:
+        report.add_column(column, justify="right")
+
+    for result in best:
+        report.add_row(result.scenario,
+                       str(result.objects),
+                       str(result.downloaded),
+                       f"{result.received / 1024 ** 2:.1f}",
+                       f"{result.seconds:.3f}",
+                       f"{result.objects_per_second:.1f}",
+                       f"{result.mb_per_second:.1f}",
+                       *[str(result.requests.get(operation, 0)) for operation in operations])
+
+    console.print(report)
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as file:
+            json.dump({"parameters": vars(args),
+                       "results": [dict(asdict(result),
+                                        objects_per_second=result.objects_per_second,
+                                        mb_per_second=result.mb_per_second) for result in best]},
+                      file, indent=2)
+        console.log(f"Results are written to {args.output_json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compares parquet writer profiles on parsed tables.
+
+For every profile the tables are rewritten into a temporary folder, then the script measures total size,
+write time, full decode time and the time to read one sensor using row group statistics. Decode throughput
+is the in-memory size of the decoded tables per second, so it doesn't depend on the compression ratio.
+
+Usage:
+    PYTHONPATH=. python scripts/bench/parquet_profiles.py --tables <session>/tables/<vendor> [--limit 100]
+"""
+import argparse
+import os
+import pandas
+import pyarrow.parquet as pq
+import tempfile
+import time
+import typing
+
+from metrics.utils.parquet import PARQUET_PROFILES, ParquetWriterProfile
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+
+def _collect_tables(path: str, limit: typing.Optional[int]) -> typing.List[str]:
+    if os.path.isfile(path):
+        return [path]
+
+    tables = []
+    for root, _, files in os.walk(path):
+        for file_name in sorted(files):
+            if file_name.endswith(".parquet"):
+                tables.append(os.path.join(root, file_name))
+
+    tables = sorted(tables)
+    return tables if limit is None else tables[:limit]
+
+
+def _bench_profile(profile: ParquetWriterProfile,
+                   tables: typing.List[pandas.DataFrame],
+                   sensor_id: typing.Optional[str],
+                   folder: str) -> typing.Dict[str, float]:
+    paths = [os.path.join(folder, f"{index}.parquet") for index in range(len(tables))]
+
+    start = time.perf_counter()
+    for table, path in zip(tables, paths):
+        profile.write(table, path)
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in paths:
+        pq.read_table(path)
+    read_time = time.perf_counter() - start
+
+    sensor_read_time = float("nan")
+    if sensor_id is not None:
+        start = time.perf_counter()
+        for path in paths:
+            pq.read_table(path, filters=[("id", "=", sensor_id)])
+        sensor_read_time = time.perf_counter() - start
+
+    return {"size": sum(os.path.getsize(path) for path in paths),
+            "write": write_time,
+            "read": read_time,
+            "sensor_read": sensor_read_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares parquet writer profiles on parsed tables")
+    parser.add_argument("--tables", type=str, required=True,
+                        help="Path to a parquet table or a folder with tables")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Maximum number of tables to use")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs for every profile, the best run is reported")
+    args = parser.parse_args()
+
+    table_paths = _collect_tables(args.tables, args.limit)
+    if len(table_paths) == 0:
+        console.log(f"No parquet tables found in {args.tables}")
+        return
+
+    tables = [pandas.read_parquet(path) for path in table_paths]
+    rows = sum(len(table) for table in tables)
+    decoded_mb = sum(table.memory_usage(deep=True).sum() for table in tables) / 1024 / 1024
+
+    sensor_id = None
+    for table in tables:
+        if "id" in table.columns and len(table) > 0:
+            sensor_id = table["id"].iloc[len(table) // 2]
+            break
+
+    console.log(f"Loaded {len(tables)} tables with {rows} rows, {decoded_mb:.2f} MB in memory, "
+                f"sensor for filtered reads: {sensor_id}")
+
+    report = Table(title="Parquet writer profiles")
+    for column in ["profile", "size, MB", "write, s", "decode, s", "decode MB/s", "one sensor, s"]:
+        report.add_column(column, justify="right")
+
+    for name, profile in PARQUET_PROFILES.items():
+        runs = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as folder:
+                runs.append(_bench_profile(profile=profile, tables=tables, sensor_id=sensor_id, folder=folder))
+
+        best = {key: min(run[key] for run in runs) for key in runs[0]}
+        size_mb = best["size"] / 1024 / 1024
+        report.add_row(name,
+                       f"{size_mb:.2f}",
+                       f"{best['write']:.3f}",
+                       f"{best['read']:.3f}",
+                       f"{decoded_mb / best['read']:.1f}",
+                       f"{best['sensor_read']:.3f}")
+
+    console.print(report)
+
+
+if __name__ == "__main__":
+    main()
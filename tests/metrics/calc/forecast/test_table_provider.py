@@ -1,9 +1,10 @@
-
+import os
 import pandas
 import pytest
 import typing
 
-from metrics.calc.forecast.table_provider import TableProvider
+from metrics.calc.forecast.table_provider import TableProvider, sensors_fingerprint
+from unittest.mock import patch
 
 
 def _create_sensors_table(data: typing.List[any]) -> pandas.DataFrame:
@@ -64,7 +65,7 @@ class TestAccuWeatherProvider:
         provider = TableProvider(tables_path="test_dir",
                                  snapshot_timestamp=snapshot_timestamp)
 
-        provider._table = mock_table
+        provider._load_table = lambda: mock_table
 
         result = provider.load(sensors_table=sensors_table)
 
@@ -75,3 +76,41 @@ class TestAccuWeatherProvider:
             pandas.testing.assert_frame_equal(result.reset_index(drop=True),
                                               expected_data.reset_index(drop=True),
                                               check_like=True)
+
+    def test_load_lazy(self, tmp_path):
+        table = _create_mock_table([("sensor_1", 0.0, 1, 7300),
+                                    ("sensor_2", 3.0, 2, 8200)])
+        table["lon"] = 23.0
+        table.to_parquet(os.path.join(tmp_path, "7200.parquet"))
+
+        with patch("metrics.calc.forecast.table_provider.TableStore.load_snapshot") as load_snapshot_mock:
+            TableProvider(tables_path=str(tmp_path), snapshot_timestamp=7200)
+            load_snapshot_mock.assert_not_called()
+
+        provider = TableProvider(tables_path=str(tmp_path), snapshot_timestamp=7200)
+        assert provider.memory_usage() == 0
+
+        sensors_table = _create_sensors_table([("sensor_2", 23, 53), ("sensor_3", 23, 54)])
+        result = provider.load(sensors_table=sensors_table)
+
+        # only used columns are loaded and only rows of the sensors are kept
+        assert list(result.columns) == ["id", "timestamp", "precip_rate", "precip_type"]
+        assert result["id"].tolist() == ["sensor_2"]
+        assert provider.memory_usage() == result.memory_usage(index=True, deep=True).sum()
+
+        # filtered table is reused for the same set of sensors, the table is loaded again for other sensors
+        with patch.object(provider, "_load_table", wraps=provider._load_table) as load_mock:
+            assert provider.load(sensors_table=sensors_table.iloc[::-1]) is result
+            load_mock.assert_not_called()
+            other = provider.load(sensors_table=sensors_table.iloc[:1])
+            assert other is not result
+            load_mock.assert_called_once()
+        assert provider.memory_usage() == sum(table.memory_usage(index=True, deep=True).sum()
+                                              for table in [result, other])
+
+    def test_sensors_fingerprint(self):
+        sensors_table = _create_sensors_table([("sensor_1", 23, 52), ("sensor_2", 23, 53)])
+
+        assert sensors_fingerprint(sensors_table) == sensors_fingerprint(sensors_table.iloc[::-1])
+        assert sensors_fingerprint(sensors_table) == sensors_fingerprint(pandas.concat([sensors_table, sensors_table]))
+        assert sensors_fingerprint(sensors_table) != sensors_fingerprint(sensors_table.iloc[:1])
@@ -5,9 +5,11 @@ import pandas
 import pytest
 import typing
 
-from metrics.calc.events import CalculateMetrics, JobParams, Worker
+from metrics.calc.events import CalculateMetrics, JobParams, MetricsWriter, Worker
 from metrics.calc.forecast_manager import ForecastManager
+from metrics.calc.scheduler import PROCESS_MEMORY, ROW_MEMORY, MemoryScheduler
 from metrics.data_vendor import BaseDataVendor, DataVendor
+from metrics.io.catalog import KIND_TABLE, SessionCatalog
 from metrics.session import Session
 from metrics.utils.metric import precision, recall, fscore
 from metrics.utils.precipitation import PrecipitationType
@@ -579,3 +581,79 @@ class TestCalculateMetrics:
         calc = _create_calculate_metrics()
 
         assert calc._calc_sensors_range() == expected_time_range
+
+    @pytest.mark.parametrize("memory_budget, expected_split_time_range", [
+        (8 * (PROCESS_MEMORY + 3600), 3600),
+        (8 * (PROCESS_MEMORY + 1800), 1800),
+        (8 * (PROCESS_MEMORY + 1500), 1200),
+        (8 * PROCESS_MEMORY, 600),
+    ])
+    def test_choose_split_time_range(self, memory_budget: int, expected_split_time_range: int):
+        calc = _create_calculate_metrics()
+        # one byte per second of a job
+        calc._estimate_jobs = lambda jobs: [job.time_range[1] - job.time_range[0] for job in jobs]
+
+        scheduler = MemoryScheduler(memory_budget=memory_budget, process_num=8)
+        assert calc._choose_split_time_range(scheduler=scheduler,
+                                             sensors_ids=[],
+                                             time_range=(0, 7200)) == expected_split_time_range
+
+    def test_estimate_jobs(self, tmp_path):
+        calc = _create_calculate_metrics(session_path=str(tmp_path), forecast_offsets=[0])
+
+        for vendor, snapshots in [(DataVendor.AccuWeather, [0, 600, 7000]), (DataVendor.Metar, [600, 7200])]:
+            folder = os.path.join(tmp_path, "tables", vendor.value)
+            os.makedirs(folder)
+            for snapshot in snapshots:
+                pandas.DataFrame({"id": ["a", "b"], "timestamp": [snapshot, snapshot]}).to_parquet(
+                    os.path.join(folder, f"{snapshot}.parquet"))
+            SessionCatalog(session_path=str(tmp_path)).sync(kind=KIND_TABLE, vendor=vendor.value, folder=folder)
+
+        jobs = calc._create_jobs(sensors_ids=[], time_range=(0, 7200), split_time_range=3600)
+
+        # forecast of 0, 600 and observations of 600 for the first job,
+        # forecast of 0, 600, 7000 and observations of 7200 for the second one
+        assert calc._estimate_jobs(jobs) == [3 * 2 * ROW_MEMORY, 4 * 2 * ROW_MEMORY]
+        assert _create_calculate_metrics()._estimate_jobs(jobs) == [0, 0]
+
+    def test_calculate_failed_job(self, tmp_path):
+        calc = _create_calculate_metrics()
+        calc._selected_sensor_ids = lambda: []
+        calc._calc_sensors_range = lambda: (0, 3 * 3600)
+
+        # the pool runs jobs in the process, the second time range raises
+        pool = MagicMock()
+        pool.__enter__.return_value.imap_unordered = map
+        results = [pandas.DataFrame({"start_time": [0], "tp": [1]}),
+                   RuntimeError("broken table"),
+                   pandas.DataFrame({"start_time": [7200], "tp": [2]})]
+        with patch("metrics.calc.events.multiprocessing.get_context") as context_mock, \
+                patch.object(Worker, "run", side_effect=results):
+            context_mock.return_value.Pool.return_value = pool
+            metrics = calc.calculate(output_csv=str(tmp_path / "metrics.csv"))
+
+        expected = pandas.DataFrame({"start_time": [0, 7200], "tp": [1, 2]})
+        pandas.testing.assert_frame_equal(metrics.reset_index(drop=True), expected)
+        pandas.testing.assert_frame_equal(pandas.read_csv(tmp_path / "metrics.csv"), expected)
+
+
+class TestMetricsWriter:
+
+    @pytest.mark.parametrize("file_name", ["metrics.csv", "metrics.parquet"])
+    def test_append(self, tmp_path, file_name: str):
+        output_path = str(tmp_path / file_name)
+        writer = MetricsWriter(output_csv=output_path)
+        writer.append(pandas.DataFrame({"start_time": [0], "tp": [1]}))
+        writer.append(pandas.DataFrame())
+        writer.append(None)
+        writer.append(pandas.DataFrame({"tp": [2], "start_time": [3600]}))
+        assert writer.failed == 1
+
+        # rows are appended to CSV files as they come, parquet tables are written by `close`
+        assert os.path.exists(output_path) == file_name.endswith(".csv")
+        writer.close()
+
+        expected = pandas.DataFrame({"start_time": [0, 3600], "tp": [1, 2]})
+        read = pandas.read_csv if file_name.endswith(".csv") else pandas.read_parquet
+        pandas.testing.assert_frame_equal(read(output_path).reset_index(drop=True), expected)
+        pandas.testing.assert_frame_equal(writer.metrics().reset_index(drop=True), expected)
@@ -1,12 +1,18 @@
+import os
 import pandas
 import pytest
+import threading
+import time
 import typing
 
 from enum import Enum
 
 from metrics.calc.forecast_manager import ForecastManager, DataVendor
 from metrics.calc.forecast.provider import ForecastProvider
+from metrics.calc.lead_time import LeadTimeFilter
+from metrics.calc.rollup import rollup_folder
 from metrics.data_vendor import BaseDataVendor
+from metrics.io.catalog import KIND_TABLE, SessionCatalog
 from metrics.session import Session
 
 
@@ -70,6 +76,29 @@ class TestForecastManager:
         with pytest.raises(ValueError):
             manager._create_data_provider(0)
 
+    def test_create_data_provider_rollup(self, tmp_path):
+        session = Session(session_path=str(tmp_path), start_time=0, end_time=3600)
+        tables_path = os.path.join(session.tables_folder, DataVendor.AccuWeather.value)
+        rollups_path = rollup_folder(session.tables_folder, DataVendor.AccuWeather, period=600)
+        os.makedirs(tables_path)
+        os.makedirs(rollups_path)
+
+        raw = pandas.DataFrame({"id": ["a"], "timestamp": [60], "precip_rate": [1.0], "precip_type": [1]})
+        binned = pandas.DataFrame({"id": ["a"], "timestamp": [600], "precip_rate": [1.0], "precip_type": [1]})
+        raw.to_parquet(os.path.join(tables_path, "0.parquet"))
+        raw.to_parquet(os.path.join(tables_path, "600.parquet"))
+        binned.to_parquet(os.path.join(rollups_path, "0.parquet"))
+        binned.to_parquet(os.path.join(rollups_path, "600.parquet"))
+        # table re-parsed after its rollup was written
+        os.utime(os.path.join(rollups_path, "600.parquet"), (0, 0))
+
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session, rollup_period=600)
+        assert manager._create_data_provider(0)._load_table()["timestamp"].tolist() == [600]
+        assert manager._create_data_provider(600)._load_table()["timestamp"].tolist() == [60]
+
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session)
+        assert manager._create_data_provider(0)._load_table()["timestamp"].tolist() == [60]
+
     @pytest.mark.parametrize("time_range, sensors_table, provider_data, expected_data", [
         (
             # time_range
@@ -121,3 +150,119 @@ class TestForecastManager:
         pandas.testing.assert_frame_equal(result.reset_index(drop=True),
                                           expected_data.reset_index(drop=True),
                                           check_like=True)
+
+    def test_load_forecast_catalog(self, tmp_path):
+        session = Session(session_path=str(tmp_path), start_time=0, end_time=3600)
+        tables_path = os.path.join(session.tables_folder, DataVendor.AccuWeather.value)
+        os.makedirs(tables_path)
+        data = _create_precip_table(data=[("sensor_1", 10.0, 1, 30)])
+        data.to_parquet(os.path.join(tables_path, "600.parquet"))
+
+        SessionCatalog(session_path=str(tmp_path)).sync(kind=KIND_TABLE,
+                                                        vendor=DataVendor.AccuWeather.value,
+                                                        folder=tables_path)
+
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session)
+        requested = []
+
+        def mock_get_provider_for_timestamp(timestamp: int) -> ForecastProvider:
+            requested.append(timestamp)
+            return MockProvider(timestamp=timestamp, mock_data=data)
+
+        manager._get_provider_for_timestamp = mock_get_provider_for_timestamp
+        manager.load_forecast(time_rage=(0, 1800), sensors_table=_create_sensors_table(data=[("sensor_1", 0, 0)]))
+
+        assert requested == [600]
+
+    def test_load_forecast_lead_times(self):
+        session = Session(session_path="test", start_time=0, end_time=3600)
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session)
+        requested = []
+
+        def mock_get_provider_for_timestamp(timestamp: int) -> ForecastProvider:
+            requested.append(timestamp)
+            return MockProvider(timestamp=timestamp,
+                                mock_data=_create_precip_table(data=[("sensor_1", 10.0, 1, timestamp + 60),
+                                                                     ("sensor_1", 10.0, 1, timestamp + 1200)]))
+
+        manager._get_provider_for_timestamp = mock_get_provider_for_timestamp
+        lead_times = LeadTimeFilter(forecast_times=[0, 600], time_range=(3000, 3600), period=600)
+        result = manager.load_forecast(time_rage=(0, 3600),
+                                       sensors_table=_create_sensors_table(data=[("sensor_1", 0, 0)]),
+                                       lead_times=lead_times)
+
+        # earlier snapshots end before the observations within 10 minutes of lead time
+        assert requested == [3000, 3600]
+        assert result["timestamp"].tolist() == [3060]
+        assert result["forecast_time"].tolist() == [60]
+
+    def test_get_provider_for_timestamp_lru(self):
+        session = Session(session_path="test", start_time=0, end_time=3600)
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session, providers_memory_limit=250)
+
+        class SizedProvider(MockProvider):
+            def memory_usage(self) -> int:
+                return 100
+
+        manager._create_data_provider = lambda timestamp: SizedProvider(timestamp=timestamp, mock_data=None)
+
+        for timestamp in [0, 600, 0, 1200]:
+            manager._get_provider_for_timestamp(timestamp)
+            manager._evict_providers()
+
+        # the least recently used provider is dropped
+        assert list(manager._providers) == [0, 1200]
+        assert manager._memory_usage == 200
+
+    @pytest.mark.parametrize("prefetch_threads", [0, 2])
+    def test_load_forecast_corrupt_table(self, tmp_path, prefetch_threads: int):
+        session = Session(session_path=str(tmp_path), start_time=0, end_time=3600)
+        tables_path = os.path.join(session.tables_folder, DataVendor.AccuWeather.value)
+        os.makedirs(tables_path)
+        _create_precip_table(data=[("sensor_1", 10.0, 1, 1260)]).to_parquet(os.path.join(tables_path, "1200.parquet"))
+        with open(os.path.join(tables_path, "600.parquet"), "w") as file:
+            file.write("not a parquet file")
+
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session,
+                                  prefetch_threads=prefetch_threads)
+        result = manager.load_forecast(time_rage=(600, 1200),
+                                       sensors_table=_create_sensors_table(data=[("sensor_1", 0, 0)]))
+
+        # the snapshot that can't be read is skipped
+        assert result["timestamp"].tolist() == [1260]
+        assert manager._memory_usage == sum(provider.memory_usage() for provider in manager._providers.values())
+
+    @pytest.mark.parametrize("prefetch_threads", [0, 1, 3])
+    def test_load_snapshots_prefetch(self, prefetch_threads: int):
+        session = Session(session_path="test", start_time=0, end_time=3600)
+        manager = ForecastManager(data_vendor=DataVendor.AccuWeather, session=session,
+                                  prefetch_threads=prefetch_threads)
+
+        lock = threading.Lock()
+        loading = []
+        max_loading = []
+
+        class SlowProvider(MockProvider):
+            def load(self, sensors_table: pandas.DataFrame) -> pandas.DataFrame:
+                with lock:
+                    loading.append(self._timestamp)
+                    max_loading.append(len(loading))
+                # later snapshots are loaded faster
+                time.sleep(0.01 * (10 - self._timestamp // 600))
+                with lock:
+                    loading.remove(self._timestamp)
+                return self._mock_data
+
+        manager._create_data_provider = lambda timestamp: SlowProvider(
+            timestamp=timestamp, mock_data=_create_precip_table(data=[("sensor_1", 10.0, 1, timestamp)]))
+
+        snapshots = [600 * index for index in range(8)]
+        loaded = list(manager._load_snapshots(snapshots=snapshots,
+                                              sensors_table=_create_sensors_table(data=[("sensor_1", 0, 0)])))
+
+        # results come in time order and no more than `prefetch_threads` snapshots are loaded at once
+        assert [snapshot for snapshot, _, _ in loaded] == snapshots
+        assert [data["timestamp"].tolist() for _, _, data in loaded] == [[snapshot] for snapshot in snapshots]
+        assert max(max_loading) <= max(prefetch_threads, 1)
+        if prefetch_threads > 1:
+            assert max(max_loading) > 1
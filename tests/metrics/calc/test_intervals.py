@@ -0,0 +1,67 @@
+import numpy as np
+import pandas
+import pytest
+
+from metrics.calc.intervals import END_TIMESTAMP_COLUMN, bin_intervals, expand_intervals
+
+
+def _create_intervals(seed: int, snapshot: int) -> pandas.DataFrame:
+    rng = np.random.default_rng(seed)
+    size = 200
+    start = snapshot + rng.integers(0, 120, size=size) * 60
+    end = (start + rng.integers(1, 40, size=size) * 60).astype(np.float64)
+    end[rng.random(size=size) < 0.1] = np.nan  # point rows of tables parsed before intervals
+    return pandas.DataFrame({
+        "id": rng.choice(["a", "b"], size=size),
+        "timestamp": start,
+        END_TIMESTAMP_COLUMN: end,
+        "forecast_time": start - snapshot,
+        "precip_rate": rng.random(size=size),
+        "precip_type": rng.choice([1, 2], size=size),
+    })
+
+
+def _binned_max(data: pandas.DataFrame, period: int, offset: int) -> pandas.DataFrame:
+    data = data.copy()
+    for column in ["timestamp", "forecast_time"]:
+        data[column] = (np.ceil((data[column] + offset) / period) * period).astype(np.int64)
+
+    return data.groupby(["id", "timestamp", "forecast_time", "precip_type"]).agg({
+        "precip_rate": "max"
+    }).reset_index()
+
+
+class TestIntervals:
+
+    def test_expand_intervals(self):
+        data = pandas.DataFrame({"id": ["a", "b"],
+                                 "timestamp": [0, 600],
+                                 END_TIMESTAMP_COLUMN: [180, np.nan],
+                                 "precip_rate": [1.0, 2.0]})
+
+        result = expand_intervals(data)
+
+        assert result.columns.tolist() == ["id", "timestamp", "precip_rate"]
+        assert result["timestamp"].tolist() == [0, 60, 120, 600]
+        assert result["precip_rate"].tolist() == [1.0, 1.0, 1.0, 2.0]
+
+    def test_bin_intervals(self):
+        data = pandas.DataFrame({"id": ["a"], "timestamp": [0], END_TIMESTAMP_COLUMN: [1800], "precip_rate": [1.0]})
+
+        result = bin_intervals(data, period=600)
+
+        # first points of bins (-600, 0], (0, 600], (600, 1200], (1200, 1800]
+        assert result["timestamp"].tolist() == [0, 60, 660, 1260]
+        assert result["precip_rate"].tolist() == [1.0] * 4
+
+    @pytest.mark.parametrize("seed", [0, 1])
+    @pytest.mark.parametrize("snapshot", [1711360800, 1711360800 + 420])
+    @pytest.mark.parametrize("period, offset", [(600, 0), (600, -600), (600, 300), (300, 0), (900, 60)])
+    def test_bin_intervals_equivalence(self, seed: int, snapshot: int, period: int, offset: int):
+        data = _create_intervals(seed=seed, snapshot=snapshot)
+
+        expected = _binned_max(expand_intervals(data), period=period, offset=offset)
+        binned = bin_intervals(data, period=period, offset=offset)
+
+        assert len(binned) < len(expand_intervals(data))
+        pandas.testing.assert_frame_equal(_binned_max(binned, period=period, offset=offset), expected)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas
+import pytest
+
+from metrics.calc.intervals import expand_intervals
+from metrics.calc.lead_time import LeadTimeFilter
+
+
+def _align(values: np.ndarray, period: int, offset: int) -> np.ndarray:
+    return (np.ceil((values + offset) / period) * period).astype(np.int64)
+
+
+def _usable(data: pandas.DataFrame, lead_times: LeadTimeFilter) -> pandas.Series:
+    """Rows that calc keeps after alignment"""
+    observations = np.arange(lead_times.time_range[0] + 60, lead_times.time_range[1] + 1, 60)
+    aligned_observations = set(_align(observations, lead_times.period, lead_times.offset))
+
+    forecast_times = _align(data["forecast_time"].to_numpy(), lead_times.period, lead_times.offset)
+    timestamps = _align(data["timestamp"].to_numpy(), lead_times.period, lead_times.offset)
+    return pandas.Series(np.isin(forecast_times, lead_times.forecast_times) &
+                         np.isin(timestamps, list(aligned_observations)), index=data.index)
+
+
+class TestLeadTimeFilter:
+
+    def test_windows(self):
+        lead_times = LeadTimeFilter(forecast_times=[1800, 0, 600, 3600], time_range=(0, 3600), period=600, offset=60)
+        assert lead_times.windows() == [(-660, 540), (1140, 1740), (2940, 3540)]
+
+    @pytest.mark.parametrize("forecast_times, offset", [
+        ([0, 1800, 3600], 0),
+        ([600, 1200], 0),
+        ([0, 1800, 3600], 300),
+        ([1200], -600),
+    ])
+    def test_filter(self, forecast_times, offset):
+        lead_times = LeadTimeFilter(forecast_times=forecast_times, time_range=(6600, 10800), period=600, offset=offset)
+
+        rows = []
+        for snapshot in range(0, 12000, 600):
+            for forecast_time in range(-120, 7200, 60):
+                rows.append((snapshot + forecast_time, forecast_time, snapshot))
+        data = pandas.DataFrame(data=rows, columns=["timestamp", "forecast_time", "snapshot"])
+
+        usable = _usable(data, lead_times)
+        filtered = lead_times.filter(data)
+
+        # all usable rows are kept and nothing else
+        assert filtered.index.tolist() == data.index[usable].tolist()
+
+        # snapshots without usable rows are skipped, others are loaded
+        usable_snapshots = set(data.loc[usable, "snapshot"])
+        for snapshot in range(0, 12000, 600):
+            if snapshot in usable_snapshots:
+                assert lead_times.can_contribute(snapshot)
+        assert sum(lead_times.can_contribute(snapshot) for snapshot in range(0, 12000, 600)) < 20
+
+    def test_filter_intervals(self):
+        lead_times = LeadTimeFilter(forecast_times=[0, 1800], time_range=(600, 4200), period=600)
+
+        data = pandas.DataFrame({
+            "timestamp": [600, 1200, 2700, 4800, 3000],
+            "end_timestamp": [1200, 2400, 3000, 5400, np.nan],
+            "forecast_time": [0, 600, 2100, 4200, 2400],
+        })
+
+        filtered = lead_times.filter(data)
+
+        points = expand_intervals(data.assign(row=data.index))
+        usable_rows = set(points.loc[_usable(points, lead_times), "row"])
+        assert sorted(usable_rows) == [1]
+
+        # intervals are kept whole when their lead times and timestamps can be used
+        assert filtered.index.tolist() == [0, 1]
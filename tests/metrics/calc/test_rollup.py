@@ -0,0 +1,115 @@
+import numpy as np
+import pandas
+import pytest
+
+from metrics.calc.events import JobParams, Worker
+from metrics.calc.forecast_manager import ForecastManager
+from metrics.calc.intervals import END_TIMESTAMP_COLUMN, expand_intervals
+from metrics.calc.rollup import can_use_rollups, rollup_table
+from metrics.data_vendor import DataVendor
+from metrics.utils.precipitation import PrecipitationType
+
+SNAPSHOT = 1711360800
+
+
+def _create_worker(observations_offset: int) -> Worker:
+    return Worker(params=JobParams(forecast_vendor=DataVendor.AccuWeather,
+                                   observation_vendor=DataVendor.Metar,
+                                   sensor_ids=[],
+                                   forecast_offsets=[0, 600, 1200],
+                                   threshold=0.1,
+                                   precip_types=[PrecipitationType.RAIN.value],
+                                   session_path="test",
+                                   time_range=(SNAPSHOT, SNAPSHOT + 3600),
+                                   observations_offset=observations_offset))
+
+
+def _create_table(seed: int) -> pandas.DataFrame:
+    rng = np.random.default_rng(seed)
+    size = 300
+    precip_types = [PrecipitationType.RAIN.value, PrecipitationType.SNOW.value, None]
+    return pandas.DataFrame({
+        "id": rng.choice(["a", "b", "c"], size=size),
+        "timestamp": SNAPSHOT + rng.integers(0, 2400, size=size),
+        "precip_rate": rng.choice([0.0, 0.05, 0.5, 2.0], size=size),
+        "precip_type": rng.choice(precip_types, size=size),
+    })
+
+
+def _with_forecast_time(table: pandas.DataFrame) -> pandas.DataFrame:
+    table = table.copy()
+    table["forecast_time"] = table["timestamp"] - SNAPSHOT
+    return table
+
+
+class TestRollup:
+
+    def test_rollup_table(self):
+        table = pandas.DataFrame(columns=["id", "timestamp", "precip_rate", "precip_type"], data=[
+            ("a", 600, 1.0, PrecipitationType.RAIN.value),
+            ("a", 300, 2.0, PrecipitationType.RAIN.value),
+            ("a", 301, 3.0, PrecipitationType.SNOW.value),
+            ("a", 601, 4.0, None),
+            ("a", 1200, 5.0, None),
+        ])
+
+        result = rollup_table(table, period=600).sort_values(by=["timestamp", "precip_rate"], ignore_index=True)
+
+        assert result["timestamp"].tolist() == [600, 600, 1200]
+        assert result["precip_rate"].tolist() == [2.0, 3.0, 5.0]
+        assert result["precip_type"].tolist()[:2] == [PrecipitationType.RAIN.value, PrecipitationType.SNOW.value]
+        assert pandas.isna(result["precip_type"].iloc[2])
+
+    def test_rollup_table_intervals(self):
+        table = pandas.DataFrame(columns=["id", "timestamp", END_TIMESTAMP_COLUMN, "precip_rate", "precip_type"], data=[
+            ("a", 0, 1800, 1.0, PrecipitationType.RAIN.value),
+            ("a", 540, 720, 2.0, PrecipitationType.RAIN.value),
+            ("b", 60, 120, 3.0, PrecipitationType.SNOW.value),
+        ])
+        columns = ["id", "timestamp", "precip_type", "precip_rate"]
+
+        result = rollup_table(table).sort_values(by=columns, ignore_index=True)
+        expected = rollup_table(expand_intervals(table)).sort_values(by=columns, ignore_index=True)
+
+        pandas.testing.assert_frame_equal(result, expected)
+        assert result["timestamp"].tolist() == [0, 600, 1200, 1800, 600]
+        assert result["precip_rate"].tolist() == [1.0, 2.0, 2.0, 1.0, 3.0]
+
+    @pytest.mark.parametrize("group_period, observations_offset, data_step, expected", [
+        (600, 0, 600, True),
+        (600, -600, 600, True),
+        (600, 1200, 1800, True),
+        (300, 0, 600, False),
+        (1200, 0, 600, False),
+        (600, 300, 600, False),
+        (600, 0, 300, False),
+    ])
+    def test_can_use_rollups(self, group_period: int, observations_offset: int, data_step: int, expected: bool):
+        assert can_use_rollups(group_period=group_period,
+                               observations_offset=observations_offset,
+                               data_step=data_step) == expected
+
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    @pytest.mark.parametrize("observations_offset", [0, 600, -600])
+    def test_calculate_equivalence(self, seed: int, observations_offset: int):
+        assert can_use_rollups(group_period=600,
+                               observations_offset=observations_offset,
+                               data_step=ForecastManager.DATA_STEP)
+
+        table = _create_table(seed)
+        observations = _create_table(seed + 100).drop(columns=["precip_type"])
+        observations["precip_type"] = PrecipitationType.RAIN.value
+
+        worker = _create_worker(observations_offset=observations_offset)
+        columns = ["id", "timestamp", "forecast_time", "tp", "tn", "fp", "fn"]
+
+        expected = worker._calculate(forecast_times=[0, 600, 1200],
+                                     observations=observations,
+                                     forecast=_with_forecast_time(table))
+        result = worker._calculate(forecast_times=[0, 600, 1200],
+                                   observations=observations,
+                                   forecast=_with_forecast_time(rollup_table(table)))
+
+        assert len(expected) > 0
+        pandas.testing.assert_frame_equal(result[columns].sort_values(by=columns, ignore_index=True),
+                                          expected[columns].sort_values(by=columns, ignore_index=True))
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from metrics.calc.scheduler import ARCHIVE_MEMORY_RATIO, PROCESS_MEMORY, ROW_MEMORY, MemoryScheduler, entries_memory
+from metrics.io.catalog import CatalogEntry
+from multiprocessing.pool import ThreadPool
+
+MB = 1024 ** 2
+
+
+class TestMemoryScheduler:
+
+    def test_entries_memory(self):
+        entries = [CatalogEntry(kind="table", vendor="vendor", snapshot=0, path="0.parquet", size=10, rows=100),
+                   CatalogEntry(kind="archive", vendor="vendor", snapshot=0, path="0.zip", size=10)]
+
+        assert entries_memory(entries) == 100 * ROW_MEMORY + 10 * ARCHIVE_MEMORY_RATIO
+
+    def test_record(self):
+        scheduler = MemoryScheduler(memory_budget=1024 * MB, process_num=4)
+        assert scheduler.expected_memory(100 * MB) == PROCESS_MEMORY + 100 * MB
+        assert scheduler.expected_memory(0) == PROCESS_MEMORY
+
+        scheduler.record(estimate=100 * MB, peak_rss=PROCESS_MEMORY + 300 * MB)
+        assert scheduler.expected_memory(100 * MB) == PROCESS_MEMORY + 300 * MB
+        assert scheduler.expected_memory(0) == PROCESS_MEMORY + 300 * MB
+
+        # the scale is refined by all finished jobs
+        scheduler.record(estimate=100 * MB, peak_rss=PROCESS_MEMORY + 200 * MB)
+        assert scheduler.expected_memory(100 * MB) == PROCESS_MEMORY + 250 * MB
+
+        # a small job whose memory is mostly the process itself doesn't blow the scale up
+        scheduler.record(estimate=1024, peak_rss=PROCESS_MEMORY + 50 * MB)
+        assert scheduler.expected_memory(100 * MB) < PROCESS_MEMORY + 300 * MB
+        assert scheduler.expected_memory(0) == PROCESS_MEMORY + 300 * MB
+
+        assert not scheduler.fits(100 * MB)
+        assert MemoryScheduler(memory_budget=4 * PROCESS_MEMORY, process_num=4).fits(0)
+
+    def test_run(self):
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def _run_job(job: int):
+            with lock:
+                running.append(job)
+                max_running.append(sum(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(job)
+            return job, PROCESS_MEMORY + job * MB
+
+        # jobs of 100 MB fit by two, the job of 1000 MB runs alone
+        jobs = [100, 100, 100, 1000, 100, 100]
+        scheduler = MemoryScheduler(memory_budget=2 * PROCESS_MEMORY + 250 * MB, process_num=4)
+        with ThreadPool(processes=4) as pool:
+            results = list(scheduler.run(pool=pool,
+                                         func=_run_job,
+                                         jobs=jobs,
+                                         estimates=[job * MB for job in jobs]))
+
+        assert sorted(results) == sorted(jobs)
+        assert max(max_running) == 1000
+        assert sorted(set(max_running)) == [100, 200, 1000]
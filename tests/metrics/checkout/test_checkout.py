@@ -1,7 +1,9 @@
+import mercantile
+import pandas
 import pytest
 import typing
 
-from metrics.checkout.checkout import _build_snapshot_list, _build_s3_download_list
+from metrics.checkout.checkout import _build_snapshot_list, _build_s3_download_list, rainviewer_selection
 
 
 class TestCheckout:
@@ -48,3 +50,20 @@ class TestCheckout:
             expected_uris: typing.List[str]):
         uris = _build_s3_download_list(snaphots=snaphots, s3_uri=s3_uri, rule=rule)
         assert uris == expected_uris
+
+    def test_rainviewer_selection(self):
+        sensors = pandas.DataFrame({"id": ["a", "b", "c"], "lon": [0.1, 0.2, -120.0], "lat": [51.5, 51.5, 40.0]})
+        selection = rainviewer_selection(sensors)
+
+        tile = mercantile.tile(0.1, 51.5, 7)
+        assert selection.accept(f"1700000000/_map/t10/7/{tile.x}/{tile.y}.png")
+        assert selection.accept(f"1700000000/_mask/7/{tile.x}/{tile.y}.png")
+        assert not selection.accept(f"1700000000/_map/t10/7/{tile.x + 1}/{tile.y}.png")
+        assert not selection.accept(f"1700000000/_map/t10/6/{tile.x}/{tile.y}.png")
+
+        # fingerprint depends on the tiles only
+        assert selection.fingerprint == rainviewer_selection(sensors.iloc[[1, 0, 2]]).fingerprint
+        assert selection.fingerprint != rainviewer_selection(sensors.iloc[:2]).fingerprint
+
+        assert rainviewer_selection(sensors[["id"]]) is None
+        assert rainviewer_selection(sensors.iloc[:0]) is None
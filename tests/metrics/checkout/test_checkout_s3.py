@@ -0,0 +1,451 @@
+import asyncio
+import aioboto3
+import boto3
+import botocore.exceptions
+import io
+import mercantile
+import numpy as np
+import os
+import pandas
+import pytest
+import socket
+import zipfile
+
+from metrics.checkout.checkout import _build_download_task, rainviewer_selection
+from metrics.checkout.engine import CheckoutEngine, DownloadListener, backoff_delay, is_retryable
+from metrics.checkout.manifest import MANIFEST_FILE_NAME, CheckoutManifest
+from metrics.checkout.multipart import PartCheckpoint
+from metrics.io.data_cache import DataCache
+from metrics.io.rainviewer import RainViewerTileLoader
+from moto.server import ThreadedMotoServer
+from unittest.mock import patch
+
+BUCKET = "rainbow-test"
+IO_DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "io")
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_client(s3_endpoint):
+    with patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test",
+                                 "AWS_SECRET_ACCESS_KEY": "test",
+                                 "AWS_DEFAULT_REGION": "us-east-1"}):
+        client = boto3.client("s3", endpoint_url=s3_endpoint)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+        for item in client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+            client.delete_object(Bucket=BUCKET, Key=item["Key"])
+        client.delete_bucket(Bucket=BUCKET)
+
+
+def _session(operations: list) -> aioboto3.Session:
+    session = aioboto3.Session()
+    session.events.register("before-call.s3", lambda model, **kwargs: operations.append(model.name))
+    return session
+
+
+def _task(download_path: str, prefix: str = "forecast"):
+    return _build_download_task(name=prefix,
+                                s3_uri=f"s3://{BUCKET}/{prefix}/",
+                                download_path=download_path,
+                                start_time=0,
+                                end_time=1800,
+                                period=600,
+                                rule="timestamp")
+
+
+class TestCheckoutS3:
+
+    def test_download(self, s3_client, s3_endpoint, tmp_path):
+        for snapshot in [0, 600, 1800, 2400]:
+            s3_client.put_object(Bucket=BUCKET, Key=f"forecast/{snapshot}.zip", Body=f"data {snapshot}".encode())
+        s3_client.put_object(Bucket=BUCKET, Key="other/600.zip", Body=b"other")
+
+        operations = []
+        engine = CheckoutEngine(session=_session(operations), endpoint_url=s3_endpoint)
+
+        def _download():
+            operations.clear()
+            return engine.run([_task(str(tmp_path))])
+
+        report = _download()
+
+        # missing 1200 snapshot costs no requests, objects are downloaded without `head_object`
+        assert (report.downloaded, report.up_to_date, report.missing, report.failed) == (3, 0, 1, [])
+        assert sorted(os.listdir(tmp_path)) == ["0.zip", "1800.zip", "600.zip", MANIFEST_FILE_NAME]
+        assert sorted(operations) == ["GetObject"] * 3 + ["ListObjectsV2"]
+        with open(os.path.join(tmp_path, "600.zip"), "rb") as file:
+            assert file.read() == b"data 600"
+
+        report = _download()
+        assert (report.downloaded, report.up_to_date) == (0, 3)
+        assert operations == ["ListObjectsV2"]
+
+        # object with the same size and another content is downloaded again
+        s3_client.put_object(Bucket=BUCKET, Key="forecast/600.zip", Body=b"DATA 600")
+        _download()
+        assert sorted(operations) == ["GetObject", "ListObjectsV2"]
+        with open(os.path.join(tmp_path, "600.zip"), "rb") as file:
+            assert file.read() == b"DATA 600"
+
+    def test_listener(self, s3_client, s3_endpoint, tmp_path):
+        for snapshot in [0, 600, 1800]:
+            s3_client.put_object(Bucket=BUCKET, Key=f"forecast/{snapshot}.zip", Body=f"data {snapshot}".encode())
+
+        class _Listener(DownloadListener):
+            def __init__(self):
+                self.slots = None
+                self.files = []
+                self.max_reserved = 0
+
+            async def reserve(self, file_path: str):
+                if self.slots is None:
+                    self.slots = asyncio.Semaphore(1)
+                await self.slots.acquire()
+                self.max_reserved = max(self.max_reserved, 1 - self.slots._value)
+
+            async def ready(self, file_path: str, ok: bool):
+                self.files.append((os.path.basename(file_path), ok, os.path.exists(file_path)))
+                self.slots.release()
+
+        engine = CheckoutEngine(session=_session([]), endpoint_url=s3_endpoint)
+        listener = _Listener()
+        engine.run([_task(str(tmp_path))], listener=listener)
+
+        # files are announced once in the task order, the next file waits for the slot of the previous one
+        assert listener.files == [("0.zip", True, True), ("600.zip", True, True),
+                                  ("1200.zip", False, False), ("1800.zip", True, True)]
+        assert listener.max_reserved == 1
+
+        # up to date files are announced too
+        listener = _Listener()
+        engine.run([_task(str(tmp_path))], listener=listener)
+        assert [ok for _, ok, _ in listener.files] == [True, True, False, True]
+
+    def test_retries(self, s3_client, s3_endpoint, tmp_path):
+        for prefix in ["forecast", "metar"]:
+            for snapshot in [0, 600, 1200, 1800]:
+                s3_client.put_object(Bucket=BUCKET, Key=f"{prefix}/{snapshot}.zip", Body=b"data")
+
+        attempts = {}
+
+        def _fail(params, **kwargs):
+            key = params["Key"]
+            attempts[key] = attempts.get(key, 0) + 1
+            # every object fails once, one object fails always
+            if attempts[key] == 1 or key == "metar/1200.zip":
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url=s3_endpoint)
+
+        session = aioboto3.Session()
+        session.events.register("before-parameter-build.s3.GetObject", _fail)
+        engine = CheckoutEngine(retries=2,
+                                backoff_base=0.001,
+                                session=session,
+                                endpoint_url=s3_endpoint)
+        report = engine.run([_task(os.path.join(tmp_path, "forecast"), "forecast"),
+                             _task(os.path.join(tmp_path, "metar"), "metar")])
+
+        assert report.downloaded == 7
+        assert report.failed == [f"s3://{BUCKET}/metar/1200.zip"]
+        assert attempts["metar/1200.zip"] == 3
+        assert not os.path.exists(os.path.join(tmp_path, "metar", "1200.zip"))
+        assert not os.path.exists(os.path.join(tmp_path, "metar", "1200.zip.tmp"))
+
+        # failed object is downloaded by the next run
+        report = CheckoutEngine(session=_session([]), endpoint_url=s3_endpoint).run(
+            [_task(os.path.join(tmp_path, "metar"), "metar")])
+        assert (report.downloaded, report.up_to_date, report.failed) == (1, 3, [])
+
+    def test_max_concurrency(self, s3_client, s3_endpoint, tmp_path):
+        for prefix in ["forecast", "metar"]:
+            for snapshot in [0, 600, 1200, 1800]:
+                s3_client.put_object(Bucket=BUCKET, Key=f"{prefix}/{snapshot}.zip", Body=b"data")
+
+        in_flight = [0, 0]  # current and maximum number of requests in flight
+
+        async def _before_call(**kwargs):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            await asyncio.sleep(0.01)
+
+        def _after_call(**kwargs):
+            in_flight[0] -= 1
+
+        session = aioboto3.Session()
+        session.events.register("before-call.s3.GetObject", _before_call)
+        session.events.register("after-call.s3.GetObject", _after_call)
+
+        engine = CheckoutEngine(max_concurrency=2, session=session, endpoint_url=s3_endpoint)
+        report = engine.run([_task(os.path.join(tmp_path, "forecast"), "forecast"),
+                             _task(os.path.join(tmp_path, "metar"), "metar")])
+
+        assert report.downloaded == 8
+        assert in_flight[1] == 2
+
+    def test_cache(self, s3_client, s3_endpoint, tmp_path):
+        for snapshot in [0, 600, 1200, 1800]:
+            s3_client.put_object(Bucket=BUCKET, Key=f"forecast/{snapshot}.zip", Body=b"data")
+
+        operations = []
+        cache = DataCache(folder=os.path.join(tmp_path, "cache"))
+        engine = CheckoutEngine(session=_session(operations), endpoint_url=s3_endpoint, cache=cache)
+
+        report = engine.run([_task(os.path.join(tmp_path, "session_a"))])
+        assert (report.downloaded, report.cached) == (4, 0)
+
+        # another session links cached objects, only changed object is downloaded
+        s3_client.put_object(Bucket=BUCKET, Key="forecast/600.zip", Body=b"DATA")
+        operations.clear()
+        report = engine.run([_task(os.path.join(tmp_path, "session_b"))])
+        assert (report.downloaded, report.cached) == (1, 3)
+        assert sorted(operations) == ["GetObject", "ListObjectsV2"]
+
+        with open(os.path.join(tmp_path, "session_b", "600.zip"), "rb") as file:
+            assert file.read() == b"DATA"
+        with open(os.path.join(tmp_path, "session_a", "600.zip"), "rb") as file:
+            assert file.read() == b"data"
+
+        # linked files are up to date in the session manifest
+        report = engine.run([_task(os.path.join(tmp_path, "session_b"))])
+        assert (report.downloaded, report.cached, report.up_to_date) == (0, 0, 4)
+
+    def test_download_by_parts(self, s3_client, s3_endpoint, tmp_path):
+        content = os.urandom(1000)
+        s3_client.put_object(Bucket=BUCKET, Key="forecast/0.zip", Body=content)
+
+        ranges = []
+        fail_ranges = {"bytes=256-511", "bytes=768-999"}
+
+        def _get_object(params, **kwargs):
+            ranges.append(params.get("Range", None))
+            if params.get("Range", None) in fail_ranges:
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url=s3_endpoint)
+
+        session = aioboto3.Session()
+        session.events.register("before-parameter-build.s3.GetObject", _get_object)
+
+        def _download():
+            ranges.clear()
+            engine = CheckoutEngine(retries=1,
+                                    backoff_base=0.001,
+                                    session=session,
+                                    endpoint_url=s3_endpoint,
+                                    multipart_threshold=100,
+                                    part_size=256,
+                                    part_concurrency=2)
+            return engine.run([_build_download_task(name="forecast",
+                                                    s3_uri=f"s3://{BUCKET}/forecast/",
+                                                    download_path=str(tmp_path),
+                                                    start_time=0,
+                                                    end_time=0,
+                                                    period=600,
+                                                    rule="timestamp")])
+
+        report = _download()
+        assert report.failed == [f"s3://{BUCKET}/forecast/0.zip"]
+        assert sorted(set(ranges)) == ["bytes=0-255", "bytes=256-511", "bytes=512-767", "bytes=768-999"]
+        assert not os.path.exists(os.path.join(tmp_path, "0.zip"))
+
+        # next run resumes with the failed parts
+        fail_ranges.clear()
+        report = _download()
+        assert (report.downloaded, report.failed) == (1, [])
+        assert sorted(ranges) == ["bytes=256-511", "bytes=768-999"]
+        assert sorted(os.listdir(tmp_path)) == ["0.zip", MANIFEST_FILE_NAME]
+        with open(os.path.join(tmp_path, "0.zip"), "rb") as file:
+            assert file.read() == content
+
+    def test_download_by_parts_changed_object(self, s3_client, s3_endpoint, tmp_path):
+        s3_client.put_object(Bucket=BUCKET, Key="forecast/0.zip", Body=b"a" * 1000)
+
+        def _change_object(params, **kwargs):
+            if params.get("Range", None) == "bytes=512-767":
+                s3_client.put_object(Bucket=BUCKET, Key="forecast/0.zip", Body=b"b" * 1000)
+
+        session = aioboto3.Session()
+        session.events.register("before-parameter-build.s3.GetObject", _change_object)
+        engine = CheckoutEngine(session=session,
+                                endpoint_url=s3_endpoint,
+                                multipart_threshold=100,
+                                part_size=256,
+                                part_concurrency=1)
+        report = engine.run([_task(str(tmp_path))])
+
+        # parts of another version fail the precondition
+        assert report.failed == [f"s3://{BUCKET}/forecast/0.zip"]
+        assert not os.path.exists(os.path.join(tmp_path, "0.zip"))
+
+    def test_download_by_parts_corrupt_checkpoint(self, s3_client, s3_endpoint, tmp_path):
+        # object uploaded by parts has ETag of MD5 of the part MD5s, S3 parts are 5 MB at least
+        content = os.urandom(5 * 1024 ** 2 + 1000)
+        upload_id = s3_client.create_multipart_upload(Bucket=BUCKET, Key="forecast/0.zip")["UploadId"]
+        parts = []
+        for number, start in enumerate([0, 5 * 1024 ** 2], start=1):
+            response = s3_client.upload_part(Bucket=BUCKET, Key="forecast/0.zip", UploadId=upload_id,
+                                             PartNumber=number, Body=content[start:start + 5 * 1024 ** 2])
+            parts.append({"ETag": response["ETag"], "PartNumber": number})
+        s3_client.complete_multipart_upload(Bucket=BUCKET, Key="forecast/0.zip", UploadId=upload_id,
+                                            MultipartUpload={"Parts": parts})
+        etag = s3_client.head_object(Bucket=BUCKET, Key="forecast/0.zip")["ETag"].strip('"')
+        assert etag.endswith("-2")
+
+        # the checkpoint has a done part whose data never reached the disk
+        file_path = os.path.join(tmp_path, "0.zip")
+        checkpoint = PartCheckpoint(file_path=file_path, size=len(content), etag=etag, part_size=1024 ** 2)
+        checkpoint.mark_done(0)
+
+        engine = CheckoutEngine(session=_session([]),
+                                endpoint_url=s3_endpoint,
+                                multipart_threshold=100,
+                                part_size=1024 ** 2)
+        report = engine.run([_task(str(tmp_path))])
+        assert report.failed == [f"s3://{BUCKET}/forecast/0.zip"]
+        assert os.listdir(tmp_path) == [MANIFEST_FILE_NAME]
+
+        # the failed download drops the progress, so the next run downloads all parts
+        report = engine.run([_task(str(tmp_path))])
+        assert (report.downloaded, report.failed) == (1, [])
+        with open(file_path, "rb") as file:
+            assert file.read() == content
+
+    def test_download_zip_members(self, s3_client, s3_endpoint, tmp_path):
+        with open(os.path.join(IO_DATA_DIRECTORY, "rainviewer_data.png"), "rb") as file:
+            data_png = file.read()
+        with open(os.path.join(IO_DATA_DIRECTORY, "rainviewer_mask.png"), "rb") as file:
+            mask_png = file.read()
+
+        sensors = pandas.DataFrame({"id": ["a", "b"], "lon": [0.1, 30.5], "lat": [51.5, 50.4]})
+        tiles = {(tile.x, tile.y) for tile in (mercantile.tile(lon, lat, 7)
+                                               for lon, lat in zip(sensors["lon"], sensors["lat"]))}
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for x in range(60, 90):
+                for y in range(30, 50):
+                    for offset in [0, 10]:
+                        content = data_png if (x, y) in tiles else os.urandom(200)
+                        archive.writestr(f"0/_map/t{offset}/7/{x}/{y}.png", content)
+                    archive.writestr(f"0/_mask/7/{x}/{y}.png", mask_png if (x, y) in tiles else os.urandom(200))
+        s3_client.put_object(Bucket=BUCKET, Key="rainviewer/0.zip", Body=buffer.getvalue())
+
+        ranges = []
+        session = aioboto3.Session()
+        session.events.register("before-parameter-build.s3.GetObject",
+                                lambda params, **kwargs: ranges.append(params.get("Range", None)))
+
+        selection = rainviewer_selection(sensors)
+        engine = CheckoutEngine(session=session, endpoint_url=s3_endpoint)
+
+        def _download():
+            ranges.clear()
+            return engine.run([_build_download_task(name="rainviewer",
+                                                    s3_uri=f"s3://{BUCKET}/rainviewer/",
+                                                    download_path=str(tmp_path),
+                                                    start_time=0,
+                                                    end_time=0,
+                                                    period=600,
+                                                    rule="timestamp",
+                                                    selection=selection)])
+
+        report = _download()
+        assert (report.downloaded, report.failed) == (1, [])
+        # tail, central directory and one range per tile, since members of a tile are far from each other
+        assert None not in ranges and len(ranges) <= 2 + 3 * len(tiles)
+
+        with zipfile.ZipFile(os.path.join(tmp_path, "0.zip"), "r") as archive:
+            assert len(archive.namelist()) == 3 * len(tiles)
+            assert all(RainViewerTileLoader.member_tile(name) in tiles for name in archive.namelist())
+
+        loader = RainViewerTileLoader(zip_path=os.path.join(tmp_path, "0.zip"))
+        for x, y in tiles:
+            data = loader.load(offset=10, tile_x=x, tile_y=y)
+            assert data is not None and np.any(~np.isnan(data.reflectivity))
+        assert loader.load(offset=0, tile_x=61, tile_y=31) is None
+
+        # slim archive is fresh for the same selection only
+        _download()
+        assert ranges == []
+        selection = rainviewer_selection(sensors.iloc[:1])
+        report = _download()
+        assert report.downloaded == 1
+        with zipfile.ZipFile(os.path.join(tmp_path, "0.zip"), "r") as archive:
+            assert len(archive.namelist()) == 3
+
+    def test_is_retryable(self):
+        def _client_error(code: str, status: int):
+            return botocore.exceptions.ClientError({"Error": {"Code": code},
+                                                    "ResponseMetadata": {"HTTPStatusCode": status}}, "GetObject")
+
+        assert is_retryable(_client_error("InternalError", 500))
+        assert is_retryable(_client_error("SlowDown", 503))
+        assert is_retryable(_client_error("RequestTimeout", 400))
+        assert is_retryable(botocore.exceptions.EndpointConnectionError(endpoint_url="http://localhost"))
+        # truncated response bodies are retried
+        assert is_retryable(botocore.exceptions.IncompleteReadError(actual_bytes=10, expected_bytes=256))
+        assert not is_retryable(_client_error("NoSuchKey", 404))
+        assert not is_retryable(_client_error("AccessDenied", 403))
+        assert not is_retryable(ValueError())
+
+    def test_backoff_delay(self):
+        for attempt in range(10):
+            assert 0 <= backoff_delay(attempt=attempt, base=0.5, max_delay=4.0) <= min(4.0, 0.5 * 2 ** attempt)
+
+    def test_manifest(self, tmp_path):
+        file_path = os.path.join(tmp_path, "0.zip")
+        with open(file_path, "wb") as file:
+            file.write(b"data")
+
+        manifest = CheckoutManifest(folder=str(tmp_path))
+
+        # files downloaded before the manifest are adopted by size
+        assert manifest.is_fresh(file_path=file_path, size=4, etag="a")
+        assert manifest.is_fresh(file_path=file_path, size=4, etag="a", selection="tiles")
+        assert not manifest.is_fresh(file_path=file_path, size=4, etag="b")
+        assert not manifest.is_fresh(file_path=file_path, size=5, etag="a")
+        assert not manifest.is_fresh(file_path=os.path.join(tmp_path, "600.zip"), size=4, etag="a")
+
+        manifest.update(file_path=file_path, size=4, etag="b")
+        manifest.save()
+        assert CheckoutManifest(folder=str(tmp_path)).is_fresh(file_path=file_path, size=4, etag="b")
+
+        # files with selected members are smaller than objects and fresh for the same selection only
+        manifest.update(file_path=file_path, size=100, etag="b", selection="tiles")
+        assert manifest.is_fresh(file_path=file_path, size=100, etag="b", selection="tiles")
+        assert not manifest.is_fresh(file_path=file_path, size=100, etag="b", selection="other")
+        assert not manifest.is_fresh(file_path=file_path, size=100, etag="b")
+
+        os.remove(file_path)
+        manifest.save()
+        with open(os.path.join(tmp_path, MANIFEST_FILE_NAME)) as file:
+            assert file.read() == ""
+
+    def test_manifest_save_merges(self, tmp_path):
+        paths = [os.path.join(tmp_path, f"{snapshot}.zip") for snapshot in [0, 600]]
+        for file_path in paths:
+            with open(file_path, "wb") as file:
+                file.write(b"data")
+
+        # checkout keeps its manifest while retention drops a parsed archive with another one
+        manifest = CheckoutManifest(folder=str(tmp_path))
+        manifest.update(file_path=paths[0], size=4, etag="a")
+        manifest.update(file_path=paths[1], size=4, etag="b")
+
+        assert CheckoutManifest(folder=str(tmp_path)).drop(paths[0])
+        os.remove(paths[0])
+
+        manifest.save()
+        saved = CheckoutManifest(folder=str(tmp_path))
+        assert saved.is_fresh(file_path=paths[0], size=4, etag="a")
+        assert saved.is_fresh(file_path=paths[1], size=4, etag="b")
@@ -0,0 +1,51 @@
+import hashlib
+import os
+
+from metrics.checkout.multipart import (CHECKPOINT_FILE_SUFFIX, PartCheckpoint, file_multipart_etag, is_md5_etag,
+                                        multipart_etag_parts, part_ranges)
+
+
+class TestMultipart:
+
+    def test_part_ranges(self):
+        assert part_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
+        assert part_ranges(8, 4) == [(0, 3), (4, 7)]
+        assert part_ranges(3, 4) == [(0, 2)]
+        assert part_ranges(0, 4) == []
+
+    def test_is_md5_etag(self):
+        assert is_md5_etag("9e107d9d372bb6826bd81d3542a419d6")
+        assert not is_md5_etag("9e107d9d372bb6826bd81d3542a419d6-3")
+        assert not is_md5_etag("9e107d9d372bb6826bd81d3542a419d6", server_side_encryption="aws:kms")
+
+    def test_multipart_etag(self, tmp_path):
+        assert multipart_etag_parts("9e107d9d372bb6826bd81d3542a419d6-3") == 3
+        assert multipart_etag_parts("9e107d9d372bb6826bd81d3542a419d6") is None
+        assert multipart_etag_parts("9e107d9d372bb6826bd81d3542a419d6-3", server_side_encryption="aws:kms") is None
+
+        file_path = os.path.join(tmp_path, "0.zip")
+        with open(file_path, "wb") as file:
+            file.write(b"abcdefghij")
+        digests = b"".join(hashlib.md5(part).digest() for part in [b"abcd", b"efgh", b"ij"])
+        assert file_multipart_etag(file_path, upload_part_size=4) == f"{hashlib.md5(digests).hexdigest()}-3"
+
+    def test_checkpoint_resume(self, tmp_path):
+        file_path = os.path.join(tmp_path, "0.zip")
+
+        checkpoint = PartCheckpoint(file_path=file_path, size=10, etag="a", part_size=4)
+        assert checkpoint.done == set()
+        assert os.path.getsize(checkpoint.part_path) == 10
+
+        checkpoint.mark_done(0)
+        checkpoint.mark_done(2)
+        assert PartCheckpoint(file_path=file_path, size=10, etag="a", part_size=4).done == {0, 2}
+
+        # progress of another object or part size is dropped
+        assert PartCheckpoint(file_path=file_path, size=10, etag="b", part_size=4).done == set()
+        checkpoint = PartCheckpoint(file_path=file_path, size=10, etag="a", part_size=4)
+        assert checkpoint.done == set()
+
+        checkpoint.mark_done(1)
+        checkpoint.complete(file_path)
+        assert os.listdir(tmp_path) == ["0.zip"]
+        assert not os.path.exists(f"{file_path}{CHECKPOINT_FILE_SUFFIX}")
@@ -0,0 +1,88 @@
+import io
+import os
+import pytest
+import zipfile
+
+from metrics.checkout.remote_zip import (MissingRangeError, RangeFile, coalesce_ranges, member_ranges,
+                                         write_members)
+
+
+def _zip_bytes(members: dict, comment: bytes = b"") -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for index, (name, data) in enumerate(members.items()):
+            compression = zipfile.ZIP_DEFLATED if index % 2 == 0 else zipfile.ZIP_STORED
+            zip_file.writestr(name, data, compress_type=compression)
+        zip_file.comment = comment
+    return buffer.getvalue()
+
+
+class TestRemoteZip:
+
+    def test_range_file(self):
+        data = bytes(range(100))
+        range_file = RangeFile(size=100)
+        range_file.add(10, data[10:20])
+        range_file.add(30, data[30:40])
+
+        range_file.seek(12)
+        assert range_file.read(5) == data[12:17]
+        assert range_file.tell() == 17
+
+        range_file.seek(15)
+        with pytest.raises(MissingRangeError) as error:
+            range_file.read(10)
+        assert (error.value.start, error.value.end) == (15, 25)
+
+        # adjacent and overlapping ranges are merged
+        range_file.add(20, data[20:32])
+        assert range_file.covers(10, 40)
+        assert not range_file.covers(5, 40)
+        range_file.seek(15)
+        assert range_file.read(20) == data[15:35]
+
+        range_file.add(90, data[90:100])
+        range_file.seek(-5, os.SEEK_END)
+        assert range_file.read() == data[95:]
+        assert range_file.read() == b""
+
+    @pytest.mark.parametrize("ranges, max_gap, expected", [
+        ([(0, 10), (10, 20)], 0, [(0, 20)]),
+        ([(30, 40), (0, 10), (12, 20)], 2, [(0, 20), (30, 40)]),
+        ([(0, 10), (12, 20)], 1, [(0, 10), (12, 20)]),
+        ([(0, 30), (10, 20)], 0, [(0, 30)]),
+        ([], 10, []),
+    ])
+    def test_coalesce_ranges(self, ranges, max_gap, expected):
+        assert coalesce_ranges(ranges, max_gap=max_gap) == expected
+
+    @pytest.mark.parametrize("comment", [b"", b"archive comment"])
+    def test_read_members(self, tmp_path, comment):
+        members = {f"0/_map/t0/7/{x}/{y}.png": os.urandom(100) + b"\0" * 100 for x in range(40) for y in range(25)}
+        data = _zip_bytes(members, comment=comment)
+
+        # archive is opened from the tail, the central directory doesn't fit it and is fetched
+        tail_size = 2 ** 16 + 100
+        range_file = RangeFile(size=len(data))
+        range_file.add(len(data) - tail_size, data[-tail_size:])
+        with pytest.raises(MissingRangeError) as error:
+            zipfile.ZipFile(range_file, "r")
+        range_file.add(error.value.start, data[error.value.start:error.value.end])
+        zip_file = zipfile.ZipFile(range_file, "r")
+
+        ranges = member_ranges(zip_file)
+        names = ["0/_map/t0/7/1/1.png", "0/_map/t0/7/1/2.png", "0/_map/t0/7/4/4.png"]
+        for start, end in coalesce_ranges([ranges[name] for name in names], max_gap=0):
+            range_file.add(start, data[start:end])
+
+        path = os.path.join(tmp_path, "0.zip")
+        write_members(zip_file, names, path)
+        with zipfile.ZipFile(path, "r") as output:
+            assert output.namelist() == names
+            for name in names:
+                assert output.read(name) == members[name]
+                assert output.getinfo(name).compress_type == zip_file.getinfo(name).compress_type
+
+        # members that weren't fetched can't be written
+        with pytest.raises(MissingRangeError):
+            write_members(zip_file, ["0/_map/t0/7/0/0.png"], path)
@@ -0,0 +1,99 @@
+import os
+import pandas
+import pyarrow
+import pytest
+
+from metrics.io.arrow_cache import ArrowCache
+from metrics.io.table_store import TableStore
+
+
+def _create_table(snapshot: int) -> pandas.DataFrame:
+    return pandas.DataFrame({"id": ["a", "b", "c"],
+                             "timestamp": [snapshot + 60, snapshot + 120, snapshot + 180],
+                             "precip_rate": [0.0, 1.0, 2.0]})
+
+
+class TestArrowCache:
+
+    @pytest.mark.parametrize("compression", ["uncompressed", "lz4"])
+    def test_write_read(self, tmp_path, compression: str):
+        tables_folder = str(tmp_path / "tables")
+        table_path = os.path.join(tables_folder, "vaisala", "1800.parquet")
+        os.makedirs(os.path.dirname(table_path))
+        _create_table(1800).to_parquet(table_path)
+
+        cache = ArrowCache(tables_folder=tables_folder, cache_folder=str(tmp_path / "cache"))
+        assert not cache.is_fresh(table_path)
+
+        cache_path = cache.write(table_path, compression=compression)
+        assert cache_path == str(tmp_path / "cache" / "vaisala" / "1800.arrow")
+        assert cache.is_fresh(table_path)
+
+        # table is read from the cache only
+        os.utime(table_path, (0, 0))
+        with open(table_path, "wb") as file:
+            file.write(b"not a parquet")
+        os.utime(table_path, (0, 0))
+
+        pandas.testing.assert_frame_equal(cache.read(table_path).to_pandas(), _create_table(1800))
+        filtered = cache.read(table_path, filters=[("precip_rate", ">", 0.5)]).to_pandas()
+        assert filtered["id"].tolist() == ["b", "c"]
+
+    def test_read_default_zero_copy(self, tmp_path):
+        tables_folder = str(tmp_path / "tables")
+        table_path = os.path.join(tables_folder, "1800.parquet")
+        os.makedirs(tables_folder)
+        _create_table(1800).to_parquet(table_path)
+
+        cache = ArrowCache(tables_folder=tables_folder, cache_folder=str(tmp_path / "cache"))
+        cache.write(table_path)
+
+        # buffers of an uncompressed copy point into the memory map
+        allocated = pyarrow.total_allocated_bytes()
+        table = cache.read(table_path)
+        assert pyarrow.total_allocated_bytes() == allocated
+        assert table.num_rows == 3
+
+    def test_read_stale(self, tmp_path):
+        tables_folder = str(tmp_path / "tables")
+        table_path = os.path.join(tables_folder, "1800.parquet")
+        os.makedirs(tables_folder)
+        _create_table(1800).to_parquet(table_path)
+
+        cache = ArrowCache(tables_folder=tables_folder, cache_folder=str(tmp_path / "cache"))
+        cache.write(table_path)
+
+        # re-parsed table
+        _create_table(3600).to_parquet(table_path)
+        os.utime(cache.cache_path(table_path), (0, 0))
+
+        assert not cache.is_fresh(table_path)
+        pandas.testing.assert_frame_equal(cache.read(table_path).to_pandas(), _create_table(3600))
+
+    def test_unknown_compression(self, tmp_path):
+        cache = ArrowCache(tables_folder=str(tmp_path), cache_folder=str(tmp_path / "cache"))
+        with pytest.raises(ValueError):
+            cache.write(str(tmp_path / "1800.parquet"), compression="gzip")
+
+    def test_table_store(self, tmp_path):
+        folder = str(tmp_path / "tables" / "vaisala")
+        os.makedirs(folder)
+        store = TableStore(folder=folder)
+        for snapshot in [1711360800, 1711361400]:
+            _create_table(snapshot).to_parquet(store.snapshot_path(snapshot))
+        store.compact()
+
+        cache = ArrowCache(tables_folder=str(tmp_path / "tables"), cache_folder=str(tmp_path / "cache"))
+        partition_path = store.partition_path(1711360800)
+        cache.write(partition_path)
+
+        # partition is read from the cache only
+        with open(partition_path, "wb") as file:
+            file.write(b"not a parquet")
+        os.utime(partition_path, (0, 0))
+
+        cached_store = TableStore(folder=folder, cache=cache)
+        pandas.testing.assert_frame_equal(cached_store.load_snapshot(1711361400), _create_table(1711361400))
+
+        tables = cached_store.load_compacted(time_range=(1711360800, 1711364400), skip_snapshots=[1711361400])
+        pandas.testing.assert_frame_equal(tables[0], _create_table(1711360800))
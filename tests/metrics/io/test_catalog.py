@@ -0,0 +1,118 @@
+import os
+import pandas
+
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, SessionCatalog, rollup_kind
+from metrics.io.table_store import TableStore
+
+from unittest.mock import patch
+
+# 2024-03-25 10:00:00 UTC
+HOUR_START = 1711360800
+
+
+def _write_table(path: str, snapshot: int):
+    pandas.DataFrame({"id": ["a", "b"],
+                      "timestamp": [snapshot + 60, snapshot + 600],
+                      "precip_rate": [0.0, 1.0]}).to_parquet(path)
+
+
+class TestSessionCatalog:
+
+    def test_sync(self, tmp_path):
+        catalog = SessionCatalog(session_path=str(tmp_path))
+        assert not catalog.exists
+        assert catalog.list(kind=KIND_TABLE, vendor="vaisala") == []
+
+        folder = str(tmp_path / "tables" / "vaisala")
+        os.makedirs(folder)
+        store = TableStore(folder=folder)
+        for snapshot in [HOUR_START, HOUR_START + 600]:
+            _write_table(store.snapshot_path(snapshot), snapshot)
+        store.compact()
+        _write_table(store.snapshot_path(HOUR_START + 3600), HOUR_START + 3600)
+        with open(os.path.join(folder, "notes.txt"), "w") as file:
+            file.write("not a table")
+
+        assert not catalog.is_synced(kind=KIND_TABLE, vendor="vaisala")
+        entries = catalog.sync(kind=KIND_TABLE, vendor="vaisala", folder=folder)
+
+        assert catalog.exists
+        assert catalog.is_synced(kind=KIND_TABLE, vendor="vaisala")
+        assert not catalog.is_synced(kind=KIND_ARCHIVE, vendor="vaisala")
+        assert catalog.synced_folders() == {os.path.normpath(folder)}
+        assert [entry.snapshot for entry in entries] == [HOUR_START, HOUR_START + 600, HOUR_START + 3600]
+        assert [entry.rows for entry in entries] == [2, 2, 2]
+        assert [(entry.start_time, entry.end_time) for entry in entries] == [
+            (snapshot + 60, snapshot + 600) for snapshot in [HOUR_START, HOUR_START + 600, HOUR_START + 3600]]
+        assert catalog.full_path(entries[0]) == store.partition_path(HOUR_START)
+        assert catalog.full_path(entries[2]) == store.snapshot_path(HOUR_START + 3600)
+
+        assert catalog.list(kind=KIND_TABLE, vendor="vaisala", time_range=(HOUR_START + 600, HOUR_START + 3600)) == \
+            entries[1:]
+        assert catalog.list(kind=KIND_ARCHIVE, vendor="vaisala") == []
+
+        # unchanged files are not opened again, removed ones are not listed anymore
+        os.remove(store.snapshot_path(HOUR_START + 3600))
+        with patch.object(SessionCatalog, "_describe_partition") as describe_mock:
+            assert catalog.sync(kind=KIND_TABLE, vendor="vaisala", folder=folder) == entries[:2]
+            describe_mock.assert_not_called()
+
+    def test_sync_files(self, tmp_path):
+        catalog = SessionCatalog(session_path=str(tmp_path))
+        folder = str(tmp_path / "tables" / "vaisala")
+        os.makedirs(folder)
+        store = TableStore(folder=folder)
+        for snapshot in [HOUR_START, HOUR_START + 600, HOUR_START + 3600]:
+            _write_table(store.snapshot_path(snapshot), snapshot)
+        catalog.sync(kind=KIND_TABLE, vendor="vaisala", folder=folder)
+
+        # only the written partition and the moved tables are described, other files aren't opened
+        compacted = store.compact(before=HOUR_START + 3600)
+        paths = list(set(compacted.values())) + [store.snapshot_path(snapshot) for snapshot in compacted]
+        with patch.object(SessionCatalog, "_describe_file") as describe_mock:
+            entries = catalog.sync_files(kind=KIND_TABLE, vendor="vaisala", paths=paths)
+            describe_mock.assert_not_called()
+
+        assert [entry.snapshot for entry in entries] == [HOUR_START, HOUR_START + 600]
+        assert catalog.list(kind=KIND_TABLE, vendor="vaisala") == \
+            catalog.sync(kind=KIND_TABLE, vendor="vaisala", folder=folder)
+        assert [catalog.full_path(entry) for entry in catalog.list(kind=KIND_TABLE, vendor="vaisala")] == \
+            [store.partition_path(HOUR_START)] * 2 + [store.snapshot_path(HOUR_START + 3600)]
+
+        # separate tables take precedence over the compacted ones
+        _write_table(store.snapshot_path(HOUR_START), HOUR_START)
+        catalog.sync_files(kind=KIND_TABLE, vendor="vaisala", paths=[store.snapshot_path(HOUR_START)])
+        catalog.sync_files(kind=KIND_TABLE, vendor="vaisala", paths=[store.partition_path(HOUR_START)])
+        assert catalog.full_path(catalog.list(kind=KIND_TABLE, vendor="vaisala")[0]) == \
+            store.snapshot_path(HOUR_START)
+
+        # entries of removed files are removed
+        removed_path = store.snapshot_path(HOUR_START + 3600)
+        os.remove(removed_path)
+        assert catalog.sync_files(kind=KIND_TABLE, vendor="vaisala", paths=[removed_path]) == []
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_TABLE, vendor="vaisala")] == \
+            [HOUR_START, HOUR_START + 600]
+
+    def test_remove(self, tmp_path):
+        catalog = SessionCatalog(session_path=str(tmp_path))
+        folder = str(tmp_path / "tables" / "rollups" / "600" / "vaisala")
+        os.makedirs(folder)
+        for snapshot in [HOUR_START, HOUR_START + 600]:
+            _write_table(os.path.join(folder, f"{snapshot}.parquet"), snapshot)
+        entries = catalog.sync(kind=rollup_kind(600), vendor="vaisala", folder=folder)
+
+        archives_folder = str(tmp_path / "data" / "vaisala")
+        os.makedirs(archives_folder)
+        with open(os.path.join(archives_folder, f"{HOUR_START}.zip"), "wb") as file:
+            file.write(b"archive")
+        archives = catalog.sync(kind=KIND_ARCHIVE, vendor="vaisala", folder=archives_folder)
+        assert archives[0].size == 7 and archives[0].rows is None
+
+        outdated = sorted(catalog.list_before(HOUR_START + 600), key=lambda entry: entry.kind)
+        assert outdated == [archives[0], entries[0]]
+
+        catalog.remove_rollups(vendor="vaisala", snapshots=[HOUR_START])
+        assert catalog.list(kind=rollup_kind(600), vendor="vaisala") == entries[1:]
+
+        catalog.remove(archives)
+        assert catalog.list_before(HOUR_START + 3600) == entries[1:]
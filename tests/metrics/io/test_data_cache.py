@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+
+from metrics.io.data_cache import DataCache, cache_key
+from unittest.mock import patch
+
+
+def _write(path: str, content: bytes) -> str:
+    with open(path, "wb") as file:
+        file.write(content)
+    return path
+
+
+def _store_many(folder: str, worker: int):
+    cache = DataCache(folder=folder, max_size=1000)
+    for index in range(20):
+        path = _write(os.path.join(folder, f"{worker}_{index}.zip"), b"x" * 100)
+        cache.store(s3_uri=f"s3://bucket/{worker}/{index}.zip", etag="a", file_path=path)
+
+
+class TestDataCache:
+
+    def test_fetch(self, tmp_path):
+        cache = DataCache(folder=os.path.join(tmp_path, "cache"))
+        session_a = os.path.join(tmp_path, "a.zip")
+        session_b = os.path.join(tmp_path, "b.zip")
+
+        assert not cache.fetch(s3_uri="s3://bucket/0.zip", etag="a", file_path=session_b)
+
+        cache.store(s3_uri="s3://bucket/0.zip", etag="a", file_path=_write(session_a, b"data"))
+        assert cache.fetch(s3_uri="s3://bucket/0.zip", etag="a", file_path=session_b)
+        assert not cache.fetch(s3_uri="s3://bucket/0.zip", etag="b", file_path=session_b)
+
+        # sessions share the cached file
+        object_path = cache.object_path(cache_key(s3_uri="s3://bucket/0.zip", etag="a"))
+        assert os.stat(session_b).st_ino == os.stat(object_path).st_ino == os.stat(session_a).st_ino
+        assert cache.size() == 4
+
+        # files removed from the cache are not fetched
+        os.remove(object_path)
+        assert not cache.fetch(s3_uri="s3://bucket/0.zip", etag="a", file_path=os.path.join(tmp_path, "c.zip"))
+        assert cache.size() == 0
+
+    def test_fetch_many(self, tmp_path):
+        cache = DataCache(folder=os.path.join(tmp_path, "cache"))
+        cache.store(s3_uri="s3://bucket/0.zip", etag="a", file_path=_write(os.path.join(tmp_path, "0.zip"), b"data"))
+        # storing the object again doesn't count its size twice
+        cache.store(s3_uri="s3://bucket/0.zip", etag="a", file_path=os.path.join(tmp_path, "0.zip"))
+        assert cache.size() == 4
+
+        assert cache.fetch_many([("s3://bucket/0.zip", "a", os.path.join(tmp_path, "a.zip")),
+                                 ("s3://bucket/1.zip", "a", os.path.join(tmp_path, "b.zip"))]) == [True, False]
+        assert os.path.exists(os.path.join(tmp_path, "a.zip"))
+        assert not os.path.exists(os.path.join(tmp_path, "b.zip"))
+        assert cache.fetch_many([]) == []
+
+    def test_evict_lru(self, tmp_path):
+        cache = DataCache(folder=os.path.join(tmp_path, "cache"), max_size=10)
+        for index in range(3):
+            path = _write(os.path.join(tmp_path, f"{index}.zip"), b"abcd")
+            cache.store(s3_uri=f"s3://bucket/{index}.zip", etag="a", file_path=path)
+            if index == 1:
+                # recently used object is kept
+                assert cache.fetch(s3_uri="s3://bucket/0.zip", etag="a", file_path=os.path.join(tmp_path, "x.zip"))
+
+        assert cache.size() == 8
+        assert not cache.fetch(s3_uri="s3://bucket/1.zip", etag="a", file_path=os.path.join(tmp_path, "y.zip"))
+        assert cache.fetch(s3_uri="s3://bucket/0.zip", etag="a", file_path=os.path.join(tmp_path, "y.zip"))
+        assert cache.fetch(s3_uri="s3://bucket/2.zip", etag="a", file_path=os.path.join(tmp_path, "z.zip"))
+
+        # evicted files stay in sessions
+        with open(os.path.join(tmp_path, "1.zip"), "rb") as file:
+            assert file.read() == b"abcd"
+
+    def test_read_uses(self, tmp_path):
+        cache = DataCache(folder=os.path.join(tmp_path, "cache"), max_size=8)
+        for index in range(2):
+            cache.write(s3_uri=f"s3://bucket/{index}.bin", etag="a", data=b"abcd")
+
+        # reads don't take the lock, their uses are written with the next write
+        with patch("metrics.io.data_cache.fcntl.flock") as flock_mock:
+            assert cache.read(s3_uri="s3://bucket/0.bin", etag="a") == b"abcd"
+            assert cache.read(s3_uri="s3://bucket/2.bin", etag="a") is None
+            flock_mock.assert_not_called()
+
+        cache.write(s3_uri="s3://bucket/2.bin", etag="a", data=b"abcd")
+        assert cache.read(s3_uri="s3://bucket/0.bin", etag="a") == b"abcd"
+        assert cache.read(s3_uri="s3://bucket/1.bin", etag="a") is None
+
+    def test_read_uses_batch(self, tmp_path):
+        cache = DataCache(folder=os.path.join(tmp_path, "cache"))
+        for index in range(2):
+            cache.write(s3_uri=f"s3://bucket/{index}.bin", etag="a", data=b"abcd")
+
+        # uses are written once enough objects are read
+        with patch("metrics.io.data_cache.USES_BATCH", 2), patch.object(cache, "flush") as flush_mock:
+            cache.read(s3_uri="s3://bucket/0.bin", etag="a")
+            cache.read(s3_uri="s3://bucket/0.bin", etag="a")
+            flush_mock.assert_not_called()
+            cache.read(s3_uri="s3://bucket/1.bin", etag="a")
+            flush_mock.assert_called_once()
+
+    def test_concurrent_store(self, tmp_path):
+        folder = str(tmp_path)
+        processes = [multiprocessing.Process(target=_store_many, args=(folder, worker)) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        assert all(process.exitcode == 0 for process in processes)
+        cache = DataCache(folder=folder, max_size=1000)
+        assert cache.size() == 1000
+
+        objects = []
+        for _, _, files in os.walk(os.path.join(folder, "objects")):
+            objects.extend(files)
+        assert len(objects) == 10
@@ -1,10 +1,14 @@
 import numpy as np
 import os
 import pytest
+import zipfile
 
 import metrics.io.rainviewer as rainviewer
 import metrics.utils.precipitation as precip
 
+from metrics.io import storage
+from unittest.mock import patch
+
 SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
 
 
@@ -153,3 +157,39 @@ class TestRainviewerIO:
 
         mask_fo.close()
         data_fo.close()
+
+    @pytest.mark.parametrize("name, expected_tile", [
+        ("1700000000/_map/t0/7/10/20.png", (10, 20)),
+        ("1700000000/_map/t120/7/0/127.png", (0, 127)),
+        ("1700000000/_mask/7/10/20.png", (10, 20)),
+        ("_mask/7/3/4.png", (3, 4)),
+        ("1700000000/_map/t0/6/10/20.png", None),
+        ("1700000000/_map/t0/7/10/20.jpg", None),
+        ("1700000000/_other/7/10/20.png", None),
+    ])
+    def test_member_tile(self, name, expected_tile):
+        assert rainviewer.RainViewerTileLoader.member_tile(name) == expected_tile
+
+    def test_loader_close(self, tmp_path):
+        zip_path = os.path.join(tmp_path, "1700000000.zip")
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            for x in [10, 11]:
+                archive.write(os.path.join(SCRIPT_DIRECTORY, "rainviewer_data.png"), f"1700000000/_map/t0/7/{x}/20.png")
+                archive.write(os.path.join(SCRIPT_DIRECTORY, "rainviewer_mask.png"), f"1700000000/_mask/7/{x}/20.png")
+
+        opened = []
+        open_file = storage.open_file
+
+        def _open_file(path: str):
+            opened.append(open_file(path))
+            return opened[-1]
+
+        # the archive is opened by loads and closed by the loader, e.g. for remote files that `ZipFile` doesn't own
+        loader = rainviewer.RainViewerTileLoader(zip_path=zip_path)
+        with patch("metrics.io.rainviewer.storage.open_file", side_effect=_open_file):
+            assert loader.load(offset=0, tile_x=10, tile_y=20) is not None
+            loader.close()
+            assert loader.load(offset=0, tile_x=11, tile_y=20) is not None
+            loader.close()
+
+        assert len(opened) == 2 and all(file.closed for file in opened)
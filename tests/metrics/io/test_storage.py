@@ -0,0 +1,241 @@
+import boto3
+import io
+import os
+import pandas
+import pyarrow
+import pyarrow.parquet as pq
+import pytest
+import socket
+import time
+import typing
+import zipfile
+
+from metrics.data_vendor import DataVendor
+from metrics.io import storage
+from metrics.io.catalog import KIND_ARCHIVE, SessionCatalog
+from metrics.io.data_cache import DataCache
+from metrics.io.storage import RemoteStorage
+from metrics.io.table_store import TableStore
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.parse import parse
+from metrics.session import Session
+from metrics.utils.parquet import read_table
+from moto.server import ThreadedMotoServer
+from unittest.mock import patch
+
+BUCKET = "rainbow-storage"
+
+
+class CsvSensorParser(BaseParser):
+    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
+        return [[os.path.splitext(file_name)[0], timestamp, float(data.decode())]]
+
+    def _should_parse_file_extension(self, file_extension: str) -> bool:
+        return file_extension == ".csv"
+
+    def _get_columns(self) -> typing.List[str]:
+        return ["id", "timestamp", "precip_rate"]
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_client(s3_endpoint):
+    # forked processes create their own clients from the environment
+    with patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test",
+                                 "AWS_SECRET_ACCESS_KEY": "test",
+                                 "AWS_DEFAULT_REGION": "us-east-1",
+                                 "AWS_ENDPOINT_URL_S3": s3_endpoint}):
+        client = boto3.client("s3", endpoint_url=s3_endpoint)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+        storage.configure(None)
+        for item in client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+            client.delete_object(Bucket=BUCKET, Key=item["Key"])
+        client.delete_bucket(Bucket=BUCKET)
+
+
+class GetRecorder:
+    """Records ranges of GET requests of the client"""
+
+    def __init__(self, client):
+        self.ranges = []
+        # handlers are referenced weakly, the recorder keeps the handler alive
+        client.meta.events.register("provide-client-params.s3.GetObject", self._record)
+
+    def _record(self, params, **kwargs):
+        self.ranges.append(params["Range"])
+
+
+def _parquet(data_frame: pandas.DataFrame, row_group_size: int) -> bytes:
+    buffer = io.BytesIO()
+    pq.write_table(pyarrow.Table.from_pandas(data_frame, preserve_index=False), buffer, row_group_size=row_group_size)
+    return buffer.getvalue()
+
+
+def _archive(members: typing.Dict[str, str]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return buffer.getvalue()
+
+
+class TestRemoteStorage:
+
+    def test_listing(self, s3_client):
+        for key in ["data/metar/100.zip", "data/metar/200.zip", "data/metar/date=2024-03-25/hour=10/data.parquet"]:
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"12345")
+        storage.configure(RemoteStorage(client=s3_client))
+
+        assert sorted(storage.listdir(f"s3://{BUCKET}/data/metar")) == ["100.zip", "200.zip", "date=2024-03-25"]
+        assert [(root, files) for root, _, files in storage.walk(f"s3://{BUCKET}/data/")] == [
+            (f"s3://{BUCKET}/data", []),
+            (f"s3://{BUCKET}/data/metar", ["100.zip", "200.zip"]),
+            (f"s3://{BUCKET}/data/metar/date=2024-03-25", []),
+            (f"s3://{BUCKET}/data/metar/date=2024-03-25/hour=10", ["data.parquet"]),
+        ]
+
+        assert storage.isdir(f"s3://{BUCKET}/data/metar")
+        assert not storage.isdir(f"s3://{BUCKET}/data/accuweather")
+        assert storage.exists(f"s3://{BUCKET}/data/metar/100.zip")
+        assert not storage.exists(f"s3://{BUCKET}/data/metar/300.zip")
+        assert storage.getsize(f"s3://{BUCKET}/data/metar/200.zip") == 5
+
+    def test_stat(self, s3_client):
+        remote = RemoteStorage(client=s3_client, stat_ttl=60)
+        uri = f"s3://{BUCKET}/object.bin"
+
+        # missing objects are requested again, so objects uploaded later are found
+        assert remote.stat(uri) is None
+        s3_client.put_object(Bucket=BUCKET, Key="object.bin", Body=b"12345")
+        assert remote.stat(uri).size == 5
+
+        # stats are kept in memory until they expire
+        s3_client.put_object(Bucket=BUCKET, Key="object.bin", Body=b"1234567")
+        assert remote.stat(uri).size == 5
+        with patch("metrics.io.storage.time.monotonic", return_value=time.monotonic() + 61):
+            assert remote.stat(uri).size == 7
+
+    def test_read_blocks(self, s3_client):
+        content = bytes(range(100))
+        s3_client.put_object(Bucket=BUCKET, Key="object.bin", Body=content)
+        remote = RemoteStorage(client=s3_client, block_size=16)
+        ranges = GetRecorder(s3_client).ranges
+
+        with remote.open(f"s3://{BUCKET}/object.bin") as file:
+            file.seek(10)
+            assert file.read(30) == content[10:40]
+            assert file.read(5) == content[40:45]
+            file.seek(-4, os.SEEK_END)
+            assert file.read() == content[96:]
+
+        assert ranges == ["bytes=0-15", "bytes=16-31", "bytes=32-47", "bytes=96-99"]
+
+        with pytest.raises(FileNotFoundError):
+            remote.open(f"s3://{BUCKET}/missing.bin")
+
+    def test_block_cache(self, s3_client, tmp_path):
+        content = os.urandom(100)
+        s3_client.put_object(Bucket=BUCKET, Key="object.bin", Body=content)
+        cache = DataCache(folder=str(tmp_path / "cache"))
+
+        with RemoteStorage(client=s3_client, cache=cache, block_size=32).open(f"s3://{BUCKET}/object.bin") as file:
+            assert file.read() == content
+
+        # blocks of another process are read from the disk cache
+        ranges = GetRecorder(s3_client).ranges
+        with RemoteStorage(client=s3_client, cache=cache, block_size=32).open(f"s3://{BUCKET}/object.bin") as file:
+            assert file.read() == content
+        assert ranges == []
+
+        # blocks of the rewritten object are downloaded again
+        content = os.urandom(100)
+        s3_client.put_object(Bucket=BUCKET, Key="object.bin", Body=content)
+        with RemoteStorage(client=s3_client, cache=cache, block_size=32).open(f"s3://{BUCKET}/object.bin") as file:
+            assert file.read() == content
+        assert len(ranges) == 4
+
+    def test_read_parquet(self, s3_client):
+        table = pandas.DataFrame({"id": [f"s{index}" for index in range(100000)],
+                                  "timestamp": list(range(100000)),
+                                  "precip_rate": [0.5] * 100000})
+        s3_client.put_object(Bucket=BUCKET, Key="table.parquet", Body=_parquet(table, row_group_size=10000))
+        storage.configure(RemoteStorage(client=s3_client, block_size=16 * 1024))
+        path = f"s3://{BUCKET}/table.parquet"
+
+        assert storage.parquet_metadata(path).num_row_groups == 10
+        ranges = GetRecorder(s3_client).ranges
+        assert storage.parquet_metadata(path).num_rows == 100000
+        assert ranges == []
+
+        result = read_table(path, filters=[("timestamp", ">=", 2500), ("timestamp", "<", 3000)],
+                            columns=["id", "timestamp", "unknown"]).to_pandas()
+
+        pandas.testing.assert_frame_equal(result, table[["id", "timestamp"]].iloc[2500:3000].reset_index(drop=True))
+        # only blocks of the first row group are downloaded
+        assert 0 < len(ranges) < storage.getsize(path) // (16 * 1024) // 2
+
+    def test_table_store(self, s3_client):
+        for snapshot in [600, 1200]:
+            table = pandas.DataFrame({"id": ["a", "b"], "timestamp": [snapshot] * 2, "precip_rate": [1.0, 2.0]})
+            s3_client.put_object(Bucket=BUCKET, Key=f"tables/metar/{snapshot}.parquet",
+                                 Body=_parquet(table, row_group_size=100))
+        storage.configure(RemoteStorage(client=s3_client))
+
+        store = TableStore(folder=f"s3://{BUCKET}/tables/metar")
+
+        assert store.list_snapshot_tables() == [600, 1200]
+        assert list(store.load_snapshot(1200, columns=["id", "timestamp"])["timestamp"]) == [1200, 1200]
+        assert store.load_snapshot(1800) is None
+
+    def test_parse_remote_archives(self, s3_client, tmp_path):
+        for snapshot in [600, 1200]:
+            s3_client.put_object(Bucket=BUCKET, Key=f"data/metar/{snapshot}.zip",
+                                 Body=_archive({"s1.csv": "1.0", "s2.csv": "0.0", "readme.txt": "skipped"}))
+        storage.configure(RemoteStorage(client=s3_client))
+
+        session_path = str(tmp_path / "session")
+        os.makedirs(session_path)
+        Session(session_path=session_path, start_time=600, end_time=1200,
+                data_folder=f"s3://{BUCKET}/data").save_meta()
+
+        def _parse():
+            return parse(session_path=session_path,
+                         process_num=1,
+                         providers=[DataVendor.Metar],
+                         providers_parser={DataVendor.Metar: CsvSensorParser})
+
+        assert _parse() == []
+
+        table = pandas.read_parquet(os.path.join(session_path, "tables", "metar", "1200.parquet"))
+        assert list(table["id"]) == ["s1", "s2"]
+
+        catalog = SessionCatalog(session_path=session_path)
+        assert [catalog.full_path(entry) for entry in catalog.list(kind=KIND_ARCHIVE, vendor="metar")] == [
+            f"s3://{BUCKET}/data/metar/600.zip", f"s3://{BUCKET}/data/metar/1200.zip"]
+
+        # remote archives are identified by their ETags, unchanged ones are not parsed again
+        with patch("metrics.parse.parse._execute_jobs") as exec_mock:
+            assert _parse() == []
+        exec_mock.assert_not_called()
+
+    def test_parse_remote_tables(self, s3_client, tmp_path):
+        session_path = str(tmp_path / "session")
+        os.makedirs(session_path)
+        Session(session_path=session_path, start_time=600, end_time=1200,
+                tables_folder=f"s3://{BUCKET}/tables").save_meta()
+
+        with pytest.raises(ValueError):
+            parse(session_path=session_path, process_num=1, providers=[DataVendor.Metar])
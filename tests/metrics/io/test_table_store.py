@@ -0,0 +1,108 @@
+import os
+import pandas
+import pyarrow.parquet as pq
+import pytest
+import typing
+
+from metrics.io.table_store import (PARTITION_FILE_NAME, SNAPSHOT_COLUMN, TableStore, partition_folder,
+                                    partition_timestamp, snapshot_table_timestamp)
+from metrics.utils.parquet import get_parquet_profile
+
+# 2024-03-25 10:00:00 UTC
+HOUR_START = 1711360800
+
+
+def _create_table(snapshot: int, ids: typing.List[str]) -> pandas.DataFrame:
+    return pandas.DataFrame({
+        "id": ids,
+        "timestamp": [snapshot + 600 * index for index in range(len(ids))],
+        "precip_rate": [float(index) for index in range(len(ids))],
+        "precip_type": [1] * len(ids)
+    })
+
+
+def _write_snapshots(store: TableStore, tables: typing.Dict[int, pandas.DataFrame]):
+    for snapshot, table in tables.items():
+        table.to_parquet(store.snapshot_path(snapshot), compression="gzip")
+
+
+class TestTableStore:
+
+    @pytest.mark.parametrize("snapshot, expected_folder", [
+        (HOUR_START, os.path.join("date=2024-03-25", "hour=10")),
+        (HOUR_START + 3599, os.path.join("date=2024-03-25", "hour=10")),
+        (HOUR_START + 14 * 3600, os.path.join("date=2024-03-26", "hour=00")),
+    ])
+    def test_partition_folder(self, snapshot: int, expected_folder: str):
+        assert partition_folder(snapshot) == expected_folder
+        assert partition_timestamp(os.path.join("tables", "vendor", expected_folder)) == snapshot - snapshot % 3600
+
+    def test_partition_timestamp_other_folders(self):
+        assert partition_timestamp(os.path.join("tables", "vendor")) is None
+        assert snapshot_table_timestamp(os.path.join("tables", "vendor", "100.parquet")) == 100
+        assert snapshot_table_timestamp(os.path.join("tables", "vendor", "data.parquet")) is None
+
+    @pytest.mark.parametrize("profile_name", ["gzip", "zstd"])
+    def test_compact(self, tmp_path, profile_name: str):
+        store = TableStore(folder=str(tmp_path), writer_profile=get_parquet_profile(profile_name))
+        tables = {
+            HOUR_START: _create_table(HOUR_START, ["b", "a", "c"]),
+            HOUR_START + 600: _create_table(HOUR_START + 600, []),
+            HOUR_START + 1200: _create_table(HOUR_START + 1200, ["c", "a"]),
+            HOUR_START + 3600: _create_table(HOUR_START + 3600, ["a"]),
+        }
+        _write_snapshots(store, tables)
+
+        compacted = store.compact()
+
+        assert compacted == {snapshot: store.partition_path(snapshot) for snapshot in tables}
+        assert store.list_snapshot_tables() == []
+        assert os.path.exists(os.path.join(str(tmp_path), "date=2024-03-25", "hour=11", PARTITION_FILE_NAME))
+
+        # every snapshot has its own row group sorted by sensor id
+        metadata = pq.ParquetFile(store.partition_path(HOUR_START)).metadata
+        assert metadata.num_row_groups == 2
+        partition = pq.read_table(store.partition_path(HOUR_START)).to_pandas()
+        assert partition[SNAPSHOT_COLUMN].tolist() == [HOUR_START] * 3 + [HOUR_START + 1200] * 2
+        assert partition["id"].tolist() == ["a", "b", "c", "a", "c"]
+
+        for snapshot, table in tables.items():
+            loaded = store.load_snapshot(snapshot)
+            if len(table) == 0:
+                assert loaded is None
+                continue
+
+            expected = table.sort_values(by=["id", "timestamp"], ignore_index=True)
+            pandas.testing.assert_frame_equal(loaded, expected)
+
+    def test_compact_replaces_snapshots(self, tmp_path):
+        store = TableStore(folder=str(tmp_path))
+        _write_snapshots(store, {HOUR_START: _create_table(HOUR_START, ["a", "b"]),
+                                 HOUR_START + 600: _create_table(HOUR_START + 600, ["a"])})
+        store.compact()
+
+        # reparsed snapshot takes precedence over the compacted one until it is compacted too
+        updated = _create_table(HOUR_START, ["x"])
+        _write_snapshots(store, {HOUR_START: updated})
+        pandas.testing.assert_frame_equal(store.load_snapshot(HOUR_START), updated)
+
+        store.compact()
+        pandas.testing.assert_frame_equal(store.load_snapshot(HOUR_START), updated)
+        assert store.load_snapshot(HOUR_START + 600)["id"].tolist() == ["a"]
+
+    def test_load_compacted(self, tmp_path):
+        store = TableStore(folder=str(tmp_path))
+        snapshots = [HOUR_START + 600 * index for index in range(9)]
+        _write_snapshots(store, {snapshot: _create_table(snapshot, ["a"]) for snapshot in snapshots})
+        store.compact()
+
+        tables = store.load_compacted(time_range=(HOUR_START + 1200, HOUR_START + 3600),
+                                      skip_snapshots=[HOUR_START + 1800, HOUR_START])
+        loaded = pandas.concat(tables)
+
+        assert len(tables) == 2
+        assert loaded["timestamp"].tolist() == [HOUR_START + 1200, HOUR_START + 2400, HOUR_START + 3000,
+                                                HOUR_START + 3600]
+        assert SNAPSHOT_COLUMN not in loaded.columns
+
+        assert store.load_compacted(time_range=(HOUR_START + 7200, HOUR_START + 10800)) == []
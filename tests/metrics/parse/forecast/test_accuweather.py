@@ -38,5 +38,19 @@ class TestAccuWeatherParser:
                                   file_name="sensor.json",
                                   data=data_bytes)
 
-        assert len(rows) == 11
+        assert len(rows) == 1
+        assert rows[0][3:5] == (0, 11 * 60)
         assert all(r[-1] == PrecipitationType.SNOW.value for r in rows)
+
+    def test_parse_intervals(self):
+        data = _mock_accuweather_response(forecasts=[(0, 4, PrecipitationType.RAIN),
+                                                     (5, 119, PrecipitationType.SNOW)])
+
+        parser = AccuWeatherParser()
+        rows = parser._parse_impl(timestamp=1800,
+                                  file_name="sensor.json",
+                                  data=json.dumps(data).encode("utf-8"))
+
+        # "id", "lon", "lat", "timestamp", "end_timestamp", "precip_rate", "precip_prob", "precip_type"
+        assert rows == [("sensor", 14.75, 56.196, 1800, 2100, 10.0, 1.0, PrecipitationType.RAIN.value),
+                        ("sensor", 14.75, 56.196, 2100, 9000, 10.0, 1.0, PrecipitationType.SNOW.value)]
@@ -47,10 +47,10 @@ class TestWeatherKit:
             },
             # expected_rows
             [
-                # "id", "lon", "lat", "timestamp", "precip_rate", "precip_prob", "precip_type"
-                ("test_sensor", -3.283, 51.458, 1699146000, 0.09, 0.73, PrecipitationType.RAIN),
-                ("test_sensor", -3.283, 51.458, 1699146060, 0.0, 0.28, PrecipitationType.SNOW),
-                ("test_sensor", -3.283, 51.458, 1699146120, 0.43, 0.7, PrecipitationType.SNOW),
+                # "id", "lon", "lat", "timestamp", "end_timestamp", "precip_rate", "precip_prob", "precip_type"
+                ("test_sensor", -3.283, 51.458, 1699146000, 1699146060, 0.09, 0.73, PrecipitationType.RAIN),
+                ("test_sensor", -3.283, 51.458, 1699146060, 1699146120, 0.0, 0.28, PrecipitationType.SNOW),
+                ("test_sensor", -3.283, 51.458, 1699146120, 1699146180, 0.43, 0.7, PrecipitationType.SNOW),
             ]
         ),
 
@@ -99,10 +99,67 @@ class TestWeatherKit:
             },
             # expected_rows
             [
-                # "id", "lon", "lat", "timestamp", "precip_rate", "precip_prob", "precip_type"
-                ("test_sensor", -3.283, 51.458, 1699146000, 0.0, 0.0, PrecipitationType.UNKNOWN),
-                ("test_sensor", -3.283, 51.458, 1699146060, 0.4, 0.7, PrecipitationType.SNOW),
-                ("test_sensor", -3.283, 51.458, 1699146120, 0.43, 0.7, PrecipitationType.RAIN),
+                # "id", "lon", "lat", "timestamp", "end_timestamp", "precip_rate", "precip_prob", "precip_type"
+                ("test_sensor", -3.283, 51.458, 1699146000, 1699146060, 0.0, 0.0, PrecipitationType.UNKNOWN),
+                ("test_sensor", -3.283, 51.458, 1699146060, 1699146120, 0.4, 0.7, PrecipitationType.SNOW),
+                ("test_sensor", -3.283, 51.458, 1699146120, 1699146180, 0.43, 0.7, PrecipitationType.RAIN),
+            ]
+        ),
+
+        # Senario:
+        # - clear minutes and minutes with the same forecast are merged
+        (
+            # forecast_json
+            {
+                "metadata": {
+                    "latitude": 51.458,
+                    "longitude": -3.283,
+                },
+                "summary": [
+                    {
+                        "startTime": "2023-11-05T01:00:00Z",
+                        "endTime": "2023-11-05T01:02:00Z",
+                        "condition": "clear",
+                    },
+                    {
+                        "startTime": "2023-11-05T01:02:00Z",
+                        "condition": "rain"
+                    }
+                ],
+                "minutes": [
+                    {
+                        "startTime": "2023-11-05T01:00:00Z",
+                        "precipitationChance": 0.1,
+                        "precipitationIntensity": 0.01
+                    },
+                    {
+                        "startTime": "2023-11-05T01:01:00Z",
+                        "precipitationChance": 0.2,
+                        "precipitationIntensity": 0.02
+                    },
+                    {
+                        "startTime": "2023-11-05T01:02:00Z",
+                        "precipitationChance": 0.8,
+                        "precipitationIntensity": 0.5
+                    },
+                    {
+                        "startTime": "2023-11-05T01:03:00Z",
+                        "precipitationChance": 0.8,
+                        "precipitationIntensity": 0.5
+                    },
+                    {
+                        "startTime": "2023-11-05T01:05:00Z",
+                        "precipitationChance": 0.8,
+                        "precipitationIntensity": 0.5
+                    }
+                ]
+            },
+            # expected_rows
+            [
+                # "id", "lon", "lat", "timestamp", "end_timestamp", "precip_rate", "precip_prob", "precip_type"
+                ("test_sensor", -3.283, 51.458, 1699146000, 1699146120, 0.0, 0.0, PrecipitationType.UNKNOWN),
+                ("test_sensor", -3.283, 51.458, 1699146120, 1699146240, 0.5, 0.8, PrecipitationType.RAIN),
+                ("test_sensor", -3.283, 51.458, 1699146300, 1699146360, 0.5, 0.8, PrecipitationType.RAIN),
             ]
         )
     ])
@@ -1,12 +1,18 @@
 import datetime
+import os
+import pandas
 import pytest
 import typing
 
-from metrics.parse.observation.metar import MetarParser
+from metar import Metar
+from metrics.parse.observation.metar import MetarParser, parse_weather_fast
 from metrics.utils.precipitation import PrecipitationType
 from unittest.mock import MagicMock, patch
 
 
+ARCHIVES_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), "archives")
+
+
 def _create_metar_file(raw_text: str = "TJBQ 251150Z 00000KT 10SM CLR 25/21 A2990",
                        station_id: str = "TJBQ",
                        observation_time: str = "2024-03-25T11:50:00Z",
@@ -145,3 +151,58 @@ class TestMetarParser:
 
         mock_to_date.assert_called_once_with(report_timestamp)
         assert got_rows == expected_rows
+
+    @pytest.mark.parametrize("archive_name", sorted(os.listdir(ARCHIVES_FOLDER)))
+    def test_fast_path_matches_python_metar(self, tmp_path, archive_name: str):
+        archive_path = os.path.join(ARCHIVES_FOLDER, archive_name)
+        reference_path = os.path.join(tmp_path, "reference.parquet")
+        fast_path = os.path.join(tmp_path, "fast.parquet")
+
+        MetarParser(use_fast_path=False).parse(input_archive_path=archive_path, output_parquet_path=reference_path)
+        MetarParser(use_fast_path=True).parse(input_archive_path=archive_path, output_parquet_path=fast_path)
+
+        reference = pandas.read_parquet(reference_path)
+        assert len(reference) > 0
+        pandas.testing.assert_frame_equal(pandas.read_parquet(fast_path), reference)
+
+    @pytest.mark.parametrize("archive_name", sorted(os.listdir(ARCHIVES_FOLDER)))
+    def test_parse_sensor_selection(self, tmp_path, archive_name: str):
+        archive_path = os.path.join(ARCHIVES_FOLDER, archive_name)
+        full_path = os.path.join(tmp_path, "full.parquet")
+        selected_path = os.path.join(tmp_path, "selected.parquet")
+
+        MetarParser().parse(input_archive_path=archive_path, output_parquet_path=full_path)
+        full = pandas.read_parquet(full_path)
+        sensor_ids = set(full["id"].unique()[::3])
+
+        MetarParser().parse(input_archive_path=archive_path, output_parquet_path=selected_path, sensor_ids=sensor_ids)
+        selected = pandas.read_parquet(selected_path)
+
+        expected = full[full["id"].isin(sensor_ids)].reset_index(drop=True)
+        assert len(expected) > 0
+        pandas.testing.assert_frame_equal(selected, expected)
+
+    @pytest.mark.parametrize("raw_text, is_classified", [
+        ("KJFK 251151Z 04012KT 10SM -RA BR OVC008 09/08 A2987 RMK AO2 SLP113 P0002", True),
+        ("KMSP 251153Z 33015G25KT 1 1/2SM -SN BLSN OVC012 M05/M07 A2992 RMK AO2", True),
+        ("KPWM 251151Z 03012KT 3/4SM -RASN BR OVC005 01/00 A2990 RMK AO2 SLP126 P0003", True),
+        ("EGLL 251150Z 24012KT 9999 -DZ FEW032 09/04 Q1012 NOSIG", True),
+        ("KXXX 251155Z 27010KT 10SM RA SN OVC020 01/00 A2995=", True),
+        # trend groups
+        ("EGCC 251150Z 25015G26KT 9999 -SHRA FEW018CB SCT030 08/03 Q1008 TEMPO 7000 SHRA", False),
+        # missing weather
+        ("KXXS 251155Z 27010KT 10SM ////// OVC020 01/00 A2995 RMK AO2", False),
+        # remark with invalid peak wind time
+        ("KXXX 251155Z 27010KT 10SM -RA OVC020 01/00 A2995 RMK AO2 PK WND 28032/1160", False),
+        # invalid observation time
+        ("KXYA 311155Z 27010KT 10SM -SN OVC020 M01/M02 A2995 RMK AO2", False),
+        # invalid wind direction
+        ("KXYC 251155Z 37010KT 10SM -RA OVC020 01/00 A2995 RMK AO2", False),
+    ])
+    def test_parse_weather_fast(self, raw_text: str, is_classified: bool):
+        report_date = datetime.datetime(2024, 4, 25, tzinfo=datetime.UTC)
+        weather = parse_weather_fast(raw_text=raw_text, report_date=report_date)
+
+        assert (weather is not None) == is_classified
+        if is_classified:
+            assert weather == Metar.Metar(raw_text, month=report_date.month, year=report_date.year).weather
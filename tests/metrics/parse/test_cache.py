@@ -0,0 +1,32 @@
+import os
+import pandas
+
+from metrics.io.arrow_cache import ArrowCache
+from metrics.parse.cache import cache
+from metrics.session import Session
+
+
+class TestCache:
+
+    def test_cache(self, tmp_path):
+        session = Session(session_path=str(tmp_path), start_time=0, end_time=1)
+        session.save_meta()
+
+        table_paths = [os.path.join(session.tables_folder, "vaisala", "1800.parquet"),
+                       os.path.join(session.tables_folder, "rollups", "600", "vaisala", "1800.parquet")]
+        for table_path in table_paths:
+            os.makedirs(os.path.dirname(table_path))
+            pandas.DataFrame({"id": ["a"], "timestamp": [1860]}).to_parquet(table_path)
+
+        table_cache = ArrowCache(tables_folder=session.tables_folder, cache_folder=session.cache_folder)
+        orphan_path = table_cache.cache_path(os.path.join(session.tables_folder, "vaisala", "1200.parquet"))
+        os.makedirs(os.path.dirname(orphan_path))
+        with open(orphan_path, "wb") as file:
+            file.write(b"compacted table")
+
+        assert cache(session_path=str(tmp_path), process_num=1) == 2
+        assert all(table_cache.is_fresh(table_path) for table_path in table_paths)
+        assert not os.path.exists(orphan_path)
+
+        # fresh copies are kept
+        assert cache(session_path=str(tmp_path), process_num=1) == 0
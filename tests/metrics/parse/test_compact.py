@@ -0,0 +1,41 @@
+import os
+import pandas
+
+from metrics.data_vendor import DataVendor
+from metrics.io.table_store import TableStore
+from metrics.parse.compact import compact
+from metrics.parse.manifest import MANIFEST_FILE_NAME, ParseManifest
+from metrics.session import Session
+
+
+# 2024-03-25 10:00:00 UTC
+HOUR_START = 1711360800
+
+
+class TestCompact:
+
+    def test_compact(self, tmp_path):
+        session = Session(session_path=str(tmp_path), start_time=0, end_time=1)
+        session.save_meta()
+
+        folder = os.path.join(session.tables_folder, DataVendor.Vaisala.value)
+        os.makedirs(folder)
+        store = TableStore(folder=folder)
+        for snapshot in [HOUR_START, HOUR_START + 600]:
+            table = pandas.DataFrame({"id": ["a"], "timestamp": [snapshot], "precip_rate": [1.0]})
+            table.to_parquet(store.snapshot_path(snapshot))
+
+        with open(os.path.join(session.tables_folder, MANIFEST_FILE_NAME), "w") as file:
+            file.write('{"output": "vaisala/%d.parquet", "entry": {"input_size": 1, "input_mtime": 1.0, '
+                       '"input_hash": "", "parser": "P", "parser_version": 1, "sensor_selection": null, '
+                       '"output_size": 1, "rows": 1}}\n' % HOUR_START)
+
+        assert compact(session_path=str(tmp_path),
+                       providers=[DataVendor.Vaisala, DataVendor.AccuWeather]) == {DataVendor.Vaisala.name: 2}
+
+        entry = ParseManifest(folder=session.tables_folder).get(store.snapshot_path(HOUR_START))
+        assert entry.location == os.path.relpath(store.partition_path(HOUR_START), session.tables_folder)
+        assert entry.output_size == os.path.getsize(store.partition_path(HOUR_START))
+
+        assert store.list_snapshot_tables() == []
+        assert store.load_snapshot(HOUR_START + 600)["timestamp"].tolist() == [HOUR_START + 600]
@@ -0,0 +1,109 @@
+import os
+import pytest
+
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.manifest import MANIFEST_FILE_NAME, ManifestEntry, ParseManifest, hash_file, selection_fingerprint
+
+from unittest.mock import patch
+
+
+class MockParser(BaseParser):
+    VERSION = 3
+
+
+def _write(path: str, data: bytes):
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def _record(manifest: ParseManifest, input_path: str, output_path: str, selection: str = None):
+    input_stat = os.stat(input_path)
+    manifest.update(output_path=output_path,
+                    entry=ManifestEntry(input_size=input_stat.st_size,
+                                        input_mtime=input_stat.st_mtime,
+                                        input_hash=hash_file(input_path),
+                                        parser=MockParser.__name__,
+                                        parser_version=MockParser.VERSION,
+                                        sensor_selection=selection,
+                                        output_size=os.path.getsize(output_path),
+                                        rows=1))
+
+
+class TestParseManifest:
+
+    @pytest.fixture
+    def files(self, tmp_path):
+        input_path = str(tmp_path / "1700000000.zip")
+        output_path = str(tmp_path / "tables" / "vendor" / "1700000000.parquet")
+        os.makedirs(os.path.dirname(output_path))
+        _write(input_path, b"archive")
+        _write(output_path, b"table")
+        return input_path, output_path
+
+    def test_is_fresh(self, tmp_path, files):
+        input_path, output_path = files
+        manifest = ParseManifest(folder=str(tmp_path / "tables"))
+
+        assert not manifest.is_fresh(input_path, output_path, MockParser, None)
+
+        _record(manifest, input_path, output_path)
+        assert manifest.is_fresh(input_path, output_path, MockParser, None)
+
+        # other parser version or sensor selection
+        with patch.object(MockParser, "VERSION", 4):
+            assert not manifest.is_fresh(input_path, output_path, MockParser, None)
+        assert not manifest.is_fresh(input_path, output_path, MockParser, selection_fingerprint(["a"]))
+
+    def test_is_fresh_hashes_only_changed_inputs(self, tmp_path, files):
+        input_path, output_path = files
+        manifest = ParseManifest(folder=str(tmp_path / "tables"))
+        _record(manifest, input_path, output_path)
+
+        with patch("metrics.parse.manifest.hash_file", wraps=hash_file) as hash_mock:
+            assert manifest.is_fresh(input_path, output_path, MockParser, None)
+            hash_mock.assert_not_called()
+
+            # the same content with a new modification time
+            os.utime(input_path, (0, 0))
+            assert manifest.is_fresh(input_path, output_path, MockParser, None)
+            assert hash_mock.call_count == 1
+
+            # new modification time is recorded
+            assert manifest.is_fresh(input_path, output_path, MockParser, None)
+            assert hash_mock.call_count == 1
+
+            # new content of the same size
+            _write(input_path, b"ARCHIVE")
+            assert not manifest.is_fresh(input_path, output_path, MockParser, None)
+
+    def test_is_fresh_output_changed(self, tmp_path, files):
+        input_path, output_path = files
+        manifest = ParseManifest(folder=str(tmp_path / "tables"))
+        _record(manifest, input_path, output_path)
+
+        _write(output_path, b"tab")
+        assert not manifest.is_fresh(input_path, output_path, MockParser, None)
+
+        os.remove(output_path)
+        assert not manifest.is_fresh(input_path, output_path, MockParser, None)
+
+    def test_reload(self, tmp_path, files):
+        input_path, output_path = files
+        folder = str(tmp_path / "tables")
+
+        manifest = ParseManifest(folder=folder)
+        _record(manifest, input_path, output_path, selection="old")
+        _record(manifest, input_path, output_path)
+
+        # line that wasn't completely written
+        with open(os.path.join(folder, MANIFEST_FILE_NAME), "a") as file:
+            file.write('{"output": "vendor/17')
+
+        reloaded = ParseManifest(folder=folder)
+        assert reloaded.get(output_path) == manifest.get(output_path)
+        assert reloaded.is_fresh(input_path, output_path, MockParser, None)
+
+        reloaded.save()
+        with open(os.path.join(folder, MANIFEST_FILE_NAME), "r") as file:
+            assert len(file.readlines()) == 1
+        assert ParseManifest(folder=folder).get(output_path) == manifest.get(output_path)
@@ -1,6 +1,16 @@
-from metrics.parse.parse import ParseSource, _process_source, parse
+import os
+import pandas
+import pytest
+import typing
+import zipfile
+
+from metrics.io.table_store import TableStore
+from metrics.parse.compact import compact
+from metrics.parse.parse import (ParseJob, ParseResult, ParseSource, _collect_source_jobs, _execute_jobs,
+                                 _parse_process_impl, parse)
 from metrics.data_vendor import BaseDataVendor, DataVendor
 from metrics.parse.base_parser import BaseParser
+from metrics.session import Session
 
 from unittest.mock import MagicMock, patch
 
@@ -10,45 +20,262 @@ class UnsupportedVendor(BaseDataVendor):
 
 
 class PickableMockParser(BaseParser):
-    def parse(input_archive_path: str, output_parquet_path: str):
+    def parse(self, input_archive_path: str, output_parquet_path: str, **kwargs):
         pass
 
 
+class FailingMockParser(BaseParser):
+    def parse(self, input_archive_path: str, output_parquet_path: str, **kwargs):
+        raise ValueError("broken archive")
+
+
+class CsvMockParser(BaseParser):
+    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
+        if b"broken" in data:
+            raise ValueError(f"broken member {file_name}")
+
+        rows = []
+        for line in data.decode().splitlines():
+            id, value = line.split(",")
+            rows.append([id, timestamp, float(value)])
+        return rows
+
+    def _should_parse_file_extension(self, file_extension: str) -> bool:
+        return file_extension == ".csv"
+
+    def _get_columns(self) -> typing.List[str]:
+        return ["id", "timestamp", "precip_rate"]
+
+
+def _create_session(session_path: str, members: typing.List[str]) -> Session:
+    os.makedirs(session_path, exist_ok=True)
+    session = Session(session_path=session_path, start_time=0, end_time=1)
+    session.save_meta()
+
+    archive_folder = os.path.join(session.data_folder, DataVendor.Vaisala.value)
+    os.makedirs(archive_folder)
+    with zipfile.ZipFile(os.path.join(archive_folder, "1700000000.zip"), "w") as archive:
+        archive.writestr("readme.txt", "not parsed")
+        for index, content in enumerate(members):
+            archive.writestr(f"{index}.csv", content)
+
+    return session
+
+
 class TestParse:
     @patch("metrics.parse.parse.Session.create_from_folder")
-    @patch("metrics.parse.parse._process_source")
+    @patch("metrics.parse.parse.SessionCatalog")
+    @patch("metrics.parse.parse.ParseManifest")
+    @patch("metrics.parse.parse._execute_jobs")
+    @patch("metrics.parse.parse._collect_source_jobs")
     @patch("metrics.parse.parse.os.makedirs")
-    def test_parse_smoke(self, mkdir_mock, process_source_mock: MagicMock, create_session_mock):
-        parse(session_path="test",
-              process_num=1,
-              providers=[DataVendor.AccuWeather,
-                         DataVendor.Vaisala,
-                         UnsupportedVendor.WeatherTest])
+    def test_parse_smoke(self, mkdir_mock, collect_mock: MagicMock, exec_mock: MagicMock, manifest_mock, catalog_mock,
+                         create_session_mock):
+        def _collect(source: ParseSource, **kwargs):
+            sizes = {DataVendor.AccuWeather.name: [10, 30], DataVendor.Vaisala.name: [20]}
+            return [ParseJob(vendor=source.vendor,
+                             input_archive_path=f"{source.vendor}/{size}.zip",
+                             output_parquet_path=f"{source.vendor}/{size}.parquet",
+                             parser_class=PickableMockParser,
+                             archive_size=size) for size in sizes[source.vendor]]
+
+        collect_mock.side_effect = _collect
+        exec_mock.side_effect = lambda jobs, process_num, manifest: [ParseResult(job=job) for job in jobs]
+
+        failed = parse(session_path="test",
+                       process_num=1,
+                       providers=[DataVendor.AccuWeather,
+                                  DataVendor.Vaisala,
+                                  UnsupportedVendor.WeatherTest])
 
         processed_sources = []
-        for args, kwargs in process_source_mock.call_args_list:
+        for args, kwargs in collect_mock.call_args_list:
             processed_sources.append(kwargs["source"].vendor)
 
         assert processed_sources == [DataVendor.AccuWeather.name, DataVendor.Vaisala.name]
+        assert failed == []
 
-    @patch("metrics.parse.parse._execute_source_jobs")
-    @patch("metrics.parse.parse.os.walk")
+        # all vendors are executed at once, the largest archives first
+        exec_mock.assert_called_once()
+        args, kwargs = exec_mock.call_args
+        assert kwargs["process_num"] == 1
+        assert [job.archive_size for job in kwargs["jobs"]] == [30, 20, 10]
+
+    @patch("metrics.parse.parse.Session.create_from_folder")
+    @patch("metrics.parse.parse.SessionCatalog")
+    @patch("metrics.parse.parse.ParseManifest")
+    @patch("metrics.parse.parse._execute_jobs")
+    @patch("metrics.parse.parse._collect_source_jobs")
     @patch("metrics.parse.parse.os.makedirs")
-    def test_process_source_smoke(self, os_mkdir_mock, os_walk_mock, exec_mock: MagicMock):
-        source = None
-        process_num = 1
+    def test_parse_nothing_to_do(self, mkdir_mock, collect_mock: MagicMock, exec_mock: MagicMock, manifest_mock,
+                                 catalog_mock, create_session_mock):
+        collect_mock.return_value = []
+
+        assert parse(session_path="test", process_num=1, providers=[DataVendor.AccuWeather]) == []
+        exec_mock.assert_not_called()
 
-        os_walk_mock.return_value = [("test/", (), ("1.zip",))]
+    @patch("metrics.parse.parse.os.path.getsize")
+    @patch("metrics.parse.parse.os.path.exists")
+    @patch("metrics.parse.parse.os.walk")
+    @patch("metrics.parse.parse.os.makedirs")
+    def test_collect_source_jobs_smoke(self, os_mkdir_mock, os_walk_mock, exists_mock, getsize_mock):
+        os_walk_mock.return_value = [("test/", (), ("1.zip", "2.zip", "notes.txt")),
+                                     ("test/sub", (), ("3.zip",))]
+        exists_mock.side_effect = lambda path: path == "out/2.parquet"
+        getsize_mock.return_value = 42
 
         source = ParseSource(vendor="test",
                              input_folder="test",
-                             output_folder="test",
+                             output_folder="out",
                              parser_class=PickableMockParser)
 
-        _process_source(source=source, process_num=process_num)
+        jobs = _collect_source_jobs(source=source)
 
-        args, kwargs = exec_mock.call_args
+        assert [job.input_archive_path for job in jobs] == ["test/1.zip", "test/sub/3.zip"]
+        assert [job.output_parquet_path for job in jobs] == ["out/1.parquet", "out/3.parquet"]
+        assert all(job.vendor == "test" and job.archive_size == 42 for job in jobs)
 
-        assert kwargs["source_name"] == "test"
-        assert kwargs["process_num"] == 1
-        assert kwargs["jobs"][0].input_archive_path == "test/1.zip"
+    def test_parse_process_impl_records_failure(self, tmp_path):
+        archive_path = str(tmp_path / "1.zip")
+        with open(archive_path, "wb") as file:
+            file.write(b"archive")
+
+        job = ParseJob(vendor="test",
+                       input_archive_path=archive_path,
+                       output_parquet_path=str(tmp_path / "1.parquet"),
+                       parser_class=FailingMockParser)
+
+        result = _parse_process_impl(job)
+
+        assert result.job is job
+        assert "broken archive" in result.error
+
+        job.parser_class = PickableMockParser
+        assert _parse_process_impl(job).error is None
+
+    @pytest.mark.parametrize("members_per_job", [None, 1, 3, 100])
+    def test_parse_archive_chunks(self, tmp_path, members_per_job: typing.Optional[int]):
+        members = [f"s{index},{index}.5\ns{index}x,0" for index in range(7)]
+        session = _create_session(session_path=str(tmp_path), members=members)
+
+        failed = parse(session_path=str(tmp_path),
+                       process_num=2,
+                       members_per_job=members_per_job,
+                       providers=[DataVendor.Vaisala],
+                       providers_parser={DataVendor.Vaisala: CsvMockParser})
+
+        assert failed == []
+
+        output_folder = os.path.join(session.tables_folder, DataVendor.Vaisala.value)
+        assert os.listdir(output_folder) == ["1700000000.parquet"]
+
+        expected_path = os.path.join(str(tmp_path), "expected.parquet")
+        CsvMockParser().parse(input_archive_path=os.path.join(session.data_folder, DataVendor.Vaisala.value,
+                                                              "1700000000.zip"),
+                              output_parquet_path=expected_path)
+
+        pandas.testing.assert_frame_equal(pandas.read_parquet(os.path.join(output_folder, "1700000000.parquet")),
+                                          pandas.read_parquet(expected_path))
+
+    def test_parse_archive_chunk_failure(self, tmp_path):
+        members = ["a,1", "b,2", "broken", "c,3"]
+        session = _create_session(session_path=str(tmp_path), members=members)
+
+        failed = parse(session_path=str(tmp_path),
+                       process_num=2,
+                       members_per_job=2,
+                       providers=[DataVendor.Vaisala],
+                       providers_parser={DataVendor.Vaisala: CsvMockParser})
+
+        assert len(failed) == 1
+        assert failed[0].job.parts_num == 1
+        assert "broken member 2.csv" in failed[0].error
+
+        # neither the snapshot table nor the chunk tables are left
+        assert os.listdir(os.path.join(session.tables_folder, DataVendor.Vaisala.value)) == []
+
+    @pytest.mark.parametrize("members_per_job", [None, 1])
+    def test_parse_sensor_selection(self, tmp_path, members_per_job: typing.Optional[int]):
+        members = [f"s{index},{index}" for index in range(5)]
+        session = _create_session(session_path=str(tmp_path / "session"), members=members)
+
+        # numeric ids are read as integers, but they have to match member names
+        selection_path = str(tmp_path / "selection.csv")
+        pandas.DataFrame({"id": [0, 3, 42]}).to_csv(selection_path, index=False)
+
+        failed = parse(session_path=str(tmp_path / "session"),
+                       process_num=1,
+                       members_per_job=members_per_job,
+                       sensor_selection_path=selection_path,
+                       providers=[DataVendor.Vaisala],
+                       providers_parser={DataVendor.Vaisala: CsvMockParser})
+
+        assert failed == []
+
+        table = pandas.read_parquet(os.path.join(session.tables_folder, DataVendor.Vaisala.value, "1700000000.parquet"))
+        assert table["id"].tolist() == ["s0", "s3"]
+
+        # the manifest records the selection, so the same selection doesn't parse again
+        with patch("metrics.parse.parse._execute_jobs") as exec_mock:
+            parse(session_path=str(tmp_path / "session"),
+                  process_num=1,
+                  members_per_job=members_per_job,
+                  sensor_selection_path=selection_path,
+                  providers=[DataVendor.Vaisala],
+                  providers_parser={DataVendor.Vaisala: CsvMockParser})
+        exec_mock.assert_not_called()
+
+    def test_parse_reruns_only_stale_archives(self, tmp_path):
+        session = _create_session(session_path=str(tmp_path), members=["a,1", "b,2"])
+        archive_path = os.path.join(session.data_folder, DataVendor.Vaisala.value, "1700000000.zip")
+
+        def _parse() -> typing.List[str]:
+            with patch("metrics.parse.parse._execute_jobs", wraps=_execute_jobs) as exec_mock:
+                parse(session_path=str(tmp_path),
+                      process_num=1,
+                      providers=[DataVendor.Vaisala],
+                      providers_parser={DataVendor.Vaisala: CsvMockParser})
+
+                if not exec_mock.called:
+                    return []
+                return [job.input_archive_path for job in exec_mock.call_args.kwargs["jobs"]]
+
+        assert _parse() == [archive_path]
+        assert _parse() == []
+
+        # the same content downloaded again
+        os.utime(archive_path, (0, 0))
+        assert _parse() == []
+
+        # truncated table
+        output_path = os.path.join(session.tables_folder, DataVendor.Vaisala.value, "1700000000.parquet")
+        with open(output_path, "r+b") as file:
+            file.truncate(10)
+        assert _parse() == [archive_path]
+
+        # new content of the archive
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            archive.writestr("0.csv", "c,3")
+        assert _parse() == [archive_path]
+
+        table = pandas.read_parquet(output_path)
+        assert table["id"].tolist() == ["c"]
+
+    def test_parse_after_compact(self, tmp_path):
+        session = _create_session(session_path=str(tmp_path), members=["a,1", "b,2"])
+        parse_params = dict(session_path=str(tmp_path),
+                            process_num=1,
+                            providers=[DataVendor.Vaisala],
+                            providers_parser={DataVendor.Vaisala: CsvMockParser})
+
+        parse(**parse_params)
+        compact(session_path=str(tmp_path), providers=[DataVendor.Vaisala])
+
+        # compacted snapshots are up to date
+        with patch("metrics.parse.parse._execute_jobs") as exec_mock:
+            parse(**parse_params)
+            exec_mock.assert_not_called()
+
+        store = TableStore(folder=os.path.join(session.tables_folder, DataVendor.Vaisala.value))
+        assert store.list_snapshot_tables() == []
+        assert store.load_snapshot(1700000000)["id"].tolist() == ["a", "b"]
@@ -0,0 +1,42 @@
+import os
+import pandas
+
+from metrics.calc.rollup import rollup_folder
+from metrics.data_vendor import DataVendor
+from metrics.io.table_store import TableStore
+from metrics.parse.rollup import rollup
+from metrics.session import Session
+
+
+SNAPSHOT = 1711360800
+
+
+class TestRollup:
+
+    def test_rollup(self, tmp_path):
+        session = Session(session_path=str(tmp_path), start_time=0, end_time=1)
+        session.save_meta()
+
+        store = TableStore(folder=os.path.join(session.tables_folder, DataVendor.Vaisala.value))
+        os.makedirs(os.path.join(session.tables_folder, DataVendor.Vaisala.value))
+        table = pandas.DataFrame({"id": ["a", "a", "b"],
+                                  "timestamp": [SNAPSHOT + 60, SNAPSHOT + 120, SNAPSHOT + 660],
+                                  "precip_rate": [1.0, 2.0, 3.0],
+                                  "precip_type": [1, 1, 2]})
+        table.to_parquet(store.snapshot_path(SNAPSHOT))
+
+        providers = [DataVendor.Vaisala, DataVendor.AccuWeather]
+        assert rollup(session_path=str(tmp_path), process_num=1, providers=providers) == {DataVendor.Vaisala.name: 1}
+
+        rollup_path = os.path.join(rollup_folder(session.tables_folder, DataVendor.Vaisala), f"{SNAPSHOT}.parquet")
+        result = pandas.read_parquet(rollup_path).sort_values(by=["id"], ignore_index=True)
+        assert result["id"].tolist() == ["a", "b"]
+        assert result["timestamp"].tolist() == [SNAPSHOT + 600, SNAPSHOT + 1200]
+        assert result["precip_rate"].tolist() == [2.0, 3.0]
+
+        # up to date rollups are kept
+        assert rollup(session_path=str(tmp_path), process_num=1, providers=providers) == {}
+
+        # re-parsed table
+        os.utime(rollup_path, (0, 0))
+        assert rollup(session_path=str(tmp_path), process_num=1, providers=providers) == {DataVendor.Vaisala.name: 1}
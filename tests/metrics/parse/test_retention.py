@@ -0,0 +1,175 @@
+import io
+import json
+import os
+import pandas
+import typing
+import zipfile
+
+from metrics.checkout.manifest import CheckoutManifest
+from metrics.data_vendor import DataVendor
+from metrics.io.catalog import KIND_ARCHIVE, KIND_TABLE, SessionCatalog
+from metrics.io.table_store import TableStore
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.manifest import ParseManifest
+from metrics.parse.parse import _parse_sources, parse
+from metrics.parse.retention import Retention, RetentionPolicy, retain
+from metrics.session import Session
+from unittest.mock import patch
+
+
+# 2024-03-25 10:00:00 UTC
+HOUR_START = 1711360800
+
+
+class CsvSensorParser(BaseParser):
+    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
+        return [[os.path.splitext(file_name)[0], timestamp, float(data.decode())]]
+
+    def _should_parse_file_extension(self, file_extension: str) -> bool:
+        return file_extension == ".csv"
+
+    def _get_columns(self) -> typing.List[str]:
+        return ["id", "timestamp", "precip_rate"]
+
+
+PARSERS = {DataVendor.Metar: CsvSensorParser}
+
+
+def _session(tmp_path, snapshots: typing.List[int], downloaded: typing.List[int]) -> Session:
+    """Creates a parsed session with METAR archives, the `downloaded` ones are known to the checkout manifest"""
+    session = Session(session_path=str(tmp_path / "session"), start_time=snapshots[0], end_time=snapshots[-1])
+    folder = os.path.join(session.data_folder, DataVendor.Metar.value)
+    os.makedirs(folder)
+    session.save_meta()
+
+    manifest = CheckoutManifest(folder=folder)
+    for snapshot in snapshots:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zip_file:
+            zip_file.writestr("s1.csv", "1.0")
+            zip_file.writestr("s2.csv", "0.0")
+
+        file_path = os.path.join(folder, f"{snapshot}.zip")
+        with open(file_path, "wb") as file:
+            file.write(buffer.getvalue())
+        if snapshot in downloaded:
+            manifest.update(file_path=file_path, size=len(buffer.getvalue()), etag=str(snapshot))
+    manifest.save()
+
+    assert parse(session_path=session.path, process_num=1, providers=[DataVendor.Metar],
+                 providers_parser=PARSERS) == []
+    return session
+
+
+def _sources(session: Session):
+    return _parse_sources(session=session, providers=[DataVendor.Metar], providers_parser=PARSERS)
+
+
+def _archives(session: Session) -> typing.List[str]:
+    return sorted(os.listdir(os.path.join(session.data_folder, DataVendor.Metar.value)))
+
+
+class TestRetention:
+
+    def test_drop_parsed_archives(self, tmp_path):
+        snapshots = [HOUR_START, HOUR_START + 600, HOUR_START + 1200]
+        session = _session(tmp_path, snapshots=snapshots, downloaded=snapshots[:2])
+        folder = os.path.join(session.data_folder, DataVendor.Metar.value)
+
+        # the archive was rewritten after it was parsed, so its table isn't verified
+        file_path = os.path.join(folder, f"{HOUR_START + 600}.zip")
+        with open(file_path, "ab") as file:
+            file.write(b"tail")
+
+        report = retain(session_path=session.path,
+                        policy=RetentionPolicy(drop_parsed_archives=True),
+                        providers_parser=PARSERS)
+
+        assert report.dropped == 1
+        # archives that checkout doesn't know are kept, it would download them again
+        assert _archives(session) == [f"{HOUR_START + 600}.zip", f"{HOUR_START + 1200}.zip",
+                                      "checkout_manifest.jsonl"]
+
+        catalog = SessionCatalog(session_path=session.path)
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_ARCHIVE, vendor=DataVendor.Metar.value)] == \
+            snapshots[1:]
+
+        # dropped archives are kept by the manifest and up to date while the object doesn't change
+        CheckoutManifest(folder=folder).save()
+        manifest = CheckoutManifest(folder=folder)
+        archive_path = os.path.join(folder, f"{HOUR_START}.zip")
+        assert manifest.is_fresh(file_path=archive_path, size=report.freed, etag=str(HOUR_START))
+        assert not manifest.is_fresh(file_path=archive_path, size=report.freed, etag="changed")
+
+        # the table of the dropped archive stays and isn't parsed again
+        with patch("metrics.parse.parse._execute_jobs", return_value=[]) as exec_mock:
+            parse(session_path=session.path, process_num=1, providers=[DataVendor.Metar], providers_parser=PARSERS)
+        assert [job.input_archive_path for job in exec_mock.call_args.kwargs["jobs"]] == [file_path]
+
+        table = pandas.read_parquet(os.path.join(session.tables_folder, DataVendor.Metar.value,
+                                                 f"{HOUR_START}.parquet"))
+        assert list(table["id"]) == ["s1", "s2"]
+
+    def test_compact_before(self, tmp_path):
+        snapshots = [HOUR_START - 600, HOUR_START, HOUR_START + 600]
+        session = _session(tmp_path, snapshots=snapshots, downloaded=snapshots)
+        retention = Retention(session=session,
+                              policy=RetentionPolicy(compact=True, drop_parsed_archives=True),
+                              parse_sources=_sources(session))
+
+        # the hour that is still being filled isn't rewritten and its archives are kept
+        report = retention.run(before=HOUR_START + 600)
+        assert (report.compacted, report.dropped) == (1, 2)
+
+        store = TableStore(folder=os.path.join(session.tables_folder, DataVendor.Metar.value))
+        assert store.list_snapshot_tables() == [HOUR_START, HOUR_START + 600]
+        assert list(store.load_snapshot(HOUR_START - 600)["timestamp"]) == [HOUR_START - 600] * 2
+        assert _archives(session) == [f"{HOUR_START + 600}.zip", "checkout_manifest.jsonl"]
+
+        report = retention.run()
+        assert (report.compacted, report.dropped) == (2, 1)
+        assert store.list_snapshot_tables() == []
+
+        # compacted tables are fresh for the parse manifest
+        with patch("metrics.parse.parse._execute_jobs") as exec_mock:
+            parse(session_path=session.path, process_num=1, providers=[DataVendor.Metar], providers_parser=PARSERS)
+        exec_mock.assert_not_called()
+
+    def test_vendor_quota(self, tmp_path):
+        snapshots = [HOUR_START + 600 * index for index in range(4)]
+        session = _session(tmp_path, snapshots=snapshots, downloaded=snapshots)
+        catalog = SessionCatalog(session_path=session.path)
+        vendor = DataVendor.Metar.value
+
+        archive_size = catalog.list(kind=KIND_ARCHIVE, vendor=vendor)[0].size
+        table_size = catalog.list(kind=KIND_TABLE, vendor=vendor)[0].size
+        retention = Retention(session=session,
+                              policy=RetentionPolicy(vendor_quotas={vendor: 3 * (archive_size + table_size)}),
+                              parse_sources=_sources(session))
+
+        # the oldest snapshot goes first, its table before its archive
+        with patch("metrics.parse.retention.os.remove", side_effect=os.remove) as remove_mock:
+            report = retention.run()
+        assert [os.path.basename(call.args[0]) for call in remove_mock.call_args_list] == \
+            [f"{snapshots[0]}.parquet", f"{snapshots[0]}.zip"]
+        assert report.evicted == 2
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_ARCHIVE, vendor=vendor)] == snapshots[1:]
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_TABLE, vendor=vendor)] == snapshots[1:]
+
+        # the parse manifest forgets the evicted tables, checkout doesn't download the evicted archives again
+        table_path = os.path.join(session.tables_folder, vendor, f"{snapshots[0]}.parquet")
+        assert ParseManifest(folder=session.tables_folder).get(table_path) is None
+        assert ParseManifest(folder=session.tables_folder).get(table_path.replace(str(snapshots[0]),
+                                                                                  str(snapshots[1]))) is not None
+        CheckoutManifest(folder=os.path.join(session.data_folder, vendor)).save()
+        with open(os.path.join(session.data_folder, vendor, "checkout_manifest.jsonl")) as file:
+            assert [(record["file"], record["entry"]["dropped"]) for record in map(json.loads, file)] == \
+                [(f"{snapshot}.zip", snapshot == snapshots[0]) for snapshot in snapshots]
+
+        # snapshots in use are kept even if the vendor takes more than its quota
+        retention = Retention(session=session,
+                              policy=RetentionPolicy(vendor_quotas={vendor: archive_size}),
+                              parse_sources=_sources(session))
+        report = retention.run(before=snapshots[2])
+        assert report.evicted == 2
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_TABLE, vendor=vendor)] == snapshots[2:]
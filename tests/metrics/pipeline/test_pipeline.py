@@ -0,0 +1,262 @@
+import aioboto3
+import asyncio
+import boto3
+import io
+import json
+import os
+import pandas
+import pytest
+import queue
+import socket
+import typing
+import zipfile
+
+from metrics.calc.events import CalculateMetrics
+from metrics.checkout.checkout import forecast_download_tasks, sensors_download_tasks
+from metrics.checkout.data_source import ForecastSourcesInfo, ObservationSourcesInfo
+from metrics.checkout.engine import CheckoutEngine
+from metrics.data_vendor import DataVendor
+from metrics.io.catalog import KIND_TABLE, SessionCatalog
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.forecast.accuweather import AccuWeatherParser
+from metrics.io.table_store import TableStore
+from metrics.parse.parse import ParseSource
+from metrics.parse.retention import RetentionPolicy
+from metrics.pipeline.pipeline import Pipeline, SnapshotTracker, _ArchiveFeed
+from metrics.session import Session
+from metrics.utils.precipitation import PrecipitationType
+from moto.server import ThreadedMotoServer
+from unittest.mock import patch
+
+BUCKET = "rainbow-pipeline"
+START_TIME = 7200
+END_TIME = 10800
+FORECAST_RANGE = 1800
+
+
+class CsvObservationParser(BaseParser):
+    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
+        precip_rate = float(data.decode())
+        precip_type = PrecipitationType.RAIN.value if precip_rate > 0 else PrecipitationType.UNKNOWN.value
+        return [[os.path.splitext(file_name)[0], 0.0, 0.0, timestamp, precip_rate, precip_type]]
+
+    def _should_parse_file_extension(self, file_extension: str) -> bool:
+        return file_extension == ".csv"
+
+    def _get_columns(self) -> typing.List[str]:
+        return ["id", "lon", "lat", "timestamp", "precip_rate", "precip_type"]
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_client(s3_endpoint):
+    with patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test",
+                                 "AWS_SECRET_ACCESS_KEY": "test",
+                                 "AWS_DEFAULT_REGION": "us-east-1"}):
+        client = boto3.client("s3", endpoint_url=s3_endpoint)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+        for item in client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+            client.delete_object(Bucket=BUCKET, Key=item["Key"])
+        client.delete_bucket(Bucket=BUCKET)
+
+
+def _archive(members: typing.Dict[str, str]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _upload_session(s3_client):
+    # it rains for the whole forecast and observations see rain in the second half of the hour
+    for snapshot in range(START_TIME - FORECAST_RANGE, END_TIME + 1, 600):
+        forecast = {"position": {"lon": 0.0, "lat": 0.0},
+                    "payload": {"Summaries": [{"Type": "RAIN", "StartMinute": 0, "EndMinute": 119}]}}
+        s3_client.put_object(Bucket=BUCKET, Key=f"accuweather/{snapshot}.zip",
+                             Body=_archive({"s1.json": json.dumps(forecast)}))
+
+    for snapshot in range(START_TIME - 600, END_TIME + 1, 120):
+        rate = "1.0" if snapshot >= START_TIME + 1800 else "0.0"
+        s3_client.put_object(Bucket=BUCKET, Key=f"metar/{snapshot}.zip", Body=_archive({"s1.csv": rate}))
+
+
+def _run(session_path: str,
+         endpoint: str,
+         output_csv: str,
+         queue_size: int = 2,
+         retention: typing.Optional[RetentionPolicy] = None):
+    session = Session(session_path=session_path,
+                      start_time=START_TIME,
+                      end_time=END_TIME,
+                      forecast_range=FORECAST_RANGE)
+
+    forecasts = ForecastSourcesInfo(s3_uri_accuweather=f"s3://{BUCKET}/accuweather/")
+    observations = ObservationSourcesInfo(s3_uri_metar=f"s3://{BUCKET}/metar/")
+    tasks = forecast_download_tasks(session=session, forecasts_source=forecasts)
+    tasks += sensors_download_tasks(session=session, observations_source=observations)
+
+    sources = [ParseSource(vendor=vendor.name,
+                           input_folder=os.path.join(session.data_folder, vendor.value),
+                           output_folder=os.path.join(session.tables_folder, vendor.value),
+                           parser_class=parser_class)
+               for vendor, parser_class in [(DataVendor.AccuWeather, AccuWeatherParser),
+                                            (DataVendor.Metar, CsvObservationParser)]]
+
+    calculator = CalculateMetrics(forecast_vendor=DataVendor.AccuWeather,
+                                  observation_vendor=DataVendor.Metar,
+                                  sensor_selection_path=None,
+                                  forecast_offsets=[0],
+                                  threshold=0.1,
+                                  precip_types=[PrecipitationType.RAIN],
+                                  session_path=session_path,
+                                  split_time_range=1200)
+
+    pipeline = Pipeline(session=session,
+                        calculator=calculator,
+                        output_csv=output_csv,
+                        parse_sources=sources,
+                        process_num=2,
+                        queue_size=queue_size,
+                        retention=retention)
+    engine = CheckoutEngine(session=aioboto3.Session(), endpoint_url=endpoint)
+    return pipeline.run(engine=engine, tasks=tasks)
+
+
+class TestSnapshotTracker:
+
+    def test_is_ready(self):
+        tracker = SnapshotTracker()
+        tracker.expect(vendor="metar", snapshots=[0, 600, 1200])
+
+        assert not tracker.is_ready("metar", (0, 600))
+        assert tracker.is_ready("metar", (700, 1100))
+        assert tracker.is_ready("accuweather", (0, 1200))
+
+        tracker.resolve("metar", 0)
+        tracker.resolve("metar", 600)
+        assert tracker.is_ready("metar", (0, 600))
+        assert not tracker.is_ready("metar", (0, 1200))
+
+        tracker.resolve_all()
+        assert tracker.is_ready("metar", (0, 1200))
+
+
+class TestArchiveFeed:
+
+    def test_reserve_in_time_order(self):
+        async def _run() -> typing.List[str]:
+            feed = _ArchiveFeed(events=queue.Queue(), queue_size=2)
+            reserved = []
+
+            async def _reserve(file_path: str):
+                await feed.reserve(file_path)
+                reserved.append(file_path)
+
+            # every task asks for slots of all its archives at once
+            tasks = [asyncio.create_task(_reserve(os.path.join(vendor, f"{snapshot}.zip")))
+                     for vendor in ["accuweather", "metar"] for snapshot in [0, 600, 1200]]
+            await asyncio.sleep(0)
+            for _ in range(4):
+                feed._release()
+                await asyncio.sleep(0)
+
+            await asyncio.gather(*tasks)
+            return reserved
+
+        # freed slots go to the earliest snapshots of all vendors, not to the rest of the first task
+        assert asyncio.run(_run()) == [os.path.join("accuweather", "0.zip"), os.path.join("accuweather", "600.zip"),
+                                       os.path.join("metar", "0.zip"), os.path.join("metar", "600.zip"),
+                                       os.path.join("accuweather", "1200.zip"), os.path.join("metar", "1200.zip")]
+
+
+class TestPipeline:
+
+    def test_run(self, s3_client, s3_endpoint, tmp_path):
+        _upload_session(s3_client)
+        session_path = str(tmp_path / "session")
+        output_csv = str(tmp_path / "metrics.csv")
+
+        with patch.object(SessionCatalog, "sync", autospec=True, side_effect=SessionCatalog.sync) as sync_mock:
+            report = _run(session_path=session_path, endpoint=s3_endpoint, output_csv=output_csv)
+
+        # folders are walked by the initial and final syncs and when their first files come
+        assert sync_mock.call_count == 8
+
+        assert report.checkout.downloaded == 10 + 36
+        assert report.checkout.failed == []
+        assert report.parsed == 10 + 36
+        assert report.parse_failed == []
+        assert (report.calculated, report.calc_failed) == (3, 0)
+
+        metrics = pandas.read_csv(output_csv)
+        assert len(metrics) > 0
+        assert os.path.exists(os.path.join(session_path, "meta.json"))
+
+        catalog = SessionCatalog(session_path=session_path)
+        assert len(catalog.list(kind=KIND_TABLE, vendor=DataVendor.Metar.value)) == 36
+
+        # archives and tables of the first run are up to date, only metrics are calculated again
+        report = _run(session_path=session_path, endpoint=s3_endpoint, output_csv=output_csv)
+
+        assert (report.checkout.downloaded, report.checkout.up_to_date) == (0, 46)
+        assert report.parsed == 0
+        assert report.calculated == 3
+        pandas.testing.assert_frame_equal(pandas.read_csv(output_csv).sort_values(list(metrics.columns))
+                                          .reset_index(drop=True),
+                                          metrics.sort_values(list(metrics.columns)).reset_index(drop=True))
+
+    def test_missing_archives(self, s3_client, s3_endpoint, tmp_path):
+        # calc doesn't wait for snapshots that don't exist
+        s3_client.put_object(Bucket=BUCKET, Key=f"metar/{START_TIME}.zip", Body=_archive({"s1.csv": "0.0"}))
+
+        report = _run(session_path=str(tmp_path / "session"), endpoint=s3_endpoint,
+                      output_csv=str(tmp_path / "metrics.csv"), queue_size=1)
+
+        assert report.checkout.downloaded == 1
+        assert report.checkout.missing == 10 + 35
+        assert report.parsed == 1
+        assert report.calculated + report.calc_failed == 3
+
+    def test_retention(self, s3_client, s3_endpoint, tmp_path):
+        _upload_session(s3_client)
+        _run(session_path=str(tmp_path / "plain"), endpoint=s3_endpoint, output_csv=str(tmp_path / "plain.csv"))
+
+        session_path = str(tmp_path / "session")
+        output_csv = str(tmp_path / "metrics.csv")
+        retention = RetentionPolicy(compact=True, drop_parsed_archives=True)
+        report = _run(session_path=session_path, endpoint=s3_endpoint, output_csv=output_csv, retention=retention)
+
+        assert (report.parsed, report.calculated, report.calc_failed) == (10 + 36, 3, 0)
+        metrics = pandas.read_csv(output_csv)
+        pandas.testing.assert_frame_equal(metrics.sort_values(list(metrics.columns)).reset_index(drop=True),
+                                          pandas.read_csv(str(tmp_path / "plain.csv"))
+                                          .sort_values(list(metrics.columns)).reset_index(drop=True))
+
+        # parsed archives are dropped and tables are compacted into partitions
+        for vendor in [DataVendor.AccuWeather, DataVendor.Metar]:
+            assert [name for name in os.listdir(os.path.join(session_path, "data", vendor.value))
+                    if name.endswith(".zip")] == []
+            assert TableStore(folder=os.path.join(session_path, "tables", vendor.value)).list_snapshot_tables() == []
+
+        # dropped archives are not downloaded and parsed again
+        report = _run(session_path=session_path, endpoint=s3_endpoint, output_csv=output_csv, retention=retention)
+
+        assert (report.checkout.downloaded, report.checkout.up_to_date) == (0, 46)
+        assert (report.parsed, report.calculated, report.calc_failed) == (0, 3, 0)
+        pandas.testing.assert_frame_equal(pandas.read_csv(output_csv).sort_values(list(metrics.columns))
+                                          .reset_index(drop=True),
+                                          metrics.sort_values(list(metrics.columns)).reset_index(drop=True))
@@ -0,0 +1,224 @@
+import boto3
+import io
+import os
+import pytest
+import socket
+import typing
+import zipfile
+
+from metrics.calc.events import CalculateMetrics
+from metrics.calc.scheduler import ARCHIVE_MEMORY_RATIO, PROCESS_MEMORY
+from metrics.checkout.engine import DownloadTask
+from metrics.data_vendor import DataVendor
+from metrics.io.table_store import TableStore
+from metrics.parse.base_parser import BaseParser
+from metrics.parse.compact import compact
+from metrics.parse.parse import parse
+from metrics.plan.plan import PlanLimits, make_plan
+from metrics.session import Session
+from metrics.utils.precipitation import PrecipitationType
+from metrics.utils.s3 import S3Client
+from moto.server import ThreadedMotoServer
+from unittest.mock import patch
+
+BUCKET = "rainbow-storage"
+MB = 1024 ** 2
+
+
+class CsvSensorParser(BaseParser):
+    def _parse_impl(self, timestamp: int, file_name: str, data: bytes) -> typing.List[typing.List[any]]:
+        return [[os.path.splitext(file_name)[0], timestamp, float(data.decode())]]
+
+    def _should_parse_file_extension(self, file_extension: str) -> bool:
+        return file_extension == ".csv"
+
+    def _get_columns(self) -> typing.List[str]:
+        return ["id", "timestamp", "precip_rate"]
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_client(s3_endpoint):
+    with patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test",
+                                 "AWS_SECRET_ACCESS_KEY": "test",
+                                 "AWS_DEFAULT_REGION": "us-east-1"}):
+        client = boto3.client("s3", endpoint_url=s3_endpoint)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+        for item in client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+            client.delete_object(Bucket=BUCKET, Key=item["Key"])
+        client.delete_bucket(Bucket=BUCKET)
+
+
+def _archive(members: typing.Dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _task(session: Session, vendor: DataVendor, snapshots: typing.List[int]) -> DownloadTask:
+    download_path = os.path.join(session.data_folder, vendor.value)
+    return DownloadTask(name=vendor.value,
+                        download_path=download_path,
+                        download_uri_list=[f"s3://{BUCKET}/{vendor.value}/{snapshot}.zip" for snapshot in snapshots],
+                        file_paths=[os.path.join(download_path, f"{snapshot}.zip") for snapshot in snapshots])
+
+
+class TestMakePlan:
+
+    def test_checkout_and_parse(self, s3_client, tmp_path):
+        archives = {snapshot: _archive({"s1.csv": b"1.0", "s2.csv": b"0.0", "padding.bin": os.urandom(snapshot)})
+                    for snapshot in [600, 1200]}
+        for snapshot, archive in archives.items():
+            s3_client.put_object(Bucket=BUCKET, Key=f"metar/{snapshot}.zip", Body=archive)
+
+        session = Session(session_path=str(tmp_path / "session"), start_time=600, end_time=1800)
+        task = _task(session, DataVendor.Metar, [600, 1200, 1800])
+
+        def _plan():
+            plan = make_plan(session=session,
+                             tasks=[task],
+                             process_num=4,
+                             client=S3Client(client=s3_client),
+                             providers_parser={DataVendor.Metar: CsvSensorParser})
+            assert len(plan.vendors) == 1
+            return plan, plan.vendors[0]
+
+        plan, metar = _plan()
+        assert (metar.objects, metar.missing, metar.download_objects) == (2, 1, 2)
+        assert metar.download_size == metar.archive_size == len(archives[600]) + len(archives[1200])
+        assert metar.parse_archives == 2
+        # rows of a vendor that was never parsed are unknown
+        assert metar.table_rows is None
+        assert metar.table_size == metar.archive_size
+        assert metar.parse_memory == PROCESS_MEMORY + len(archives[1200]) * ARCHIVE_MEMORY_RATIO
+        assert plan.parse_process_num == 4
+        assert plan.free_disk is not None
+        assert not os.path.exists(session.path)
+
+        # the first archive is checked out and parsed, its table tells rows per archive byte of the vendor
+        os.makedirs(task.download_path)
+        with open(task.file_paths[0], "wb") as file:
+            file.write(archives[600])
+        session.save_meta()
+
+        # files without manifest entries are fresh by their size, but planning doesn't record them
+        plan, metar = _plan()
+        assert metar.download_objects == 1
+        assert os.listdir(task.download_path) == ["600.zip"]
+
+        assert parse(session_path=session.path,
+                     process_num=1,
+                     providers=[DataVendor.Metar],
+                     providers_parser={DataVendor.Metar: CsvSensorParser}) == []
+
+        plan, metar = _plan()
+        assert (metar.objects, metar.download_objects, metar.download_size) == (2, 1, len(archives[1200]))
+        assert metar.parse_archives == 1
+        assert metar.table_rows == 2 + int(len(archives[1200]) * 2 / len(archives[600]))
+
+    def test_compacted_vendor(self, s3_client, tmp_path):
+        archives = {snapshot: _archive({"s1.csv": b"1.0", "s2.csv": b"0.0", "padding.bin": os.urandom(snapshot)})
+                    for snapshot in [600, 1200, 1800]}
+        for snapshot, archive in archives.items():
+            s3_client.put_object(Bucket=BUCKET, Key=f"metar/{snapshot}.zip", Body=archive)
+
+        session = Session(session_path=str(tmp_path / "session"), start_time=600, end_time=1800)
+        task = _task(session, DataVendor.Metar, [600, 1200, 1800])
+        os.makedirs(task.download_path)
+        for snapshot in [600, 1200]:
+            with open(os.path.join(task.download_path, f"{snapshot}.zip"), "wb") as file:
+                file.write(archives[snapshot])
+        session.save_meta()
+
+        parsers = {DataVendor.Metar: CsvSensorParser}
+        assert parse(session_path=session.path, process_num=1, providers=[DataVendor.Metar],
+                     providers_parser=parsers) == []
+        assert compact(session_path=session.path, providers=[DataVendor.Metar]) == {DataVendor.Metar.name: 2}
+
+        plan = make_plan(session=session, tasks=[task], client=S3Client(client=s3_client), providers_parser=parsers)
+        metar = plan.vendors[0]
+
+        # both snapshots share the partition by their rows, so it's counted once
+        partition_size = os.path.getsize(TableStore(folder=os.path.join(session.tables_folder, "metar"))
+                                         .partition_path(600))
+        assert [table.size for table in metar.tables[:2]] == [partition_size // 2] * 2
+        assert metar.parse_archives == 1
+        assert metar.table_size == int(len(archives[1800]) * (partition_size // 2 * 2) /
+                                       (len(archives[600]) + len(archives[1200])))
+
+    def test_limits(self, s3_client, tmp_path):
+        s3_client.put_object(Bucket=BUCKET, Key="metar/600.zip", Body=_archive({"s1.csv": b"1.0"}))
+        session = Session(session_path=str(tmp_path / "session"), start_time=600, end_time=600)
+
+        def _plan(limits: PlanLimits):
+            return make_plan(session=session,
+                             tasks=[_task(session, DataVendor.Metar, [600])],
+                             process_num=4,
+                             limits=limits,
+                             client=S3Client(client=s3_client),
+                             providers_parser={DataVendor.Metar: CsvSensorParser})
+
+        limits = PlanLimits(max_download_size=1024, max_disk_size=1024, max_memory=PROCESS_MEMORY * 4 + MB)
+        plan = _plan(limits)
+        assert plan.violations(limits) == []
+        assert plan.peak_memory <= limits.max_memory
+
+        limits = PlanLimits(max_download_size=1, max_disk_size=1, max_memory=PROCESS_MEMORY * 2)
+        plan = _plan(limits)
+        assert len(plan.violations(limits)) == 3
+        # processes are suggested to fit the memory limit
+        assert plan.parse_process_num == 1
+
+    def test_calc(self, s3_client, tmp_path):
+        for vendor in [DataVendor.AccuWeather, DataVendor.Metar]:
+            for snapshot in range(0, 7200, 600):
+                s3_client.put_object(Bucket=BUCKET, Key=f"{vendor.value}/{snapshot}.zip",
+                                     Body=_archive({"s1.csv": b"1.0", "padding.bin": os.urandom(MB)}))
+
+        session = Session(session_path=str(tmp_path / "session"), start_time=3600, end_time=7200)
+        calculator = CalculateMetrics(forecast_vendor=DataVendor.AccuWeather,
+                                      observation_vendor=DataVendor.Metar,
+                                      sensor_selection_path=None,
+                                      forecast_offsets=[0],
+                                      threshold=0.1,
+                                      precip_types=[PrecipitationType.RAIN],
+                                      session_path=session.path)
+
+        def _plan(max_memory: int):
+            return make_plan(session=session,
+                             tasks=[_task(session, vendor, list(range(0, 7200, 600)))
+                                    for vendor in [DataVendor.AccuWeather, DataVendor.Metar]],
+                             calculator=calculator,
+                             process_num=4,
+                             limits=PlanLimits(max_memory=max_memory),
+                             client=S3Client(client=s3_client),
+                             providers_parser={DataVendor.AccuWeather: CsvSensorParser,
+                                               DataVendor.Metar: CsvSensorParser})
+
+        plan = _plan(max_memory=16 * 1024 * MB)
+        assert (plan.calc.jobs, plan.calc.split_time_range, plan.calc.process_num) == (1, 3600, 4)
+        assert plan.calc.job_memory > PROCESS_MEMORY
+
+        # the split time range is reduced to fit the memory, then the processes
+        max_memory = plan.calc.job_memory * 4 - 1
+        plan = _plan(max_memory=max_memory)
+        assert (plan.calc.jobs, plan.calc.split_time_range, plan.calc.process_num) == (2, 1800, 4)
+        assert plan.calc.job_memory * 4 <= max_memory
+
+        plan = _plan(max_memory=PROCESS_MEMORY)
+        assert plan.calc.process_num == 1
@@ -1,6 +1,8 @@
-
+import os
+import pandas
 
 from unittest.mock import MagicMock, mock_open, patch
+from metrics.io.catalog import KIND_TABLE, SessionCatalog
 from metrics.session import Session
 
 
@@ -67,3 +69,72 @@ class TestSession:
             removed_zips.append(args[0])
 
         assert removed_zips == ["test/99.zip", "test/60.zip"]
+
+    @patch("metrics.session.os.rmdir")
+    @patch("metrics.session.os.remove")
+    @patch("metrics.session.os.walk")
+    def test_clear_outdated_partitions(self, os_walk_mock, os_rm_mock: MagicMock, os_rmdir_mock: MagicMock):
+        session = Session(session_path="test",
+                          start_time=0,
+                          end_time=100)
+
+        os_walk_mock.return_value = [("test/vendor", (), ("7100.parquet",)),
+                                     ("test/vendor/date=1970-01-01/hour=00", (), ("data.parquet",)),
+                                     ("test/vendor/date=1970-01-01/hour=01", (), ("data.parquet",))]
+        session._clear_outdated(target_dir="test",
+                                deadline=7199)
+
+        removed_files = []
+        for args, _ in os_rm_mock.call_args_list:
+            removed_files.append(args[0])
+
+        assert removed_files == ["test/vendor/7100.parquet", "test/vendor/date=1970-01-01/hour=00/data.parquet"]
+        # the emptied partition goes with its date folder
+        assert [args[0] for args, _ in os_rmdir_mock.call_args_list] == ["test/vendor/date=1970-01-01/hour=00",
+                                                                         "test/vendor/date=1970-01-01"]
+
+    def test_clear_outdated_catalog(self, tmp_path):
+        session = Session(session_path=str(tmp_path),
+                          start_time=0,
+                          end_time=100)
+
+        folder = os.path.join(session.tables_folder, "vendor")
+        partition_folder = os.path.join(folder, "date=1970-01-01", "hour=01")
+        os.makedirs(partition_folder)
+        paths = [os.path.join(folder, "3000.parquet"),
+                 os.path.join(folder, "7300.parquet"),
+                 os.path.join(partition_folder, "data.parquet")]
+        pandas.DataFrame({"id": ["a"], "timestamp": [0]}).to_parquet(paths[0])
+        pandas.DataFrame({"id": ["a"], "timestamp": [0]}).to_parquet(paths[1])
+        pandas.DataFrame({"id": ["a"], "timestamp": [0], "snapshot": [3600]}).to_parquet(paths[2])
+
+        catalog = SessionCatalog(session_path=str(tmp_path))
+        catalog.sync(kind=KIND_TABLE, vendor="vendor", folder=folder)
+
+        # tables of a vendor that the catalog has never synced are found by walking its folder
+        other_path = os.path.join(session.tables_folder, "other", "10.parquet")
+        os.makedirs(os.path.dirname(other_path))
+        with open(other_path, "wb") as file:
+            file.write(b"table")
+
+        walked_folders = []
+        walk = os.walk
+
+        def _walk(top: str):
+            for dir, subdirs, files in walk(top):
+                walked_folders.append(dir)
+                yield dir, subdirs, files
+
+        with patch("metrics.session.os.walk", side_effect=_walk):
+            session.clear_outdated(deadline_timestamp=7000)
+
+        # the synced folder isn't walked into
+        assert not any(walked.startswith(folder + os.sep) for walked in walked_folders)
+        assert [os.path.exists(path) for path in paths] == [False, True, True]
+        assert not os.path.exists(other_path)
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_TABLE, vendor="vendor")] == [3600, 7300]
+
+        session.clear_outdated(deadline_timestamp=7200)
+        assert [os.path.exists(path) for path in paths] == [False, True, False]
+        assert not os.path.exists(os.path.dirname(partition_folder))
+        assert [entry.snapshot for entry in catalog.list(kind=KIND_TABLE, vendor="vendor")] == [7300]
@@ -0,0 +1,31 @@
+import os
+import pytest
+
+from metrics.utils.file import write_atomic
+
+
+def _write(path: str, data: bytes):
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+class TestWriteAtomic:
+
+    def test_write_atomic(self, tmp_path):
+        path = str(tmp_path / "table.parquet")
+        _write(path, b"old")
+
+        def _fail(tmp_path: str):
+            _write(tmp_path, b"partial")
+            raise OSError("disk is full")
+
+        with pytest.raises(OSError):
+            write_atomic(path, _fail)
+
+        assert os.listdir(tmp_path) == ["table.parquet"]
+        with open(path, "rb") as file:
+            assert file.read() == b"old"
+
+        write_atomic(path, lambda tmp_path: _write(tmp_path, b"new"))
+        with open(path, "rb") as file:
+            assert file.read() == b"new"
@@ -0,0 +1,14 @@
+from metrics.utils.memory import peak_rss, reset_peak_rss
+
+
+class TestMemory:
+
+    def test_peak_rss(self):
+        reset_peak_rss()
+        before = peak_rss()
+
+        data = bytearray(64 * 1024 ** 2)
+        data[::4096] = b"x" * len(data[::4096])
+
+        assert before > 0
+        assert peak_rss() >= before + 32 * 1024 ** 2
@@ -0,0 +1,65 @@
+import os
+import pandas
+import pyarrow.parquet as pq
+import pytest
+
+from metrics.utils.parquet import PARQUET_PROFILES, ParquetWriterProfile, get_parquet_profile
+
+
+def _create_table(rows: int) -> pandas.DataFrame:
+    return pandas.DataFrame({
+        "id": [f"sensor_{index % 7}" for index in reversed(range(rows))],
+        "timestamp": [1700000000 + 600 * (index % 5) for index in range(rows)],
+        "precip_rate": [float(index) for index in range(rows)],
+        "precip_type": [index % 3 for index in range(rows)],
+    })
+
+
+class TestParquetWriterProfile:
+
+    @pytest.mark.parametrize("profile_name", list(PARQUET_PROFILES))
+    def test_write(self, tmp_path, profile_name: str):
+        profile = get_parquet_profile(profile_name)
+        table = _create_table(rows=100)
+        path = os.path.join(tmp_path, "table.parquet")
+
+        profile.write(table, path)
+
+        expected = table
+        if len(profile.sort_by) > 0:
+            expected = table.sort_values(by=profile.sort_by, kind="stable", ignore_index=True)
+
+        pandas.testing.assert_frame_equal(pandas.read_parquet(path), expected)
+        assert pq.ParquetFile(path).metadata.row_group(0).column(0).compression == profile.compression.upper()
+
+    def test_write_options(self, tmp_path):
+        profile = ParquetWriterProfile(compression="zstd",
+                                       compression_level=9,
+                                       row_group_size=30,
+                                       dictionary_columns=["id", "unknown"],
+                                       sort_by=["id", "timestamp"])
+        path = os.path.join(tmp_path, "table.parquet")
+
+        profile.write(_create_table(rows=100), path)
+
+        metadata = pq.ParquetFile(path).metadata
+        assert metadata.num_row_groups == 4
+
+        # only `id` is dictionary encoded
+        row_group = metadata.row_group(0)
+        encodings = {row_group.column(index).path_in_schema: row_group.column(index).encodings
+                     for index in range(row_group.num_columns)}
+        assert "RLE_DICTIONARY" in encodings["id"]
+        assert "RLE_DICTIONARY" not in encodings["precip_rate"]
+
+        # sorted rows make id statistics of row groups narrow
+        ids = pandas.read_parquet(path)["id"].tolist()
+        assert ids == sorted(ids)
+        statistics = metadata.row_group(0).column(0).statistics
+        assert (statistics.min, statistics.max) == ("sensor_0", "sensor_1")
+
+    def test_get_parquet_profile(self):
+        assert get_parquet_profile() == ParquetWriterProfile(compression="gzip")
+
+        with pytest.raises(ValueError):
+            get_parquet_profile("unknown")
@@ -0,0 +1,13 @@
+from metrics.utils.s3 import ListWindow, list_window
+
+
+class TestS3:
+
+    def test_list_window(self):
+        keys = ["rainviewer/1711360800.zip", "rainviewer/1711361400.zip", "rainviewer/1711364400.zip"]
+
+        # the first key is listed, listing stops after the last one
+        assert list_window(keys[::-1]) == ListWindow(prefix="rainviewer/171136",
+                                                     start_after="rainviewer/1711360800.zi",
+                                                     end_key="rainviewer/1711364400.zip")
+        assert list_window(keys[:1]) == ListWindow(prefix=keys[0], start_after=keys[0][:-1], end_key=keys[0])
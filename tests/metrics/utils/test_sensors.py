@@ -1,19 +1,19 @@
 import pandas
 import pytest
 
-from metrics.calc.utils import read_selected_sensors
+from metrics.utils.sensors import read_selected_sensors
 
 from unittest.mock import patch
 
 
-class TestCalcUtils:
+class TestSensors:
     @pytest.mark.parametrize("file_path, exp_type", [
         ("1.csv", "csv"),
         ("2.parquet", "parquet"),
         ("3.zip", "zip")
     ])
-    @patch("metrics.calc.utils.pandas.read_csv")
-    @patch("metrics.calc.utils.pandas.read_parquet")
+    @patch("metrics.utils.sensors.pandas.read_csv")
+    @patch("metrics.utils.sensors.pandas.read_parquet")
     def test_read_selected_sensors_file(self,
                                         read_parquet_mock,
                                         read_csv_mock,
@@ -48,10 +48,10 @@ class TestCalcUtils:
         data = read_selected_sensors("test.abcde")
         assert all(data.columns == ["id", "lon", "lat", "count", "country"])
 
-    @patch("metrics.calc.utils.pandas.read_csv")
-    @patch("metrics.calc.utils.pandas.read_parquet")
-    @patch("metrics.calc.utils.os.listdir")
-    @patch("metrics.calc.utils.os.path.isdir")
+    @patch("metrics.utils.sensors.pandas.read_csv")
+    @patch("metrics.utils.sensors.pandas.read_parquet")
+    @patch("metrics.utils.sensors.os.listdir")
+    @patch("metrics.utils.sensors.os.path.isdir")
     def test_read_selected_sensors_dir(self, is_dir_mock, listdir_mock, read_csv_mock, read_parquet_mock):
         data_types = []
 